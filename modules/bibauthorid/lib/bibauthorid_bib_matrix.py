@@ -5,6 +5,7 @@ from cPickle import dump, load, UnpicklingError
 from invenio.bibauthorid_dbinterface import get_db_time
 from invenio.bibauthorid_logutils import Logger
 import h5py
+import numpy
 import errno
 
 
@@ -74,6 +75,64 @@ class Bib_matrix(object):
     def getitem_numeric(self, bibs):
         return self._matrix[self._resolve_entry(bibs)]
 
+    # The matrix is stored row by row: the row of the signature with
+    # index j holds its comparisons with the signatures 0..j, so the
+    # rows first..last are the contiguous slice returned by _row_slice.
+
+    @staticmethod
+    def _row_slice(first, last):
+        return (first * first + first) / 2, (last * last + last) / 2
+
+    def get_bibs(self):
+        '''
+        Returns the signatures ordered by their index in the matrix.
+        '''
+        bibs = [None] * len(self._bibmap)
+        for bib, idx in self._bibmap.iteritems():
+            bibs[idx] = bib
+        return bibs
+
+    def get_index(self, bib, default=-1):
+        return self._bibmap.get(bib, default)
+
+    def set_rows(self, first, values):
+        '''
+        Writes the rows first..first+n-1 at once.
+        @param values: a numeric array with the (first + 1) + ... + (first + n)
+            entries of the rows, one after the other.
+        '''
+        start = self._row_slice(first, first)[0]
+        if self._matrix is None:
+            self._initialize_matrix()
+        self._matrix[start:start + len(values)] = values
+
+    def get_entries_numeric(self, bib_indexes1, bib_indexes2, max_gap=64):
+        '''
+        Reads the entries of many pairs of signatures at once.
+        @param bib_indexes1: array of signature indexes (see get_index)
+        @param bib_indexes2: array of signature indexes (see get_index)
+        @param max_gap: entries closer than this are read with one slice
+        @return: an array with one numeric entry per pair.
+        '''
+        lo = numpy.minimum(bib_indexes1, bib_indexes2)
+        hi = numpy.maximum(bib_indexes1, bib_indexes2)
+        entries, inverse = numpy.unique(lo + (hi * hi + hi) / 2, return_inverse=True)
+        values = numpy.empty((len(entries), 2), dtype=numpy.float32)
+        # runs of close entries are read as slices, isolated entries
+        # with a single point selection
+        starts = numpy.concatenate(([0], numpy.nonzero(numpy.diff(entries) > max_gap)[0] + 1))
+        ends = numpy.concatenate((starts[1:], [len(entries)]))
+        isolated = list()
+        for start, end in zip(starts, ends):
+            if end - start > 1:
+                first = entries[start]
+                values[start:end] = self._matrix[first:entries[end - 1] + 1][entries[start:end] - first]
+            else:
+                isolated.append(start)
+        if isolated:
+            values[isolated] = self._matrix[entries[isolated].tolist()]
+        return values[inverse]
+
     def __contains__(self, bib):
         return bib in self._bibmap
 
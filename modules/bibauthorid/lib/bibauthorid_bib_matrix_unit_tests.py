@@ -133,6 +133,27 @@ class Test_Bib_matrix(InvenioTestCase):
         self.assertTrue(self.bmcs0.getitem_numeric([0, 1])[0] == -1)
         self.assertTrue(self.bmcs0.getitem_numeric([0, 2])[0] == -3)
 
+    def test_set_rows(self):
+        '''
+        Writing whole rows should be the same as writing the entries one by one
+        '''
+        bibs = self.bmcs0.get_bibs()
+        values = [(i, j) for i in range(10, 20) for j in range(i + 1)]
+        self.bmcs0.set_rows(10, values)
+        for i, j in values:
+            self.assertEqual(self.bmcs0[bibs[i], bibs[j]], (i, j))
+
+    def test_get_entries_numeric(self):
+        bibs = self.bmcs0.get_bibs()
+        for i in range(100):
+            for j in range(i + 1):
+                self.bmcs0[bibs[i], bibs[j]] = (i, j)
+        first = [self.bmcs0.get_index(bibs[i]) for i in (5, 99, 0, 42)]
+        second = [self.bmcs0.get_index(bibs[j]) for j in (7, 3, 0, 99)]
+        ret = self.bmcs0.get_entries_numeric(first, second, max_gap=2)
+        self.assertEqual([tuple(val) for val in ret],
+                         [(7, 5), (99, 3), (0, 0), (99, 42)])
+
 
 TEST_SUITE = make_test_suite(Test_Bib_matrix)
 
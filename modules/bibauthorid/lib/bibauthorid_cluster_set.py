@@ -231,9 +231,14 @@ def delayed_create_from_mark(bibrefs, last_name):
     return ret
 
 
-def delayed_cluster_sets_from_marktables(limit_to_surnames=False):
+def last_name_clusters_from_marktables(limit_to_surnames=False):
+    '''
+    Groups the bibrefs of the marc tables by last name cluster.
+    @return: [(last name, [(table, bibref)], number of signatures)]
+        sorted by number of signatures.
+    '''
     # { name -> [(table, bibref)] }
-    logger.log('Delayed_cluster_set_from_marktables limited to %s' % str(limit_to_surnames))
+    logger.log('Last_name_clusters_from_marktables limited to %s' % str(limit_to_surnames))
 
     name_buket = {}
     if limit_to_surnames:
@@ -250,7 +255,11 @@ def delayed_cluster_sets_from_marktables(limit_to_surnames=False):
 
     all_refs = ((name, refs, len(list(get_signatures_from_bibrefs(refs))))
                 for name, refs in name_buket.items())
-    all_refs = sorted(all_refs, key=itemgetter(2))
+    return sorted(all_refs, key=itemgetter(2))
+
+
+def delayed_cluster_sets_from_marktables(limit_to_surnames=False):
+    all_refs = last_name_clusters_from_marktables(limit_to_surnames)
     return ([delayed_create_from_mark(set(refs), name) for name, refs, _ in all_refs],
             map(itemgetter(0), all_refs),
             map(itemgetter(2), all_refs))
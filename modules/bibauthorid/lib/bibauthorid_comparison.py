@@ -35,6 +35,7 @@ from invenio.bibrank_citation_searcher import get_cited_by, get_refers_to
 from invenio.bibauthorid_logutils import Logger
 import gc
 import random
+import numpy
 
 CFG_MEMOIZE_DICT_SIZE = 1000000
 
@@ -451,3 +452,229 @@ elif bconfig.CFG_ADS_SITE:
 
 else:
     cbrr_func_weight = ((_compare_names, 5., 'names'),)
+
+
+# Block comparison
+#
+# compare_bibrefrecs() compares one pair of signatures at a time. The
+# code below computes the same values for whole blocks of signature
+# pairs: the metadata of every signature is extracted once into
+# SignatureFeatures and each comparison function of cbrr_func_weight is
+# evaluated with numpy on (rows x columns) tiles. compare_bibrefrecs()
+# remains the reference: comparison functions without a block
+# counterpart are evaluated pair by pair, and with DEBUG_CHECKS every
+# block is checked against it.
+
+def _token_sets(sets):
+    '''
+    Converts a list of sets into (list of sorted arrays of token ids,
+    array of set sizes).
+    '''
+    vocabulary = dict()
+    tokens = list()
+    for s in sets:
+        tokens.append(numpy.array(sorted(vocabulary.setdefault(x, len(vocabulary)) for x in s),
+                                  dtype=numpy.int64))
+    sizes = numpy.array([len(t) for t in tokens], dtype=numpy.float64)
+    return tokens, sizes
+
+
+def _block_jaccard(feature, rows, cols):
+    '''
+    Same as jaccard() on every (row, column) pair. The intersection sizes
+    are counted row by row with an index of the tokens of the columns, so
+    that the memory used does not depend on the number of distinct tokens
+    (e.g. coauthors or citations).
+    '''
+    tokens, sizes = feature
+    row_sizes, col_sizes = sizes[rows], sizes[cols]
+    empty = numpy.empty(0, dtype=numpy.int64)
+    # all the tokens of the columns, sorted, with the column they belong to
+    col_tokens = numpy.concatenate([tokens[j] for j in cols] + [empty])
+    col_index = numpy.repeat(numpy.arange(len(cols)), col_sizes.astype(numpy.int64))
+    order = numpy.argsort(col_tokens, kind='mergesort')
+    col_tokens, col_index = col_tokens[order], col_index[order]
+    match = numpy.zeros((len(rows), len(cols)))
+    if len(col_tokens):
+        for i, row in enumerate(rows):
+            toks = tokens[row]
+            start = numpy.searchsorted(col_tokens, toks, 'left')
+            lengths = numpy.searchsorted(col_tokens, toks, 'right') - start
+            total = lengths.sum()
+            if not total:
+                continue
+            # positions in col_tokens of the tokens of the row
+            offsets = numpy.cumsum(lengths) - lengths
+            positions = numpy.arange(total) + numpy.repeat(start - offsets, lengths)
+            match[i] = numpy.bincount(col_index[positions], minlength=len(cols))
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        ret = match / (row_sizes[:, None] + col_sizes[None, :] - match)
+    ret[(row_sizes == 0)[:, None] | (col_sizes == 0)[None, :]] = numpy.nan
+    return ret
+
+
+def _single_value_codes(sets):
+    '''
+    Encodes each set holding exactly one value as the id of that value,
+    and the other sets as -1.
+    '''
+    codes = dict()
+    ret = numpy.empty(len(sets), dtype=numpy.int64)
+    for i, s in enumerate(sets):
+        if len(s) == 1:
+            ret[i] = codes.setdefault(iter(s).next(), len(codes))
+        else:
+            ret[i] = -1
+    return ret
+
+
+def _block_single_value(same, different):
+    '''
+    Block counterpart of the comparisons returning 'same' when both
+    signatures have the same single value, 'different' when they have
+    different single values and '?' otherwise.
+    '''
+    def compare(codes, rows, cols):
+        row_codes, col_codes = codes[rows], codes[cols]
+        ret = numpy.where(row_codes[:, None] == col_codes[None, :], float(same), float(different))
+        ret[(row_codes < 0)[:, None] | (col_codes < 0)[None, :]] = numpy.nan
+        return ret
+    return compare
+
+
+def _name_codes(names):
+    '''
+    Encodes the names as (array of name ids, -1 for missing names,
+    list of distinct names).
+    '''
+    codes = dict()
+    ret = numpy.empty(len(names), dtype=numpy.int64)
+    for i, name in enumerate(names):
+        if name:
+            ret[i] = codes.setdefault(name, len(codes))
+        else:
+            ret[i] = -1
+    distinct = [None] * len(codes)
+    for name, code in codes.iteritems():
+        distinct[code] = name
+    return ret, distinct
+
+
+def _block_names(feature, rows, cols):
+    '''
+    Same as _compare_names() on every (row, column) pair: compare_names()
+    is only called once per pair of distinct names.
+    '''
+    codes, distinct = feature
+    row_codes, col_codes = codes[rows], codes[cols]
+    row_names = numpy.unique(row_codes[row_codes >= 0])
+    col_names = numpy.unique(col_codes[col_codes >= 0])
+    values = numpy.empty((len(row_names), len(col_names)))
+    for i, name1 in enumerate(row_names):
+        for j, name2 in enumerate(col_names):
+            cmpv = cached_compare_names(distinct[name1], distinct[name2])
+            values[i, j] = numpy.nan if cmpv == '?' else cmpv
+    ret = numpy.empty((len(rows), len(cols)))
+    ret.fill(numpy.nan)
+    row_valid, col_valid = row_codes >= 0, col_codes >= 0
+    if row_valid.any() and col_valid.any():
+        ret[numpy.ix_(row_valid, col_valid)] = values[
+            numpy.ix_(numpy.searchsorted(row_names, row_codes[row_valid]),
+                      numpy.searchsorted(col_names, col_codes[col_valid]))]
+    return ret
+
+
+# comparison function -> (per signature feature extraction,
+#                         conversion of the features of all signatures,
+#                         block comparison)
+_block_comparisons = {
+    _compare_affiliations: (_find_affiliation, _token_sets, _block_jaccard),
+    # _compare_unified_affiliations uses _find_affiliation as well
+    _compare_unified_affiliations: (_find_affiliation, _token_sets, _block_jaccard),
+    _compare_coauthors: (_find_coauthors, _token_sets, _block_jaccard),
+    _compare_key_words: (_find_key_words, _token_sets, _block_jaccard),
+    _compare_citations: (lambda bib: set(_find_citations(bib)), _token_sets, _block_jaccard),
+    _compare_citations_by: (lambda bib: set(_find_citations_by(bib)), _token_sets, _block_jaccard),
+    _compare_inspireid: (_find_inspireid, _single_value_codes, _block_single_value(1, 0)),
+    _compare_email: (_find_email, _single_value_codes, _block_single_value(1.0, 0.3)),
+    _compare_collaboration: (_find_collaboration, _single_value_codes, _block_single_value(1., 0.)),
+    _compare_names: (cached_get_name_by_bibrecref, _name_codes, _block_names),
+}
+
+
+class SignatureFeatures(object):
+
+    '''
+    The metadata used by compare_bibrefrecs() for a list of signatures,
+    extracted once so that the signatures can be compared in blocks
+    with compare_bibrefrecs_block().
+    '''
+
+    def __init__(self, bibs):
+        self.bibs = list(bibs)
+        self.recs = numpy.array([bib[2] for bib in self.bibs], dtype=numpy.int64)
+        self.features = dict()
+        for func, dummy, dummy in cbrr_func_weight:
+            if func in _block_comparisons:
+                find, convert, dummy = _block_comparisons[func]
+                self.features[func] = convert([find(bib) for bib in self.bibs])
+
+    def __len__(self):
+        return len(self.bibs)
+
+
+def compare_bibrefrecs_block(features, rows, cols, needed=None):
+    '''
+    Compares the signatures features.bibs[rows] with features.bibs[cols].
+
+    @param features: a SignatureFeatures object
+    @param rows: array of signature indexes
+    @param cols: array of signature indexes
+    @param needed: optional boolean (rows x cols) array telling which
+        pairs will be used; the comparison functions without block
+        counterpart are only evaluated on those.
+    @return: (values, different) where values is a (rows x cols x 2)
+        array holding the pairs compare_bibrefrecs() would return, and
+        different is a boolean (rows x cols) array marking the pairs for
+        which it would return '-'.
+    '''
+    rows = numpy.asarray(rows, dtype=numpy.int64)
+    cols = numpy.asarray(cols, dtype=numpy.int64)
+    shape = (len(rows), len(cols))
+    if needed is None:
+        needed = numpy.ones(shape, dtype=bool)
+
+    different = features.recs[rows][:, None] == features.recs[cols][None, :]
+
+    total_weights = sum(weight for dummy, weight, dummy in cbrr_func_weight)
+    cert = numpy.zeros(shape)
+    prob = numpy.zeros(shape)
+    for func, weight, dummy in cbrr_func_weight:
+        if func in _block_comparisons:
+            res = _block_comparisons[func][2](features.features[func], rows, cols)
+        else:
+            res = numpy.empty(shape)
+            res.fill(numpy.nan)
+            for i, j in zip(*numpy.nonzero(needed & ~different)):
+                r = func(features.bibs[rows[i]], features.bibs[cols[j]])
+                if r != '?':
+                    res[i, j] = r
+        known = ~numpy.isnan(res)
+        cert[known] += res[known] * weight
+        prob[known] += weight
+
+    values = numpy.zeros(shape + (2,))
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        values[:, :, 0] = numpy.where(prob > 0, cert / prob, 0)
+        values[:, :, 1] = numpy.where(prob > 0, prob / total_weights, 0)
+
+    if bconfig.DEBUG_CHECKS:
+        for i, j in zip(*numpy.nonzero(needed)):
+            val = compare_bibrefrecs(features.bibs[rows[i]], features.bibs[cols[j]])
+            if different[i, j]:
+                assert val == '-', 'BLOCK COMPARISON: expected %s' % str(val)
+            else:
+                assert abs(val[0] - values[i, j, 0]) < 1e-9 and abs(val[1] - values[i, j, 1]) < 1e-9, \
+                    'BLOCK COMPARISON: %s instead of %s' % (str(values[i, j]), str(val))
+
+    return values, different
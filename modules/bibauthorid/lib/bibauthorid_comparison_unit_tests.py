@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2014 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the block comparison of signatures."""
+
+import numpy
+from mock import patch
+
+from invenio.testutils import InvenioTestCase, make_test_suite, run_test_suite
+from invenio import bibauthorid_comparison as comparison
+
+
+# signature -> metadata, with empty and missing values
+AFFILIATIONS = {1: set(['cern', 'mit']), 2: set(['cern']), 3: set(),
+                4: set(['desy']), 5: set(['cern', 'mit']), 6: set()}
+COAUTHORS = {10: set(['ellis', 'smith', 'jones']), 11: set(['ellis']),
+             12: set(), 13: set(['smith', 'jones', 'doe', 'roe']),
+             14: set(['doe'])}
+KEY_WORDS = {10: set(['higgs', 'lhc']), 11: set(), 12: set(['higgs']),
+             13: set(['qcd']), 14: set(['lhc', 'qcd', 'higgs'])}
+CITATIONS = {10: set([100, 101]), 11: set([101]), 12: set(),
+             13: set([100, 101, 102]), 14: set()}
+REFERENCES = {10: set([200]), 11: set(), 12: set([200, 201]),
+              13: set([201]), 14: set([202])}
+COLLABORATIONS = {10: set(['atlas']), 11: set(['atlas']), 12: set(),
+                  13: set(['cms']), 14: set(['atlas', 'cms'])}
+INSPIREIDS = {1: set(['INSPIRE-1']), 2: set(['INSPIRE-1']), 3: set(),
+              4: set(['INSPIRE-2']), 5: set(['INSPIRE-1', 'INSPIRE-2']),
+              6: set(['INSPIRE-2'])}
+EMAILS = {1: set(['a@cern.ch']), 2: set(['b@cern.ch']), 3: set(),
+          4: set(['a@cern.ch']), 5: set(), 6: set(['b@cern.ch'])}
+NAMES = {1: 'Ellis, J.', 2: 'Ellis, John', 3: None, 4: 'Smith, A.',
+         5: 'Ellis, J.', 6: ''}
+
+# (100, bibref, bibrec): signatures 1 and 5 are on the same paper
+BIBS = [(100, 1, 10), (100, 2, 11), (700, 3, 12), (700, 4, 13),
+        (700, 5, 10), (100, 6, 14)]
+
+
+def fake_compare_names(name1, name2):
+    if name1 == name2:
+        return 1.
+    if name1.split(',')[0] == name2.split(',')[0]:
+        return 0.8
+    return '?'
+
+
+FIND_FUNCTIONS = {
+    '_find_affiliation': lambda bib: AFFILIATIONS[bib[1]],
+    '_find_coauthors': lambda bib: COAUTHORS[bib[2]],
+    '_find_key_words': lambda bib: KEY_WORDS[bib[2]],
+    '_find_citations': lambda bib: CITATIONS[bib[2]],
+    '_find_citations_by': lambda bib: REFERENCES[bib[2]],
+    '_find_collaboration': lambda bib: COLLABORATIONS[bib[2]],
+    '_find_inspireid': lambda bib: INSPIREIDS[bib[1]],
+    '_find_email': lambda bib: EMAILS[bib[1]],
+    'cached_get_name_by_bibrecref': lambda bib: NAMES[bib[1]],
+}
+
+
+class TestBlockComparison(InvenioTestCase):
+
+    '''
+    compare_bibrefrecs_block must give the same results as
+    compare_bibrefrecs.
+    '''
+
+    def setUp(self):
+        comparison.clear_all_caches()
+        # the block comparisons use the same metadata
+        features = {
+            '_compare_affiliations': '_find_affiliation',
+            '_compare_unified_affiliations': '_find_affiliation',
+            '_compare_coauthors': '_find_coauthors',
+            '_compare_key_words': '_find_key_words',
+            '_compare_inspireid': '_find_inspireid',
+            '_compare_email': '_find_email',
+            '_compare_collaboration': '_find_collaboration',
+            '_compare_names': 'cached_get_name_by_bibrecref'}
+        block_comparisons = dict()
+        for func_name, find_name in features.iteritems():
+            func = getattr(comparison, func_name)
+            convert, block = comparison._block_comparisons[func][1:]
+            block_comparisons[func] = (FIND_FUNCTIONS[find_name], convert, block)
+        for func_name, find_name in (('_compare_citations', '_find_citations'),
+                                     ('_compare_citations_by', '_find_citations_by')):
+            func = getattr(comparison, func_name)
+            convert, block = comparison._block_comparisons[func][1:]
+            find = FIND_FUNCTIONS[find_name]
+            block_comparisons[func] = (lambda bib, find=find: set(find(bib)),
+                                       convert, block)
+        self.patches = [patch.dict(comparison._block_comparisons,
+                                   block_comparisons),
+                        patch.object(comparison, 'cached_compare_names',
+                                     fake_compare_names)]
+        self.patches.extend(patch.object(comparison, name, find)
+                            for name, find in FIND_FUNCTIONS.iteritems())
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in reversed(self.patches):
+            p.stop()
+        comparison.clear_all_caches()
+
+    def _check(self, func_weight, rows, cols):
+        with patch.object(comparison, 'cbrr_func_weight', func_weight):
+            features = comparison.SignatureFeatures(BIBS)
+            values, different = comparison.compare_bibrefrecs_block(
+                features, rows, cols)
+            for i, row in enumerate(rows):
+                for j, col in enumerate(cols):
+                    expected = comparison.compare_bibrefrecs(BIBS[row],
+                                                             BIBS[col])
+                    if expected == '-':
+                        self.assertTrue(different[i, j])
+                    else:
+                        self.assertFalse(different[i, j])
+                        self.assertAlmostEqual(values[i, j, 0], expected[0])
+                        self.assertAlmostEqual(values[i, j, 1], expected[1])
+
+    def test_all_features(self):
+        """bibauthorid - block comparison of all the features"""
+        func_weight = (
+            (comparison._compare_inspireid, .5, 'inspID'),
+            (comparison._compare_email, 3., 'email'),
+            (comparison._compare_affiliations, .3, 'aff'),
+            (comparison._compare_unified_affiliations, 2., 'uaff'),
+            (comparison._compare_names, 1., 'names'),
+            (comparison._compare_citations, .1, 'cit'),
+            (comparison._compare_citations_by, .1, 'citby'),
+            (comparison._compare_key_words, .1, 'kw'),
+            (comparison._compare_collaboration, .3, 'collab'),
+            (comparison._compare_coauthors, .1, 'coauth'))
+        self._check(func_weight, range(len(BIBS)), range(len(BIBS)))
+        self._check(func_weight, [0, 3], [5, 1, 2])
+
+    def test_missing_features(self):
+        """bibauthorid - block comparison without any known value"""
+        func_weight = ((comparison._compare_collaboration, .3, 'collab'),
+                       (comparison._compare_inspireid, .5, 'inspID'))
+        self._check(func_weight, [2, 5], [2, 3])
+
+    def test_jaccard(self):
+        """bibauthorid - block jaccard on sets of many tokens"""
+        sets = [set(range(0, 3000, 2)), set(range(0, 3000, 3)), set(),
+                set([1, 2999]), set(range(1000, 1010))]
+        result = comparison._block_jaccard(comparison._token_sets(sets),
+                                           numpy.arange(len(sets)),
+                                           numpy.arange(len(sets)))
+        for i, set1 in enumerate(sets):
+            for j, set2 in enumerate(sets):
+                expected = comparison.jaccard(set1, set2)
+                if expected == '?':
+                    self.assertTrue(numpy.isnan(result[i, j]))
+                else:
+                    self.assertAlmostEqual(result[i, j], expected)
+
+
+TEST_SUITE = make_test_suite(TestBlockComparison)
+
+if __name__ == '__main__':
+    run_test_suite(TEST_SUITE)
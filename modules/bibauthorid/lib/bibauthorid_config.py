@@ -150,6 +150,10 @@ else:
 
 WEDGE_THRESHOLD = 0.70
 
+# Memory (in MB) the wedge algorithm may use to sort the edges of a last
+# name cluster: larger edge lists are sorted on disk in chunks.
+WEDGE_MEMORY_BUDGET = 512
+
 # Rabbit use or ignore external ids
 RABBIT_USE_EXTERNAL_IDS = True
 
@@ -205,6 +209,13 @@ DEBUG_CHECKS = False
 
 TORTOISE_FILES_PATH = '/opt/invenio/var/cache/bibauthorid/tortoise_cache/'
 
+# Distributed tortoise: a worker must renew the lease of the last name
+# cluster it works on every TORTOISE_QUEUE_LEASE_TIME seconds, otherwise
+# the cluster is given to another worker. A cluster is marked as failed
+# after TORTOISE_QUEUE_MAX_ATTEMPTS attempts.
+TORTOISE_QUEUE_LEASE_TIME = 600
+TORTOISE_QUEUE_MAX_ATTEMPTS = 3
+
 # force skip ui arxiv stub page (specific for inspire)
 BIBAUTHORID_UI_SKIP_ARXIV_STUB_PAGE = True
 
@@ -263,6 +274,11 @@ MATCHING_QGRAMS_PERCENTAGE = 0.8
 MAX_T_OCCURANCE_RESULT_LIST_CARDINALITY = 35
 MIN_T_OCCURANCE_RESULT_LIST_CARDINALITY = 10
 
+# The search engine index is loaded in memory by every process answering
+# author searches. It is dumped here by the indexer and reloaded by the
+# processes whenever the file changes.
+SEARCH_ENGINE_INDEX_FILE = '/opt/invenio/var/cache/bibauthorid/search_engine_index'
+
 # List that contains the existing remote systems that a user can logged in via them in Inspire
 CFG_BIBAUTHORID_EXISTING_REMOTE_LOGIN_SYSTEMS = ['arXiv', 'orcid']
 
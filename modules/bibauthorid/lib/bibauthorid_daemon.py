@@ -100,6 +100,11 @@ Examples:
         --single-threaded         Single-threaded mode. Useful when handling a limited number of names
                                   and for testing. The flag is only valid when some last names are specified.
 
+      --distributed=enqueue     Puts all the last name clusters in a queue shared by several machines.
+      --distributed=work        Disambiguates the last name clusters of the shared queue, one worker per
+                                processor. Run it on every machine taking part in the disambiguation.
+      --distributed=status      Reports the progress of the shared queue.
+
     There are no options for the merger.
 
     Options for force identifier consistency
@@ -127,6 +132,7 @@ Examples:
                                        "last-names=",
                                        "st",
                                        "single-threaded",
+                                       "distributed=",
                                        "force-identifier-consistency",
                                        "check-db",
                                        "do-not-modify-records",
@@ -172,6 +178,10 @@ def _task_submit_elaborate_specific_parameter(key, value, opts, args):
         bibtask.task_set_option("last-names", value)
     elif key in ("--single-threaded",):
         bibtask.task_set_option("single_threaded", True)
+    elif key in ("--distributed",):
+        if value.count("="):
+            value = value[1:]
+        bibtask.task_set_option("distributed", value)
     elif key in ("--force-identifier-consistency",):
         bibtask.task_set_option("force_identifier_consistency", True)
     elif key in ("--check-db",):
@@ -221,7 +231,12 @@ def _task_run_core():
         if single_threaded and not last_names:
             bibtask.write_message("""--single-threaded will not be considered
                                      as there are no last names specified.""")
-        if last_names:
+        distributed = bibtask.task_get_option("distributed")
+        if distributed:
+            bibtask.task_update_progress('Performing distributed disambiguation (%s)...' % distributed)
+            run_tortoise_distributed(distributed, from_scratch)
+            bibtask.task_update_progress('Distributed disambiguation (%s) finished!' % distributed)
+        elif last_names:
             last_names_thresholds = _group_last_names(last_names)
             bibtask.task_update_progress('Performing disambiguation on specific last names.')
             run_tortoise(from_scratch, last_names_thresholds, single_threaded)
@@ -341,6 +356,17 @@ def _task_submit_check_options():
                                   "with --disambiguate is from-scratch", stream=sys.stdout, verbose=0)
             return False
 
+        distributed = bibtask.task_get_option("distributed")
+        if distributed:
+            if distributed not in ('enqueue', 'work', 'status'):
+                bibtask.write_message("ERROR: --distributed expects enqueue, work or status. "
+                                      "Provided: %s." % distributed, stream=sys.stdout, verbose=0)
+                return False
+            if bibtask.task_get_option("last-names"):
+                bibtask.write_message("ERROR: conflicting options: --distributed and "
+                                      "--last-names are mutually exclusive.", stream=sys.stdout, verbose=0)
+                return False
+
     if merge:
         if any((record_ids, all_records, from_scratch)):
             bibtask.write_message("ERROR: There are no options which can be "
@@ -470,6 +496,40 @@ def run_tortoise(from_scratch, last_names_thresholds=None,
         insert_user_log(tortoise_db_name, '-1', '', '', '', timestamp=start_time)
 
 
+def run_tortoise_distributed(mode, from_scratch):
+    _prepare_tortoise_cache()
+
+    from invenio.bibauthorid_tortoise import tortoise_distributed_enqueue, \
+        tortoise_distributed, log_tortoise_distributed_progress
+    from invenio.bibauthorid_backinterface import get_failed_tortoise_jobs
+
+    if mode == 'enqueue':
+        if from_scratch:
+            tortoise_distributed_enqueue(from_mark=True)
+        else:
+            start_time = get_db_time()
+            tortoise_db_name = 'tortoise'
+
+            last_run = get_user_logs(userinfo=tortoise_db_name, only_most_recent=True)
+            if last_run:
+                last_run = last_run[0][2]
+            else:
+                last_run = None
+            tortoise_distributed_enqueue(from_mark=False, last_run=last_run)
+
+            # The clusters of the papers modified from now on will be
+            # enqueued by the next run.
+            insert_user_log(tortoise_db_name, '-1', '', '', '', timestamp=start_time)
+    elif mode == 'work':
+        tortoise_distributed()
+
+    status = log_tortoise_distributed_progress()
+    for state in sorted(status):
+        bibtask.write_message("%s: %d last name clusters (cost %d)" % ((state,) + status[state]))
+    for last_name, attempts, message in get_failed_tortoise_jobs():
+        bibtask.write_message("FAILED: %s after %d attempts: %s" % (last_name, attempts, message))
+
+
 def _prepare_tortoise_cache():
     if not os.path.isdir(bconfig.TORTOISE_FILES_PATH):
         os.makedirs(bconfig.TORTOISE_FILES_PATH)
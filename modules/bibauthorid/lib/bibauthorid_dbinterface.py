@@ -3279,6 +3279,141 @@ def duplicated_tortoise_results_exist():  # check_results
     return duplicated_tortoise_results_not_found
 
 
+#
+#
+# aidTORTOISEQUEUE table                                 ###
+#
+#
+
+# ********** setters **********#
+
+
+def empty_tortoise_queue():
+    '''
+    Truncates the distributed disambiguation queue.
+    '''
+    _truncate_table('aidTORTOISEQUEUE')
+
+
+def add_tortoise_jobs(jobs):
+    '''
+    Adds last name clusters to the distributed disambiguation queue.
+
+    @param jobs: last name clusters ((last_name, cost, payload),)
+    @type jobs: iterable ((str, int, dict),)
+    '''
+    for last_name, cost, payload in jobs:
+        run_sql("""insert into aidTORTOISEQUEUE
+                   (last_name, cost, payload, status)
+                   values (%s, %s, %s, 'WAITING')""",
+                (last_name, cost, serialize(payload)))
+
+
+def lease_tortoise_job(worker, lease_time, max_attempts):
+    '''
+    Assigns the most expensive available last name cluster of the
+    distributed disambiguation queue to the specified worker. A cluster
+    is available if it is waiting or if the lease of the worker which was
+    processing it has expired (i.e. the worker crashed). Clusters which
+    have been attempted max_attempts times are marked as failed.
+
+    @param worker: worker identifier
+    @type worker: str
+    @param lease_time: seconds after which the lease expires if not renewed
+    @type lease_time: int
+    @param max_attempts: maximum number of attempts per cluster
+    @type max_attempts: int
+
+    @return: (job_id, last_name, payload) or None if no cluster is available
+    @rtype: (int, str, dict)
+    '''
+    run_sql("""update aidTORTOISEQUEUE
+               set status='FAILED', finished=now(), message='Lease expired too many times.'
+               where status='RUNNING' and lease_expires < now() and attempts >= %s""",
+            (max_attempts,))
+
+    while True:
+        candidates = run_sql("""select id
+                                from aidTORTOISEQUEUE
+                                where status='WAITING'
+                                or (status='RUNNING' and lease_expires < now())
+                                order by cost desc
+                                limit 10""")
+        if not candidates:
+            return None
+
+        for job_id, in candidates:
+            # the update is atomic: only one of the competing workers gets the job
+            leased = run_sql("""update aidTORTOISEQUEUE
+                                set status='RUNNING', worker=%s, attempts=attempts+1,
+                                    lease_expires=now() + interval %s second, started=now()
+                                where id=%s
+                                and (status='WAITING' or (status='RUNNING' and lease_expires < now()))""",
+                             (worker, lease_time, job_id))
+            if leased:
+                last_name, payload = run_sql("""select last_name, payload
+                                                from aidTORTOISEQUEUE
+                                                where id=%s""",
+                                             (job_id,))[0]
+                return job_id, last_name, deserialize(payload)
+
+
+def renew_tortoise_job_lease(job_id, worker, lease_time):
+    '''
+    Extends the lease of a last name cluster held by the specified worker.
+
+    @return: the worker still holds the lease
+    @rtype: bool
+    '''
+    return bool(run_sql("""update aidTORTOISEQUEUE
+                           set lease_expires=now() + interval %s second
+                           where id=%s and worker=%s and status='RUNNING'""",
+                        (lease_time, job_id, worker)))
+
+
+def finish_tortoise_job(job_id, worker, failed=False, max_attempts=1, message=''):
+    '''
+    Marks a last name cluster held by the specified worker as done. If
+    the worker failed, the cluster is put back in the queue unless it has
+    been attempted max_attempts times already.
+    '''
+    if not failed:
+        status = "'DONE'"
+    else:
+        status = "if(attempts >= %d, 'FAILED', 'WAITING')" % max_attempts
+    run_sql("""update aidTORTOISEQUEUE
+               set status=%s, finished=now(), message=%%s
+               where id=%%s and worker=%%s and status='RUNNING'""" % status,
+            (message, job_id, worker))
+
+# ********** getters **********#
+
+
+def get_tortoise_queue_status():
+    '''
+    Gets the progress of the distributed disambiguation queue.
+
+    @return: {status: (number of last name clusters, total cost)}
+    @rtype: dict {str: (int, int)}
+    '''
+    return dict((status, (int(count), int(cost or 0))) for status, count, cost in
+                run_sql("""select status, count(*), sum(cost)
+                           from aidTORTOISEQUEUE
+                           group by status"""))
+
+
+def get_failed_tortoise_jobs():
+    '''
+    Gets the last name clusters the distributed disambiguation gave up on.
+
+    @return: ((last_name, attempts, message),)
+    @rtype: tuple ((str, int, str),)
+    '''
+    return run_sql("""select last_name, attempts, message
+                      from aidTORTOISEQUEUE
+                      where status='FAILED'""")
+
+
 #
 #
 # aidUSERINPUTLOG table                                    ###
@@ -4033,6 +4168,33 @@ def get_inverted_lists(qgrams):
                    % _get_sqlstr_from_set(qgrams, f=lambda x: "'%s'" % x))
 
 
+def get_all_inverted_lists():
+    '''
+    Gets all the inverted lists of the search engine.
+
+    @return: qgrams and their inverted lists
+    @rtype: tuple ((str, bytes),)
+    '''
+    return run_sql("""select qgram, inverted_list
+                      from aidINVERTEDLISTS
+                      where qgram != %s""",
+                   ('!' * bconfig.QGRAM_LEN,))
+
+
+def get_dense_index():
+    '''
+    Gets the whole dense index of the search engine: the indexable names
+    (flag 0) and the name variants of the authors (flag 1).
+
+    @return: identifier, indexable name, serialized authors or name
+        variants, flag and indexable surname of each entry
+    @rtype: tuple ((int, str, bytes, int, str),)
+    '''
+    return run_sql("""select id, indexable_string, personids, flag, indexable_surname
+                      from aidDENSEINDEX
+                      where flag in (0, 1)""")
+
+
 def populate_partial_marc_caches(selected_bibrecs=None, verbose=True, create_inverted_dicts=False):
     '''
     Populates marc caches.
@@ -292,13 +292,10 @@ def person_search_engine_query(query_string):
     except ValueError:
         pass
 
-    search_engine_status = dbinter.search_engine_is_operating()
-
-    if search_engine_status:
-        personids_list = find_personids_by_name(query_string, trust_is_operating=True)
-        personid_list = [(i, []) for i in personids_list]
-        if personid_list:
-            return personid_list
+    # None if the search engine is not operating
+    personids_list = find_personids_by_name(query_string)
+    if personids_list:
+        return [(i, []) for i in personids_list]
 
     return fallback_find_personids_by_name_string(query_string)
 
@@ -19,8 +19,10 @@
 
 
 import gc
+import numpy
 import invenio.bibauthorid_config as bconfig
 from invenio.bibauthorid_comparison import compare_bibrefrecs
+from invenio.bibauthorid_comparison import compare_bibrefrecs_block, SignatureFeatures
 from invenio.bibauthorid_comparison import clear_all_caches as clear_comparison_caches
 from invenio.bibauthorid_backinterface import get_modified_papers_before
 from invenio.bibauthorid_logutils import Logger
@@ -41,6 +43,11 @@ if bconfig.DEBUG_CHECKS:
 
 logger = Logger("prob_matrix")
 
+# number of matrix entries computed at once by recalculate
+CFG_BLOCK_SIZE = 2000000
+# number of columns of a tile passed to compare_bibrefrecs_block
+CFG_TILE_SIZE = 4096
+
 
 class ProbabilityMatrix(object):
 
@@ -69,6 +76,12 @@ class ProbabilityMatrix(object):
     def getitem_numeric(self, bibs):
         return self._bib_matrix.getitem_numeric(bibs)
 
+    def get_index(self, bib):
+        return self._bib_matrix.get_index(bib)
+
+    def get_entries_numeric(self, bib_indexes1, bib_indexes2):
+        return self._bib_matrix.get_entries_numeric(bib_indexes1, bib_indexes2)
+
     def __get_up_to_date_bibs(self, bib_matrix):
         return frozenset(get_modified_papers_before(
                          bib_matrix.get_keys(),
@@ -77,6 +90,23 @@ class ProbabilityMatrix(object):
     def is_up_to_date(self, cluster_set):
         return self.__get_up_to_date_bibs(self._bib_matrix) >= frozenset(cluster_set.all_bibs())
 
+    @staticmethod
+    def _calculate_tile(features, rows, cols, cluster_of, hated):
+        '''
+        Returns an empty tile of the matrix and the mask of its entries
+        which have to be filled: a signature is compared with the
+        signatures with a smaller index, unless they belong to the same
+        cluster or to clusters which hate each other.
+        '''
+        values = numpy.empty((len(rows), len(cols), 2), dtype=numpy.float32)
+        values.fill(Bib_matrix.special_symbols[None])
+        row_clusters, col_clusters = cluster_of[rows], cluster_of[cols]
+        needed = (cols[None, :] < rows[:, None]) & (row_clusters[:, None] != col_clusters[None, :])
+        for i, cl in enumerate(row_clusters):
+            if len(hated[cl]):
+                needed[i] &= ~numpy.in1d(col_clusters, hated[cl])
+        return values, needed
+
     def recalculate(self, cluster_set):
         '''
         Constructs probability matrix. If use_cache is true, it will
@@ -106,9 +136,31 @@ class ProbabilityMatrix(object):
         if expected == 0:
             expected = 1
 
+        # The matrix is filled a block of rows at a time: the comparisons
+        # are computed by compare_bibrefrecs_block on tiles of the block
+        # and every block is written with a single slice assignment.
+        bibs = self._bib_matrix.get_bibs()
+        nbibs = len(bibs)
+        cluster_of = numpy.empty(nbibs, dtype=numpy.int64)
+        cluster_index = dict((id(cl), i) for i, cl in enumerate(cluster_set.clusters))
+        hated = list()
+        for i, cl in enumerate(cluster_set.clusters):
+            for bib in cl.bibs:
+                cluster_of[self._bib_matrix.get_index(bib)] = i
+            hated.append(numpy.array([cluster_index[id(h)] for h in cl.hate
+                                      if id(h) in cluster_index], dtype=numpy.int64))
+
+        if have_cached_bibs:
+            old_index = numpy.array([old_matrix.get_index(bib) for bib in bibs], dtype=numpy.int64)
+
         try:
+            features = SignatureFeatures(bibs)
             cur_calc, opti, prints_counter = 0, 0, 0
-            for cl1 in cluster_set.clusters:
+            first = 0
+            while first < nbibs:
+                last = first + 1
+                while last < nbibs and (last - first + 1) * last < CFG_BLOCK_SIZE:
+                    last += 1
 
                 if cur_calc + opti - prints_counter > 100000 or cur_calc == 0:
                     logger.update_status(
@@ -116,33 +168,45 @@ class ProbabilityMatrix(object):
                         (cur_calc, opti))
                     prints_counter = cur_calc + opti
 
-    # clean caches
+                rows = numpy.arange(first, last)
+                block = list()
+                for col_first in xrange(0, last, CFG_TILE_SIZE):
+                    cols = numpy.arange(col_first, min(last, col_first + CFG_TILE_SIZE))
+                    values, needed = self._calculate_tile(features, rows, cols, cluster_of, hated)
+                    ncached = 0
+                    if have_cached_bibs:
+                        cached = needed & (old_index[rows][:, None] >= 0) & (old_index[cols][None, :] >= 0)
+                        idx1, idx2 = numpy.nonzero(cached)
+                        if len(idx1):
+                            old_values = old_matrix.get_entries_numeric(old_index[rows][idx1], old_index[cols][idx2])
+                            valid = old_values[:, 0] != Bib_matrix.special_symbols[None]
+                            values[idx1[valid], idx2[valid]] = old_values[valid]
+                            cached[idx1[~valid], idx2[~valid]] = False
+                            ncached = int(valid.sum())
+                            if bconfig.DEBUG_CHECKS:
+                                for i, j in zip(idx1[valid], idx2[valid]):
+                                    assert _debug_is_eq_v(Bib_matrix.special_numbers.get(values[i, j, 0], tuple(values[i, j])),
+                                                          compare_bibrefrecs(bibs[rows[i]], bibs[cols[j]]))
+                    to_calculate = needed
+                    if ncached:
+                        to_calculate = needed & ~cached
+                    if to_calculate.any():
+                        computed, different = compare_bibrefrecs_block(features, rows, cols, to_calculate)
+                        computed[different] = Bib_matrix.special_symbols['-']
+                        values[to_calculate] = computed[to_calculate]
+                    opti += ncached
+                    cur_calc += int(needed.sum()) - ncached
+                    block.append(values)
+                block = numpy.concatenate(block, axis=1)
+                # row j only holds the comparisons with the signatures 0..j
+                self._bib_matrix.set_rows(first, block[numpy.tril(numpy.ones((last - first, last), dtype=bool), first)])
+                first = last
+
+                # clean caches
                 if cur_calc - last_cleaned > 20000000:
                     gc.collect()
-    #                clear_comparison_caches()
                     last_cleaned = cur_calc
 
-                for cl2 in cluster_set.clusters:
-                    if id(cl1) < id(cl2) and not cl1.hates(cl2):
-                        for bib1 in cl1.bibs:
-                            for bib2 in cl2.bibs:
-                                if have_cached_bibs:
-                                    try:
-                                        val = old_matrix[bib1, bib2]
-                                        opti += 1
-                                        if bconfig.DEBUG_CHECKS:
-                                            assert _debug_is_eq_v(val, compare_bibrefrecs(bib1, bib2))
-                                    except KeyError:
-                                        cur_calc += 1
-                                        val = compare_bibrefrecs(bib1, bib2)
-                                    if val is None:
-                                        cur_calc += 1
-                                        val = compare_bibrefrecs(bib1, bib2)
-                                else:
-                                    cur_calc += 1
-                                    val = compare_bibrefrecs(bib1, bib2)
-                                self._bib_matrix[bib1, bib2] = val
-
         except Exception as e:
             raise Exception("""Error happened in prob_matrix.recalculate
             original_exception: %s
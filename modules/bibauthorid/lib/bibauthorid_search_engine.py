@@ -20,10 +20,15 @@
 """ Approximate search engine for authors. """
 
 from invenio.bibauthorid_config import QGRAM_LEN, MATCHING_QGRAMS_PERCENTAGE, \
-    MAX_T_OCCURANCE_RESULT_LIST_CARDINALITY, MIN_T_OCCURANCE_RESULT_LIST_CARDINALITY
+    MAX_T_OCCURANCE_RESULT_LIST_CARDINALITY, MIN_T_OCCURANCE_RESULT_LIST_CARDINALITY, \
+    SEARCH_ENGINE_INDEX_FILE
 
 from multiprocessing import Queue, Process, Pool
+import os
 import re
+import cPickle
+from array import array
+from bisect import bisect_left
 # from threading import Thread
 from operator import itemgetter
 from itertools import groupby, chain
@@ -38,7 +43,8 @@ from invenio.bibauthorid_dbinterface import get_confirmed_name_to_authors_mappin
     populate_table, set_inverted_lists_ready, \
     set_dense_index_ready, search_engine_is_operating, \
     get_indexed_strings, get_author_groups_from_string_ids, \
-    get_name_variants_for_authors, get_inverted_lists
+    get_name_variants_for_authors, get_inverted_lists, \
+    get_all_inverted_lists, get_dense_index
 
 from invenio.bibauthorid_general_utils import memoized
 
@@ -117,6 +123,10 @@ def create_bibauthorid_indexer():
     cache_name_variants_of_authors(author_to_name_and_occurrence_mapping)
     set_dense_index_ready()
 
+    index = SearchEngineIndex()
+    index.load_from_db()
+    store_search_engine_index(index)
+
 
 def _split_and_index(el):
     name, pids = el
@@ -253,6 +263,181 @@ def cache_name_variants_of_authors(author_to_name_and_occurrence_mapping):
     populate_table('aidDENSEINDEX', ['id', 'personids', 'flag'], args, empty_table_first=False)
 
 
+#
+#
+# In-memory index     ###
+#
+#
+
+
+class SearchEngineIndex(object):
+    '''
+    In-memory copy of the search engine index. The inverted lists are sorted
+    arrays of string identifiers and the dense index is made of lists
+    addressed by string identifier, hence a query does not need to access
+    the database.
+    '''
+
+    # To be increased whenever the structure of the index changes.
+    version = 1
+
+    def __init__(self):
+        self.inverted_lists = dict()
+        self.strings = list()
+        self.surnames = list()
+        self.authors = list()
+        self.name_variants = dict()
+
+    def load_from_db(self):
+        '''
+        Reads the whole index from the aidINVERTEDLISTS and aidDENSEINDEX tables.
+        '''
+        dense_index = get_dense_index()
+        size = max([sid + 1 for sid, _, _, flag, _ in dense_index if flag == 0] or [0])
+        self.strings = [None] * size
+        self.surnames = [None] * size
+        self.authors = [()] * size
+        self.name_variants = dict()
+
+        for sid, string, authors, flag, surname in dense_index:
+            if flag == 0:
+                self.strings[sid] = string
+                self.surnames[sid] = surname
+                self.authors[sid] = tuple(deserialize(authors))
+            else:
+                self.name_variants[sid] = deserialize(authors)
+
+        self.inverted_lists = dict()
+        for qgram, inverted_list in get_all_inverted_lists():
+            self.inverted_lists[qgram] = array('i', sorted(deserialize(inverted_list)))
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['inverted_lists'] = dict((qgram, inverted_list.tostring())
+                                       for qgram, inverted_list in self.inverted_lists.iteritems())
+        return state
+
+    def __setstate__(self, state):
+        inverted_lists = dict()
+        for qgram, inverted_list in state['inverted_lists'].iteritems():
+            inverted_lists[qgram] = array('i')
+            inverted_lists[qgram].fromstring(inverted_list)
+        state['inverted_lists'] = inverted_lists
+        self.__dict__.update(state)
+
+    def get_inverted_lists(self, qgrams):
+        '''
+        @return: sorted inverted lists of the given qgrams and their cardinality
+        @rtype: list [(array, int),]
+        '''
+        inverted_lists = list()
+        for qgram in sorted(qgrams):
+            try:
+                inverted_list = self.inverted_lists[qgram]
+            except KeyError:
+                continue
+            inverted_lists.append((inverted_list, len(inverted_list)))
+        return inverted_lists
+
+    def get_indexed_strings(self, string_ids):
+        '''
+        Same as get_indexed_strings in bibauthorid_dbinterface.
+        '''
+        strings_to_ids_mapping = dict()
+        for sid in string_ids:
+            strings_to_ids_mapping[self.strings[sid]] = {'sid': sid, 'surname': self.surnames[sid]}
+        return strings_to_ids_mapping
+
+    def get_authors(self, string_ids):
+        '''
+        @return: authors who carry any of the given indexable names
+        @rtype: set set(int,)
+        '''
+        authors = set()
+        for sid in string_ids:
+            authors.update(self.authors[sid])
+        return authors
+
+    def get_name_variants_for_authors(self, authors):
+        '''
+        Same as get_name_variants_for_authors in bibauthorid_dbinterface.
+        '''
+        return dict((author, self.name_variants[author])
+                    for author in authors if author in self.name_variants)
+
+
+class _DatabaseSearchEngineIndex(object):
+    '''
+    Same interface as SearchEngineIndex, answering from the database. Used
+    when the in-memory index is not available.
+    '''
+
+    def get_inverted_lists(self, qgrams):
+        return [(sorted(deserialize(inverted_list)), cardinality)
+                for inverted_list, cardinality in get_inverted_lists(qgrams)]
+
+    def get_indexed_strings(self, string_ids):
+        return get_indexed_strings(string_ids)
+
+    def get_authors(self, string_ids):
+        authors = set()
+        for author_group in get_author_groups_from_string_ids(string_ids):
+            authors |= set(deserialize(author_group[0]))
+        return authors
+
+    def get_name_variants_for_authors(self, authors):
+        return get_name_variants_for_authors(authors)
+
+
+_SEARCH_ENGINE_INDEX_CACHE = {'mtime': None, 'index': None}
+
+
+def store_search_engine_index(index):
+    '''
+    Atomically replaces SEARCH_ENGINE_INDEX_FILE with the given index. The
+    processes which have the previous one loaded pick up the new one at
+    their next query.
+    '''
+    dirname = os.path.dirname(SEARCH_ENGINE_INDEX_FILE)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    tmp_file = '%s.%s.tmp' % (SEARCH_ENGINE_INDEX_FILE, os.getpid())
+    index_file = open(tmp_file, 'wb')
+    try:
+        cPickle.dump(index, index_file, -1)
+    finally:
+        index_file.close()
+    os.rename(tmp_file, SEARCH_ENGINE_INDEX_FILE)
+
+
+def load_search_engine_index():
+    '''
+    Returns the in-memory search engine index, or None if the indexer has
+    not dumped it yet. The index is kept in memory by each process and
+    reloaded only when the file changes.
+
+    @rtype: SearchEngineIndex
+    '''
+    try:
+        mtime = os.path.getmtime(SEARCH_ENGINE_INDEX_FILE)
+    except OSError:
+        return None
+    if _SEARCH_ENGINE_INDEX_CACHE['mtime'] != mtime:
+        try:
+            index_file = open(SEARCH_ENGINE_INDEX_FILE, 'rb')
+            try:
+                index = cPickle.load(index_file)
+            finally:
+                index_file.close()
+        except (IOError, EOFError, cPickle.UnpicklingError):
+            return None
+        if getattr(index, 'version', None) != SearchEngineIndex.version:
+            return None
+        _SEARCH_ENGINE_INDEX_CACHE['index'] = index
+        _SEARCH_ENGINE_INDEX_CACHE['mtime'] = mtime
+    return _SEARCH_ENGINE_INDEX_CACHE['index']
+
+
 #
 #
 # Querying            ###
@@ -273,10 +458,11 @@ def find_personids_by_name(query_string, trust_is_operating=False):
     @return: author identifiers
     @rtype: list [int,]
     '''
-    if not trust_is_operating:
-        search_engine_is_oper = search_engine_is_operating()
-        if not search_engine_is_oper:
+    index = load_search_engine_index()
+    if index is None:
+        if not trust_is_operating and not search_engine_is_operating():
             return None
+        index = _DatabaseSearchEngineIndex()
 
     asciified_qstring = translate_to_ascii(query_string)[0]
     indexable_qstring = create_indexable_name(split_name_parts(indexable_name_re.sub(' ', asciified_qstring)))
@@ -287,24 +473,21 @@ def find_personids_by_name(query_string, trust_is_operating=False):
 
     qstring_first_names = indexable_qstring.split(' ')[len(indexable_qstring_sur.split(' ')):]
 
-    string_ids = solve_T_occurence_problem(indexable_qstring) | solve_T_occurence_problem(indexable_qstring_sur)
+    string_ids = solve_T_occurence_problem(indexable_qstring, index) | \
+        solve_T_occurence_problem(indexable_qstring_sur, index)
     if not string_ids:
         return list()
 
-    strings_to_ids_mapping = get_indexed_strings(string_ids)
+    strings_to_ids_mapping = index.get_indexed_strings(string_ids)
 
     passing_string_ids, surname_score_cache = remove_false_positives(indexable_qstring_sur, strings_to_ids_mapping)
 
     if not passing_string_ids:
         return list()
 
-    author_groups = get_author_groups_from_string_ids(passing_string_ids)
-
-    authors = set()
-    for author_group in author_groups:
-        authors |= set(deserialize(author_group[0]))
+    authors = index.get_authors(passing_string_ids)
 
-    author_to_names_mapping = get_name_variants_for_authors(authors)
+    author_to_names_mapping = index.get_name_variants_for_authors(authors)
 
     surname_score_clusters = create_surname_score_clusters(
         indexable_qstring_sur,
@@ -322,7 +505,36 @@ def find_personids_by_name(query_string, trust_is_operating=False):
     return sorted_authors
 
 
-def solve_T_occurence_problem(query_string):
+def intersect_sorted_lists(first, second):
+    '''
+    Merges two sorted lists of string ids keeping the common ones. The
+    shortest list is scanned while the position in the longest one only moves
+    forward with binary searches.
+
+    @param first: sorted string ids
+    @type first: sequence
+    @param second: sorted string ids
+    @type second: sequence
+
+    @return: sorted string ids found in both lists
+    @rtype: array [int,]
+    '''
+    if len(first) > len(second):
+        first, second = second, first
+
+    common = array('i')
+    lo, hi = 0, len(second)
+    for sid in first:
+        lo = bisect_left(second, sid, lo, hi)
+        if lo == hi:
+            break
+        if second[lo] == sid:
+            common.append(sid)
+
+    return common
+
+
+def solve_T_occurence_problem(query_string, index=None):
     '''
     It solves a 'T-occurence problem' which is defined as follows: find the
     string ids that appear at least T times in the inverted lists which
@@ -333,6 +545,9 @@ def solve_T_occurence_problem(query_string):
 
     @param query_string: the query string
     @type query_string: str
+    @param index: index to query (the in-memory one if available, otherwise
+        the database)
+    @type index: SearchEngineIndex
 
     @return: strings that share T (or more) common qgrams with the query string
     @rtype: intbitset intbitset(int,)
@@ -341,29 +556,35 @@ def solve_T_occurence_problem(query_string):
     if not qgrams:
         return intbitset()
 
-    inverted_lists = get_inverted_lists(qgrams)
+    if index is None:
+        index = load_search_engine_index() or _DatabaseSearchEngineIndex()
+
+    inverted_lists = index.get_inverted_lists(qgrams)
     if not inverted_lists:
         return intbitset()
 
     inverted_lists = sorted(inverted_lists, key=itemgetter(1), reverse=True)
     T = int(MATCHING_QGRAMS_PERCENTAGE * len(inverted_lists))
-    string_ids = intbitset(deserialize(inverted_lists[0][0]))
 
-    for i in range(1, T):
-        inverted_list = intbitset(deserialize(inverted_lists[i][0]))
-        string_ids &= inverted_list
+    # The T lists must all be intersected: start from the shortest ones,
+    # which keeps the merges cheap.
+    first_lists = sorted([inverted_list for inverted_list, _ in inverted_lists[:max(T, 1)]], key=len)
+    string_ids = first_lists[0]
+    for inverted_list in first_lists[1:]:
+        if not string_ids:
+            break
+        string_ids = intersect_sorted_lists(string_ids, inverted_list)
 
     for i in range(T, len(inverted_lists)):
         if len(string_ids) < MAX_T_OCCURANCE_RESULT_LIST_CARDINALITY:
             break
-        inverted_list = intbitset(deserialize(inverted_lists[i][0]))
-        string_ids_temp = string_ids & inverted_list
+        string_ids_temp = intersect_sorted_lists(string_ids, inverted_lists[i][0])
         if len(string_ids_temp) > MIN_T_OCCURANCE_RESULT_LIST_CARDINALITY:
             string_ids = string_ids_temp
         else:
             break
 
-    return string_ids
+    return intbitset(list(string_ids))
 
 
 def remove_false_positives(query_surname, strings_to_ids_mapping):
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the author search engine."""
+
+__revision__ = \
+    "$Id$"
+
+import cPickle
+from array import array
+
+from invenio.testutils import InvenioTestCase, make_test_suite, \
+    run_test_suite
+
+from invenio.intbitset import intbitset
+from invenio.bibauthorid_search_engine import SearchEngineIndex, \
+    intersect_sorted_lists, solve_T_occurence_problem
+
+
+class Test_intersect_sorted_lists(InvenioTestCase):
+
+    def test_intersection(self):
+        first = [1, 4, 5, 9, 12, 30]
+        second = array('i', [0, 4, 9, 10, 11, 12, 31])
+        self.assertEqual(list(intersect_sorted_lists(first, second)), [4, 9, 12])
+        self.assertEqual(list(intersect_sorted_lists(second, first)), [4, 9, 12])
+
+    def test_disjoint(self):
+        self.assertEqual(list(intersect_sorted_lists([1, 2, 3], [4, 5])), [])
+        self.assertEqual(list(intersect_sorted_lists([], [4, 5])), [])
+
+
+class Test_SearchEngineIndex(InvenioTestCase):
+
+    def setUp(self):
+        self.index = SearchEngineIndex()
+        self.index.strings = ['smith john', 'smith', 'smyth jane']
+        self.index.surnames = ['smith', '', 'smyth']
+        self.index.authors = [(1, 2), (1, 2, 3), (3,)]
+        self.index.name_variants = {1: {'smith john': 4}, 3: {'smyth jane': 1}}
+        self.index.inverted_lists = {}
+        for sid, string in enumerate(self.index.strings):
+            for qgram in set(string[x:x + 2] for x in range(len(string) - 1)):
+                self.index.inverted_lists.setdefault(qgram, array('i')).append(sid)
+
+    def test_pickle(self):
+        '''
+        The index should survive being stored and loaded.
+        '''
+        loaded = cPickle.loads(cPickle.dumps(self.index, -1))
+        self.assertEqual(loaded.inverted_lists, self.index.inverted_lists)
+        self.assertEqual(loaded.strings, self.index.strings)
+        self.assertEqual(loaded.authors, self.index.authors)
+
+    def test_lookups(self):
+        self.assertEqual(self.index.get_indexed_strings([0, 2]),
+                         {'smith john': {'sid': 0, 'surname': 'smith'},
+                          'smyth jane': {'sid': 2, 'surname': 'smyth'}})
+        self.assertEqual(self.index.get_authors([0, 2]), set([1, 2, 3]))
+        self.assertEqual(self.index.get_name_variants_for_authors([1, 2]),
+                         {1: {'smith john': 4}})
+
+    def test_T_occurence(self):
+        self.assertEqual(solve_T_occurence_problem('smith', self.index), intbitset([0, 1]))
+        self.assertEqual(solve_T_occurence_problem('zz', self.index), intbitset())
+
+
+TEST_SUITE = make_test_suite(Test_intersect_sorted_lists, Test_SearchEngineIndex)
+
+if __name__ == '__main__':
+    run_test_suite(TEST_SUITE)
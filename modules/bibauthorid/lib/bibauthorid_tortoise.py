@@ -18,6 +18,10 @@
 # 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
 
 import os
+import socket
+import multiprocessing as mp
+import threading
+import time
 # import cPickle as SER
 import msgpack as SER
 
@@ -34,15 +38,27 @@ try:
 except:
     from invenio.containerutils import defaultdict
 
+from invenio import bibauthorid_config as bconfig
 from invenio.bibauthorid_logutils import Logger
 
 
 from invenio.bibauthorid_cluster_set import delayed_cluster_sets_from_marktables
 from invenio.bibauthorid_cluster_set import delayed_cluster_sets_from_personid
+from invenio.bibauthorid_cluster_set import last_name_clusters_from_marktables
+from invenio.bibauthorid_cluster_set import create_lastname_list_from_personid
+from invenio.bibauthorid_cluster_set import delayed_create_from_mark
+from invenio.bibauthorid_cluster_set import delayed_create
+from invenio.bibauthorid_cluster_set import ClusterSet
 from invenio.bibauthorid_wedge import wedge
 from invenio.bibauthorid_name_utils import generate_last_name_cluster_str
 from invenio.bibauthorid_backinterface import empty_tortoise_results_table
 from invenio.bibauthorid_backinterface import remove_clusters_by_name
+from invenio.bibauthorid_backinterface import empty_tortoise_queue
+from invenio.bibauthorid_backinterface import add_tortoise_jobs
+from invenio.bibauthorid_backinterface import lease_tortoise_job
+from invenio.bibauthorid_backinterface import renew_tortoise_job_lease
+from invenio.bibauthorid_backinterface import finish_tortoise_job
+from invenio.bibauthorid_backinterface import get_tortoise_queue_status
 from invenio.bibauthorid_prob_matrix import prepare_matrix
 # Scheduler is [temporarily] deprecated in favour of the much simpler schedule_workers
 # from invenio.bibauthorid_scheduler import schedule, matrix_coefs
@@ -53,7 +69,7 @@ from invenio.bibauthorid_general_utils import schedule_workers
 logger = Logger("tortoise")
 
 '''
-    There are three main entry points to tortoise
+    There are four main entry points to tortoise
 
     i) tortoise
         Performs disambiguation iteration.
@@ -73,6 +89,11 @@ logger = Logger("tortoise")
         may also be used to fix a broken last name
         cluster. It does not involve multiprocessing
         so it is convinient to debug with pdb.
+
+    iv) tortoise_distributed_enqueue and tortoise_distributed
+        Same as tortoise/tortoise_from_scratch, but the
+        last name clusters are put in a queue shared by
+        workers running on several machines.
 '''
 
 # Exit codes:
@@ -149,6 +170,165 @@ def tortoise_last_names(names_args_list):
     schedule_workers(tortoise_last_name, names_args_list, with_kwargs=True)
 
 
+def tortoise_distributed_enqueue(from_mark=True, pure=False, last_run=None,
+                                 force_matrix_creation=False):
+    '''
+    Fills the distributed disambiguation queue with all last name clusters,
+    replacing the previous content of the queue. The cost of a cluster is
+    the square of its number of signatures, the number of comparisons of
+    its probability matrix: workers process the most expensive clusters
+    first, so that the small ones fill the gaps at the end of the run.
+    '''
+    empty_tortoise_queue()
+    if from_mark:
+        empty_tortoise_results_table()
+        jobs = ((name, size ** 2, {'from_mark': True,
+                                   'refs': list(refs),
+                                   'force_matrix': True})
+                for name, refs, size in last_name_clusters_from_marktables())
+    else:
+        force_matrix_creation = force_matrix_creation or pure
+        jobs = ((name, size ** 2, {'from_mark': False,
+                                   'pure': pure,
+                                   'pids': list(pids),
+                                   'force_matrix': force_matrix_creation})
+                for name, pids, size in create_lastname_list_from_personid(last_run))
+    add_tortoise_jobs(jobs)
+    log_tortoise_distributed_progress()
+
+
+class _LeaseKeeper(threading.Thread):
+
+    '''
+    Renews the lease of a job while the worker is processing it.
+    '''
+
+    def __init__(self, job_id, worker):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.job_id = job_id
+        self.worker = worker
+        self.lost = False
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while True:
+            self._stop_event.wait(bconfig.TORTOISE_QUEUE_LEASE_TIME / 3.)
+            if self._stop_event.isSet():
+                return
+            if not renew_tortoise_job_lease(self.job_id, self.worker,
+                                            bconfig.TORTOISE_QUEUE_LEASE_TIME):
+                self.lost = True
+                logger.log("Lost the lease of job %s." % self.job_id)
+                return
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def _tortoise_distributed_job(last_name, payload, may_store=None):
+    '''
+    Disambiguates a last name cluster of the distributed queue.
+
+    @return: whether the results were stored (see wedge_and_store)
+    '''
+    if payload['from_mark']:
+        create = delayed_create_from_mark(set(tuple(ref) for ref in payload['refs']), last_name)
+    else:
+        if payload['pure']:
+            create_f = ClusterSet.create_pure
+        else:
+            create_f = ClusterSet.create_skeleton
+        create = delayed_create(create_f, payload['pids'], last_name)
+    create_matrix(create(), payload['force_matrix'])
+    return wedge_and_store(create(), may_store=may_store)
+
+
+def tortoise_distributed_worker(worker=None):
+    '''
+    Processes last name clusters from the distributed disambiguation queue
+    until all of them are done. Several workers, on one or many machines,
+    may run at the same time.
+    '''
+    if worker is None:
+        worker = "%s:%d" % (socket.gethostname(), os.getpid())
+
+    processed = 0
+    while True:
+        job = lease_tortoise_job(worker, bconfig.TORTOISE_QUEUE_LEASE_TIME,
+                                 bconfig.TORTOISE_QUEUE_MAX_ATTEMPTS)
+        if job is None:
+            status = get_tortoise_queue_status()
+            if 'RUNNING' not in status:
+                break
+            # the jobs left are being processed: wait in case their worker
+            # crashes and the lease expires
+            time.sleep(min(bconfig.TORTOISE_QUEUE_LEASE_TIME / 10., 30))
+            continue
+
+        job_id, last_name, payload = job
+        logger.log("Worker %s got %s." % (worker, last_name))
+        keeper = _LeaseKeeper(job_id, worker)
+        keeper.start()
+
+        def may_store():
+            # The results are stored only under a valid lease: once it is
+            # lost, another worker may be processing the same cluster.
+            # Renewing it gives the storage a whole lease time, during
+            # which no other worker can take the cluster.
+            return not keeper.lost and \
+                renew_tortoise_job_lease(job_id, worker,
+                                         bconfig.TORTOISE_QUEUE_LEASE_TIME)
+
+        try:
+            stored = _tortoise_distributed_job(last_name, payload, may_store)
+        except Exception as e:
+            keeper.stop()
+            logger.log("Worker %s failed on %s: %s" % (worker, last_name, str(e)))
+            if not keeper.lost:
+                finish_tortoise_job(job_id, worker, failed=True,
+                                    max_attempts=bconfig.TORTOISE_QUEUE_MAX_ATTEMPTS,
+                                    message=str(e))
+            continue
+        keeper.stop()
+        if not stored or keeper.lost:
+            logger.log("Worker %s lost the lease of %s, abandoning it." % (worker, last_name))
+            continue
+        finish_tortoise_job(job_id, worker)
+        processed += 1
+        log_tortoise_distributed_progress()
+
+    return processed
+
+
+def tortoise_distributed(processes=None):
+    '''
+    Runs workers on the distributed disambiguation queue, one per
+    processor by default.
+    '''
+    if processes is None:
+        processes = mp.cpu_count()
+    schedule_workers(tortoise_distributed_worker, [()] * processes, max_processes=processes)
+
+
+def log_tortoise_distributed_progress():
+    '''
+    Logs the progress of the distributed disambiguation.
+    @return: {status: (number of last name clusters, total cost)}
+    '''
+    status = get_tortoise_queue_status()
+    total = sum(cost for dummy, cost in status.itervalues())
+    done = sum(status.get(s, (0, 0))[1] for s in ('DONE', 'FAILED'))
+    if total:
+        progress = float(done) / total
+    else:
+        progress = 1.
+    logger.update_status(progress, "Distributed tortoise: %s" %
+                         ", ".join("%s %d" % (s, status[s][0]) for s in sorted(status)))
+    return status
+
+
 def _collect_statistics_lname_coeff(params):
     lname = params[0]
     coeff = params[1]
@@ -371,7 +551,13 @@ def force_create_matrix(cluster_set, force):
     return create_matrix(cluster_set(), force)
 
 
-def wedge_and_store(cluster_set, wedge_threshold=None):
+def wedge_and_store(cluster_set, wedge_threshold=None, may_store=None):
+    '''
+    Wedges the cluster set and stores the results, unless may_store is
+    given and returns False once the wedge is done.
+
+    @return: whether the results were stored
+    '''
     bibs = cluster_set.num_all_bibs
     expected = bibs * (bibs - 1) / 2
     logger.log("Start working on %s. Total number of bibs: %d, "
@@ -379,6 +565,9 @@ def wedge_and_store(cluster_set, wedge_threshold=None):
                % (cluster_set.last_name, bibs, expected))
 
     wedge(cluster_set, force_wedge_thrsh=wedge_threshold)
+    if may_store is not None and not may_store():
+        logger.log("Not storing the results of %s." % cluster_set.last_name)
+        return False
     remove_clusters_by_name(cluster_set.last_name)
     cluster_set.store()
     return True
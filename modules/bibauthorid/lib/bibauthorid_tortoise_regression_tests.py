@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2014 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Regression tests for the distributed disambiguation queue."""
+
+from invenio.testutils import (InvenioTestCase,
+                               make_test_suite,
+                               run_test_suite)
+
+from invenio.bibauthorid_dbinterface import empty_tortoise_queue
+from invenio.bibauthorid_dbinterface import add_tortoise_jobs
+from invenio.bibauthorid_dbinterface import lease_tortoise_job
+from invenio.bibauthorid_dbinterface import renew_tortoise_job_lease
+from invenio.bibauthorid_dbinterface import finish_tortoise_job
+from invenio.bibauthorid_dbinterface import get_tortoise_queue_status
+from invenio.bibauthorid_tortoise import tortoise_distributed_worker
+
+from invenio.dbquery import run_sql
+
+from mock import patch
+
+
+class BibAuthorIDTortoiseQueueTestCase(InvenioTestCase):
+
+    def setUp(self):
+        empty_tortoise_queue()
+        add_tortoise_jobs([('testsurname', 4, {'from_mark': True, 'refs': [],
+                                                'force_matrix': True})])
+
+    def tearDown(self):
+        empty_tortoise_queue()
+
+    def _get_job(self):
+        return run_sql("""select status, worker, attempts
+                          from aidTORTOISEQUEUE
+                          where last_name='testsurname'""")[0]
+
+    def test_lease_and_finish(self):
+        job_id, last_name, payload = lease_tortoise_job('a', 60, 3)
+        self.assertEqual(last_name, 'testsurname')
+        self.assertEqual(payload['from_mark'], True)
+        # the lease is valid: nobody else gets the job
+        self.assertEqual(lease_tortoise_job('b', 60, 3), None)
+        self.assertTrue(renew_tortoise_job_lease(job_id, 'a', 60))
+        finish_tortoise_job(job_id, 'a')
+        self.assertEqual(self._get_job(), ('DONE', 'a', 1))
+
+    def test_expired_lease_is_reclaimed(self):
+        # a negative lease time makes the lease expire right away
+        job_id = lease_tortoise_job('a', -1, 3)[0]
+        self.assertEqual(lease_tortoise_job('b', 60, 3)[0], job_id)
+        self.assertEqual(self._get_job(), ('RUNNING', 'b', 2))
+        # the first worker lost the job
+        self.assertFalse(renew_tortoise_job_lease(job_id, 'a', 60))
+        finish_tortoise_job(job_id, 'a')
+        self.assertEqual(self._get_job(), ('RUNNING', 'b', 2))
+
+    def test_failed_job_is_retried(self):
+        job_id = lease_tortoise_job('a', 60, 2)[0]
+        finish_tortoise_job(job_id, 'a', failed=True, max_attempts=2)
+        self.assertEqual(self._get_job()[0], 'WAITING')
+        job_id = lease_tortoise_job('b', 60, 2)[0]
+        finish_tortoise_job(job_id, 'b', failed=True, max_attempts=2)
+        self.assertEqual(self._get_job()[0], 'FAILED')
+        self.assertEqual(lease_tortoise_job('c', 60, 2), None)
+
+    def test_max_attempts_of_expired_leases(self):
+        lease_tortoise_job('a', -1, 2)
+        lease_tortoise_job('b', -1, 2)
+        self.assertEqual(lease_tortoise_job('c', 60, 2), None)
+        self.assertEqual(self._get_job(), ('FAILED', 'b', 2))
+        self.assertEqual(get_tortoise_queue_status()['FAILED'], (1, 4))
+
+    def test_worker_does_not_store_without_lease(self):
+        stored = []
+
+        def job_taken_over(last_name, payload, may_store):
+            # another worker reclaims the job while this one processes it
+            run_sql("""update aidTORTOISEQUEUE set worker='other'
+                       where last_name=%s""", (last_name,))
+            stored.append(may_store())
+            job_id = run_sql("""select id from aidTORTOISEQUEUE
+                                where last_name=%s""", (last_name,))[0][0]
+            finish_tortoise_job(job_id, 'other')
+            return stored[-1]
+
+        with patch('invenio.bibauthorid_tortoise._tortoise_distributed_job',
+                   job_taken_over):
+            self.assertEqual(tortoise_distributed_worker('a'), 0)
+        self.assertEqual(stored, [False])
+        self.assertEqual(self._get_job(), ('DONE', 'other', 1))
+
+
+TEST_SUITE = make_test_suite(BibAuthorIDTortoiseQueueTestCase)
+
+if __name__ == '__main__':
+    run_test_suite(TEST_SUITE, warn_user=True)
@@ -21,7 +21,6 @@ from invenio import bibauthorid_config as bconfig
 from itertools import izip, starmap
 from operator import mul
 from multiprocessing import Process
-from invenio.bibauthorid_general_utils import sortFileInPlace
 from invenio.bibauthorid_logutils import Logger
 
 from invenio.bibauthorid_prob_matrix import ProbabilityMatrix, Bib_matrix
@@ -33,6 +32,7 @@ import gzip as filehandler
 import h5py
 
 import gc
+import heapq
 
 import cPickle
 
@@ -52,9 +52,11 @@ logger = Logger("wedge", verbose=bconfig.DEBUG_WEDGE_OUTPUT)
 import os
 PID = lambda: str(os.getpid())
 
-import pyximport
-pyximport.install()
-from invenio.bibauthorid_meld_edges import meld_edges
+# Edges are stored on disk as fixed size records. The value edges are
+# sorted by decreasing key (probability + certainty / 10) in runs of at
+# most WEDGE_MEMORY_BUDGET, merged while being read.
+EDGE_RECORD = numpy.dtype([('key', '<f8'), ('bib1', '<i4'), ('bib2', '<i4'),
+                           ('prob', '<f4'), ('cert', '<f4')])
 
 
 def wedge(cluster_set, report_cluster_status=False, force_wedge_thrsh=False):
@@ -124,7 +126,7 @@ def _decide(cl1, cl2):
 
 def _compare_to(cl1, cl2):
     cl1_out_edges = h5file[str(id(cl1))]
-    pointers = [cl1_out_edges[v] for v in cl2.bibs]
+    pointers = list(cl1_out_edges[sorted(cl2.bibs)])
 
     assert pointers, PID() + "Wedge: no edges between clusters!"
     vals, probs = zip(*pointers)
@@ -173,20 +175,59 @@ def _compare_to_final_bounds(score1, score2):
     return score1 + score2 > bconfig.WEDGE_THRESHOLD
 
 
-def _edge_sorting(edge):
+def _edges_path(kind, process_id):
+    return bconfig.TORTOISE_FILES_PATH + '/wedge_edges_cache_%s_%s' % (kind, process_id)
+
+
+def _edge_records(bib1, bibs2, vals):
+    records = numpy.empty(len(bibs2), dtype=EDGE_RECORD)
+    records['bib1'] = bib1
+    records['bib2'] = bibs2
+    records['prob'] = vals[:, 0]
+    records['cert'] = vals[:, 1]
+    # probability + certainty / 10
+    records['key'] = records['prob'].astype(numpy.float64) + records['cert'] / 10.
+    return records
+
+
+def _write_sorted_run(records, path):
+    order = numpy.argsort(-records['key'], kind='mergesort')
+    records[order].tofile(path)
+
+
+def _read_edges(path, block):
     '''
-    probability + certainty / 10
+    Yields the edge records of a file, reading block records at a time.
     '''
-    return edge[2][0] + edge[2][1] / 10.
+    fp = open(path, 'rb')
+    try:
+        while True:
+            records = numpy.fromfile(fp, dtype=EDGE_RECORD, count=block)
+            if not len(records):
+                break
+            for record in records:
+                yield record
+    finally:
+        fp.close()
 
 
-def _pack_vals(v):
-    return str(v[0]) + ';' + str(v[1]) + ';' + str(v[2][0]) + ';' + str(v[2][1]) + '\n'
+def _read_sorted_edges(process_id, runs):
+    '''
+    Merges the sorted runs of value edges. Edges with the same key come
+    in the order they were grouped, as with a stable sort.
+    '''
+    block = max(1, _max_buffered_edges() / max(1, runs))
+
+    def run_edges(run):
+        for pos, record in enumerate(_read_edges(_edges_path('e', process_id) + '.%03d' % run, block)):
+            yield -record['key'], run, pos, record
 
+    for dummy, dummy, dummy, record in heapq.merge(*[run_edges(run) for run in xrange(runs)]):
+        yield record
 
-def _unpack_vals(s):
-    v = s.strip().split(';')
-    return int(v[0]), int(v[1]), (float(v[2]), float(v[3]))
+
+def _max_buffered_edges():
+    return max(1, int(bconfig.WEDGE_MEMORY_BUDGET * 1024 * 1024 / (2 * EDGE_RECORD.itemsize)))
 
 
 def do_wedge(cluster_set, deep_debug=False):
@@ -205,17 +246,15 @@ def do_wedge(cluster_set, deep_debug=False):
     p.start()
     p.join()
 
-    plus_edges_fp = open(bconfig.TORTOISE_FILES_PATH + '/wedge_edges_cache_p_' + str(original_process_id), 'r')
-    minus_edges_fp = open(bconfig.TORTOISE_FILES_PATH + '/wedge_edges_cache_m_' + str(original_process_id), 'r')
-    edges_fp = open(bconfig.TORTOISE_FILES_PATH + '/wedge_edges_cache_e_' + str(original_process_id), 'r')
-    data_fp = open(bconfig.TORTOISE_FILES_PATH + '/wedge_edges_cache_data_' + str(original_process_id), 'r')
-
-    len_plus, len_minus, len_edges = cPickle.load(data_fp)
+    data_fp = open(_edges_path('data', original_process_id), 'r')
+    len_plus, len_minus, len_edges, runs = cPickle.load(data_fp)
     data_fp.close()
 
+    block = _max_buffered_edges()
+
     interval = 1000
-    for i, s in enumerate(plus_edges_fp):
-        bib1, bib2, unused = _unpack_vals(s)
+    for i, edge in enumerate(_read_edges(_edges_path('p', original_process_id), block)):
+        bib1, bib2 = int(edge['bib1']), int(edge['bib2'])
         if (i % interval) == 0:
             logger.update_status(float(i) / len_plus, "Agglomerating obvious clusters...")
         cl1 = bib_map[bib1]
@@ -228,8 +267,8 @@ def do_wedge(cluster_set, deep_debug=False):
     logger.update_status_final("Agglomerating obvious clusters done.")
 
     interval = 1000
-    for i, s in enumerate(minus_edges_fp):
-        bib1, bib2, unused = _unpack_vals(s)
+    for i, edge in enumerate(_read_edges(_edges_path('m', original_process_id), block)):
+        bib1, bib2 = int(edge['bib1']), int(edge['bib2'])
         if (i % interval) == 0:
             logger.update_status(float(i) / len_minus, "Dividing obvious clusters...")
         cl1 = bib_map[bib1]
@@ -241,8 +280,9 @@ def do_wedge(cluster_set, deep_debug=False):
     interval = 50000
     logger.log("Wedge: New wedge, %d edges." % len_edges)
     current = -1
-    for s in edges_fp:
-        v1, v2, unused = _unpack_vals(s)
+    for edge in _read_sorted_edges(original_process_id, runs):
+        v1, v2 = int(edge['bib1']), int(edge['bib2'])
+        unused = (float(edge['prob']), float(edge['cert']))
         current += 1
         if (current % interval) == 0:
             logger.update_status(float(current) / len_edges, "Wedge...")
@@ -292,16 +332,12 @@ def do_wedge(cluster_set, deep_debug=False):
     if deep_debug:
         export_to_dot(cluster_set, "/tmp/%sfinal.dot" % cluster_set.last_name, bib_map)
 
-    plus_edges_fp.close()
-    minus_edges_fp.close()
-    edges_fp.close()
-    data_fp.close()
-
     try:
-        os.remove(bconfig.TORTOISE_FILES_PATH + '/wedge_edges_cache_p_' + str(original_process_id))
-        os.remove(bconfig.TORTOISE_FILES_PATH + '/wedge_edges_cache_m_' + str(original_process_id))
-        os.remove(bconfig.TORTOISE_FILES_PATH + '/wedge_edges_cache_e_' + str(original_process_id))
-        os.remove(bconfig.TORTOISE_FILES_PATH + '/wedge_edges_cache_data_' + str(original_process_id))
+        os.remove(_edges_path('p', original_process_id))
+        os.remove(_edges_path('m', original_process_id))
+        for run in xrange(runs):
+            os.remove(_edges_path('e', original_process_id) + '.%03d' % run)
+        os.remove(_edges_path('data', original_process_id))
     except:
         pass
 
@@ -333,62 +369,41 @@ def convert_cluster_set(cs, prob_matr):
 
     # step 2:
     #    + Using the prob matrix create a vector values to all other bibs.
-    #    + Meld those vectors into one for each cluster.
+    #    + Meld those vectors into one for each cluster, one at a time so
+    #      that memory stays linear in the number of bibs.
 
-    special_symbols = Bib_matrix.special_symbols  # locality optimization
-    pb_getitem_numeric = prob_matr.getitem_numeric
+    size = len(result_mapping)
+    matrix_index = numpy.array([prob_matr.get_index(bib) for bib in result_mapping], dtype=numpy.int64)
+    assert (matrix_index >= 0).all(), PID() + "Cluster set conversion failed: bibs missing from the matrix"
 
     interval = 100
-    gc.set_threshold(100, 100, 100)
     current = -1
-    real_pointer = None
-    try:
-        for c1 in cs.clusters:
-            gc.collect()
-            current += 1
-            if (current % interval) == 0:
-                logger.update_status(float(current) / len(cs.clusters), "Converting the cluster set...")
+    for c1 in cs.clusters:
+        current += 1
+        if (current % interval) == 0:
+            logger.update_status(float(current) / len(cs.clusters), "Converting the cluster set...")
+
+        assert len(c1.bibs) > 0, PID() + "Empty cluster send to wedge"
 
-            assert len(c1.bibs) > 0, PID() + "Empty cluster send to wedge"
-            pointers = list()
+        others = numpy.ones(size, dtype=bool)
+        others[c1.bibs] = False
+        for c2 in c1.hate:
+            others[c2.bibs] = False
+        index = numpy.nonzero(others)[0]
 
+        h5file.create_dataset(str(id(c1)), (size, 2), 'f')
+        if len(index):
+            out_edges = None
             for v1 in c1.bibs:
-                pointer = list()
-                index = list()
-                rm = result_mapping[v1]  # locality optimization
-                for c2 in cs.clusters:
-                    if c1 != c2 and not c1.hates(c2):
-                        pointer += [pb_getitem_numeric((rm, result_mapping[v2])) for v2 in c2.bibs]
-                        index += c2.bibs
-                if index and pointer:
-                    real_pointer = numpy.ndarray(shape=(len(result_mapping), 2), dtype=float, order='C')
-                    real_pointer.fill(special_symbols[None])
-                    real_pointer[index] = pointer
-                    pointers.append((real_pointer, 1))
-
-            if pointers:
-                out_edges = reduce(meld_edges, pointers)[0]
-                h5file.create_dataset(str(id(c1)), (len(out_edges), 2), 'f')
-                dset = h5file[str(id(c1))]
-                dset[:] = out_edges
-            else:
-                h5file.create_dataset(str(id(c1)), (len(cs.clusters), 2), 'f')
-
-    except Exception as e:
-        raise Exception("""Error happened in convert_cluster_set with
-                        v1: %s,
-                        real_pointer: %s,
-                        pointer: %s,
-                        pointers: %s,
-                        result_mapping: %s, index: %s,
-                        len(real_pointer): %s,
-                        len(pointer): %s,
-                        len(pointers):  %s,
-                        original_exception: %s
-                        """ % (str(v1), str(real_pointer), str(pointer), str(pointers),
-                               str(result_mapping), str(index),
-                        str(len(real_pointer)), str(len(pointer)),
-                        str(len(pointers)), str(e)))
+                pointer = numpy.empty((size, 2), dtype=numpy.float32)
+                pointer.fill(SP_SYMBOLS[None])
+                pointer[index] = prob_matr.get_entries_numeric(
+                    numpy.repeat(matrix_index[v1], len(index)), matrix_index[index])
+                if out_edges is None:
+                    out_edges = (pointer, 1)
+                else:
+                    out_edges = meld_edges(out_edges, (pointer, 1))
+            h5file[str(id(c1))][:] = out_edges[0]
 
     logger.update_status_final("Converting the cluster set done.")
     # gc.enable()
@@ -416,17 +431,21 @@ def create_bib_2_cluster_dict(cs):
 def group_sort_edges(cs, original_process_id):
     logger.log("group_sort_edges spowned by %s" % original_process_id)
 
-    plus_fp = open(bconfig.TORTOISE_FILES_PATH + '/wedge_edges_cache_p_' + str(original_process_id), 'w')
-    minus_fp = open(bconfig.TORTOISE_FILES_PATH + '/wedge_edges_cache_m_' + str(original_process_id), 'w')
-    pairs_fp = open(bconfig.TORTOISE_FILES_PATH + '/wedge_temp_edges_cache_e_' + str(original_process_id), 'w')
-    data_fp = open(bconfig.TORTOISE_FILES_PATH + '/wedge_edges_cache_data_' + str(original_process_id), 'w')
+    plus_fp = open(_edges_path('p', original_process_id), 'wb')
+    minus_fp = open(_edges_path('m', original_process_id), 'wb')
+    data_fp = open(_edges_path('data', original_process_id), 'w')
 
     plus_count = 0
     minus_count = 0
     pairs_count = 0
 
-    default_val = [0., 0.]
-    # gc.disable()
+    # value edges are buffered up to the memory budget, then sorted and
+    # written to disk as a run
+    max_buffered = _max_buffered_edges()
+    buffered = list()
+    buffered_count = 0
+    runs = 0
+
     interval = 1000
     current = -1
     for cl1 in cs.clusters:
@@ -435,57 +454,90 @@ def group_sort_edges(cs, original_process_id):
             logger.update_status(float(current) / len(cs.clusters), "Grouping all edges...")
 
         bib1 = tuple(cl1.bibs)[0]
-        pointers = h5file[str(id(cl1))]
-        for bib2 in xrange(len(h5file[str(id(cl1))])):
-            val = pointers[bib2]
-            # if val[0] not in Bib_matrix.special_numbers:
-            # optimization: special numbers are assumed to be negative
-            if val[0] >= 0:
-
-                if val[0] > edge_cut_prob:
-                    pairs_count += 1
-                    pairs_fp.write(_pack_vals((bib1, bib2, val)))
-
-            elif val[0] == Bib_matrix.special_symbols['+']:
-                plus_count += 1
-                plus_fp.write(_pack_vals((bib1, bib2, default_val)))
-
-            elif val[0] == Bib_matrix.special_symbols['-']:
-                minus_count += 1
-                minus_fp.write(_pack_vals((bib1, bib2, default_val)))
-            else:
-                assert val[0] == Bib_matrix.special_symbols[None], "Invalid Edge"
+        out_edges = h5file[str(id(cl1))][...]
+        vals = out_edges[:, 0]
+        bibs2 = numpy.arange(len(out_edges))
+
+        # optimization: special numbers are assumed to be negative
+        pairs = vals > edge_cut_prob
+        plus = vals == Bib_matrix.special_symbols['+']
+        minus = vals == Bib_matrix.special_symbols['-']
+        assert (vals[(vals < 0) & ~plus & ~minus] == Bib_matrix.special_symbols[None]).all(), "Invalid Edge"
+
+        default_vals = numpy.zeros((len(out_edges), 2), dtype=numpy.float32)
+        _edge_records(bib1, bibs2[plus], default_vals[plus]).tofile(plus_fp)
+        _edge_records(bib1, bibs2[minus], default_vals[minus]).tofile(minus_fp)
+        plus_count += int(plus.sum())
+        minus_count += int(minus.sum())
+
+        if pairs.any():
+            buffered.append(_edge_records(bib1, bibs2[pairs], out_edges[pairs]))
+            buffered_count += len(buffered[-1])
+            pairs_count += len(buffered[-1])
+        if buffered_count >= max_buffered:
+            _write_sorted_run(numpy.concatenate(buffered), _edges_path('e', original_process_id) + '.%03d' % runs)
+            runs += 1
+            buffered = list()
+            buffered_count = 0
+
+    if buffered:
+        _write_sorted_run(numpy.concatenate(buffered), _edges_path('e', original_process_id) + '.%03d' % runs)
+        runs += 1
 
     logger.update_status_final("Finished with the edge grouping.")
 
     plus_fp.close()
     minus_fp.close()
-    pairs_fp.close()
-
-    logger.log("Positive edges: %d, Negative edges: %d, Value edges: %d."
-               % (plus_count, minus_count, pairs_count))
-    # gc.enable()
-    logger.log("Sorting in-file value edges.")
-    sortFileInPlace(bconfig.TORTOISE_FILES_PATH + '/wedge_temp_edges_cache_e_' + str(original_process_id),
-                    bconfig.TORTOISE_FILES_PATH + '/wedge_edges_cache_e_' + str(original_process_id),
-                    lambda x: _edge_sorting(_unpack_vals(x)), reverse=True)
 
-    os.remove(bconfig.TORTOISE_FILES_PATH + '/wedge_temp_edges_cache_e_' + str(original_process_id))
+    logger.log("Positive edges: %d, Negative edges: %d, Value edges: %d in %d sorted runs."
+               % (plus_count, minus_count, pairs_count, runs))
 
     logger.log("Dumping egdes data to file...")
-    cPickle.dump((plus_count, minus_count, pairs_count), data_fp)
+    cPickle.dump((plus_count, minus_count, pairs_count, runs), data_fp)
     logger.log("Grouping and sorting of edges is done!")
     data_fp.close()
 
 
+def meld_edges(p1, p2):
+    '''
+    Creates one out_edges set from two.
+    The operation is associative and commutative.
+    The objects are: (out_edges for in a cluster, number of vertices in the same cluster)
+    '''
+    out_edges1, verts1 = p1
+    out_edges2, verts2 = p2
+    assert verts1 > 0 and verts2 > 0, PID() + 'MELD_EDGES: verts problem %s %s ' % (str(verts1), str(verts2))
+    assert len(out_edges1) == len(out_edges2), PID() + "MELD_EDGES: Invalid arguments for meld edges"
+    vsum = verts1 + verts2
+
+    out_edges1 = numpy.asarray(out_edges1, dtype=numpy.float64)
+    out_edges2 = numpy.asarray(out_edges2, dtype=numpy.float64)
+    i1 = out_edges1[:, 1] * verts1
+    i2 = out_edges2[:, 1] * verts2
+    inter_cert = i1 + i2
+    inter_prob = out_edges1[:, 0] * i1 + out_edges2[:, 0] * i2
+
+    result = numpy.zeros((len(out_edges1), 2), dtype=numpy.float32)
+    valid = inter_cert != 0
+    result[valid, 0] = inter_prob[valid] / inter_cert[valid]
+    result[valid, 1] = inter_cert[valid] / vsum
+
+    # special numbers are negative and take precedence, the first set first
+    special = out_edges2[:, 0] < 0
+    result[special] = out_edges2[special]
+    special = out_edges1[:, 0] < 0
+    result[special] = out_edges1[special]
+    return (result, vsum)
+
+
 def join(cl1, cl2):
     '''
     Joins two clusters from a cluster set in the first.
     '''
     cl1_out_edges = h5file[str(id(cl1))]
     cl2_out_edges = h5file[str(id(cl2))]
-    cl1_out_edges[:] = meld_edges((cl1_out_edges, len(cl1.bibs)),
-                                  (cl2_out_edges, len(cl2.bibs)))[0]
+    cl1_out_edges[:] = meld_edges((cl1_out_edges[...], len(cl1.bibs)),
+                                  (cl2_out_edges[...], len(cl2.bibs)))[0]
     cl1.bibs += cl2.bibs
 
     assert not cl1.hates(cl1), PID() + "Joining hateful clusters"
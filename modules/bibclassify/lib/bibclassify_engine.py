@@ -174,6 +174,7 @@ def get_keywords_from_text(text_lines, taxonomy_name, output_mode="text",
 
     _skw = cache[0]
     _ckw = cache[1]
+    _matcher = cache[2]
 
     text_lines = normalizer.cut_references(text_lines)
     fulltext = normalizer.normalize_fulltext("\n".join(text_lines))
@@ -183,14 +184,14 @@ def get_keywords_from_text(text_lines, taxonomy_name, output_mode="text",
 
     author_keywords = None
     if with_author_keywords:
-        author_keywords = extract_author_keywords(_skw, _ckw, fulltext)
+        author_keywords = extract_author_keywords(_skw, _ckw, fulltext, _matcher)
 
     acronyms = {}
     if extract_acronyms:
         acronyms = extract_abbreviations(fulltext)
 
 
-    single_keywords = extract_single_keywords(_skw, fulltext)
+    single_keywords = extract_single_keywords(_skw, fulltext, _matcher)
     composite_keywords = extract_composite_keywords(_ckw, fulltext, single_keywords)
 
 
@@ -218,17 +219,18 @@ def get_keywords_from_text(text_lines, taxonomy_name, output_mode="text",
 
 
 
-def extract_single_keywords(skw_db, fulltext):
+def extract_single_keywords(skw_db, fulltext, matcher=None):
     """Find single keywords in the fulltext
     @var skw_db: list of KeywordToken objects
     @var fulltext: string, which will be searched
+    @keyword matcher: KeywordMatcher of skw_db
     @return : dictionary of matches in a format {
             <keyword object>, [[position, position...], ],
             ..
             }
             or empty {}
     """
-    return keyworder.get_single_keywords(skw_db, fulltext) or {}
+    return keyworder.get_single_keywords(skw_db, fulltext, matcher) or {}
 
 def extract_composite_keywords(ckw_db, fulltext, skw_spans):
     """Returns a list of composite keywords bound with the number of
@@ -258,7 +260,7 @@ def extract_abbreviations(fulltext):
         acronyms[K(k, type='acronym')] = v
     return acronyms
 
-def extract_author_keywords(skw_db, ckw_db, fulltext):
+def extract_author_keywords(skw_db, ckw_db, fulltext, matcher=None):
     """Finds out human defined keyowrds in a text string. Searches for
     the string "Keywords:" and its declinations and matches the
     following words.
@@ -266,6 +268,7 @@ def extract_author_keywords(skw_db, ckw_db, fulltext):
     @var skw_db: list single kw object
     @var ckw_db: list of composite kw objects
     @var fulltext: utf-8 string
+    @keyword matcher: KeywordMatcher of skw_db
     @return: dictionary of matches in a formt {
           <keyword object>, [matched skw or ckw object, ....]
           }
@@ -273,7 +276,7 @@ def extract_author_keywords(skw_db, ckw_db, fulltext):
     """
     akw = {}
     K = reader.KeywordToken
-    for k, v in keyworder.get_author_keywords(skw_db, ckw_db, fulltext).items():
+    for k, v in keyworder.get_author_keywords(skw_db, ckw_db, fulltext, matcher).items():
         akw[K(k, type='author-kw')] = v
     return akw
 
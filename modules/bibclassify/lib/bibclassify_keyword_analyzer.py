@@ -37,12 +37,123 @@ log = bconfig.get_logger("bibclassify.keyword_analyzer")
 _MAXIMUM_SEPARATOR_LENGTH = max([len(_separator)
     for _separator in bconfig.CFG_BIBCLASSIFY_VALID_SEPARATORS])
 
+# Every keyword regex starts with the left part of the word wrap.
+_WORD_WRAP_START = bconfig.CFG_BIBCLASSIFY_WORD_WRAP.split('%s')[0]
+# A letter in both cases, as produced by _capitalize_first_letter
+_CASE_CLASS = re.compile(r'\[(\w)(\w)\]')
+# The beginning of a word, where keyword matches start.
+_WORD_START = re.compile(r'(?<=[^\w-])\w')
+
+
+def _has_alternative(pattern):
+    """Return True if the pattern has a top-level alternative."""
+    depth = 0
+    in_class = escaped = False
+    for char in pattern:
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif in_class:
+            in_class = char != ']'
+        elif char == '[':
+            in_class = True
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == '|' and depth == 0:
+            return True
+    return False
+
+
+def _get_literal_prefix(pattern):
+    """Return the lowercased text any match of the keyword pattern
+    starts with (after the word separator), or '' if the pattern
+    does not start with a literal."""
+    if not pattern.startswith(_WORD_WRAP_START):
+        return ''
+    pattern = pattern[len(_WORD_WRAP_START):]
+    if _has_alternative(pattern):
+        return ''
+
+    prefix = []
+    index = 0
+    while index < len(pattern):
+        if pattern[index].isalnum():
+            char, next_index = pattern[index].lower(), index + 1
+        else:
+            match = _CASE_CLASS.match(pattern, index)
+            if match is None or \
+               match.group(1).lower() != match.group(2).lower():
+                break
+            char, next_index = match.group(1).lower(), match.end()
+        quantifier = pattern[next_index:next_index + 1]
+        if quantifier in ('?', '*', '{'):
+            # Optional character
+            break
+        prefix.append(char)
+        if quantifier == '+':
+            break
+        index = next_index
+    return ''.join(prefix)
+
+
+class KeywordMatcher:
+    """Preselection of the single keyword regexes that can match a text.
+
+    The literal beginning of every regex (e.g. 'quark' for the keyword
+    'quark') is stored in a trie.  Walking the trie from the beginning
+    of every word of the text gives the regexes worth running, so that
+    a text is read once instead of once per regex.  The regexes which
+    do not start with a literal are always run.
+    """
 
-# XXX - rebuild this whole thing
-def get_single_keywords(skw_db, fulltext):
+    def __init__(self, skw_db):
+        """
+        @var skw_db: dictionary of single KeywordToken objects
+        """
+        # prefix -> [(keyword id, regex index), ...]
+        self.prefixes = {}
+        # The trie: all the beginnings of the prefixes
+        self.stems = set()
+        self.max_length = 0
+        self.always = set()
+        for single_keyword in skw_db.values():
+            for index, regex in enumerate(single_keyword.regex):
+                prefix = _get_literal_prefix(regex.pattern)
+                if not prefix:
+                    self.always.add((single_keyword.short_id, index))
+                    continue
+                self.prefixes.setdefault(prefix, []).append(
+                    (single_keyword.short_id, index))
+                for length in range(1, len(prefix) + 1):
+                    self.stems.add(prefix[:length])
+                self.max_length = max(self.max_length, len(prefix))
+
+    def get_candidates(self, fulltext):
+        """Return the set of (keyword id, regex index) whose regex can
+        match the text."""
+        candidates = set(self.always)
+        text = fulltext.lower()
+        text_length = len(text)
+        for word in _WORD_START.finditer(text):
+            start = word.start()
+            for end in xrange(start + 1, min(start + self.max_length, text_length) + 1):
+                stem = text[start:end]
+                if stem not in self.stems:
+                    break
+                if stem in self.prefixes:
+                    candidates.update(self.prefixes[stem])
+        return candidates
+
+
+def get_single_keywords(skw_db, fulltext, matcher=None):
     """Find single keywords in the fulltext
     @var skw_db: list of KeywordToken objects
     @var fulltext: string, which will be searched
+    @keyword matcher: KeywordMatcher of skw_db, to only run the regexes
+        which can match; all the regexes are run if it is not given
     @return : dictionary of matches in a format {
             <keyword object>, [[position, position...], ],
             ..
@@ -50,31 +161,25 @@ def get_single_keywords(skw_db, fulltext):
     """
     timer_start = time.clock()
 
+    candidates = None
+    if matcher is not None:
+        candidates = matcher.get_candidates(fulltext)
+
     # single keyword -> [spans]
     records = []
 
     for single_keyword in skw_db.values():
-        for regex in single_keyword.regex:
+        for index, regex in enumerate(single_keyword.regex):
+            if candidates is not None and \
+               (single_keyword.short_id, index) not in candidates:
+                continue
             for match in regex.finditer(fulltext):
                 # Modify the right index to put it on the last letter
                 # of the word.
                 span = (match.span()[0], match.span()[1] - 1)
+                records.append((span, single_keyword))
 
-                # FIXME: expensive!!!
-                # Remove the previous records contained by this span
-                records = [record for record in records
-                                  if not _contains_span(span, record[0])]
-
-                add = True
-                for previous_record in records:
-                    if ((span, single_keyword) == previous_record or
-                        _contains_span(previous_record[0], span)):
-                        # Match is contained by a previous match.
-                        add = False
-                        break
-
-                if add:
-                    records.append((span, single_keyword))
+    records = _remove_contained_spans(records)
 
     # TODO - change to the requested format (I will return to it later)
 
@@ -240,10 +345,10 @@ def get_composite_keywords(ckw_db, fulltext, skw_spans):
 
 
 
-def get_author_keywords(skw_db, ckw_db, fulltext):
+def get_author_keywords(skw_db, ckw_db, fulltext, matcher=None):
     """Finds out human defined keyowrds in a text string. Searches for
     the string "Keywords:" and its declinations and matches the
-    following words."""
+    following words.  See get_single_keywords for the matcher."""
     timer_start = time.clock()
     out = {}
 
@@ -274,7 +379,7 @@ def get_author_keywords(skw_db, ckw_db, fulltext):
 
         # First try with the keyword as such, then lower it.
         kw_with_spaces = ' %s ' % kw
-        matching_skw = get_single_keywords(skw_db, kw_with_spaces)
+        matching_skw = get_single_keywords(skw_db, kw_with_spaces, matcher)
         matching_ckw = get_composite_keywords(ckw_db, kw_with_spaces,
             matching_skw)
 
@@ -284,7 +389,7 @@ def get_author_keywords(skw_db, ckw_db, fulltext):
 
         lowkw = kw.lower()
 
-        matching_skw = get_single_keywords(skw_db, ' %s ' % lowkw)
+        matching_skw = get_single_keywords(skw_db, ' %s ' % lowkw, matcher)
         matching_ckw = get_composite_keywords(ckw_db, ' %s ' % lowkw,
             matching_skw)
 
@@ -314,13 +419,29 @@ def _get_ckw_span(fulltext, spans):
     # There is no inclusion.
     return None
 
-def _contains_span(span0, span1):
-    """Return true if span0 contains span1, False otherwise."""
-    if (span0 == span1 or
-        span0[0] > span1[0] or
-        span0[1] < span1[1]):
-        return False
-    return True
+def _remove_contained_spans(records):
+    """Return the (span, keyword) records whose span is not contained
+    in the span of another record, without duplicates and in their
+    original order."""
+    # Sorted by start, longest first, a span is contained in another
+    # one iff one of the previous spans ends after it.
+    spans = sorted(set([span for span, dummy in records]),
+                   key=lambda span: (span[0], -span[1]))
+    contained = set()
+    max_end = -1
+    for span in spans:
+        if span[1] <= max_end:
+            contained.add(span)
+        else:
+            max_end = span[1]
+
+    kept = []
+    seen = set()
+    for record in records:
+        if record[0] not in contained and record not in seen:
+            seen.add(record)
+            kept.append(record)
+    return kept
 
 def _span_overlapping(aspan, bspan):
     # there are 6 posibilities, 2 are false
@@ -55,6 +55,7 @@ except ImportError:
     rdflib_exceptions_Error = None
 
 from invenio import bibclassify_config as bconfig
+from invenio.bibclassify_keyword_analyzer import KeywordMatcher
 log = bconfig.get_logger("bibclassify.ontology_reader")
 from invenio import config
 
@@ -120,7 +121,9 @@ def set_cache(taxonomy_id, contents):
 
 def get_regular_expressions(taxonomy_name, rebuild=False, no_cache=False):
     """Returns a list of patterns compiled from the RDF/SKOS ontology.
-    Uses cache if it exists and if the taxonomy hasn't changed."""
+    Uses cache if it exists and if the taxonomy hasn't changed.
+    @return: (single_keywords, composite_keywords, matcher), matcher
+        being the KeywordMatcher of the single keywords"""
 
     # Translate the ontology name into a local path. Check if the name
     # relates to an existing ontology.
@@ -594,6 +597,7 @@ def _build_cache(source_file, skip_cache=False):
     cached_data = {}
     cached_data["single"] = single_keywords
     cached_data["composite"] = composite_keywords
+    cached_data["matcher"] = KeywordMatcher(single_keywords)
     cached_data["creation_time"] = time.gmtime()
     cached_data["version_info"] = {'rdflib': rdflib and rdflib.__version__, 'bibclassify': bconfig.VERSION}
 
@@ -642,7 +646,7 @@ def _build_cache(source_file, skip_cache=False):
     if store:
         store.close()
 
-    return (single_keywords, composite_keywords)
+    return (single_keywords, composite_keywords, cached_data["matcher"])
 
 
 
@@ -718,7 +722,7 @@ def _get_cache(cache_file, source_file=None):
     @keyword source_file: if we discover the cache is obsolete, we
         will build a new cache, therefore we need the source path
         of the cache
-    @return: (single_keywords, composite_keywords)"""
+    @return: (single_keywords, composite_keywords, matcher)"""
     timer_start = time.clock()
 
     filestream = open(cache_file, "rb")
@@ -750,6 +754,9 @@ def _get_cache(cache_file, source_file=None):
 
     single_keywords = cached_data["single"]
     composite_keywords = cached_data["composite"]
+    matcher = cached_data.get("matcher")
+    if matcher is None:
+        matcher = KeywordMatcher(single_keywords)
 
     # the cache contains only keys of the composite keywords, not the objects
     # so now let's resolve them into objects
@@ -763,7 +770,7 @@ def _get_cache(cache_file, source_file=None):
         (len(single_keywords) + len(composite_keywords),
         time.clock() - timer_start))
 
-    return (single_keywords, composite_keywords)
+    return (single_keywords, composite_keywords, matcher)
 
 def _get_cache_path(source_file):
     """Returns the path where the cache of this taxonomy should
@@ -280,6 +280,33 @@ class BibClassifyTest(BibClassifyTestCase):
 
 
 
+class BibClassifyKeywordMatcherTest(InvenioTestCase):
+    """Tests of the preselection of single keyword regexes."""
+
+    def test_literal_prefix(self):
+        """bibclassify - literal beginning of keyword regexes"""
+        from invenio.bibclassify_keyword_analyzer import _get_literal_prefix
+        regexes = bibclassify_ontology_reader._get_searchable_regex(
+            ["quark", "QCD", "non-abelian"], ["/Yang[-\s]Mills theor\w+/", "/(?i)boson/"])
+        self.assertEqual(sorted([_get_literal_prefix(regex.pattern) for regex in regexes]),
+                         ["", "non", "qcd", "quark", "yang"])
+
+    def test_get_single_keywords(self):
+        """bibclassify - single keywords with and without matcher"""
+        from invenio import bibclassify_keyword_analyzer as keyworder
+        skw_db = {}
+        for label in ("quark", "heavy quark", "gluon", "QCD"):
+            keyword = bibclassify_ontology_reader.KeywordToken(label)
+            skw_db[keyword.short_id] = keyword
+        matcher = keyworder.KeywordMatcher(skw_db)
+        fulltext = " Heavy quarks and gluons in QCD, quark mass. "
+        expected = {skw_db["heavy quark"]: [[(0, 13)]],
+                    skw_db["gluon"]: [[(17, 24)]],
+                    skw_db["QCD"]: [[(27, 31)]],
+                    skw_db["quark"]: [[(32, 38)]]}
+        self.assertEqual(keyworder.get_single_keywords(skw_db, fulltext), expected)
+        self.assertEqual(keyworder.get_single_keywords(skw_db, fulltext, matcher), expected)
+
 
 def suite(cls=BibClassifyTest):
     import unittest
@@ -295,7 +322,7 @@ def suite(cls=BibClassifyTest):
 if 'custom' in sys.argv:
     TEST_SUITE = suite(BibClassifyTest)
 else:
-    TEST_SUITE = make_test_suite(BibClassifyTest)
+    TEST_SUITE = make_test_suite(BibClassifyTest, BibClassifyKeywordMatcherTest)
 
 
 if __name__ == '__main__':
@@ -57,6 +57,7 @@ import requests
 import binascii
 import cgi
 import sys
+import threading
 
 import requests.packages.urllib3
 requests.packages.urllib3.disable_warnings()
@@ -342,6 +343,26 @@ def _sql_generate_conjunctive_where(to_process):
         q_str.append(_val_or_null(entry[0], eq_name = entry[1], q_args = q_args))
     return (" AND ".join(q_str), q_args)
 
+def _run_sql_for_ids(query, ids, chunk_size=1000):
+    """
+    Run a query restricted to a list of identifiers.
+
+    @param query: the query, with a C{IN (%s)} clause (its only
+        parameter) to be filled with the identifiers.
+    @type query: string
+    @param ids: the identifiers.
+    @type ids: iterable of integers
+    @param chunk_size: how many identifiers to put in one query.
+    @type chunk_size: integer
+    @return: the rows returned by the queries.
+    @rtype: list of tuples
+    """
+    ids = [int(an_id) for an_id in ids]
+    res = []
+    for i in xrange(0, len(ids), chunk_size):
+        res.extend(run_sql(query % ','.join([str(an_id) for an_id in ids[i:i + chunk_size]])))
+    return res
+
 def file_strip_ext(afile, skip_version=False, only_known_extensions=False, allow_subformat=True):
     """
     Strip in the best way the extension from a filename.
@@ -856,6 +877,61 @@ class BibRecDocs(object):
             self._bibdocs[row[1]] = (cur_doc, row[2])
         self.dirty = False
 
+    @staticmethod
+    def load_many(recids, deleted_too=False, human_readable=False, verify=False):
+        """
+        Build the L{BibRecDocs} of many records at once.
+
+        The documents of all the records are retrieved with a few queries
+        over all of them (instead of several queries per document), and
+        their files are taken from the bibdocfsinfo table instead of
+        listing the document directories (even if
+        CFG_BIBDOCFILE_ENABLE_BIBDOCFSINFO_CACHE is not set).
+
+        @param recids: the record identifiers.
+        @type recids: list of integers
+        @param deleted_too: as for L{BibRecDocs}.
+        @type deleted_too: bool
+        @param human_readable: as for L{BibRecDocs}.
+        @type human_readable: bool
+        @param verify: whether to list the files of the documents from
+            the filesystem, as if they had been loaded one by one.
+        @type verify: bool
+        @return: the L{BibRecDocs} of each record.
+        @rtype: dict of recid -> L{BibRecDocs}
+        """
+        bibrecdocs = {}
+        for recid in recids:
+            recdocs = BibRecDocs(recid, deleted_too=deleted_too,
+                                 human_readable=human_readable)
+            recdocs._bibdocs = {}
+            recdocs.dirty = False
+            bibrecdocs[recdocs.id] = recdocs
+        if not bibrecdocs:
+            return bibrecdocs
+
+        if deleted_too:
+            status_condition = ""
+        else:
+            status_condition = "AND bd.status<>'DELETED'"
+        attachments = _run_sql_for_ids("""SELECT brbd.id_bibrec, brbd.id_bibdoc, brbd.docname, brbd.type
+                                          FROM bibrec_bibdoc as brbd JOIN bibdoc as bd ON bd.id=brbd.id_bibdoc
+                                          WHERE brbd.id_bibrec IN (%%s) %s""" % status_condition,
+                                       bibrecdocs.keys())
+        docids = set([row[1] for row in attachments])
+        initial_data = BibDoc._retrieve_data_many(docids, verify=verify)
+
+        bibdocs = {}
+        for docid in docids:
+            if docid in initial_data:
+                bibdocs[docid] = BibDoc.create_instance(docid=docid,
+                                                        human_readable=human_readable,
+                                                        initial_data=initial_data[docid])
+        for recid, docid, docname, attachment_type in attachments:
+            if docid in bibdocs:
+                bibrecdocs[recid]._bibdocs[docname] = (bibdocs[docid], attachment_type)
+        return bibrecdocs
+
     def list_bibdocs_by_names(self, doctype=None):
         """
         Returns the dictionary of all bibdocs object belonging to a recid.
@@ -1589,6 +1665,39 @@ class BibRecDocs(object):
         return " ".join(texts)
 
 
+## BibRecDocs loaded in advance by preload_bibrecdocs(), per thread
+_PRELOADED_BIBRECDOCS = threading.local()
+
+def preload_bibrecdocs(recids):
+    """
+    Load at once the documents of records that are going to be
+    accessed through L{get_bibrecdocs} (e.g. the records of a page of
+    search results), replacing those previously preloaded.
+
+    @param recids: the record identifiers.
+    @type recids: list of integers
+    """
+    _PRELOADED_BIBRECDOCS.bibrecdocs = BibRecDocs.load_many(recids)
+
+def forget_preloaded_bibrecdocs():
+    """
+    Drop the documents loaded by L{preload_bibrecdocs}, so that they
+    are retrieved again from the database.
+    """
+    _PRELOADED_BIBRECDOCS.bibrecdocs = {}
+
+def get_bibrecdocs(recid):
+    """
+    @return: the L{BibRecDocs} of the record, as loaded by
+        L{preload_bibrecdocs} if it was, otherwise newly built.
+    @rtype: L{BibRecDocs}
+    """
+    preloaded = getattr(_PRELOADED_BIBRECDOCS, 'bibrecdocs', {})
+    if recid in preloaded:
+        return preloaded[recid]
+    return BibRecDocs(recid)
+
+
 class BibDoc(object):
     """
     This class represents one document (i.e. a set of files with different
@@ -1652,11 +1761,15 @@ class BibDoc(object):
         attaching newly created document to a record
         """
         # docid is known, the document already exists
-        res2 = run_sql("SELECT id_bibrec, type, docname FROM bibrec_bibdoc WHERE id_bibdoc=%s", (docid,))
-        self.bibrec_types = [(r[0], r[1], r[2]) for r in res2 ] # just in case the result was behaving like tuples but was something else
-        if not res2:
-            # fake attachment
-            self.bibrec_types = [(0, None, "fake_name_for_unattached_document")]
+        if initial_data is not None and "bibrec_types" in initial_data:
+            # already retrieved by _retrieve_data_many
+            self.bibrec_types = initial_data["bibrec_types"]
+        else:
+            res2 = run_sql("SELECT id_bibrec, type, docname FROM bibrec_bibdoc WHERE id_bibdoc=%s", (docid,))
+            self.bibrec_types = [(r[0], r[1], r[2]) for r in res2 ] # just in case the result was behaving like tuples but was something else
+            if not res2:
+                # fake attachment
+                self.bibrec_types = [(0, None, "fake_name_for_unattached_document")]
 
         if initial_data is None:
             initial_data = BibDoc._retrieve_data(docid)
@@ -1676,10 +1789,13 @@ class BibDoc(object):
         self.doctype = initial_data["doctype"]
         self.storagename = initial_data["storagename"] # the old docname -> now used as a storage name for old records
 
-        self.more_info = BibDocMoreInfo(self.id)
+        self.more_info = BibDocMoreInfo(self.id, database_data=initial_data.get("more_info"))
         self.dirty = True
         self.dirty_related_files = True
         self.last_action = 'init'
+        if "fsinfo" in initial_data:
+            self._docfiles = self._build_file_list_from_fsinfo(initial_data["fsinfo"])
+            self.dirty = False
 
     def __del__(self):
         if self.dirty and self.last_action != 'init':
@@ -1778,9 +1894,65 @@ class BibDoc(object):
             container["extensions"] = set([fname[len(fprefix):].rsplit(";", 1)[0] for fname in filter(lambda x: x.startswith(fprefix), os.listdir(container["basedir"]))])
         return container
 
+    @staticmethod
+    def _retrieve_data_many(docids, verify=False):
+        """
+        Same as L{_retrieve_data} for many documents at once.  The data
+        of each document also contains its links to records, the content
+        of its L{BibDocMoreInfo} and, unless verify is set, its files as
+        stored in the bibdocfsinfo table.
+
+        @return: the data of each existing document.
+        @rtype: dict of docid -> dict
+        """
+        containers = {}
+        if not docids:
+            return containers
+        for docid, status, cd, md, td, doctype, storagename in _run_sql_for_ids(
+                "SELECT id, status, creation_date, modification_date, text_extraction_date, doctype, docname FROM bibdoc WHERE id IN (%s)", docids):
+            containers[docid] = {"id": docid,
+                                 "basedir": _make_base_dir(docid),
+                                 "bibrec_links": [],
+                                 "bibrec_types": [],
+                                 "more_info": {},
+                                 "status": status,
+                                 "cd": cd,
+                                 "md": md,
+                                 "td": td,
+                                 "doctype": doctype,
+                                 "storagename": storagename}
+
+        for docid, recid, doctype, docname in _run_sql_for_ids(
+                "SELECT id_bibdoc, id_bibrec, type, docname FROM bibrec_bibdoc WHERE id_bibdoc IN (%s)", containers.keys()):
+            containers[docid]["bibrec_links"].append({"recid": recid, "doctype": doctype, "docname": docname})
+            containers[docid]["bibrec_types"].append((recid, doctype, docname))
+
+        for docid, namespace, data_key, data_value in _run_sql_for_ids(
+                "SELECT id_bibdoc, namespace, data_key, data_value FROM bibdocmoreinfo WHERE id_bibdoc IN (%s) AND version IS NULL AND format IS NULL AND id_rel IS NULL", containers.keys()):
+            containers[docid]["more_info"].setdefault(namespace, {})[data_key] = cPickle.loads(data_value)
+
+        if not verify:
+            for row in _run_sql_for_ids(
+                    "SELECT id_bibdoc, version, format, cd, md, checksum, filesize FROM bibdocfsinfo WHERE id_bibdoc IN (%s)", containers.keys()):
+                containers[row[0]].setdefault("fsinfo", []).append(row[1:])
+
+        for container in containers.itervalues():
+            if not container["bibrec_types"]:
+                # fake attachment
+                container["bibrec_types"] = [(0, None, "fake_name_for_unattached_document")]
+            if "fsinfo" in container:
+                container["extensions"] = set([row[1] for row in container["fsinfo"]])
+            else:
+                ## Documents missing from bibdocfsinfo are listed from
+                ## the filesystem, as by _retrieve_data.
+                fprefix = container["storagename"] or "content"
+                container["extensions"] = set([fname[len(fprefix):].rsplit(";", 1)[0] for fname in filter(lambda x: x.startswith(fprefix), os.listdir(container["basedir"]))])
+        return containers
+
     @staticmethod
     def create_instance(docid=None, recid=None, docname=None,
-                        doctype='Fulltext', a_type = 'Main', human_readable=False):
+                        doctype='Fulltext', a_type = 'Main', human_readable=False,
+                        initial_data=None):
         """
         Parameters of an attachement to the record:
         a_type, recid, docname
@@ -1789,13 +1961,17 @@ class BibDoc(object):
 
         @param doctype Type of the document itself (by default Fulltext)
         @type doctype String
+
+        @param initial_data Data of the existing document docid, as returned
+                            by _retrieve_data (retrieved if not specified)
+        @type initial_data dict
         """
 
         # first try to retrieve existing record based on obtained data
         data = None
         extensions = []
         if docid is not None:
-            data = BibDoc._retrieve_data(docid)
+            data = initial_data or BibDoc._retrieve_data(docid)
             doctype = data["doctype"]
             extensions = data["extensions"]
 
@@ -2736,12 +2912,7 @@ class BibDoc(object):
         if CFG_BIBDOCFILE_ENABLE_BIBDOCFSINFO_CACHE and context == 'init':
             ## In normal init context we read from DB
             res = run_sql("SELECT version, format, cd, md, checksum, filesize FROM bibdocfsinfo WHERE id_bibdoc=%s", (self.id, ))
-            for version, docformat, cd, md, checksum, size in res:
-                filepath = self.get_filepath(docformat, version)
-                self._docfiles.append(BibDocFile(
-                    filepath, self.bibrec_types,
-                    version, docformat,  self.id, self.status, checksum,
-                    self.more_info, human_readable=self.human_readable, cd=cd, md=md, size=size, bibdoc=self))
+            self._docfiles = self._build_file_list_from_fsinfo(res)
         else:
             if os.path.exists(self.basedir):
                 files = os.listdir(self.basedir)
@@ -2777,6 +2948,22 @@ class BibDoc(object):
                     md = '' # No modification time
                 log_action(deletedstr, self.id, docname, docformat, version, size, checksum, md)
 
+    def _build_file_list_from_fsinfo(self, res):
+        """
+        @param res: the (version, format, cd, md, checksum, filesize) rows
+            of the bibdocfsinfo table for this document.
+        @return: the files of the document.
+        @rtype: list of L{BibDocFile}
+        """
+        docfiles = []
+        for version, docformat, cd, md, checksum, size in res:
+            filepath = self.get_filepath(docformat, version)
+            docfiles.append(BibDocFile(
+                filepath, self.bibrec_types,
+                version, docformat,  self.id, self.status, checksum,
+                self.more_info, human_readable=self.human_readable, cd=cd, md=md, size=size, bibdoc=self))
+        return docfiles
+
     def _sync_to_db(self):
         """
         Update the content of the bibdocfile table by taking what is available on the filesystem.
@@ -3619,7 +3806,7 @@ def bibdocfile_url_to_bibrecdocs(url):
     a BibRecDocs object for the corresponding recid."""
 
     recid = decompose_bibdocfile_url(url)[0]
-    return BibRecDocs(recid)
+    return get_bibrecdocs(recid)
 
 def bibdocfile_url_to_bibdoc(url):
     """Given an URL in the form CFG_SITE_[SECURE_]URL/CFG_SITE_RECORD/xxx/files/... it returns
@@ -4004,7 +4191,8 @@ class MoreInfo(object):
        """
 
     def __init__(self, docid = None, version = None, docformat = None,
-                 relation = None, cache_only = False, cache_reads = True, initial_data = None):
+                 relation = None, cache_only = False, cache_reads = True, initial_data = None,
+                 database_data = None):
         """
         @param cache_only Determines if MoreInfo object should be created in
                           memory only or reflected in the database
@@ -4023,6 +4211,12 @@ class MoreInfo(object):
                              instance from serialised value
         @type initial_data string
 
+        @param database_data Content of the database entries, when it has
+                             already been retrieved (e.g. for many documents
+                             at once). It is used instead of querying the
+                             database
+        @type database_data dictionary {namespace: {key1: value1, ... }}
+
         """
         self.docid = docid
         self.version = version
@@ -4043,7 +4237,10 @@ class MoreInfo(object):
         self.cache_reads = cache_reads
 
         if not self.cache_only:
-            self.populate_from_database()
+            if database_data is None:
+                self.populate_from_database()
+            else:
+                self.cache.update(database_data)
 
     @staticmethod
     def create_from_serialised(ser_str, docid = None, version = None, docformat = None,
@@ -4337,10 +4534,11 @@ class BibDocMoreInfo(MoreInfo):
     @note: this class will be extended in the future to hold all the new auxiliary
     information about a document.
     """
-    def __init__(self, docid, cache_only = False, initial_data = None):
+    def __init__(self, docid, cache_only = False, initial_data = None, database_data = None):
         if not (type(docid) in (long, int) and docid > 0):
             raise ValueError("docid is not a positive integer, but %s." % docid)
-        MoreInfo.__init__(self, docid, cache_only = cache_only, initial_data = initial_data)
+        MoreInfo.__init__(self, docid, cache_only = cache_only, initial_data = initial_data,
+                          database_data = database_data)
 
         if 'descriptions' not in self:
             self['descriptions'] = {}
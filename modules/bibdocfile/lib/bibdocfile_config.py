@@ -15,8 +15,11 @@
 ## along with Invenio; if not, write to the Free Software Foundation, Inc.,
 ## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
 
+import os
 import re
 
+from invenio.config import CFG_CACHEDIR
+
 try:
     from invenio.config import CFG_BIBDOCFILE_DOCUMENT_FILE_MANAGER_MISC
 except ImportError:
@@ -69,3 +72,7 @@ CFG_BIBDOCFILE_ICON_SUBFORMAT_RE = re.compile(r"icon.*")
 ## CFG_BIBDOCFILE_DEFAULT_ICON_SUBFORMAT -- this is the default subformat used
 ## when creating new icons.
 CFG_BIBDOCFILE_DEFAULT_ICON_SUBFORMAT = "icon"
+
+## CFG_BIBDOCFILE_TEXT_CACHEDIR -- where the text extracted from fulltext
+## files is cached (see CFG_BIBDOCFILE_TEXT_CACHE).
+CFG_BIBDOCFILE_TEXT_CACHEDIR = os.path.join(CFG_CACHEDIR, 'fulltext')
@@ -28,6 +28,8 @@ from invenio.testutils import make_test_suite, run_test_suite
 from invenio.bibdocfile import BibRecDocs, BibRelation, MoreInfo, \
     check_bibdoc_authorization, bibdocfile_url_p, guess_format_from_url, CFG_HAS_MAGIC, \
     Md5Folder, calculate_md5, calculate_md5_external, BibDoc
+from invenio.bibdocfile_text_cache import get_text, get_cached_text, \
+    cache_text, get_converter_name, get_cached_text_path
 from invenio.dbquery import run_sql
 
 from invenio.access_control_config import CFG_WEBACCESS_WARNING_MSGS
@@ -38,7 +40,8 @@ from invenio.config import \
         CFG_SITE_RECORD, \
         CFG_WEBDIR, \
         CFG_TMPDIR, \
-        CFG_PATH_MD5SUM
+        CFG_PATH_MD5SUM, \
+        CFG_BIBDOCFILE_TEXT_CACHE
 import invenio.template
 from datetime import datetime
 import time
@@ -210,6 +213,38 @@ class BibRecDocsTest(InvenioTestCase):
         my_bibrecdoc.delete_bibdoc('file')
         my_bibrecdoc.delete_bibdoc('test')
 
+class BibRecDocsLoadManyTest(InvenioTestCase):
+    """regression tests about BibRecDocs.load_many"""
+
+    def _describe(self, bibrecdocs):
+        return sorted([(bibdoc.id, bibdoc.get_docname(), bibdoc.status,
+                        sorted([(docfile.get_url(), docfile.get_version(),
+                                 docfile.get_size(), docfile.get_checksum(),
+                                 docfile.get_description(), docfile.hidden_p())
+                                for docfile in bibdoc.list_all_files()]))
+                       for bibdoc in bibrecdocs.list_bibdocs()])
+
+    def test_load_many(self):
+        """bibdocfile - BibRecDocs.load_many same as BibRecDocs"""
+        recids = [1, 2, 8, 9, 10, 54, 55, 56]
+        loaded = BibRecDocs.load_many(recids)
+        self.assertEqual(sorted(loaded.keys()), recids)
+        for recid in recids:
+            self.assertEqual(self._describe(loaded[recid]),
+                             self._describe(BibRecDocs(recid)))
+
+    def test_load_many_verify(self):
+        """bibdocfile - BibRecDocs.load_many from the filesystem"""
+        loaded = BibRecDocs.load_many([2, 8], verify=True)
+        for recid in (2, 8):
+            self.assertEqual(self._describe(loaded[recid]),
+                             self._describe(BibRecDocs(recid)))
+
+    def test_load_many_no_records(self):
+        """bibdocfile - BibRecDocs.load_many with no records"""
+        self.assertEqual(BibRecDocs.load_many([]), {})
+
+
 class BibDocsTest(InvenioTestCase):
     """regression tests about BibDocs"""
 
@@ -598,6 +633,39 @@ class BibDocFileMd5FolderTests(InvenioTestCase):
             self.assertEqual(calculate_md5(filepath, force_internal=True), calculate_md5_external(filepath))
 
 
+class BibDocFileTextCacheTests(InvenioTestCase):
+    """Regression test class for the cache of extracted texts"""
+    def setUp(self):
+        self.path = os.path.join(CFG_TMPDIR, 'text_cache_tests')
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self.checksum = '0123456789abcdef0123456789abcdef'
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        for converter in (get_converter_name(), get_converter_name(True, 'fr')):
+            path = get_cached_text_path(self.checksum, converter)
+            if os.path.exists(path):
+                os.remove(path)
+
+    if CFG_BIBDOCFILE_TEXT_CACHE:
+        def test_cache_text(self):
+            """bibdocfile - cache extracted text"""
+            self.assertEqual(get_cached_text(self.checksum, get_converter_name()), None)
+            cache_text(self.checksum, get_converter_name(), "some text")
+            self.assertEqual(get_cached_text(self.checksum, get_converter_name()), "some text")
+            self.assertEqual(get_cached_text(self.checksum, get_converter_name(True, 'fr')), None)
+
+        def test_get_cached_text(self):
+            """bibdocfile - get text without converting a cached file"""
+            filepath = os.path.join(self.path, 'test.pdf')
+            open(filepath, "w").write("not a PDF")
+            output = os.path.join(self.path, '.text;1')
+            cache_text(self.checksum, get_converter_name(), "some text")
+            self.assertEqual(get_text(filepath, output, checksum=self.checksum), "some text")
+            self.assertEqual(open(output).read(), "some text")
+
+
 class BibDocFileMemoryLeak(InvenioTestCase):
     def test_for_memory_leaks(self):
         """bibdocfile - test for memory leaks"""
@@ -617,6 +685,7 @@ class BibDocFileMemoryLeak(InvenioTestCase):
 
 TEST_SUITE = make_test_suite(BibDocFileMd5FolderTests,
                              BibRecDocsTest,
+                             BibRecDocsLoadManyTest,
                              BibDocsTest,
                              BibDocFilesTest,
                              MoreInfoTest,
@@ -625,6 +694,7 @@ TEST_SUITE = make_test_suite(BibDocFileMd5FolderTests,
                              CheckBibDocAuthorizationTest,
                              BibDocFsInfoTest,
                              BibDocFileGuessFormat,
+                             BibDocFileTextCacheTests,
                              BibDocFileMemoryLeak)
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE, warn_user=True)
@@ -0,0 +1,208 @@
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+Cache of the text extracted from fulltext files.
+
+The text is stored in CFG_BIBDOCFILE_TEXT_CACHEDIR under the MD5
+checksum of the file it was extracted from and the name of the
+converter that extracted it, so that the same file is never converted
+twice, whichever record, version or module (fulltext indexing,
+reference extraction...) asks for its text.  The converter name
+contains a version number, to be increased whenever the extraction
+changes in a way that invalidates the texts already cached.
+"""
+
+import os
+import tempfile
+import multiprocessing
+
+from invenio.config import CFG_BIBDOCFILE_TEXT_CACHE, \
+     CFG_BIBDOCFILE_TEXT_EXTRACTION_WORKERS
+from invenio.bibdocfile_config import CFG_BIBDOCFILE_TEXT_CACHEDIR
+from invenio.errorlib import register_exception
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+## Version of the text extraction done through websubmit_file_converter
+CFG_BIBDOCFILE_TEXT_CONVERTER_VERSION = 1
+
+_MD5_BUFFER = 1024 * 1024
+
+
+def calculate_checksum(filename):
+    """Return the MD5 checksum of a file."""
+    checksum = md5()
+    input_file = open(filename, 'rb')
+    try:
+        while True:
+            buf = input_file.read(_MD5_BUFFER)
+            if not buf:
+                break
+            checksum.update(buf)
+    finally:
+        input_file.close()
+    return checksum.hexdigest()
+
+
+def get_converter_name(perform_ocr=False, ln='en'):
+    """
+    Return the name under which the text extracted by
+    websubmit_file_converter with the given parameters is cached.
+    """
+    name = 'txt%i' % CFG_BIBDOCFILE_TEXT_CONVERTER_VERSION
+    if perform_ocr:
+        name += '-ocr-%s' % ln
+    return name
+
+
+def get_cached_text_path(checksum, converter):
+    """Return the path of the cached text of a file."""
+    return os.path.join(CFG_BIBDOCFILE_TEXT_CACHEDIR, checksum[:2],
+                        '%s.%s' % (checksum, converter))
+
+
+def get_cached_text(checksum, converter):
+    """
+    Return the cached text of the file with the given checksum, or None
+    if it has not been cached yet.
+    """
+    if not CFG_BIBDOCFILE_TEXT_CACHE:
+        return None
+    try:
+        return open(get_cached_text_path(checksum, converter), 'rb').read()
+    except IOError:
+        return None
+
+
+def cache_text(checksum, converter, text):
+    """
+    Store the text extracted by the given converter from the file with
+    the given checksum.  The text is written to a temporary file which
+    is then renamed, so that concurrent readers and writers never see a
+    partial text.
+    """
+    if not CFG_BIBDOCFILE_TEXT_CACHE:
+        return
+    path = get_cached_text_path(checksum, converter)
+    cache_dir = os.path.dirname(path)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+    except OSError:
+        # Probably created in the meantime by another process
+        pass
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix='.%s' % checksum)
+    try:
+        os.write(fd, text)
+        os.close(fd)
+        os.rename(tmp_path, path)
+    except OSError:
+        register_exception(alert_admin=True,
+                           prefix="Can't store extracted text in %s" % path)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def get_text(input_file, output_file=None, checksum=None, perform_ocr=False,
+             ln='en'):
+    """
+    Return the text of a file, extracting it with websubmit_file_converter
+    only if it is not in the cache.
+
+    @param input_file: the path of the file.
+    @param output_file: if given, where to write the text too.
+    @param checksum: the MD5 checksum of the file, if already known.
+    @param perform_ocr: whether to perform OCR.
+    @param ln: a two letter language code to give as a hint to the OCR
+        procedure.
+    @return: the text.
+    @raise InvenioWebSubmitFileConverterError: in case of error.
+    """
+    if CFG_BIBDOCFILE_TEXT_CACHE and checksum is None:
+        checksum = calculate_checksum(input_file)
+    converter = get_converter_name(perform_ocr, ln)
+    text = None
+    if checksum:
+        text = get_cached_text(checksum, converter)
+    if text is None:
+        from invenio.websubmit_file_converter import convert_file
+        tmp_path = convert_file(input_file, output_format='.txt',
+                                perform_ocr=perform_ocr, ln=ln)
+        try:
+            text = open(tmp_path, 'rb').read()
+        finally:
+            os.remove(tmp_path)
+        if checksum:
+            cache_text(checksum, converter, text)
+    if output_file:
+        open(output_file, 'wb').write(text)
+    return text
+
+
+def _extract_text(args):
+    """Extract and cache the text of a file in a worker process."""
+    input_file, checksum, perform_ocr, ln = args
+    try:
+        get_text(input_file, checksum=checksum, perform_ocr=perform_ocr,
+                 ln=ln)
+    except Exception:
+        # The error will be reported again to the caller that will
+        # actually need the text
+        return False
+    return True
+
+
+def extract_texts(files, workers=CFG_BIBDOCFILE_TEXT_EXTRACTION_WORKERS):
+    """
+    Extract in parallel, into the cache, the text of the files that are
+    not cached yet, so that later calls to L{get_text} on them are
+    immediate.
+
+    @param files: list of (path, checksum, perform_ocr, ln), checksum
+        being None if unknown.
+    @param workers: number of processes extracting the texts.
+    @return: the number of texts extracted.
+    """
+    if not CFG_BIBDOCFILE_TEXT_CACHE:
+        return 0
+    to_extract = []
+    seen = set()
+    for input_file, checksum, perform_ocr, ln in files:
+        if checksum is None:
+            checksum = calculate_checksum(input_file)
+        path = get_cached_text_path(checksum,
+                                    get_converter_name(perform_ocr, ln))
+        # The same file may be attached to several records
+        if path not in seen and not os.path.exists(path):
+            seen.add(path)
+            to_extract.append((input_file, checksum, perform_ocr, ln))
+    if not to_extract:
+        return 0
+    if workers <= 1 or len(to_extract) == 1:
+        results = map(_extract_text, to_extract)
+    else:
+        pool = multiprocessing.Pool(min(workers, len(to_extract)))
+        try:
+            results = pool.map(_extract_text, to_extract)
+        finally:
+            pool.close()
+            pool.join()
+    return len([result for result in results if result])
@@ -29,6 +29,7 @@ import os
 import time
 import fnmatch
 import time
+import multiprocessing
 from datetime import datetime
 from logging import getLogger, debug, DEBUG
 from optparse import OptionParser, OptionGroup, OptionValueError
@@ -36,13 +37,18 @@ from tempfile import mkstemp
 
 from invenio.errorlib import register_exception
 from invenio.config import CFG_SITE_URL, CFG_BIBDOCFILE_FILEDIR, \
-    CFG_SITE_RECORD, CFG_TMPSHAREDDIR
+    CFG_SITE_RECORD, CFG_TMPSHAREDDIR, CFG_BIBDOCFILE_MD5_CHECK_WORKERS
 from invenio.bibdocfile import BibRecDocs, BibDoc, InvenioBibDocFileError, \
     nice_size, check_valid_url, clean_url, get_docname_from_url, \
     guess_format_from_url, KEEP_OLD_VALUE, decompose_bibdocfile_fullpath, \
     bibdocfile_url_to_bibdoc, decompose_bibdocfile_url, CFG_BIBDOCFILE_AVAILABLE_FLAGS
 
 from invenio.intbitset import intbitset
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
 from invenio.search_engine import perform_request_search
 from invenio.textutils import wrap_text_in_a_box, wait_for_user
 from invenio.dbquery import run_sql
@@ -473,6 +479,14 @@ def prepare_option_parser():
         except Exception, e:
             raise OptionValueError("It's impossible to parse the range '%s' for option %s: %s" % (value, opt, e))
 
+    def _since_callback(option, opt, value, parser):
+        """Callback for optparse to parse a date as a range of dates
+        starting at it."""
+        try:
+            setattr(parser.values, option.dest, (_parse_datetime(value), None))
+        except Exception, e:
+            raise OptionValueError("It's impossible to parse the date '%s' for option %s: %s" % (value, opt, e))
+
     parser = OptionParserSpecial(usage="usage: %prog [options]",
     #epilog="""With <query> you select the range of record/docnames/single files to work on. Note that some actions e.g. delete, append, revise etc. works at the docname level, while others like --set-comment, --set-description, at single file level and other can be applied in an iterative way to many records in a single run. Note that specifing docid(2) takes precedence over recid(2) which in turns takes precedence over pattern/collection search.""",
         version=__revision__)
@@ -564,6 +578,10 @@ Examples:
     housekeeping_options.add_option("--fix-format", action='store_const', const='fix-format', dest='action', help='fix format related inconsistences')
     housekeeping_options.add_option("--fix-duplicate-docnames", action='store_const', const='fix-duplicate-docnames', dest='action', help='fix duplicate docnames associated with the same record')
     housekeeping_options.add_option("--fix-bibdocfsinfo-cache", action='store_const', const='fix-bibdocfsinfo-cache', dest='action', help='fix bibdocfsinfo cache related inconsistences')
+    housekeeping_options.add_option("--since", action="callback", callback=_since_callback, dest="md_doc", nargs=1, type="string", help="with --check-md5 or --update-md5, consider only the documents modified since the given date; the date can be expressed relatively, e.g.: \"-7d\" (same as --with-document-modification-date=date,)", metavar="date")
+    housekeeping_options.add_option("--skip-unchanged", action='store_true', dest='skip_unchanged', default=False, help='with --check-md5 or --update-md5, do not read the files whose size and modification time match bibdocfsinfo')
+    housekeeping_options.add_option("--workers", type="int", dest='workers', help='with --check-md5 or --update-md5, number of processes computing the checksums (default %s)' % CFG_BIBDOCFILE_MD5_CHECK_WORKERS, metavar="N")
+    housekeeping_options.add_option("--resume", action='store_true', dest='resume', default=False, help='with --check-md5 or --update-md5, continue the last interrupted check run with the same arguments')
     parser.add_option_group(housekeeping_options)
 
     experimental_options = OptionGroup(parser, 'Experimental options (do not expect to find them in the next release)')
@@ -1077,18 +1095,139 @@ def cli_get_disk_usage(options):
             % (total_size, total_latest_size),
             style='conclusion')
 
+## Size of the reads when checking the MD5 checksums of the files
+_MD5_CHECK_BUFFER = 4 * 1024 * 1024
+
+## Number of documents whose files are checked between two checkpoints
+_MD5_CHECK_BATCH_SIZE = 100
+
+def _calculate_md5_and_size(path):
+    """Calculate, in a worker process, the MD5 checksum of a file,
+    reading it sequentially with a large buffer.
+
+    Returns (checksum, size, error message)
+    """
+    try:
+        computed_md5 = md5()
+        size = 0
+        to_be_read = open(path, "rb")
+        try:
+            while True:
+                buf = to_be_read.read(_MD5_CHECK_BUFFER)
+                if not buf:
+                    break
+                computed_md5.update(buf)
+                size += len(buf)
+        finally:
+            to_be_read.close()
+        return computed_md5.hexdigest(), size, None
+    except (IOError, OSError), e:
+        return None, 0, str(e)
+
+def _get_files_to_check(docid, skip_unchanged=False):
+    """Return the files of a document whose checksum has to be checked,
+    as a list of (path, expected checksum), skipping if required the
+    files whose size and modification time match bibdocfsinfo."""
+    bibdoc = BibDoc.create_instance(docid)
+    fsinfo = {}
+    if skip_unchanged:
+        for version, docformat, filesize, md in run_sql("SELECT version, format, filesize, md FROM bibdocfsinfo WHERE id_bibdoc=%s", (docid, )):
+            fsinfo[(version, docformat)] = (filesize, md)
+    files = []
+    for afile in bibdoc.list_all_files():
+        path = afile.get_full_path()
+        if skip_unchanged:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                stat = None
+            if stat and fsinfo.get((afile.get_version(), afile.get_format())) == \
+                    (stat.st_size, datetime.fromtimestamp(int(stat.st_mtime))):
+                continue
+        files.append((path, afile.get_checksum()))
+    return files
+
+def _get_md5_check_checkpoint(action, resume=False):
+    """Return the checkpoint of the check of the MD5 checksums, as
+    (id, last docid checked, files, bytes, failures), either resuming
+    the last interrupted check run with the same arguments or starting
+    a new one."""
+    arguments = ' '.join([arg for arg in sys.argv[1:] if arg != '--resume'])
+    if resume:
+        res = run_sql("SELECT id, last_docid, files, bytes, failures FROM bibdocfscheck WHERE action=%s AND arguments=%s AND status='RUNNING' ORDER BY id DESC LIMIT 1", (action, arguments))
+        if res:
+            print "Resuming check started on %s after docid %s" % (run_sql("SELECT start_time FROM bibdocfscheck WHERE id=%s", (res[0][0], ))[0][0], res[0][1])
+            return res[0]
+        print "No interrupted check to resume: starting a new one"
+    checkid = run_sql("INSERT INTO bibdocfscheck(action, arguments, start_time, last_update) VALUES(%s, %s, NOW(), NOW())", (action, arguments))
+    return checkid, 0, 0, 0, 0
+
+def _iter_md5_check(options, action):
+    """Check in parallel the MD5 checksums of the files of the matched
+    documents, in batches of documents whose progress is checkpointed in
+    bibdocfscheck.
+
+    Yields (docid, list of the files failing checksum) for each document
+    and prints the throughput after every batch.
+    """
+    checkid, last_docid, files, size, failures = _get_md5_check_checkpoint(action, getattr(options, 'resume', False))
+    skip_unchanged = getattr(options, 'skip_unchanged', False)
+    recids = cli_quick_match_all_recids(options)
+    docids = cli_quick_match_all_docids(options, recids)
+    if last_docid:
+        docids = intbitset([docid for docid in docids if docid > last_docid])
+    workers = getattr(options, 'workers', None) or CFG_BIBDOCFILE_MD5_CHECK_WORKERS
+    pool = multiprocessing.Pool(workers)
+    run_start_time = start_time = time.time()
+    run_size = checked_size = 0
+    try:
+        batch = []
+        docids_iterator = cli_docids_iterator(options, recids, docids)
+        while True:
+            for docid in docids_iterator:
+                batch.append((docid, _get_files_to_check(docid, skip_unchanged)))
+                if len(batch) == _MD5_CHECK_BATCH_SIZE:
+                    break
+            if not batch:
+                break
+            paths = [path for dummy, docfiles in batch for path, dummy in docfiles]
+            results = iter(pool.imap(_calculate_md5_and_size, paths))
+            for docid, docfiles in batch:
+                failing = []
+                for path, checksum in docfiles:
+                    computed_checksum, file_size, error = results.next()
+                    files += 1
+                    checked_size += file_size
+                    if error:
+                        print_info(docid, '%s cannot be read: %s' % (path, error))
+                        failing.append(path)
+                    elif computed_checksum != checksum:
+                        failing.append(path)
+                failures += len(failing)
+                yield docid, failing
+            size += checked_size
+            run_size += checked_size
+            last_docid = batch[-1][0]
+            batch = []
+            run_sql("UPDATE bibdocfscheck SET last_update=NOW(), last_docid=%s, files=%s, bytes=%s, failures=%s WHERE id=%s", (last_docid, files, size, failures, checkid))
+            print "%i files checked up to docid %i (%s, %.1f MB/s)" % (files, last_docid, nice_size(size), checked_size / 1048576.0 / max(time.time() - start_time, 0.001))
+            start_time = time.time()
+            checked_size = 0
+        run_sql("UPDATE bibdocfscheck SET last_update=NOW(), status='DONE' WHERE id=%s", (checkid, ))
+        print "%i files checked (%s) in %.1fs, %.1f MB/s" % (files, nice_size(size), time.time() - run_start_time, run_size / 1048576.0 / max(time.time() - run_start_time, 0.001))
+    finally:
+        pool.close()
+        pool.join()
+
 def cli_check_md5(options):
     """Check the md5 sums of a docid_set."""
     failures = 0
-    for docid in cli_docids_iterator(options):
-        bibdoc = BibDoc.create_instance(docid)
-        if bibdoc.md5s.check():
+    for docid, failing in _iter_md5_check(options, 'check-md5'):
+        if not failing:
             print_info(docid, 'checksum OK')
-        else:
-            for afile in bibdoc.list_all_files():
-                if not afile.check():
-                    failures += 1
-                    print_info(docid, '%s failing checksum!' % afile.get_full_path())
+        for path in failing:
+            failures += 1
+            print_info(docid, '%s failing checksum!' % path)
     if failures:
         print wrap_text_in_a_box('%i files failing' % failures , style='conclusion')
     else:
@@ -1096,15 +1235,14 @@ def cli_check_md5(options):
 
 def cli_update_md5(options):
     """Update the md5 sums of a docid_set."""
-    for docid in cli_docids_iterator(options):
-        bibdoc = BibDoc.create_instance(docid)
-        if bibdoc.md5s.check():
+    for docid, failing in _iter_md5_check(options, 'update-md5'):
+        if not failing:
             print_info(docid, 'checksum OK')
         else:
-            for afile in bibdoc.list_all_files():
-                if not afile.check():
-                    print_info(docid, '%s failing checksum!' % afile.get_full_path())
+            for path in failing:
+                print_info(docid, '%s failing checksum!' % path)
             wait_for_user('Updating the md5s of this document can hide real problems.')
+            bibdoc = BibDoc.create_instance(docid)
             bibdoc.md5s.update(only_new=False)
             bibdoc._sync_to_db()
 
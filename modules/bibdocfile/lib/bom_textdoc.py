@@ -87,29 +87,52 @@ class BibTextDoc(BibDoc):
         @note: the text is extracted and cached for later use. Use L{get_text}
             to retrieve it.
         """
-        from invenio.websubmit_file_converter import get_best_format_to_extract_text_from, convert_file, InvenioWebSubmitFileConverterError
+        from invenio.websubmit_file_converter import InvenioWebSubmitFileConverterError
+        from invenio.bibdocfile_text_cache import get_text
+        if version is None:
+            version = self.get_latest_version()
+        docfile = self.get_file_to_extract_text_from(version)
+        if docfile is None:
+            open(os.path.join(self.basedir, '.text;%i' % version), 'w').write('')
+            return
+        try:
+            ## The text is taken from the cache of extracted texts if the
+            ## same file was already converted (e.g. for another record).
+            get_text(docfile.get_full_path(), os.path.join(self.basedir, '.text;%i' % version), checksum=docfile.get_checksum(), perform_ocr=perform_ocr, ln=ln)
+            if version == self.get_latest_version():
+                run_sql("UPDATE bibdoc SET text_extraction_date=NOW() WHERE id=%s", (self.id, ))
+        except InvenioWebSubmitFileConverterError, e:
+            register_exception(alert_admin=True, prefix="Error in extracting text from bibdoc %i, version %i" % (self.id, version))
+            raise InvenioBibDocFileError, str(e)
+
+    def get_file_to_extract_text_from(self, version=None):
+        """
+        @param version: the version of the document. If not specified the
+            last version is considered.
+        @type version: integer
+        @return: the file of the given version the text should be extracted
+            from, or None if there is no suitable file.
+        @rtype: BibDocFile
+        """
+        from invenio.websubmit_file_converter import get_best_format_to_extract_text_from, InvenioWebSubmitFileConverterError
         if version is None:
             version = self.get_latest_version()
         docfiles = self.list_version_files(version)
         ## We try to extract text only from original or OCRed documents.
-        filenames = [docfile.get_full_path() for docfile in docfiles if 'CONVERTED' not in docfile.flags or 'OCRED' in docfile.flags]
+        candidates = [docfile for docfile in docfiles if 'CONVERTED' not in docfile.flags or 'OCRED' in docfile.flags]
         try:
-            filename = get_best_format_to_extract_text_from(filenames)
+            filename = get_best_format_to_extract_text_from([docfile.get_full_path() for docfile in candidates])
         except InvenioWebSubmitFileConverterError:
             ## We fall back on considering all the documents
-            filenames = [docfile.get_full_path() for docfile in docfiles]
+            candidates = docfiles
             try:
-                filename = get_best_format_to_extract_text_from(filenames)
+                filename = get_best_format_to_extract_text_from([docfile.get_full_path() for docfile in candidates])
             except InvenioWebSubmitFileConverterError:
-                open(os.path.join(self.basedir, '.text;%i' % version), 'w').write('')
-                return
-        try:
-            convert_file(filename, os.path.join(self.basedir, '.text;%i' % version), '.txt', perform_ocr=perform_ocr, ln=ln)
-            if version == self.get_latest_version():
-                run_sql("UPDATE bibdoc SET text_extraction_date=NOW() WHERE id=%s", (self.id, ))
-        except InvenioWebSubmitFileConverterError, e:
-            register_exception(alert_admin=True, prefix="Error in extracting text from bibdoc %i, version %i" % (self.id, version))
-            raise InvenioBibDocFileError, str(e)
+                return None
+        for docfile in candidates:
+            if docfile.get_full_path() == filename:
+                return docfile
+        return None
 
     def pdf_a_p(self):
         """
@@ -0,0 +1,123 @@
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+Changes of the BibEdit cache.
+
+The cache of a record being edited is the list [cache_dirty,
+record_revision, record, pending_changes, disabled_hp_changes, undo_list,
+redo_list] (see bibedit_utils.create_cache).  It is stored in full only
+from time to time: in between, every update is stored as its difference
+with the previous state, as computed by L{diff_cache}, so that the cost of
+an update depends on the size of the edit rather than on the size of the
+record.  L{apply_cache_change} rebuilds the new state from the previous
+one.
+
+A change is a dictionary {position in the cache: operation}, the
+operation being one of:
+  - ('set', value): replace the part of the cache;
+  - ('splice', (start, stop, items)): replace the slice [start:stop] of a
+    list by items;
+  - ('record', {tag: operation}): change the fields of the given tags of
+    the record, the operation being 'set' or 'splice' on the list of
+    fields, or ('delete', None) to remove the tag.
+"""
+
+CACHE_RECORD_POSITION = 2
+
+
+def _diff_list(old, new):
+    """
+    Return (start, stop, items) such that replacing old[start:stop] by
+    items gives new, the slice being as small as possible at both ends.
+    """
+    length = min(len(old), len(new))
+    start = 0
+    while start < length and old[start] == new[start]:
+        start += 1
+    end = 0
+    while end < length - start and old[-1 - end] == new[-1 - end]:
+        end += 1
+    return start, len(old) - end, new[start:len(new) - end]
+
+
+def _diff_record(old, new):
+    """Return the operations turning the record old into new."""
+    operations = {}
+    for tag, fields in new.iteritems():
+        if tag not in old:
+            operations[tag] = ('set', fields)
+        elif old[tag] != fields:
+            operations[tag] = ('splice', _diff_list(old[tag], fields))
+    for tag in old:
+        if tag not in new:
+            operations[tag] = ('delete', None)
+    return operations
+
+
+def diff_cache(old, new):
+    """
+    Return the change turning the cache old into new, or None if they
+    cannot be compared (the change is then the whole new cache).
+    """
+    if len(old) != len(new):
+        return None
+    change = {}
+    for position in range(len(new)):
+        old_part, new_part = old[position], new[position]
+        if old_part == new_part:
+            continue
+        if position == CACHE_RECORD_POSITION and \
+               isinstance(old_part, dict) and isinstance(new_part, dict):
+            change[position] = ('record', _diff_record(old_part, new_part))
+        elif isinstance(old_part, list) and isinstance(new_part, list):
+            change[position] = ('splice', _diff_list(old_part, new_part))
+        else:
+            change[position] = ('set', new_part)
+    return change
+
+
+def _apply_operation(value, operation, argument):
+    """Return value changed by the given operation."""
+    if operation == 'set':
+        return argument
+    elif operation == 'splice':
+        start, stop, items = argument
+        value[start:stop] = items
+        return value
+    raise ValueError("Unknown BibEdit cache operation %s" % operation)
+
+
+def apply_cache_change(cache, change):
+    """
+    Apply to the cache (modified in place) a change returned by
+    L{diff_cache}, and return it.
+    """
+    for position, (operation, argument) in change.iteritems():
+        if operation == 'record':
+            record = cache[position]
+            for tag, (tag_operation, tag_argument) in argument.iteritems():
+                if tag_operation == 'delete':
+                    del record[tag]
+                else:
+                    record[tag] = _apply_operation(record.get(tag),
+                                                   tag_operation,
+                                                   tag_argument)
+        else:
+            cache[position] = _apply_operation(cache[position], operation,
+                                               argument)
+    return cache
@@ -212,6 +212,10 @@ CFG_BIBEDIT_KEYWORD_RDFLABEL = "" #'prefLabel'
 #where are BibEdit cache files stored
 CFG_BIBEDIT_CACHEDIR = CFG_TMPSHAREDDIR + '/bibedit-cache'
 
+# number of changes appended to the BibEdit cache of a record before it is
+# stored again in full (see bibedit_cache)
+CFG_BIBEDIT_CACHE_MAX_CHANGES = 50
+
 # CFG_BIBEDIT_DOI_LOOKUP_FIELD - for which tag bibedit should add a link
 # to a DOI name resolver
 CFG_BIBEDIT_DOI_LOOKUP_FIELD = '0247_a'
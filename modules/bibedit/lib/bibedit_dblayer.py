@@ -25,11 +25,14 @@ try:
 except ImportError:
     import Pickle
 import zlib
+import random
 
 from datetime import datetime, timedelta
 
-from invenio.dbquery import run_sql
+from invenio.dbquery import run_sql, IntegrityError
 from invenio.config import CFG_BIBEDIT_TIMEOUT
+from invenio.bibedit_config import CFG_BIBEDIT_CACHE_MAX_CHANGES
+from invenio.bibedit_cache import diff_cache, apply_cache_change
 
 
 def get_name_tags_all():
@@ -51,6 +54,47 @@ def get_bibupload_task_opts(task_ids):
                            (task_id, )))
     return res
 
+# Identifiers of the records in the files of the BibUpload queue
+
+def get_indexed_bibupload_task_ids(task_ids):
+    """Return the set of the task IDs among TASK_IDS whose records have been
+    indexed in bibEDITQUEUE."""
+    if not task_ids:
+        return set()
+    return set([row[0] for row in run_sql("""SELECT DISTINCT id_schTASK
+        FROM bibEDITQUEUE WHERE id_type='' AND id_schTASK IN (%s)""" % \
+        ','.join(['%s'] * len(task_ids)), tuple(task_ids))])
+
+def index_bibupload_task(task_id, identifiers):
+    """Store the IDENTIFIERS, a list of (type, value) pairs, of the records
+    uploaded by task TASK_ID.  A row with an empty type records that the
+    task has been indexed, even if its files contain no identifiers."""
+    identifiers = [('', '')] + identifiers
+    params = []
+    for id_type, id_value in identifiers:
+        params.extend((task_id, id_type, id_value[:255]))
+    run_sql("""INSERT INTO bibEDITQUEUE (id_schTASK, id_type, id_value)
+               VALUES %s""" % ', '.join(['(%s, %s, %s)'] * len(identifiers)),
+            tuple(params))
+
+def delete_bibupload_task_index(task_id):
+    """Forget the identifiers of the records uploaded by task TASK_ID."""
+    run_sql("DELETE FROM bibEDITQUEUE WHERE id_schTASK=%s", (task_id, ))
+
+def bibupload_tasks_have_identifiers(task_ids, identifiers):
+    """Check if any task among TASK_IDS uploads a record with one of the
+    IDENTIFIERS, a list of (type, value) pairs."""
+    if not task_ids or not identifiers:
+        return False
+    params = []
+    for id_type, id_value in identifiers:
+        params.extend((id_type, id_value[:255]))
+    params.extend(task_ids)
+    return bool(run_sql("""SELECT 1 FROM bibEDITQUEUE
+        WHERE (%s) AND id_schTASK IN (%s) LIMIT 1""" % \
+        (' OR '.join(['(id_type=%s AND id_value=%s)'] * len(identifiers)),
+         ','.join(['%s'] * len(task_ids))), tuple(params)))
+
 def get_marcxml_of_record_revision(recid, job_date):
     """Return MARCXML string of record revision specified by RECID and JOB_DATE.
 
@@ -176,19 +220,97 @@ def update_cache_post_date(recid, uid):
     run_sql("""UPDATE bibEDITCACHE SET post_date = NOW(), is_active = 1
                WHERE id_bibrec = %s AND uid = %s""", (recid, uid))
 
+# State of the caches last read or written by this process:
+# {(recid, uid): (base_id, number of changes applied, pickled cache)}
+_CACHES = {}
+_CACHES_SIZE = 20
+
+def _remember_cache(recid, uid, base_id, nb_changes, data):
+    """Remember the state of a cache, to read or diff against it later."""
+    if len(_CACHES) >= _CACHES_SIZE and (recid, uid) not in _CACHES:
+        _CACHES.clear()
+    _CACHES[(recid, uid)] = (base_id, nb_changes, Pickle.dumps(data, -1))
+
 def get_cache(recid, uid):
-    """Return a BibEdit cache object from the database."""
-    r = run_sql("""SELECT data FROM bibEDITCACHE
+    """Return a BibEdit cache object from the database.
+
+    The cache is stored in bibEDITCACHE as its last full version (the base)
+    and in bibEDITCACHECHANGES as the changes appended since then (see
+    bibedit_cache).  If this process already knows a state of the same base,
+    only the changes that followed are read.
+    """
+    r = run_sql("""SELECT base_id FROM bibEDITCACHE
                    WHERE id_bibrec = %s AND uid = %s""", (recid, uid))
-    if r:
-        return Pickle.loads(r[0][0])
+    if not r:
+        _CACHES.pop((recid, uid), None)
+        return None
+    base_id = r[0][0]
+    known = _CACHES.get((recid, uid))
+    if known and known[0] == base_id:
+        nb_changes = known[1]
+        data = Pickle.loads(known[2])
+    else:
+        r = run_sql("""SELECT base_id, data FROM bibEDITCACHE
+                       WHERE id_bibrec = %s AND uid = %s""", (recid, uid))
+        if not r:
+            return None
+        base_id = r[0][0]
+        nb_changes = 0
+        data = Pickle.loads(r[0][1])
+    for seq, change in run_sql("""SELECT seq, data FROM bibEDITCACHECHANGES
+                                  WHERE id_bibrec = %s AND uid = %s
+                                  AND base_id = %s AND seq > %s
+                                  ORDER BY seq""",
+                               (recid, uid, base_id, nb_changes)):
+        if seq != nb_changes + 1:
+            break
+        data = apply_cache_change(data, Pickle.loads(change))
+        nb_changes = seq
+    _remember_cache(recid, uid, base_id, nb_changes, data)
+    return data
 
 def update_cache(recid, uid, data):
-    data_str = Pickle.dumps(data)
-    r = run_sql("""INSERT INTO bibEDITCACHE (id_bibrec, uid, data, post_date)
-                   VALUES (%s, %s, %s, NOW())
-                   ON DUPLICATE KEY UPDATE data = %s, post_date = NOW(), is_active = 1""",
-                   (recid, uid, data_str, data_str))
+    """Store the full BibEdit cache object, as a new base."""
+    base_id = random.randint(1, 2 ** 31 - 1)
+    data_str = Pickle.dumps(data, -1)
+    run_sql("""INSERT INTO bibEDITCACHE (id_bibrec, uid, data, post_date, base_id)
+               VALUES (%s, %s, %s, NOW(), %s)
+               ON DUPLICATE KEY UPDATE data = %s, post_date = NOW(), is_active = 1,
+               base_id = %s, nb_changes = 0""",
+               (recid, uid, data_str, base_id, data_str, base_id))
+    run_sql("""DELETE FROM bibEDITCACHECHANGES
+               WHERE id_bibrec = %s AND uid = %s AND base_id <> %s""",
+               (recid, uid, base_id))
+    _remember_cache(recid, uid, base_id, 0, data)
+
+def append_cache_change(recid, uid, data):
+    """Store the BibEdit cache object as its difference with the previous
+    state of the cache, or in full once CFG_BIBEDIT_CACHE_MAX_CHANGES changes
+    have been appended to the base, or if the previous state is not known by
+    this process (e.g. it was updated by another web node in the meantime).
+    """
+    known = _CACHES.get((recid, uid))
+    if known and known[1] < CFG_BIBEDIT_CACHE_MAX_CHANGES:
+        base_id, nb_changes = known[:2]
+        change = diff_cache(Pickle.loads(known[2]), data)
+        if change is not None:
+            try:
+                run_sql("""INSERT INTO bibEDITCACHECHANGES
+                           (id_bibrec, uid, base_id, seq, data)
+                           VALUES (%s, %s, %s, %s, %s)""",
+                        (recid, uid, base_id, nb_changes + 1,
+                         Pickle.dumps(change, -1)))
+            except IntegrityError:
+                # Another process appended a change in the meantime
+                pass
+            else:
+                if run_sql("""UPDATE bibEDITCACHE SET nb_changes = %s,
+                              post_date = NOW(), is_active = 1
+                              WHERE id_bibrec = %s AND uid = %s AND base_id = %s""",
+                           (nb_changes + 1, recid, uid, base_id)):
+                    _remember_cache(recid, uid, base_id, nb_changes + 1, data)
+                    return
+    update_cache(recid, uid, data)
 
 def get_cache_post_date(recid, uid):
     r = run_sql("""SELECT post_date FROM bibEDITCACHE
@@ -199,6 +321,9 @@ def get_cache_post_date(recid, uid):
 def delete_cache(recid, uid):
     run_sql("""DELETE FROM bibEDITCACHE
                WHERE id_bibrec = %s AND uid = %s""", (recid, uid))
+    run_sql("""DELETE FROM bibEDITCACHECHANGES
+               WHERE id_bibrec = %s AND uid = %s""", (recid, uid))
+    _CACHES.pop((recid, uid), None)
 
 def uids_with_active_caches(recid):
     """Return list of uids with active caches for record RECID. Active caches
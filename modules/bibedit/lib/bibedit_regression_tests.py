@@ -21,11 +21,25 @@
 
 __revision__ = "$Id$"
 
+import marshal
+import os
+import tempfile
+
+from mock import patch
+
 from invenio.testutils import InvenioTestCase
 
-from invenio.config import CFG_SITE_URL
+from invenio.config import CFG_SITE_URL, \
+     CFG_BIBUPLOAD_EXTERNAL_OAIID_TAG as OAIID_TAG, \
+     CFG_BIBUPLOAD_EXTERNAL_SYSNO_TAG as SYSNO_TAG
 from invenio.testutils import make_test_suite, run_test_suite, \
                               test_web_page_content, merge_error_messages
+from invenio.dbquery import run_sql
+from invenio.bibedit_config import CFG_BIBEDIT_CACHEDIR
+from invenio.bibedit_dblayer import get_indexed_bibupload_task_ids
+from invenio.bibedit_utils import record_locked_by_queue, \
+     _get_file_identifiers
+from invenio.inveniogc import clean_bibedit_cache
 
 class BibEditWebPagesAvailabilityTest(InvenioTestCase):
     """Check BibEdit web pages whether they are up or not."""
@@ -61,7 +75,81 @@ class BibEditWebPagesAvailabilityTest(InvenioTestCase):
             self.fail(merge_error_messages(error_messages))
         return
 
-TEST_SUITE = make_test_suite(BibEditWebPagesAvailabilityTest)
+class BibEditQueueLockTest(InvenioTestCase):
+    """Check the locking of the records uploaded by queued bibupload tasks."""
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(dir=CFG_BIBEDIT_CACHEDIR,
+                                             prefix='test_queue_',
+                                             suffix='.xml')
+        os.write(fd, """<collection><record>
+  <controlfield tag="001">1</controlfield>
+  <datafield tag="%s" ind1=" " ind2=" ">
+    <subfield code="%s">oai:test:1</subfield>
+  </datafield>
+  <datafield tag="%s" ind1=" " ind2=" ">
+    <subfield code="%s">SYSNO-TEST-1</subfield>
+  </datafield>
+</record></collection>""" % (OAIID_TAG[0:3], OAIID_TAG[5],
+                             SYSNO_TAG[0:3], SYSNO_TAG[5]))
+        os.close(fd)
+        # a task that bibsched will not run during the test
+        self.task_id = run_sql("""INSERT INTO schTASK (proc, user, runtime,
+            sleeptime, arguments, status) VALUES ('bibupload', 'admin',
+            '2100-01-01 00:00:00', '', %s, 'WAITING')""",
+            (marshal.dumps(['bibupload', '-r', self.filename]), ))
+
+    def tearDown(self):
+        run_sql("DELETE FROM schTASK WHERE id=%s", (self.task_id, ))
+        run_sql("DELETE FROM bibEDITQUEUE WHERE id_schTASK=%s",
+                (self.task_id, ))
+        os.remove(self.filename)
+
+    def _check_file_identifiers(self, method):
+        with patch('invenio.bibedit_utils.CFG_BIBEDIT_QUEUE_CHECK_METHOD',
+                   method):
+            self.assertEqual(sorted(_get_file_identifiers(self.filename)),
+                             [('001', '1'), ('oaiid', 'oai:test:1'),
+                              ('sysno', 'SYSNO-TEST-1')])
+
+    def test_file_identifiers_bibrecord(self):
+        """bibedit - identifiers of a queued file read with bibrecord"""
+        self._check_file_identifiers('bibrecord')
+
+    def test_file_identifiers_regexp(self):
+        """bibedit - identifiers of a queued file read with regexps"""
+        self._check_file_identifiers('regexp')
+
+    @patch('invenio.bibedit_utils.CFG_BIBEDIT_LOCKLEVEL', 3)
+    def test_record_locked_by_queue(self):
+        """bibedit - records locked by the queued bibupload tasks"""
+        self.assertEqual(get_indexed_bibupload_task_ids([self.task_id]),
+                         set())
+        self.assertTrue(record_locked_by_queue(1))
+        # the files of the task are indexed once
+        self.assertEqual(get_indexed_bibupload_task_ids([self.task_id]),
+                         set([self.task_id]))
+        self.assertFalse(record_locked_by_queue(2))
+        # the records of tasks that are not queued are not locked
+        run_sql("UPDATE schTASK SET status='ERROR' WHERE id=%s",
+                (self.task_id, ))
+        self.assertFalse(record_locked_by_queue(1))
+
+    @patch('invenio.bibedit_utils.CFG_BIBEDIT_LOCKLEVEL', 3)
+    def test_clean_queue_index(self):
+        """bibedit - garbage collection of the bibupload queue index"""
+        record_locked_by_queue(1)
+        clean_bibedit_cache()
+        self.assertEqual(get_indexed_bibupload_task_ids([self.task_id]),
+                         set([self.task_id]))
+        run_sql("UPDATE schTASK SET status='DONE' WHERE id=%s",
+                (self.task_id, ))
+        clean_bibedit_cache()
+        self.assertEqual(get_indexed_bibupload_task_ids([self.task_id]),
+                         set())
+
+TEST_SUITE = make_test_suite(BibEditWebPagesAvailabilityTest,
+                             BibEditQueueLockTest)
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE, warn_user=True)
@@ -25,6 +25,7 @@ import re
 from invenio.testutils import make_test_suite, run_test_suite
 from invenio.bibedit_utils import get_xml_from_textmarc
 from invenio.bibedit_engine import perform_doi_search
+from invenio.bibedit_cache import diff_cache, apply_cache_change
 
 class TextmarcToXMLTests(InvenioTestCase):
     """ Test utility functions to convert textmarc to XML """
@@ -112,8 +113,52 @@ class TestPerformDoiSearch(InvenioTestCase):
         wrong_output = {}
         self.assertNotEqual(perform_doi_search(doi), wrong_output)
 
+class BibEditCacheChangesTest(InvenioTestCase):
+    """Test the changes of the BibEdit cache"""
+
+    def setUp(self):
+        self.cache = [True, '20140101000000',
+                      {'001': [([], ' ', ' ', '1', 1)],
+                       '100': [([('a', 'Doe, J.')], ' ', ' ', '', 2)],
+                       '700': [([('a', 'Smith, A.')], ' ', ' ', '', 3),
+                               ([('a', 'Jones, B.')], ' ', ' ', '', 4)]},
+                      [], [], [], []]
+
+    def _check(self, new):
+        """Check that the change from self.cache rebuilds new"""
+        change = diff_cache(self.cache, new)
+        self.assertEqual(apply_cache_change(self.cache, change), new)
+        return change
+
+    def test_no_change(self):
+        """bibedit - empty change of an unmodified cache"""
+        self.assertEqual(diff_cache(self.cache, eval(repr(self.cache))), {})
+
+    def test_change_field(self):
+        """bibedit - change of a field only contains this field"""
+        new = eval(repr(self.cache))
+        new[2]['700'][1] = ([('a', 'Jones, C.')], ' ', ' ', '', 4)
+        new[5].append(['modify', '700'])
+        change = self._check(new)
+        self.assertEqual(change[2], ('record', {'700': ('splice',
+            (1, 2, [([('a', 'Jones, C.')], ' ', ' ', '', 4)]))}))
+        self.assertEqual(change[5], ('splice', (0, 0, [['modify', '700']])))
+
+    def test_add_delete_tags(self):
+        """bibedit - change adding and deleting tags of the record"""
+        new = eval(repr(self.cache))
+        del new[2]['100']
+        new[2]['245'] = [([('a', 'Title')], ' ', ' ', '', 5)]
+        new[1] = '20140102000000'
+        self._check(new)
+
+    def test_incompatible(self):
+        """bibedit - no change between caches of different lengths"""
+        self.assertEqual(diff_cache(self.cache, self.cache[:-1]), None)
+
 TEST_SUITE = make_test_suite(TextmarcToXMLTests,
-                            TestPerformDoiSearch)
+                             TestPerformDoiSearch,
+                             BibEditCacheChangesTest)
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE)
@@ -51,7 +51,7 @@ from invenio.bibedit_config import CFG_BIBEDIT_FILENAME, \
     CFG_BIBEDIT_FIELD_TEMPLATES_PATH, CFG_BIBEDIT_CACHEDIR
 from invenio.bibedit_dblayer import (get_record_last_modification_date,
     delete_hp_change, cache_exists, update_cache_post_date, get_cache,
-    update_cache, get_cache_post_date, uids_with_active_caches,
+    update_cache, append_cache_change, get_cache_post_date, uids_with_active_caches,
     get_record_revision_author, delete_cache as _delete_cache)
 from invenio.bibrecord import create_record, create_records, \
     record_get_field_value, record_has_field, record_xml_output, \
@@ -72,7 +72,8 @@ from invenio.dateutils import convert_datetext_to_dategui
 from invenio.textutils import wash_for_xml
 from invenio.bibedit_dblayer import get_bibupload_task_opts, \
     get_marcxml_of_record_revision, get_record_revisions, \
-    get_info_of_record_revision
+    get_info_of_record_revision, get_indexed_bibupload_task_ids, \
+    index_bibupload_task, bibupload_tasks_have_identifiers
 from invenio.search_engine import record_exists, get_colID, \
      guess_primary_collection_of_a_record, get_record, \
      get_all_collections_of_a_record
@@ -97,6 +98,9 @@ from invenio.pluginutils import PluginContainer
 # Precompile regexp:
 re_file_option = re.compile(r'^%s' % CFG_BIBEDIT_CACHEDIR)
 re_xmlfilename_suffix = re.compile(r'_(\d+)_\d+\.xml$')
+re_controlfield_001 = re.compile(r'<controlfield tag="001">\s*(\d+)\s*</controlfield>')
+re_datafield_ids = dict([(id_type, re.compile(r'<datafield tag="%s" ind1=" " ind2=" ">(?:\s*<subfield code="%s">\s*|\s*<subfield code="9">\s*.*\s*</subfield>\s*<subfield code="%s">\s*)([^<]*?)\s*</subfield>' % (tag[0:3], tag[5], tag[5])))
+                         for id_type, tag in (('oaiid', OAIID_TAG), ('sysno', SYSNO_TAG))])
 re_revid_split = re.compile(r'^(\d+)\.(\d{14})$')
 re_revdate_split = re.compile(r'^(\d\d\d\d)(\d\d)(\d\d)(\d\d)(\d\d)(\d\d)')
 re_taskid = re.compile(r'ID="(\d+)"')
@@ -306,7 +310,7 @@ def update_cache_contents(recid, uid, record_revision, record, pending_changes,
     """
     data = [True, record_revision, record, pending_changes,
             disabled_hp_changes, undo_list, redo_list]
-    update_cache(recid, uid, data)
+    append_cache_change(recid, uid, data)
     return get_cache_mtime(recid, uid)
 
 def delete_cache(recid, uid):
@@ -384,7 +388,9 @@ def save_xml_record(recid, uid, xml_record='', to_upload=True, to_merge=False,
         if sequence_id:
             args.extend(["-I", sequence_id])
         args.extend(['--email-logs-on-error'])
-        task_low_level_submission(*args)
+        task_id = task_low_level_submission(*args)
+        # Index the identifiers of the record for record_locked_by_queue
+        index_bibupload_task(task_id, _get_record_identifiers(record))
     return True
 
 
@@ -465,21 +471,19 @@ def record_locked_by_queue(recid):
                 recids.append(int(filename_suffix.group(1)))
         return recid in recids
 
-    # Check for match between content of files and record.
+    # Check for match between content of files and record, using the
+    # identifiers of the records of each file, read once per task.
     elif CFG_BIBEDIT_LOCKLEVEL == 3:
-        filenames = _get_bibupload_filenames()
-        while True:
-            lock = _record_in_files_p(recid, filenames)
-            # Check if any new files were added while we were searching
-            if not lock:
-                filenames_updated = _get_bibupload_filenames()
-                for filename in filenames_updated:
-                    if not filename in filenames:
-                        break
-                else:
-                    return lock
-            else:
-                return lock
+        task_ids = _get_bibupload_task_ids()
+        if not task_ids:
+            return False
+        indexed_task_ids = get_indexed_bibupload_task_ids(task_ids)
+        for task_id in task_ids:
+            if task_id not in indexed_task_ids:
+                # Task not submitted by save_xml_record
+                _index_bibupload_task_files(task_id)
+        return bibupload_tasks_have_identifiers(task_ids,
+                                                _get_identifiers_of_recid(recid))
 
 # History/revisions
 
@@ -695,73 +699,73 @@ def _get_bibupload_task_ids():
 
 def _get_bibupload_filenames():
     """Return paths to all files scheduled for upload."""
-    task_ids = _get_bibupload_task_ids()
     filenames = []
-    tasks_opts = get_bibupload_task_opts(task_ids)
-    for task_opts in tasks_opts:
-        if task_opts:
-            record_options = marshal.loads(task_opts[0][0])
-            for option in record_options[1:]:
-                if re_file_option.search(option):
-                    filenames.append(option)
+    for task_id in _get_bibupload_task_ids():
+        filenames.extend(_get_bibupload_task_filenames(task_id))
+    return filenames
+
+def _get_bibupload_task_filenames(task_id):
+    """Return paths to the files scheduled for upload by a task."""
+    filenames = []
+    task_opts = get_bibupload_task_opts([task_id])[0]
+    if task_opts:
+        record_options = marshal.loads(task_opts[0][0])
+        for option in record_options[1:]:
+            if re_file_option.search(option):
+                filenames.append(option)
     return filenames
 
-def _record_in_files_p(recid, filenames):
-    """Search XML files for given record."""
-    # Get id tags of record in question
-    rec_oaiid = rec_sysno = -1
-    rec_oaiid_tag = get_fieldvalues(recid, OAIID_TAG)
-    rec_sysno_tag = get_fieldvalues(recid, SYSNO_TAG)
-    if rec_sysno_tag:
-        rec_sysno = rec_sysno_tag[0]
-
-    # For each record in each file, compare ids and abort if match is found
-    for filename in filenames:
+def _get_identifiers_of_recid(recid):
+    """Return the identifiers of a record, as (type, value) pairs, type
+    being one of '001', 'oaiid' and 'sysno'."""
+    identifiers = [('001', str(recid))]
+    for oaiid in get_fieldvalues(recid, OAIID_TAG):
+        identifiers.append(('oaiid', oaiid))
+    sysno = get_fieldvalues(recid, SYSNO_TAG)
+    if sysno:
+        identifiers.append(('sysno', sysno[0]))
+    return identifiers
+
+def _get_record_identifiers(record):
+    """Return the identifiers of a record structure, as (type, value)
+    pairs, type being one of '001', 'oaiid' and 'sysno'."""
+    identifiers = [('001', value) for value in
+                   record_get_field_values(record, '001')]
+    for id_type, tag in (('oaiid', OAIID_TAG), ('sysno', SYSNO_TAG)):
+        for value in record_get_field_values(record, tag[0:3], tag[3],
+                                             tag[4], tag[5]):
+            identifiers.append((id_type, value))
+    return identifiers
+
+def _get_file_identifiers(filename):
+    """Return the identifiers of the records of an XML file, as (type,
+    value) pairs, type being one of '001', 'oaiid' and 'sysno'."""
+    file_content = open(filename).read()
+    if CFG_BIBEDIT_QUEUE_CHECK_METHOD == 'regexp':
+        # check via regexp: this is fast, but may not be precise
+        identifiers = [('001', value) for value in
+                       re_controlfield_001.findall(file_content)]
+        for id_type, re_datafield in re_datafield_ids.iteritems():
+            identifiers.extend([(id_type, value) for value in
+                                re_datafield.findall(file_content)])
+        return identifiers
+    # by default, check via bibrecord: this is accurate, but may be slow
+    identifiers = []
+    for record in create_records(file_content, 0, 0):
+        record, all_good = record[:2]
+        if record and all_good:
+            identifiers.extend(_get_record_identifiers(record))
+    return identifiers
+
+def _index_bibupload_task_files(task_id):
+    """Index the identifiers of the records in the files of a task."""
+    identifiers = []
+    for filename in _get_bibupload_task_filenames(task_id):
         try:
-            if CFG_BIBEDIT_QUEUE_CHECK_METHOD == 'regexp':
-                # check via regexp: this is fast, but may not be precise
-                file_content = open(filename).read()
-                re_match_001 = re.compile('<controlfield tag="001">%s</controlfield>' % (recid))
-                if re_match_001.search(file_content):
-                    return True
-                for rec_oaiid in rec_oaiid_tag:
-                    re_match_oaiid = re.compile(r'<datafield tag="%s" ind1=" " ind2=" ">(\s*<subfield code="a">\s*|\s*<subfield code="9">\s*.*\s*</subfield>\s*<subfield code="a">\s*)%s' % (OAIID_TAG[0:3], re.escape(rec_oaiid)))
-                    if re_match_oaiid.search(file_content):
-                        return True
-                re_match_sysno = re.compile(r'<datafield tag="%s" ind1=" " ind2=" ">(\s*<subfield code="a">\s*|\s*<subfield code="9">\s*.*\s*</subfield>\s*<subfield code="a">\s*)%s' % (SYSNO_TAG[0:3], re.escape(str(rec_sysno))))
-                if rec_sysno_tag:
-                    if re_match_sysno.search(file_content):
-                        return True
-            else:
-                # by default, check via bibrecord: this is accurate, but may be slow
-                file_ = open(filename)
-                records = create_records(file_.read(), 0, 0)
-                for i in range(0, len(records)):
-                    record, all_good = records[i][:2]
-                    if record and all_good:
-                        if _record_has_id_p(record, recid, rec_oaiid, rec_sysno):
-                            return True
-                file_.close()
+            identifiers.extend(_get_file_identifiers(filename))
         except IOError:
             continue
-    return False
-
-def _record_has_id_p(record, recid, rec_oaiid, rec_sysno):
-    """Check if record matches any of the given IDs."""
-    if record_has_field(record, '001'):
-        if record_get_field_value(record, '001', '%', '%') == str(recid):
-            return True
-    if record_has_field(record, OAIID_TAG[0:3]):
-        if (record_get_field_value(
-                record, OAIID_TAG[0:3], OAIID_TAG[3],
-                OAIID_TAG[4], OAIID_TAG[5]) == rec_oaiid):
-            return True
-    if record_has_field(record, SYSNO_TAG[0:3]):
-        if (record_get_field_value(
-                record, SYSNO_TAG[0:3], SYSNO_TAG[3],
-                SYSNO_TAG[4], SYSNO_TAG[5]) == rec_sysno):
-            return True
-    return False
+    index_bibupload_task(task_id, identifiers)
 
 
 def can_record_have_physical_copies(recid):
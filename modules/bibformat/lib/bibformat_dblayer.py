@@ -27,7 +27,7 @@ __revision__ = "$Id$"
 import zlib
 import time
 
-from invenio.dbquery import run_sql
+from invenio.dbquery import run_sql, run_sql_many
 from invenio.dateutils import localtime_to_utc
 
 
@@ -494,6 +494,38 @@ def save_preformatted_record(recID, of, res, needs_2nd_pass=False,
             (recID, of, start_date, formatted_record, needs_2nd_pass))
 
 
+def save_preformatted_records(records, of, low_priority=False,
+                              compress=zlib.compress):
+    """
+    Saves many preformatted records at once in bibfmt.
+
+    The rows are written with multi-row INSERTs (via run_sql_many) which
+    is a lot faster than calling save_preformatted_record() in a loop
+    when reformatting big sets of records.
+
+    @param records: list of (recID, formatted record, needs_2nd_pass) tuples
+    @param of: the output format code
+    @param low_priority: if True, use INSERT LOW_PRIORITY
+    @return: the number of affected rows
+    """
+    if not records:
+        return 0
+    start_date = time.strftime('%Y-%m-%d %H:%M:%S')
+    params = [(recID, of, start_date, compress(res), needs_2nd_pass)
+              for recID, res, needs_2nd_pass in records]
+    sql_str = ""
+    if low_priority:
+        sql_str = " LOW_PRIORITY"
+    return run_sql_many("""INSERT%s INTO bibfmt
+               (id_bibrec, format, last_updated, value, needs_2nd_pass)
+               VALUES (%%s, %%s, %%s, %%s, %%s)
+               ON DUPLICATE KEY UPDATE
+                    last_updated = VALUES(last_updated),
+                    value = VALUES(value),
+                    needs_2nd_pass = VALUES(needs_2nd_pass)
+               """ % sql_str, params)
+
+
 
 ## def keep_formats_in_db(output_formats):
 ##     """
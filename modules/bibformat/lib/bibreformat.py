@@ -26,13 +26,17 @@ import os
 import random
 from datetime import datetime, timedelta
 
+from invenio.config import CFG_CACHEDIR, \
+    CFG_BIBFORMAT_REFORMAT_WORKERS, \
+    CFG_BIBFORMAT_REFORMAT_BATCH_SIZE
 from invenio.dbquery import run_sql
 
 from invenio.intbitset import intbitset
 from invenio.search_engine import perform_request_search, search_pattern
 from invenio.bibrank_citation_searcher import get_cited_by
 from invenio.bibrank_citation_indexer import get_bibrankmethod_lastupdate
-from invenio.bibformat_dblayer import save_preformatted_record
+from invenio.bibformat_dblayer import save_preformatted_record, \
+    save_preformatted_records
 from invenio.shellutils import split_cli_ids_arg
 from invenio.bibfield import get_record
 from invenio.bibtask import task_init, \
@@ -42,7 +46,8 @@ from invenio.bibtask import task_init, \
     task_update_progress, \
     task_has_option, \
     task_sleep_now_if_required
-from invenio.bibformat_engine import format_record_1st_pass
+from invenio.bibformat_engine import format_record_1st_pass, \
+    get_output_format
 
 
 def fetch_last_updated(fmt):
@@ -64,7 +69,7 @@ def store_last_updated(fmt, iso_date):
 ### run the bibreformat task bibsched scheduled
 ###
 
-def bibreformat_task(fmt, recids, without_fmt, process):
+def bibreformat_task(fmt, recids, without_fmt, process, workers=1):
     """
     BibReformat main task
 
@@ -75,6 +80,7 @@ def bibreformat_task(fmt, recids, without_fmt, process):
     @param process_format:
     @param process:
     @param recids: a list of record IDs to reformat
+    @param workers: number of processes formatting the records in parallel
     @return: None
     """
     write_message("Processing format %s" % fmt)
@@ -147,7 +153,12 @@ def bibreformat_task(fmt, recids, without_fmt, process):
 
 ### Iterate over all records prepared in lists I (option)
     if process:
-        total_rec_1, tbibformat_1, tbibupload_1 = iterate_over_new(recIDs, fmt)
+        if workers > 1:
+            total_rec_1, tbibformat_1, tbibupload_1 = \
+                iterate_over_new_parallel(recIDs, fmt, workers)
+        else:
+            total_rec_1, tbibformat_1, tbibupload_1 = \
+                iterate_over_new(recIDs, fmt)
         total_rec += total_rec_1
         tbibformat += tbibformat_1
         tbibupload += tbibupload_1
@@ -177,6 +188,10 @@ def bibreformat_task(fmt, recids, without_fmt, process):
     message = " bibupload: %2f sec" % tbibupload
     write_message(message)
 
+    if process and total_rec:
+        message = "throughput: %.1f records/sec" % (total_rec / max(elapsed, 1e-3))
+        write_message(message)
+
 def check_validity_input_formats(input_formats):
     """
     Checks the validity of every input format.
@@ -263,6 +278,177 @@ def iterate_over_new(recIDs, fmt):
     if tot % 100 != 0:
         write_message("   ... formatted %s records out of %s" % (tot, tot))
 
+    # the records resumed from an interrupted run are done as well, but
+    # not the ones this run did not load (see --resume)
+    finish_checkpoint(fmt, load_checkpoint(fmt) - intbitset(recIDs))
+    return tot, tbibformat, tbibupload
+
+
+### Parallel bibreformat: records are sharded in batches over a pool of
+### worker processes, each of them keeping its BibFormat caches warm
+### across batches and saving its results with bulk upserts.
+
+def get_checkpoint_path(fmt):
+    """Return the path of the checkpoint file of the given format."""
+    return os.path.join(CFG_CACHEDIR, 'bibreformat',
+                        'checkpoint_%s' % fmt.lower())
+
+
+def load_checkpoint(fmt):
+    """Return the record IDs left to be formatted by an interrupted run.
+
+    @param fmt: the output format
+    @rtype: intbitset
+    """
+    try:
+        checkpoint = open(get_checkpoint_path(fmt), 'rb')
+        try:
+            return intbitset(checkpoint.read())
+        finally:
+            checkpoint.close()
+    except (IOError, ValueError):
+        return intbitset()
+
+
+def store_checkpoint(fmt, recids):
+    """Store the record IDs still to be formatted.
+
+    The file is written to a temporary name and then renamed in order to
+    never leave a truncated checkpoint behind.
+
+    @param fmt: the output format
+    @param recids: the record IDs still to be formatted
+    @type recids: intbitset
+    """
+    path = get_checkpoint_path(fmt)
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    checkpoint = open(path + '.tmp', 'wb')
+    try:
+        checkpoint.write(recids.fastdump())
+    finally:
+        checkpoint.close()
+    os.rename(path + '.tmp', path)
+
+
+def clear_checkpoint(fmt):
+    """Remove the checkpoint of the given format, if any."""
+    try:
+        os.remove(get_checkpoint_path(fmt))
+    except OSError:
+        pass
+
+
+def finish_checkpoint(fmt, remaining):
+    """Keep in the checkpoint only the record IDs of an interrupted run
+    that the finished run did not format.
+
+    @param fmt: the output format
+    @param remaining: the record IDs still to be formatted
+    @type remaining: intbitset
+    """
+    if remaining:
+        write_message("%s records of an interrupted run are still to be "
+                      "formatted (see --resume)" % len(remaining))
+        store_checkpoint(fmt, remaining)
+    else:
+        clear_checkpoint(fmt)
+
+
+def _init_reformat_worker(fmt):
+    """Prepare a bibreformat worker process.
+
+    Loading the output format here fills the BibFormat engine caches
+    once per worker instead of once per batch.
+    """
+    if fmt.lower() not in _CFG_BIBFORMAT_UPDATE_FORMAT_FUNCTIONS:
+        get_output_format(fmt)
+
+
+def _reformat_batch(args):
+    """Format a batch of records and save them in bibfmt in one go.
+
+    Runs in a worker process.
+
+    @param args: tuple (output format, list of record IDs)
+    @return: tuple (record IDs, time taken to format, time taken to insert)
+    """
+    fmt, recids = args
+    reformat_function = _CFG_BIBFORMAT_UPDATE_FORMAT_FUNCTIONS.get(
+        fmt.lower())
+    t1 = os.times()[4]
+    if reformat_function:
+        for recid in recids:
+            reformat_function(recid, fmt)
+        return recids, os.times()[4] - t1, 0
+
+    records = []
+    for recid in recids:
+        record, needs_2nd_pass = format_record_1st_pass(recID=recid,
+                                                        of=fmt,
+                                                        on_the_fly=True,
+                                                        save_missing=False)
+        records.append((recid, record, needs_2nd_pass))
+    t2 = os.times()[4]
+    save_preformatted_records(records, fmt, low_priority=True)
+    t3 = os.times()[4]
+    return recids, t2 - t1, t3 - t2
+
+
+def iterate_over_new_parallel(recIDs, fmt, workers,
+                              batch_size=CFG_BIBFORMAT_REFORMAT_BATCH_SIZE):
+    """
+    Iterate over list of IDs using a pool of worker processes.
+
+    The record IDs not yet formatted are stored in a checkpoint after
+    each batch, so that an interrupted run can be resumed (see --resume).
+    The records left in the checkpoint by a previous interrupted run are
+    kept in it if this run does not format them.
+
+    @param recIDs: the list of record IDs to format
+    @param fmt: the output format to use
+    @param workers: the number of worker processes
+    @param batch_size: the number of records formatted and saved at once
+    @return: tuple (total number of records, time taken to format, time taken to insert)
+    """
+    from multiprocessing import Pool
+
+    tbibformat = 0
+    tbibupload = 0
+
+    tot = len(recIDs)
+    pending = intbitset(recIDs)
+    previous = load_checkpoint(fmt) - pending
+    store_checkpoint(fmt, pending | previous)
+
+    batches = [(fmt, recIDs[i:i + batch_size])
+               for i in xrange(0, tot, batch_size)]
+    write_message("Formatting %s records in %s batches with %s workers"
+                  % (tot, len(batches), workers))
+
+    count = 0
+    pool = Pool(processes=workers, initializer=_init_reformat_worker,
+                initargs=(fmt, ))
+    try:
+        for recids, tformat, tupload in pool.imap_unordered(_reformat_batch,
+                                                            batches):
+            tbibformat += tformat
+            tbibupload += tupload
+            count += len(recids)
+            pending -= intbitset(recids)
+            store_checkpoint(fmt, pending | previous)
+            write_message("   ... formatted %s records out of %s" % (count, tot))
+            task_update_progress('Formatted %s out of %s' % (count, tot))
+            task_sleep_now_if_required(can_stop_too=True)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    finish_checkpoint(fmt, previous)
     return tot, tbibformat, tbibupload
 
 
@@ -380,6 +566,12 @@ def task_run_core():
         cli_recids = split_cli_ids_arg(task_get_option('recids', ''))
         recids += cli_recids
 
+        if task_has_option('resume'):
+            checkpoint = load_checkpoint(fmt)
+            write_message("resuming %s records from last interrupted run"
+                          % len(checkpoint))
+            recids += checkpoint
+
         query_params = {'collection': task_get_option('collection', ''),
                         'field': task_get_option('field', ''),
                         'pattern': task_get_option('pattern', ''),
@@ -389,7 +581,9 @@ def task_run_core():
         bibreformat_task(fmt,
                          recids,
                          without_fmt,
-                         not task_has_option('noprocess'))
+                         not task_has_option('noprocess'),
+                         task_get_option('workers',
+                                         CFG_BIBFORMAT_REFORMAT_WORKERS))
 
     return True
 
@@ -434,6 +628,9 @@ Examples:
   bibreformat -n -c 'Articles'   Show how many records are to be (re)formatted in 'Articles' collection.
 
   bibreformat -oHB -s1h          Format all new and modified records every hour, in HB.
+
+  bibreformat -a -w 8            Force reformatting all records (in HB) using 8 processes.
+  bibreformat -w 8 --resume      Resume an interrupted parallel run.
 """, help_specific_usage="""  -o,  --formats         \t Specify output format/s (default HB)
   -n,  --noprocess      \t Count records to be formatted (no processing done)
 Reformatting options:
@@ -443,12 +640,15 @@ Reformatting options:
   -p,  --pattern        \t Force reformatting records by pattern
   -i,  --id             \t Force reformatting records by record id(s)
   --no-missing          \t Ignore reformatting records without format
+  --resume              \t Reformat records left over by an interrupted parallel run
+Parallel options:
+  -w,  --workers        \t Number of processes formatting records (default %s)
 Pattern options:
   -m,  --matching       \t Specify if pattern is exact (e), regular expression (r),
                         \t partial (p), any of the words (o) or all of the words (a)
-""",
+""" % CFG_BIBFORMAT_REFORMAT_WORKERS,
             version=__revision__,
-            specific_params=("ac:f:p:lo:nm:i:",
+            specific_params=("ac:f:p:lo:nm:i:w:",
                 ["all",
                  "collection=",
                  "matching=",
@@ -457,7 +657,9 @@ Pattern options:
                  "format=",
                  "noprocess",
                  "id=",
-                 "no-missing"]),
+                 "no-missing",
+                 "resume",
+                 "workers="]),
             task_submit_check_options_fnc=task_submit_check_options,
             task_submit_elaborate_specific_parameter_fnc=task_submit_elaborate_specific_parameter,
             task_run_fnc=task_run_core)
@@ -467,7 +669,8 @@ def task_submit_check_options():
     """Last checks and updating on the options..."""
     if not (task_has_option('all') or task_has_option('collection')
             or task_has_option('field') or task_has_option('pattern')
-            or task_has_option('matching') or task_has_option('recids')):
+            or task_has_option('matching') or task_has_option('recids')
+            or task_has_option('resume')):
         task_set_option('last', 1)
     return True
 
@@ -509,6 +712,13 @@ def task_submit_elaborate_specific_parameter(key, value, opts, args):  # pylint:
             task_set_option("format", value)
     elif key in ("-i", "--id"):
         task_set_option("recids", value)
+    elif key in ("--resume", ):
+        task_set_option("resume", 1)
+    elif key in ("-w", "--workers"):
+        try:
+            task_set_option("workers", int(value))
+        except ValueError:
+            raise StandardError("Number of workers must be an integer")
     else:
         return False
     return True
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""BibReformat - Unit Test Suite"""
+
+import shutil
+import tempfile
+
+from invenio.testutils import InvenioTestCase
+from invenio.testutils import make_test_suite, run_test_suite
+from invenio.intbitset import intbitset
+from invenio import bibreformat
+
+
+class CheckpointTest(InvenioTestCase):
+    """Test the checkpoints of parallel bibreformat runs"""
+
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+        self.orig_cachedir = bibreformat.CFG_CACHEDIR
+        bibreformat.CFG_CACHEDIR = self.cachedir
+
+    def tearDown(self):
+        bibreformat.CFG_CACHEDIR = self.orig_cachedir
+        shutil.rmtree(self.cachedir)
+
+    def test_missing_checkpoint(self):
+        """bibreformat - missing checkpoint is empty"""
+        self.assertEqual(intbitset(), bibreformat.load_checkpoint('hb'))
+
+    def test_checkpoint_roundtrip(self):
+        """bibreformat - stored checkpoint is loaded back"""
+        bibreformat.store_checkpoint('HB', intbitset([1, 5, 10]))
+        self.assertEqual(intbitset([1, 5, 10]),
+                         bibreformat.load_checkpoint('hb'))
+        bibreformat.store_checkpoint('HB', intbitset([10]))
+        self.assertEqual(intbitset([10]), bibreformat.load_checkpoint('HB'))
+
+    def test_clear_checkpoint(self):
+        """bibreformat - cleared checkpoint is empty"""
+        bibreformat.store_checkpoint('hb', intbitset([1]))
+        bibreformat.clear_checkpoint('hb')
+        self.assertEqual(intbitset(), bibreformat.load_checkpoint('hb'))
+        # clearing twice is harmless
+        bibreformat.clear_checkpoint('hb')
+
+    def _reformat(self, recids, checkpoint, workers=1):
+        """Run bibreformat on RECIDS with CHECKPOINT left by a previous
+        run, without formatting anything, and return the new checkpoint."""
+        orig_functions = bibreformat._CFG_BIBFORMAT_UPDATE_FORMAT_FUNCTIONS
+        orig_task_functions = (bibreformat.write_message,
+                               bibreformat.task_update_progress,
+                               bibreformat.task_sleep_now_if_required)
+        bibreformat._CFG_BIBFORMAT_UPDATE_FORMAT_FUNCTIONS = {
+            'hb': lambda recid, fmt: None}
+        bibreformat.write_message = lambda *args, **kwargs: None
+        bibreformat.task_update_progress = lambda *args: None
+        bibreformat.task_sleep_now_if_required = lambda *args, **kwargs: None
+        try:
+            bibreformat.store_checkpoint('hb', intbitset(checkpoint))
+            if workers > 1:
+                bibreformat.iterate_over_new_parallel(recids, 'hb', workers,
+                                                      batch_size=1)
+            else:
+                bibreformat.iterate_over_new(recids, 'hb')
+        finally:
+            bibreformat._CFG_BIBFORMAT_UPDATE_FORMAT_FUNCTIONS = orig_functions
+            (bibreformat.write_message,
+             bibreformat.task_update_progress,
+             bibreformat.task_sleep_now_if_required) = orig_task_functions
+        return bibreformat.load_checkpoint('hb')
+
+    def test_sequential_run_clears_checkpoint(self):
+        """bibreformat - sequential run clears the resumed checkpoint"""
+        self.assertEqual(intbitset(), self._reformat([1, 5], [1, 5]))
+
+    def test_sequential_run_keeps_checkpoint(self):
+        """bibreformat - sequential run keeps the records it did not load"""
+        self.assertEqual(intbitset([7]), self._reformat([1, 5], [1, 7]))
+
+    def test_parallel_run_clears_checkpoint(self):
+        """bibreformat - parallel run clears the resumed checkpoint"""
+        self.assertEqual(intbitset(), self._reformat([1, 5], [5], workers=2))
+
+    def test_parallel_run_keeps_checkpoint(self):
+        """bibreformat - parallel run keeps the records it did not load"""
+        self.assertEqual(intbitset([7]),
+                         self._reformat([1, 5], [1, 7], workers=2))
+
+
+TEST_SUITE = make_test_suite(CheckpointTest, )
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
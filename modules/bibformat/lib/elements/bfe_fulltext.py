@@ -21,7 +21,7 @@
 __revision__ = "$Id$"
 
 import re
-from invenio.bibdocfile import BibRecDocs, file_strip_ext, normalize_format, compose_format
+from invenio.bibdocfile import get_bibrecdocs, file_strip_ext, normalize_format, compose_format
 from invenio.messages import gettext_set_language
 from invenio.config import CFG_SITE_URL, CFG_BASE_URL, CFG_CERN_SITE, CFG_SITE_RECORD, \
     CFG_BIBFORMAT_HIDDEN_FILE_FORMATS
@@ -207,7 +207,7 @@ def get_files(bfo, distinguish_main_and_additional_files=True, include_subformat
         hide_doctypes = []
 
     urls = bfo.fields("8564_")
-    bibarchive = BibRecDocs(bfo.recID)
+    bibarchive = get_bibrecdocs(bfo.recID)
 
     old_versions = False # We can provide link to older files. Will be
                          # set to True if older files are found.
@@ -21,7 +21,7 @@
 
 from invenio.config import CFG_WEBSEARCH_ENABLE_GOOGLESCHOLAR
 from invenio.bibformat_elements.bfe_fulltext import get_files
-from invenio.bibdocfile import BibRecDocs, decompose_bibdocfile_url
+from invenio.bibdocfile import get_bibrecdocs, decompose_bibdocfile_url
 
 def format_element(bfo, file_format='pdf'):
     """Return the files attached to this record, in order to be
@@ -32,7 +32,7 @@ def format_element(bfo, file_format='pdf'):
     if not CFG_WEBSEARCH_ENABLE_GOOGLESCHOLAR:
         return ""
 
-    bibarchive = BibRecDocs(bfo.recID)
+    bibarchive = get_bibrecdocs(bfo.recID)
 
     (files, old_versions_p, additionals_p) = get_files(bfo)
     filtered_files = []
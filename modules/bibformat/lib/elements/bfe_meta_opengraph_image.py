@@ -20,7 +20,7 @@
 """BibFormat element - return an image for the record"""
 
 from invenio.config import CFG_SITE_URL, CFG_SITE_SECURE_URL, CFG_CERN_SITE
-from invenio.bibdocfile import BibRecDocs, get_superformat_from_format
+from invenio.bibdocfile import get_bibrecdocs, get_superformat_from_format
 from invenio.config import CFG_WEBSEARCH_ENABLE_OPENGRAPH
 
 def format_element(bfo, max_photos='', one_icon_per_bibdoc='yes', twitter_card_type='photo', use_webjournal_featured_image='no'):
@@ -39,7 +39,7 @@ def format_element(bfo, max_photos='', one_icon_per_bibdoc='yes', twitter_card_t
     """
     if not CFG_WEBSEARCH_ENABLE_OPENGRAPH:
         return ""
-    bibarchive = BibRecDocs(bfo.recID)
+    bibarchive = get_bibrecdocs(bfo.recID)
     bibdocs = bibarchive.list_bibdocs()
     tags = []
     images = []
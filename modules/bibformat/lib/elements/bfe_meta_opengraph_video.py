@@ -21,7 +21,7 @@
 
 import cgi
 from invenio.config import CFG_SITE_URL, CFG_SITE_SECURE_URL, CFG_CERN_SITE
-from invenio.bibdocfile import BibRecDocs, get_superformat_from_format
+from invenio.bibdocfile import get_bibrecdocs, get_superformat_from_format
 from invenio.config import CFG_WEBSEARCH_ENABLE_OPENGRAPH
 
 def format_element(bfo):
@@ -30,7 +30,7 @@ def format_element(bfo):
     """
     if not CFG_WEBSEARCH_ENABLE_OPENGRAPH:
         return ""
-    bibarchive = BibRecDocs(bfo.recID)
+    bibarchive = get_bibrecdocs(bfo.recID)
     bibdocs = bibarchive.list_bibdocs()
     additional_tags = ""
     tags = []
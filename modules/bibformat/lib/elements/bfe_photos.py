@@ -20,7 +20,7 @@
 """
 
 import cgi
-from invenio.bibdocfile import BibRecDocs
+from invenio.bibdocfile import get_bibrecdocs
 from invenio.urlutils import (create_html_link,
                               get_relative_url)
 
@@ -46,7 +46,7 @@ def format_element(bfo, separator=" ", style='', img_style='', text_style='font-
     @param display_all_version_links: if 'yes', print links to additional (sub)formats
     """
     photos = []
-    bibarchive = BibRecDocs(bfo.recID)
+    bibarchive = get_bibrecdocs(bfo.recID)
     bibdocs = bibarchive.list_bibdocs()
 
     if max_photos.isdigit():
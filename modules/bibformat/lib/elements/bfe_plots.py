@@ -21,7 +21,7 @@
 """BibFormat element - Display image of the plot if we are in selected plots collection
 """
 
-from invenio.bibdocfile import BibRecDocs
+from invenio.bibdocfile import get_bibrecdocs
 from invenio.urlutils import create_html_link
 from invenio.config import CFG_SITE_RECORD
 from invenio.messages import gettext_set_language
@@ -53,7 +53,7 @@ def format_element(bfo, width="", caption="yes", max_plots="3"):
         max_plots = 3
 
     link = ""
-    bibarchive = BibRecDocs(bfo.recID)
+    bibarchive = get_bibrecdocs(bfo.recID)
 
     if width != "":
         width = 'width="%s"' % width
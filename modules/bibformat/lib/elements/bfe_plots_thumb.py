@@ -22,7 +22,7 @@
 """
 __revision__ = "$Id: bfe_CERN_plots.py,v 1.3 2009/03/17 10:55:15 jerome Exp $"
 
-from invenio.bibdocfile import BibRecDocs
+from invenio.bibdocfile import get_bibrecdocs
 from invenio.urlutils import create_html_link
 
 def format_element(bfo):
@@ -31,7 +31,7 @@ def format_element(bfo):
     """
     ## To achieve this, we take the Thumb file associated with this document
 
-    bibarchive = BibRecDocs(bfo.recID)
+    bibarchive = get_bibrecdocs(bfo.recID)
 
     img_files = []
 
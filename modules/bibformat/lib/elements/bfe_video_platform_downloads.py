@@ -22,7 +22,7 @@
 * The list includes the codec/container, subformat/resolution and file size
 """
 
-from invenio.bibdocfile import BibRecDocs
+from invenio.bibdocfile import get_bibrecdocs
 
 html_skeleton_popup = """<!-- DOWNLOAD POPUP -->
 <div id="video_download_popup_box">
@@ -53,7 +53,7 @@ def format_element(bfo):
 def create_download_popup(bfo):
     """Create the complete download popup"""
     elements = []
-    recdoc = BibRecDocs(bfo.recID)
+    recdoc = get_bibrecdocs(bfo.recID)
     bibdocs = recdoc.list_bibdocs()
     ## Go through all the BibDocs and search for video related signatures
     for bibdoc in bibdocs:
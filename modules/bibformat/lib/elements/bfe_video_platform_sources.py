@@ -25,7 +25,7 @@
 * Based on bfe_video_selector.py
 """
 
-from invenio.bibdocfile import BibRecDocs
+from invenio.bibdocfile import get_bibrecdocs
 
 def format_element(bfo):
     """ Format element function to create the select and option elements
@@ -37,7 +37,7 @@ def format_element(bfo):
              '720p': {'width': 1280, 'height': 720, 'poster': None, 'mp4': None, 'webm': None, 'ogv': None},
              '1080p': {'width': 1920, 'height': 1080, 'poster': None, 'mp4': None, 'webm': None, 'ogv': None}
              }
-    recdoc = BibRecDocs(bfo.recID)
+    recdoc = get_bibrecdocs(bfo.recID)
     bibdocs = recdoc.list_bibdocs()
     ## Go through all the BibDocs and search for video related signatures
     for bibdoc in bibdocs:
@@ -19,7 +19,7 @@
 """BibFormat element - Creates <source> elements for html5 videos
 """
 
-from invenio.bibdocfile import BibRecDocs
+from invenio.bibdocfile import get_bibrecdocs
 
 def format_element(bfo, subformat="480p"):
     """ Creates HTML5 source elements for the given subformat. 
@@ -31,7 +31,7 @@ def format_element(bfo, subformat="480p"):
     @param subformat: BibDocFile subformat to create the sources from (e.g. 480p)
     """
     video_sources = []
-    recdoc = BibRecDocs(bfo.recID)
+    recdoc = get_bibrecdocs(bfo.recID)
     bibdocs = recdoc.list_bibdocs()
     for bibdoc in bibdocs:
         bibdocfiles = bibdoc.list_all_files()
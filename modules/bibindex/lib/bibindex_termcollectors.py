@@ -24,10 +24,13 @@ import fnmatch
 
 from invenio.bibindex_engine_utils import list_union, \
     UnknownTokenizer, \
-    get_values_recursively
+    get_values_recursively, \
+    get_idx_indexer
 from invenio.bibindex_engine_config import CFG_BIBINDEX_TOKENIZER_TYPE
 from invenio.dbquery import run_sql
-from invenio.bibdocfile import BibRecDocs
+from invenio.bibdocfile import get_bibrecdocs, preload_bibrecdocs, \
+     forget_preloaded_bibrecdocs
+from invenio.bibdocfile_text_cache import extract_texts
 from invenio.search_engine_utils import get_fieldvalues
 
 from invenio.bibauthority_engine import get_index_strings_by_control_no
@@ -115,14 +118,17 @@ class TermCollector(object):
         """
         for tag in self.tags:
             tokenizing_function = self.special_tags.get(tag, self.tokenizing_function)
-            phrases = self._get_phrases_for_tokenizing(tag, recIDs)
-            for row in phrases:
-                recID, phrase = row
-                if recID in recIDs:
-                    if not recID in termslist:
-                        termslist[recID] = []
-                    new_words = tokenizing_function(phrase)
-                    termslist[recID] = list_union(new_words, termslist[recID])
+            try:
+                phrases = self._get_phrases_for_tokenizing(tag, recIDs)
+                for row in phrases:
+                    recID, phrase = row
+                    if recID in recIDs:
+                        if not recID in termslist:
+                            termslist[recID] = []
+                        new_words = tokenizing_function(phrase)
+                        termslist[recID] = list_union(new_words, termslist[recID])
+            finally:
+                forget_preloaded_bibrecdocs()
         return termslist
 
     def _get_phrases_for_tokenizing(self, tag, recIDs):
@@ -144,9 +150,13 @@ class TermCollector(object):
             ## FIXME: Quick hack to be sure that hidden files are
             ## actually indexed.
             phrases = set(phrases)
+            ## The documents are preloaded for the fulltext tokenizer too
+            preload_bibrecdocs(recIDs)
             for recID in recIDs:
-                for bibdocfile in BibRecDocs(recID).list_latest_files():
+                for bibdocfile in get_bibrecdocs(recID).list_latest_files():
                     phrases.add((recID, bibdocfile.get_url()))
+            if get_idx_indexer('fulltext') != 'native':
+                self._extract_fulltexts(recIDs)
         #authority records
         pattern = tag.replace('%', '*')
         matches = fnmatch.filter(CFG_BIBAUTHORITY_CONTROLLED_FIELDS_BIBLIOGRAPHIC.keys(), pattern)
@@ -163,6 +173,28 @@ class TermCollector(object):
                         phrases.add((recID, string_value))
         return phrases
 
+    def _extract_fulltexts(self, recIDs):
+        """
+        Extracts in parallel, into the cache of extracted texts, the
+        texts of the documents of the given records that are not up to
+        date, so that the fulltext tokenizer (which extracts them one
+        by one when the fulltext index relies on an external indexer)
+        only has to read them.
+        @param recIDs: list of specific recIDs (preloaded)
+        """
+        files = []
+        for recID in recIDs:
+            for bibdoc in get_bibrecdocs(recID).list_bibdocs():
+                if not hasattr(bibdoc, 'has_text') or \
+                       bibdoc.has_text(require_up_to_date=True):
+                    continue
+                docfile = bibdoc.get_file_to_extract_text_from()
+                if docfile is not None:
+                    files.append((docfile.get_full_path(),
+                                  docfile.get_checksum(),
+                                  bibdoc.is_ocr_required(), 'en'))
+        extract_texts(files)
+
 
 class NonmarcTermCollector(TermCollector):
     """
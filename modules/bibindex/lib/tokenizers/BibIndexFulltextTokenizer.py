@@ -33,12 +33,13 @@ from invenio.config import \
      CFG_BIBINDEX_FULLTEXT_INDEX_LOCAL_FILES_ONLY, \
      CFG_BIBINDEX_SPLASH_PAGES
 from invenio.htmlutils import get_links_in_html_page
-from invenio.websubmit_file_converter import convert_file, get_file_converter_logger
+from invenio.websubmit_file_converter import get_file_converter_logger
+from invenio.bibdocfile_text_cache import get_text
 from invenio.solrutils_bibindex_indexer import solr_add_fulltext
 from invenio.xapianutils_bibindex_indexer import xapian_add
 from invenio.bibdocfile import bibdocfile_url_p, \
      bibdocfile_url_to_bibdoc, download_url, \
-     BibRecDocs, InvenioBibDocFileError
+     get_bibrecdocs, InvenioBibDocFileError
 from invenio.bibindex_engine_utils import get_idx_indexer
 from invenio.bibtask import write_message
 from invenio.errorlib import register_exception
@@ -101,7 +102,7 @@ class BibIndexFulltextTokenizer(BibIndexDefaultTokenizer):
                         recid = rec_link["recid"]
                         # Adds fulltexts of all files once per records
                         if not recid in fulltext_added:
-                            bibrecdocs = BibRecDocs(recid)
+                            bibrecdocs = get_bibrecdocs(recid)
                             try:
                                 text = bibrecdocs.get_text()
                             except InvenioBibDocFileError:
@@ -150,9 +151,7 @@ class BibIndexFulltextTokenizer(BibIndexDefaultTokenizer):
                         file_converter_logger.setLevel(logging.DEBUG)
                     try:
                         try:
-                            tmptext = convert_file(tmpdoc, output_format='.txt')
-                            text = open(tmptext).read()
-                            os.remove(tmptext)
+                            text = get_text(tmpdoc)
 
                             indexer = get_idx_indexer('fulltext')
                             if indexer != 'native':
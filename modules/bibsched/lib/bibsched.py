@@ -26,6 +26,10 @@ import time
 import re
 import marshal
 import getopt
+import errno
+import fcntl
+import select
+import socket
 from itertools import chain
 from socket import gethostname
 from subprocess import Popen
@@ -52,7 +56,9 @@ from invenio.config import \
      CFG_BIBSCHED_INCOMPATIBLE_TASKS, \
      CFG_BIBSCHED_NON_CONCURRENT_TASKS, \
      CFG_VERSION, \
-     CFG_BIBSCHED_NEVER_STOPS
+     CFG_BIBSCHED_NEVER_STOPS, \
+     CFG_BIBSCHED_EVENT_DRIVEN, \
+     CFG_BIBSCHED_FULL_REFRESHTIME
 from invenio.dbquery import run_sql, real_escape_string
 from invenio.errorlib import register_exception, register_emergency
 from invenio.shellutils import run_shell_command
@@ -67,6 +73,15 @@ CFG_MOTD_PATH = os.path.join(CFG_TMPSHAREDDIR, "bibsched.motd")
 ACTIVE_STATUS = ('SCHEDULED', 'ABOUT TO SLEEP', 'ABOUT TO STOP',
                  'CONTINUING', 'RUNNING')
 
+## The statuses of the tasks the scheduler has to keep track of.
+SCHEDULABLE_STATUS = ('WAITING', 'SLEEPING') + ACTIVE_STATUS
+
+## Local socket on which bibsched is notified of task changes
+CFG_BIBSCHED_SOCKET_PATH = os.path.join(CFG_PREFIX, 'var', 'run', 'bibsched.sock')
+
+## Changes older than this (in days) are removed from schCHANGE
+CFG_BIBSCHED_CHANGES_MAX_AGE = 1
+
 
 SHIFT_RE = re.compile(r"([-\+]{0,1})([\d]+)([dhms])")
 
@@ -132,6 +147,39 @@ def get_last_taskid():
 def delete_task(task_id):
     """Delete the corresponding task."""
     run_sql("DELETE FROM schTASK WHERE id=%s", (task_id, ))
+    bibsched_notify_task_change(task_id)
+
+
+def bibsched_notify_task_change(task_id=None):
+    """
+    Tell bibsched that task_id has been submitted or updated.  Use None
+    when several tasks might have changed: the scheduler will then reload
+    the whole queue.
+
+    The change is recorded in schCHANGE, which every bibsched node polls,
+    and bibsched running on this node is woken up through its local
+    socket.
+    """
+    if not CFG_BIBSCHED_EVENT_DRIVEN:
+        return
+    run_sql("INSERT INTO schCHANGE (id_schTASK, change_date) VALUES (%s, NOW())",
+            (task_id, ))
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            sock.setblocking(0)
+            sock.sendto(str(task_id or 0), CFG_BIBSCHED_SOCKET_PATH)
+        finally:
+            sock.close()
+    except socket.error:
+        ## bibsched is not running on this node (or its socket is full):
+        ## the change will be noticed by polling schCHANGE.
+        pass
+
+
+def get_last_task_change():
+    """Return the ID of the last change recorded in schCHANGE."""
+    return run_sql("SELECT MAX(id) FROM schCHANGE")[0][0] or 0
 
 def is_task_scheduled(task_name):
     """Check if a certain task_name is due for execution (WAITING or RUNNING)"""
@@ -218,7 +266,9 @@ def bibsched_get_host(task_id):
 
 def bibsched_set_host(task_id, host=""):
     """Update the progress of task_id."""
-    return run_sql("UPDATE schTASK SET host=%s WHERE id=%s", (host, task_id))
+    res = run_sql("UPDATE schTASK SET host=%s WHERE id=%s", (host, task_id))
+    bibsched_notify_task_change(task_id)
+    return res
 
 def bibsched_task_finished_successfully(task_id):
     """Check if the task has finished and no errors occurred."""
@@ -262,11 +312,14 @@ def bibsched_get_status(task_id):
 def bibsched_set_status(task_id, status, when_status_is=None):
     """Update the status of task_id."""
     if when_status_is is None:
-        return run_sql("UPDATE schTASK SET status=%s WHERE id=%s",
-                       (status, task_id))
+        res = run_sql("UPDATE schTASK SET status=%s WHERE id=%s",
+                      (status, task_id))
     else:
-        return run_sql("UPDATE schTASK SET status=%s WHERE id=%s AND status=%s",
-                       (status, task_id, when_status_is))
+        res = run_sql("UPDATE schTASK SET status=%s WHERE id=%s AND status=%s",
+                      (status, task_id, when_status_is))
+    if res:
+        bibsched_notify_task_change(task_id)
+    return res
 
 
 def bibsched_set_progress(task_id, progress):
@@ -276,11 +329,15 @@ def bibsched_set_progress(task_id, progress):
 
 def bibsched_set_priority(task_id, priority):
     """Update the priority of task_id."""
-    return run_sql("UPDATE schTASK SET priority=%s WHERE id=%s", (priority, task_id))
+    res = run_sql("UPDATE schTASK SET priority=%s WHERE id=%s", (priority, task_id))
+    bibsched_notify_task_change(task_id)
+    return res
 
 def bibsched_set_name(task_id, name):
     """Update the name of task_id."""
-    return run_sql("UPDATE schTASK SET proc=%s WHERE id=%s", (name, task_id))
+    res = run_sql("UPDATE schTASK SET proc=%s WHERE id=%s", (name, task_id))
+    bibsched_notify_task_change(task_id)
+    return res
 
 def bibsched_set_sleeptime(task_id, sleeptime):
     """Update the sleeptime of task_id."""
@@ -289,7 +346,9 @@ def bibsched_set_sleeptime(task_id, sleeptime):
 
 def bibsched_set_runtime(task_id, runtime):
     """Update the sleeptime of task_id."""
-    return run_sql("UPDATE schTASK SET runtime=%s WHERE id=%s", (runtime, task_id))
+    res = run_sql("UPDATE schTASK SET runtime=%s WHERE id=%s", (runtime, task_id))
+    bibsched_notify_task_change(task_id)
+    return res
 
 
 def bibsched_send_signal(task_id, sig):
@@ -380,6 +439,11 @@ class BibSched(object):
         self.waiting_tasks_all_nodes = ()
         self.active_tasks_all_nodes = ()
         self.mono_tasks_all_nodes = ()
+        ## Event driven mode: the schedulable tasks of all nodes, by ID
+        self.tasks = {}
+        self.last_change = None
+        self.last_full_refresh = 0
+        self.notification_socket = None
 
         self.allowed_task_types = CFG_BIBSCHED_NODE_TASKS.get(self.hostname, CFG_BIBTASK_VALID_TASKS)
 
@@ -391,6 +455,8 @@ class BibSched(object):
         r = run_sql("""UPDATE schTASK SET host=%s, status='SCHEDULED'
                    WHERE id=%s AND status='WAITING'""",
                                             (self.hostname, task_id))
+        if r:
+            bibsched_notify_task_change(task_id)
         return bool(r)
 
     def filter_for_allowed_tasks(self):
@@ -557,6 +623,7 @@ class BibSched(object):
                               'SLEEPING', 'ABOUT TO STOP', 'ABOUT TO SLEEP',
                               'SCHEDULED', 'CONTINUING') AND sequenceid=%s""",
                            (max_priority, task.sequenceid)):
+                    bibsched_notify_task_change()
                     Log("Raised all waiting tasks with sequenceid "
                         "%s to the max priority %s" % (task.sequenceid, max_priority))
                     ## Some priorities where raised
@@ -571,6 +638,7 @@ class BibSched(object):
                     for the_task_id, runtime in current_runtimes:
                         if runtime < last_runtime:
                             run_sql("""UPDATE schTASK SET runtime=%s WHERE id=%s""", (last_runtime, the_task_id))
+                            bibsched_notify_task_change(the_task_id)
                             Log("Adjusted runtime of task_id %s to %s in order to be executed in the correct sequenceid order" % (the_task_id, last_runtime), debug)
                             runtimes_adjusted = True
                             runtime = last_runtime
@@ -728,8 +796,107 @@ class BibSched(object):
                 else:
                     raise StandardError(msg)
 
+    def refresh_tasks(self):
+        """
+        Bring self.tasks up to date and return True if any task changed
+        since the last call.  Only the tasks recorded in schCHANGE are
+        re-read; the whole queue is reloaded the first time, when a change
+        is not bound to a task and every CFG_BIBSCHED_FULL_REFRESHTIME
+        seconds (to catch changes that were not notified).
+        """
+        last_change = get_last_task_change()
+        full_refresh = self.last_change is None \
+            or last_change < self.last_change \
+            or time.time() - self.last_full_refresh >= CFG_BIBSCHED_FULL_REFRESHTIME
+        if not full_refresh and last_change == self.last_change:
+            return False
+
+        if not full_refresh:
+            changed = set(row[0] for row in run_sql(
+                """SELECT id_schTASK FROM schCHANGE
+                   WHERE id > %s AND id <= %s""",
+                (self.last_change, last_change)))
+            full_refresh = None in changed
+
+        if full_refresh:
+            self.tasks = dict((task.id, task) for task in Task.from_resultset(run_sql(
+                """SELECT id, proc, runtime, status, priority, host, sequenceid
+                   FROM schTASK WHERE status IN (%s)"""
+                        % ','.join("'%s'" % s for s in SCHEDULABLE_STATUS))))
+            self.last_full_refresh = time.time()
+            run_sql("""DELETE FROM schCHANGE WHERE id < %%s
+                       AND change_date < DATE_SUB(NOW(), INTERVAL %d DAY)"""
+                    % CFG_BIBSCHED_CHANGES_MAX_AGE, (last_change, ))
+        else:
+            for task_id in changed:
+                self.tasks.pop(task_id, None)
+            if changed:
+                for task in Task.from_resultset(run_sql(
+                        """SELECT id, proc, runtime, status, priority, host, sequenceid
+                           FROM schTASK WHERE id IN (%s)"""
+                                % ','.join(str(int(task_id)) for task_id in changed))):
+                    if task.status in SCHEDULABLE_STATUS:
+                        self.tasks[task.id] = task
+
+        self.last_change = last_change
+        return True
+
     def calculate_rows(self):
         """Return all the node relevant tasks for the algorithm to work on."""
+        if CFG_BIBSCHED_EVENT_DRIVEN:
+            self.calculate_rows_from_tasks()
+        else:
+            self.calculate_rows_from_db()
+
+        self.mono_tasks_all_nodes = tuple(t for t in
+            chain(self.waiting_tasks_all_nodes, self.active_tasks_all_nodes)
+                                                        if is_monotask(t.proc))
+        ## Remove tasks that can not be executed on this host
+
+        def filter_by_host(tasks):
+            return tuple(t for t in tasks if t.host == self.hostname or not t.host)
+
+        self.node_active_tasks = filter_by_host(self.active_tasks_all_nodes)
+        self.node_sleeping_tasks = filter_by_host(self.sleeping_tasks_all_nodes)
+
+        self.filter_for_allowed_tasks()
+
+    def calculate_rows_from_tasks(self):
+        """Same as calculate_rows_from_db(), using self.tasks, as kept up
+        to date by refresh_tasks(), instead of querying schTASK."""
+        now = datetime.now()
+        tasks = self.tasks.values()
+        if not CFG_INSPIRE_SITE:
+            bibupload_tasks = [t for t in tasks
+                               if t.proc == 'bibupload' and t.runtime <= now]
+            if bibupload_tasks:
+                max_bibupload_priority = max(t.priority for t in bibupload_tasks)
+                for t in bibupload_tasks:
+                    if t.priority < max_bibupload_priority and run_sql(
+                        """UPDATE schTASK SET priority = %%s
+                           WHERE id = %%s AND status IN (%s)"""
+                            % ','.join("'%s'" % s for s in SCHEDULABLE_STATUS),
+                        (max_bibupload_priority, t.id)):
+                        t.priority = max_bibupload_priority
+                        bibsched_notify_task_change(t.id)
+
+            # The bibupload tasks are sorted by id,
+            # which means by the order they were scheduled
+            self.node_relevant_bibupload_tasks = sorted(
+                [t for t in bibupload_tasks if t.status in ('WAITING', 'SLEEPING')],
+                key=lambda t: (t.status != 'SLEEPING', t.id))[:1]
+        ## The other tasks are sorted by priority
+        self.waiting_tasks_all_nodes = sorted(
+            [t for t in tasks if t.status == 'SLEEPING'
+                or (t.status == 'WAITING' and t.runtime <= now)],
+            key=lambda t: (-t.priority, t.runtime, t.id))
+        self.sleeping_tasks_all_nodes = [t for t in self.waiting_tasks_all_nodes
+                                         if t.status == 'SLEEPING']
+        self.active_tasks_all_nodes = sorted(t for t in tasks
+                                             if t.status in ACTIVE_STATUS)
+
+    def calculate_rows_from_db(self):
+        """Fetch the task lists needed by calculate_rows() from schTASK."""
         if not CFG_INSPIRE_SITE:
             max_bibupload_priority, min_bibupload_priority = run_sql(
                     """SELECT MAX(priority), MIN(priority)
@@ -776,19 +943,6 @@ class BibSched(object):
                                              'SCHEDULED', 'ABOUT TO STOP',
                                              'ABOUT TO SLEEP')"""))
 
-        self.mono_tasks_all_nodes = tuple(t for t in
-            chain(self.waiting_tasks_all_nodes, self.active_tasks_all_nodes)
-                                                        if is_monotask(t.proc))
-        ## Remove tasks that can not be executed on this host
-
-        def filter_by_host(tasks):
-            return tuple(t for t in tasks if t.host == self.hostname or not t.host)
-
-        self.node_active_tasks = filter_by_host(self.active_tasks_all_nodes)
-        self.node_sleeping_tasks = filter_by_host(self.sleeping_tasks_all_nodes)
-
-        self.filter_for_allowed_tasks()
-
     def check_auto_mode(self):
         """Check if the queue is in automatic or manual mode"""
         r = run_sql('SELECT value FROM schSTATUS WHERE name = "auto_mode"')
@@ -825,6 +979,7 @@ class BibSched(object):
                            WHERE id = %%s AND status IN (%s)"""
                                  % ','.join("'%s'" % s for s in ACTIVE_STATUS),
                         [task.id])
+                bibsched_notify_task_change(task.id)
 
     def check_debug_mode(self):
         debug_mode = fetch_debug_mode()
@@ -835,6 +990,82 @@ class BibSched(object):
             Log('Switching out of debug mode')
         self.debug = debug_mode
 
+    def open_notification_socket(self):
+        """Listen on the socket used by bibsched_notify_task_change()."""
+        try:
+            if os.path.exists(CFG_BIBSCHED_SOCKET_PATH):
+                os.remove(CFG_BIBSCHED_SOCKET_PATH)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(CFG_BIBSCHED_SOCKET_PATH)
+            sock.setblocking(0)
+            ## Tasks spawned by bibsched must not inherit the socket
+            fcntl.fcntl(sock.fileno(), fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+        except (socket.error, OSError) as err:
+            Log("Cannot listen on %s, falling back to polling: %s"
+                % (CFG_BIBSCHED_SOCKET_PATH, err))
+            return
+        self.notification_socket = sock
+
+    def close_notification_socket(self):
+        if self.notification_socket is not None:
+            self.notification_socket.close()
+            self.notification_socket = None
+            try:
+                os.remove(CFG_BIBSCHED_SOCKET_PATH)
+            except OSError:
+                pass
+
+    def wait_for_changes(self, timeout, since=None):
+        """
+        Sleep until a change more recent than since (by default, the last
+        recorded one) is notified, or at most timeout seconds.  Changes
+        made on other nodes are detected by polling schCHANGE every
+        CFG_BIBSCHED_REFRESHTIME seconds.
+
+        @return: True if something changed
+        """
+        if since is None:
+            since = get_last_task_change()
+        deadline = time.time() + timeout
+        while get_last_task_change() == since:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            wait = min(remaining, CFG_BIBSCHED_REFRESHTIME)
+            if self.notification_socket is None:
+                time.sleep(wait)
+                continue
+            try:
+                readable = select.select([self.notification_socket], [], [], wait)[0]
+            except select.error as err:
+                if err.args[0] != errno.EINTR:
+                    raise
+                readable = ()
+            if readable:
+                ## Drain the pending notifications: schCHANGE tells what changed
+                try:
+                    while self.notification_socket.recv(64):
+                        pass
+                except socket.error:
+                    pass
+        return True
+
+    def get_idle_timeout(self):
+        """
+        Return how long the scheduler can sleep when there is nothing to
+        do, i.e. until the next task runtime or the next full refresh.
+        """
+        timeout = self.last_full_refresh + CFG_BIBSCHED_FULL_REFRESHTIME - time.time()
+        if self.node_active_tasks:
+            ## Keep checking regularly for crashed tasks
+            timeout = min(timeout, CFG_BIBSCHED_REFRESHTIME)
+        now = datetime.now()
+        for task in self.tasks.itervalues():
+            if task.status == 'WAITING' and task.runtime > now:
+                delta = task.runtime - now
+                timeout = min(timeout, delta.days * 86400 + delta.seconds + 1)
+        return max(timeout, 0)
+
     def tick(self):
         Log("New bibsched cycle", self.debug)
         self.cycles_count += 1
@@ -844,15 +1075,22 @@ class BibSched(object):
         if self.cycles_count % 50 == 0:
             self.check_for_crashed_tasks()
 
-        try:
-            self.check_errors()
-        except RecoverableError as msg:
-            if "bibupload ->" in str(msg) or "bibupload:" in str(msg):
-                register_exception(alert_admin=True)
-            else:
-                register_emergency(
-                    'Light emergency from {0}: BibTask failed: {1}'.format(CFG_SITE_URL, msg)
-                )
+        if CFG_BIBSCHED_EVENT_DRIVEN:
+            ## Errors can only be new if some task changed
+            check_errors = self.refresh_tasks()
+        else:
+            check_errors = True
+
+        if check_errors:
+            try:
+                self.check_errors()
+            except RecoverableError as msg:
+                if "bibupload ->" in str(msg) or "bibupload:" in str(msg):
+                    register_exception(alert_admin=True)
+                else:
+                    register_emergency(
+                        'Light emergency from {0}: BibTask failed: {1}'.format(CFG_SITE_URL, msg)
+                    )
 
         # Update our tasks list (to know who is running, sleeping, etc.)
         self.calculate_rows()
@@ -875,7 +1113,11 @@ class BibSched(object):
                     ## Something has changed
                     break
             else:
-                time.sleep(CFG_BIBSCHED_REFRESHTIME)
+                if CFG_BIBSCHED_EVENT_DRIVEN:
+                    self.wait_for_changes(self.get_idle_timeout(),
+                                          since=self.last_change)
+                else:
+                    time.sleep(CFG_BIBSCHED_REFRESHTIME)
 
     def watch_loop(self):
         ## Cleaning up scheduled task not run because of bibsched being
@@ -884,12 +1126,19 @@ class BibSched(object):
                    SET status = 'WAITING'
                    WHERE status = 'SCHEDULED'
                    AND host = %s""", (self.hostname, ))
+        bibsched_notify_task_change()
+
+        if CFG_BIBSCHED_EVENT_DRIVEN:
+            self.open_notification_socket()
 
         try:
             while True:
                 auto_mode = self.check_auto_mode()
                 if auto_mode:
                     self.tick()
+                elif CFG_BIBSCHED_EVENT_DRIVEN:
+                    ## Woken up when the monitor switches to automatic mode
+                    self.wait_for_changes(CFG_BIBSCHED_REFRESHTIME)
                 else:
                     time.sleep(CFG_BIBSCHED_REFRESHTIME)
         except Exception as err:
@@ -902,6 +1151,8 @@ class BibSched(object):
                 except NotImplementedError:
                     pass
             raise
+        finally:
+            self.close_notification_socket()
 
 
 def Log(message, debug=None):
@@ -54,6 +54,7 @@ from invenio.bibsched import bibsched_get_status, \
                              bibsched_set_name, \
                              bibsched_set_sleeptime, \
                              bibsched_set_runtime, \
+                             bibsched_notify_task_change, \
                              spawn_task, \
                              gc_tasks, \
                              Log, \
@@ -765,6 +766,7 @@ order to let this task run. The current priority is %s. New value:"
                 if run_sql("""UPDATE schTASK SET status='SCHEDULED', host=%s
                               WHERE id=%s and status='WAITING'""",
                            (self.hostname, task_id)):
+                    bibsched_notify_task_change(task_id)
                     program = os.path.join(CFG_BINDIR, process)
                     command = "%s %s" % (program, str(task_id))
                     spawn_task(command)
@@ -904,6 +906,8 @@ order to let this task run. The current priority is %s. New value:"
         if new_mode:
             run_sql('UPDATE schSTATUS SET value = "" WHERE name = "resume_after"')
             run_sql('UPDATE schSTATUS SET value = "1" WHERE name = "auto_mode"')
+            ## Wake up bibsched
+            bibsched_notify_task_change()
             log('queue changed to automatic mode')
         # Enable manual mode
         else:
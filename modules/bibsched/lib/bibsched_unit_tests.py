@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""BibSched - Unit Test Suite"""
+
+from datetime import datetime, timedelta
+
+from invenio.testutils import InvenioTestCase
+from invenio.testutils import make_test_suite, run_test_suite
+from invenio.bibsched import BibSched, Task
+
+
+class CalculateRowsFromTasksTest(InvenioTestCase):
+    """Test the task lists computed from the in-memory queue"""
+
+    def setUp(self):
+        now = datetime.now()
+        past = now - timedelta(hours=1)
+        future = now + timedelta(hours=1)
+        self.bibsched = BibSched()
+        tasks = [Task(1, 'bibindex', past, 'WAITING', 0, '', None),
+                 Task(2, 'webcoll', past, 'WAITING', 5, '', None),
+                 Task(3, 'bibrank', future, 'WAITING', 10, '', None),
+                 Task(4, 'bibreformat', past, 'SLEEPING', 0, '', None),
+                 Task(5, 'bibupload', past, 'RUNNING', 0, '', None),
+                 Task(6, 'bibupload', past, 'WAITING', 0, '', None),
+                 Task(7, 'bibupload', past, 'SLEEPING', 0, '', None)]
+        self.bibsched.tasks = dict((task.id, task) for task in tasks)
+
+    def test_waiting_tasks(self):
+        """bibsched - waiting tasks are due and sorted by priority"""
+        self.bibsched.calculate_rows_from_tasks()
+        self.assertEqual([t.id for t in self.bibsched.waiting_tasks_all_nodes],
+                         [2, 1, 4, 6, 7])
+        self.assertEqual([t.id for t in self.bibsched.sleeping_tasks_all_nodes],
+                         [4, 7])
+
+    def test_active_tasks(self):
+        """bibsched - active tasks"""
+        self.bibsched.calculate_rows_from_tasks()
+        self.assertEqual([t.id for t in self.bibsched.active_tasks_all_nodes],
+                         [5])
+
+    def test_bibupload_tasks(self):
+        """bibsched - sleeping bibuploads are resumed first"""
+        self.bibsched.calculate_rows_from_tasks()
+        self.assertEqual([t.id for t in self.bibsched.node_relevant_bibupload_tasks],
+                         [7])
+
+
+TEST_SUITE = make_test_suite(CalculateRowsFromTasksTest, )
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
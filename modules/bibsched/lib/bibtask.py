@@ -86,7 +86,8 @@ from invenio.dateutils import parse_runtime_limit
 from invenio.shellutils import escape_shell_arg
 from invenio.mailutils import send_email
 from invenio.bibsched import bibsched_set_host, \
-                             bibsched_get_host
+                             bibsched_get_host, \
+                             bibsched_notify_task_change
 from invenio.intbitset import intbitset
 
 
@@ -309,6 +310,7 @@ def task_low_level_submission(name, user, *argv):
             VALUES (%s,%s,%s,%s,%s,'WAITING',%s,%s,%s,%s)""",
             (name, host, user, runtime, sleeptime, verbose_argv,
              marshal.dumps(argv), priority, sequenceid))
+        bibsched_notify_task_change(task_id)
 
     except Exception:
         register_exception(alert_admin=True)
@@ -794,8 +796,10 @@ def task_update_status(val):
     """Updates status information in the BibSched task table."""
     write_message("Updating task status to %s." % val, verbose=9)
     if "task_id" in _TASK_PARAMS:
-        return run_sql("UPDATE schTASK SET status=%s where id=%s",
+        res = run_sql("UPDATE schTASK SET status=%s where id=%s",
             (val, _TASK_PARAMS["task_id"]))
+        bibsched_notify_task_change(_TASK_PARAMS["task_id"])
+        return res
 
 def task_read_status():
     """Read status information in the BibSched task table."""
@@ -1009,6 +1013,7 @@ def _task_submit(argv, authorization_action, authorization_msg):
          _TASK_PARAMS["sleeptime"], verbose_argv[:255], marshal.dumps(argv),
          _TASK_PARAMS['priority'], _TASK_PARAMS['sequence-id'],
          _TASK_PARAMS['host']))
+    bibsched_notify_task_change(_TASK_PARAMS['task_id'])
 
     ## update task number:
     write_message("Task #%d submitted." % _TASK_PARAMS['task_id'])
@@ -1151,7 +1156,9 @@ def _task_run(task_run_fnc):
             if _TASK_PARAMS['sequence-id']:
                 ## Also postponing other dependent tasks.
                 run_sql("UPDATE schTASK SET runtime=%s, progress=%s WHERE sequenceid=%s AND status='WAITING'", (new_runtime, 'Postponed as task %s' % _TASK_PARAMS['task_id'], _TASK_PARAMS['sequence-id'])) # kwalitee: disable=sql
+                bibsched_notify_task_change()
             run_sql("UPDATE schTASK SET runtime=%s, status='WAITING', progress=%s, host='' WHERE id=%s", (new_runtime, 'Postponed %d time(s)' % (postponed_times + 1), _TASK_PARAMS['task_id'])) # kwalitee: disable=sql
+            bibsched_notify_task_change(_TASK_PARAMS['task_id'])
             write_message("Task #%d postponed because outside of runtime limit" % _TASK_PARAMS['task_id'])
             return True
 
@@ -1204,9 +1211,11 @@ def _task_run(task_run_fnc):
             if task_status == 'DONE':
                 ## It has finished in a good way. We recycle the database row
                 run_sql("UPDATE schTASK SET runtime=%s, status='WAITING', progress=%s, host=%s WHERE id=%s", (new_runtime, verbose_argv, _TASK_PARAMS['host'], _TASK_PARAMS['task_id']))
+                bibsched_notify_task_change(_TASK_PARAMS['task_id'])
                 write_message("Task #%d finished and resubmitted." % _TASK_PARAMS['task_id'])
             elif task_status == 'STOPPED':
                 run_sql("UPDATE schTASK SET status='WAITING', progress=%s, host='' WHERE id=%s", (verbose_argv, _TASK_PARAMS['task_id'], ))
+                bibsched_notify_task_change(_TASK_PARAMS['task_id'])
                 write_message("Task #%d stopped and resubmitted." % _TASK_PARAMS['task_id'])
             else:
                 ## We keep the bad result and we resubmit with another id.
@@ -97,6 +97,7 @@ from invenio.intbitset import intbitset
 from invenio.urlutils import make_user_agent_string
 from invenio.textutils import wash_for_xml
 from invenio.config import CFG_BIBDOCFILE_FILEDIR
+from invenio.bibedit_dblayer import delete_bibupload_task_index
 from invenio.bibtask import task_init, write_message, \
     task_set_option, task_get_option, task_get_task_param, \
     task_update_progress, task_sleep_now_if_required, fix_argv_paths, \
@@ -2990,6 +2991,10 @@ def task_run_core():
         # Print out the statistics
         print_out_bibupload_statistics()
 
+    # The records of this task no longer lock them in BibEdit (see
+    # bibedit_utils.record_locked_by_queue)
+    delete_bibupload_task_index(task_get_task_param('task_id'))
+
     # Check if they were errors
     return not stat['nb_errors'] >= 1
 
@@ -32,9 +32,15 @@ replace in plain-text.
 import os
 import re
 import subprocess
+from cStringIO import StringIO
 
-from invenio.config import CFG_PATH_PDFTOTEXT
+from invenio.config import CFG_PATH_PDFTOTEXT, CFG_BIBDOCFILE_TEXT_CACHE
 from invenio.docextract_utils import write_message
+from invenio.bibdocfile_text_cache import calculate_checksum, \
+     get_cached_text, cache_text
+
+## Version of the pdftotext output cached by convert_PDF_to_plaintext
+CFG_DOCEXTRACT_PDFTOTEXT_CACHE_VERSION = 1
 
 # a dictionary of undesirable characters and their replacements:
 UNDESIRABLE_CHAR_REPLACEMENTS = {
@@ -490,15 +496,32 @@ def convert_PDF_to_plaintext(fpath, keep_layout=False):
     # its own line because we rely upon this for trying to strip headers
     # and footers, and for some other pattern matching.
     p_break_in_line = re.compile(ur'^\s*\f(.+)$', re.UNICODE)
-    # build pdftotext command:
-    cmd_pdftotext = [CFG_PATH_PDFTOTEXT, layout_option, "-q",
-                      "-enc", "UTF-8", fpath, "-"]
-    write_message("* %s" % ' '.join(cmd_pdftotext), verbose=2)
-    # open pipe to pdftotext:
-    pipe_pdftotext = subprocess.Popen(cmd_pdftotext, stdout=subprocess.PIPE)
+    # The output of pdftotext is cached with the other texts extracted
+    # from fulltext files, so a file is converted only once:
+    checksum = None
+    text = None
+    if CFG_BIBDOCFILE_TEXT_CACHE:
+        checksum = calculate_checksum(fpath)
+        converter = "pdftotext%s%i" % (layout_option,
+                                       CFG_DOCEXTRACT_PDFTOTEXT_CACHE_VERSION)
+        text = get_cached_text(checksum, converter)
+    if text is None:
+        # build pdftotext command:
+        cmd_pdftotext = [CFG_PATH_PDFTOTEXT, layout_option, "-q",
+                          "-enc", "UTF-8", fpath, "-"]
+        write_message("* %s" % ' '.join(cmd_pdftotext), verbose=2)
+        # open pipe to pdftotext:
+        pipe_pdftotext = subprocess.Popen(cmd_pdftotext,
+                                          stdout=subprocess.PIPE)
+        text = pipe_pdftotext.communicate()[0]
+        if checksum and pipe_pdftotext.returncode == 0:
+            cache_text(checksum, converter, text)
+    else:
+        write_message("* using cached pdftotext output of %s" % fpath,
+                      verbose=2)
 
     # read back results:
-    for docline in pipe_pdftotext.stdout:
+    for docline in StringIO(text):
         unicodeline = docline.decode("utf-8")
         # Check for a page-break in this line:
         m_break_in_line = p_break_in_line.match(unicodeline)
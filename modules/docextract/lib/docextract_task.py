@@ -28,12 +28,14 @@ from invenio.dbquery import run_sql
 from invenio.search_engine import get_collection_reclist
 
 
-def task_run_core_wrapper(name, core_func, extra_vars=None, post_process=None):
+def task_run_core_wrapper(name, core_func, extra_vars=None, post_process=None,
+                          batch_func=None):
     def fun():
         return task_run_core(name,
                              core_func,
                              extra_vars=extra_vars,
-                             post_process=post_process)
+                             post_process=post_process,
+                             batch_func=batch_func)
     return fun
 
 
@@ -112,8 +114,30 @@ def process_records(name, records, func, extra_vars):
         count += 1
 
 
-def task_run_core(name, func, extra_vars=None, post_process=None):
-    """Calls extract_references in refextract"""
+def process_records_batch(name, records, func, extra_vars):
+    """Same as process_records, for a function processing all the records
+    at once: func(recids, **extra_vars) must yield every recid once it
+    has been processed, in the same order.
+    """
+    total = len(records)
+    done = func([recid for recid, dummy in records], **extra_vars)
+    for count, (recid, date) in enumerate(records):
+        done.next()
+        msg = "Extracted for %s (%d/%d)" % (recid, count + 1, total)
+        task_update_progress(msg)
+        write_message(msg)
+        if date:
+            store_last_updated(None, date, name)
+        task_sleep_now_if_required(can_stop_too=True)
+
+
+def task_run_core(name, func, extra_vars=None, post_process=None,
+                  batch_func=None):
+    """Calls extract_references in refextract
+
+    If batch_func is given, the records are processed all at once by it
+    (see process_records_batch) instead of one by one by func.
+    """
     if task_get_option('task_specific_name'):
         name = "%s:%s" % (name, task_get_option('task_specific_name'))
     write_message("Starting %s" % name)
@@ -122,7 +146,10 @@ def task_run_core(name, func, extra_vars=None, post_process=None):
         extra_vars = {}
 
     records = fetch_concerned_records(name)
-    process_records(name, records, func, extra_vars)
+    if batch_func:
+        process_records_batch(name, records, batch_func, extra_vars)
+    else:
+        process_records(name, records, func, extra_vars)
 
     if post_process:
         post_process(**extra_vars)
@@ -26,6 +26,7 @@ present here can be considered private by the invenio modules.
 
 
 import os
+import time
 from tempfile import mkstemp
 import requests
 from requests.exceptions import HTTPError, Timeout
@@ -108,27 +109,48 @@ def extract_references_from_file_xml(path, recid=None):
     return extract_references_from_file(path=path, recid=recid).to_xml()
 
 
-def extract_references_from_file(path, recid=None):
+def extract_references_from_file(path, recid=None, kbs_files=None,
+                                 timings=None):
     """Extract references from a local pdf file
 
     The single parameter is the path to the file
     It raises FullTextNotAvailable if the file does not exist
     The result is given as a bibrecord class.
+
+    kbs_files overrides the default knowledge bases (see get_kbs).
+    If the timings dictionary is given, the time spent in each stage
+    of the extraction (text conversion, reference section lookup,
+    parsing) is added to it.
     """
     if not os.path.isfile(path):
         raise FullTextNotAvailable()
 
+    if timings is None:
+        timings = {}
+    start = time.time()
     docbody, dummy = get_plaintext_document_body(path)
+    start = _add_timing(timings, 'text', start)
     reflines, dummy, dummy = extract_references_from_fulltext(docbody)
+    start = _add_timing(timings, 'section', start)
     if not reflines:
         docbody, dummy = get_plaintext_document_body(path, keep_layout=True)
+        start = _add_timing(timings, 'text', start)
         reflines, dummy, dummy = extract_references_from_fulltext(docbody)
+        start = _add_timing(timings, 'section', start)
 
-    references = parse_references(reflines, recid=recid)
+    references = parse_references(reflines, recid=recid, kbs_files=kbs_files)
     references['999C6'][0].add_subfield('v', os.path.basename(path))
+    _add_timing(timings, 'parsing', start)
     return references
 
 
+def _add_timing(timings, stage, start):
+    """Add the time elapsed since start to the stage and return now."""
+    now = time.time()
+    timings[stage] = timings.get(stage, 0) + now - start
+    return now
+
+
 def extract_references_from_string_xml(source,
                                        is_only_references=True,
                                        recid=None):
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+Reference extraction from many files in parallel.
+
+The files are processed by a pool of worker processes.  The knowledge
+bases are loaded once, before the workers are forked, so that every
+worker starts with them in memory instead of loading them for every
+file.  The time spent in each stage of the extraction is reported.
+"""
+
+import time
+import traceback
+import threading
+import multiprocessing
+
+from invenio.config import CFG_REFEXTRACT_WORKERS
+from invenio.refextract_api import extract_references_from_file, \
+                                   FullTextNotAvailable
+from invenio.refextract_kbs import get_kbs
+
+
+def _init_worker(kbs_files):
+    """Load the knowledge bases in a worker (a no-op if it inherited
+    them from the parent process)."""
+    get_kbs(custom_kbs_files=kbs_files)
+
+
+def _extract(args):
+    """Extract the references of a file in a worker.
+
+    Returns (record, error message, timings)
+    """
+    path, recid, kbs_files = args
+    timings = {}
+    try:
+        record = extract_references_from_file(path, recid=recid,
+                                              kbs_files=kbs_files,
+                                              timings=timings)
+    except FullTextNotAvailable:
+        return None, "No full text available for %s" % path, timings
+    except Exception:
+        return None, "Error extracting references from %s:\n%s" \
+                     % (path, traceback.format_exc()), timings
+    return record, None, timings
+
+
+class RefextractPool(object):
+    """Pool of processes extracting references from files."""
+
+    def __init__(self, workers=CFG_REFEXTRACT_WORKERS, kbs_files=None):
+        """
+        @param workers: number of worker processes; the extraction runs
+            in the calling process if it is 1 or less
+        @param kbs_files: knowledge bases overriding the default ones
+            (see get_kbs)
+        """
+        self.kbs_files = kbs_files
+        # Load the knowledge bases before forking the workers
+        get_kbs(custom_kbs_files=kbs_files)
+        self.pool = None
+        if workers > 1:
+            self.pool = multiprocessing.Pool(workers, _init_worker,
+                                             (kbs_files, ))
+        self.start_time = time.time()
+        self.nb_files = 0
+        self.timings = {}
+        self.lock = threading.Lock()
+
+    def _add_timings(self, timings):
+        self.lock.acquire()
+        try:
+            self.nb_files += 1
+            for stage, duration in timings.iteritems():
+                self.timings[stage] = self.timings.get(stage, 0) + duration
+        finally:
+            self.lock.release()
+
+    def extract_references_from_file(self, path, recid=None, kbs_files=None):
+        """Same as refextract_api.extract_references_from_file, run in
+        one of the workers.  Can be called from several threads.
+
+        @param kbs_files: knowledge bases to use instead of the ones of
+            the pool (they are then loaded by the worker, once)
+        @return: (record, error message), record being None in case of
+            error.
+        """
+        args = (path, recid, kbs_files or self.kbs_files)
+        if self.pool is None:
+            record, error, timings = _extract(args)
+        else:
+            record, error, timings = self.pool.apply(_extract, (args, ))
+        self._add_timings(timings)
+        return record, error
+
+    def imap(self, files):
+        """Extract the references from many files.
+
+        @param files: list of (key, path, recid), path being None for
+            keys with no file to process
+        @return: iterator over (key, record, error message) in the same
+            order as the files, record being None when there is no file
+            or in case of error
+        """
+        args = [(path, recid, self.kbs_files)
+                for dummy, path, recid in files if path]
+        if self.pool is None:
+            results = (_extract(arg) for arg in args)
+        else:
+            results = self.pool.imap(_extract, args)
+        for key, path, dummy in files:
+            if not path:
+                yield key, None, None
+                continue
+            record, error, timings = results.next()
+            self._add_timings(timings)
+            yield key, record, error
+
+    def get_report(self):
+        """Return a summary of the time spent in the extraction."""
+        duration = time.time() - self.start_time
+        stages = ", ".join(["%s: %.1fs" % (stage, self.timings[stage])
+                            for stage in sorted(self.timings)])
+        return "%d files processed in %.1fs (%.1f files/minute; %s)" \
+               % (self.nb_files, duration,
+                  self.nb_files * 60 / max(duration, 0.001), stages)
+
+    def close(self):
+        """Stop the workers, once they are done with the pending files."""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def terminate(self):
+        """Stop the workers right away, e.g. when the task is stopped."""
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+The Refextract batch extraction tests suite
+
+It requires a fully functional invenio installation.
+"""
+
+from mock import patch
+
+from invenio.testutils import InvenioTestCase
+from invenio.testutils import make_test_suite, run_test_suite
+from invenio.refextract_api import FullTextNotAvailable
+from invenio.refextract_batch import RefextractPool
+from invenio.docextract_task import process_records_batch
+
+
+def fake_extract_references_from_file(path, recid=None, kbs_files=None,
+                                      timings=None):
+    """Stands for the extraction, in the workers too (they are forked
+    once it is patched)."""
+    if path == 'missing':
+        raise FullTextNotAvailable()
+    if path == 'broken':
+        raise ValueError('broken file')
+    timings['parsing'] = 1.0
+    return 'references of %s (%s)' % (path, recid)
+
+
+class RefextractPoolTest(InvenioTestCase):
+
+    def _check_imap(self, workers):
+        files = [(1, 'a.pdf', 1), (2, None, 2), (3, 'missing', 3),
+                 (4, 'broken', 4), (5, 'b.pdf', 5)]
+        pool = RefextractPool(workers=workers)
+        try:
+            results = list(pool.imap(files))
+        finally:
+            pool.close()
+        self.assertEqual([key for key, dummy, dummy in results],
+                         [1, 2, 3, 4, 5])
+        self.assertEqual(results[0][1:], ('references of a.pdf (1)', None))
+        self.assertEqual(results[1][1:], (None, None))
+        self.assertEqual(results[2][1:],
+                         (None, 'No full text available for missing'))
+        self.assertEqual(results[3][1], None)
+        self.assert_('broken file' in results[3][2])
+        self.assertEqual(results[4][1:], ('references of b.pdf (5)', None))
+        self.assertEqual(pool.nb_files, 4)
+        self.assertEqual(pool.timings, {'parsing': 2.0})
+        self.assert_(pool.get_report().startswith('4 files processed'))
+
+    @patch('invenio.refextract_batch.extract_references_from_file',
+           fake_extract_references_from_file)
+    def test_imap_in_process(self):
+        """refextract - batch extraction in the task process"""
+        self._check_imap(1)
+
+    @patch('invenio.refextract_batch.extract_references_from_file',
+           fake_extract_references_from_file)
+    def test_imap_in_workers(self):
+        """refextract - batch extraction by worker processes"""
+        self._check_imap(2)
+
+    @patch('invenio.refextract_batch.extract_references_from_file',
+           fake_extract_references_from_file)
+    def test_extract_and_terminate(self):
+        """refextract - single extraction and stop of the workers"""
+        pool = RefextractPool(workers=2)
+        self.assertEqual(pool.extract_references_from_file('a.pdf', 7),
+                         ('references of a.pdf (7)', None))
+        pool.terminate()
+        self.assertEqual(pool.pool, None)
+
+
+class ProcessRecordsBatchTest(InvenioTestCase):
+
+    @patch('invenio.docextract_task.task_sleep_now_if_required')
+    @patch('invenio.docextract_task.task_update_progress')
+    @patch('invenio.docextract_task.write_message')
+    @patch('invenio.docextract_task.store_last_updated')
+    def test_process_records_batch(self, store_last_updated, *dummy_mocks):
+        """docextract - records processed all at once"""
+        calls = []
+
+        def batch(recids, records):
+            calls.append((recids, records))
+            for recid in recids:
+                yield recid
+
+        process_records_batch('refextract', [(1, '2014-01-01'), (2, None),
+                                             (3, '2014-01-03')],
+                              batch, {'records': []})
+        self.assertEqual(calls, [([1, 2, 3], [])])
+        self.assertEqual([call[0] for call in store_last_updated.call_args_list],
+                         [(None, '2014-01-01', 'refextract'),
+                          (None, '2014-01-03', 'refextract')])
+
+
+TEST_SUITE = make_test_suite(RefextractPoolTest,
+                             ProcessRecordsBatchTest)
+
+if __name__ == '__main__':
+    run_test_suite(TEST_SUITE)
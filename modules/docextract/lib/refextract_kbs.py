@@ -44,6 +44,10 @@ from invenio.bibrecord import record_get_field_values, \
                               field_get_subfield_instances
 
 
+re_title_word = re.compile(ur'\w+', re.UNICODE)
+re_regexp_special_char = re.compile(r'[][\\.^$*+?{}()|]')
+
+
 def get_kbs(custom_kbs_files=None, cache={}):
     """Load kbs (with caching)
 
@@ -433,10 +437,80 @@ def build_reportnum_kb(fpath):
         write_message(emsg, sys.stderr, verbose=0)
         raise IOError("Error: Unable to open report number kb '%s'" % fpath)
 
+    # Order the categories by length (long - short), as they must be
+    # searched in this order.  Categories without regexp special
+    # characters are also given as literal strings: they can only match
+    # lines containing them.
+    def _by_len(a, b):
+        return _cmp_bystrlen_reverse(a[1], b[1])
+    ordered_categories = standardised_preprint_reference_categories.keys()
+    ordered_categories.sort(_by_len)
+    ordered_categories = [(categ, _get_literal(categ[1].strip()))
+                          for categ in ordered_categories]
+
     # return the preprint reference patterns and the replacement strings
     # for non-standard categ-strings:
     return (preprint_reference_search_regexp_patterns,
-            standardised_preprint_reference_categories)
+            standardised_preprint_reference_categories,
+            ordered_categories)
+
+
+def _get_literal(pattern):
+    """Return the pattern if it only matches itself, None otherwise.
+
+    Patterns containing underscores are not considered as literal,
+    as underscores are used to blank the matched parts of the lines.
+    """
+    if re_regexp_special_char.search(pattern) or '_' in pattern:
+        return None
+    return pattern
+
+
+class TitlesIndex(object):
+    """Index of the journal titles by their first word.
+
+    It is used to find the few titles that can be matched in a line
+    without trying the pattern of every title in the knowledge base.
+    A title can only be matched where a word of the line starts with
+    the first word of the title (titles made of a single word can be
+    followed by other word characters, such as accented letters, hence
+    the prefix lookup).  Titles containing underscores, which are used
+    to blank the matched parts of the lines, are always searched.
+    """
+
+    def __init__(self, titles):
+        """
+        @param titles: list of titles, in the order they must be searched
+        """
+        self.words = {}
+        self.prefixes = {}
+        self.always = []
+        for rank, title in enumerate(titles):
+            first_word = re_title_word.match(title)
+            if not first_word or '_' in title:
+                self.always.append((rank, title))
+            elif first_word.end() == len(title):
+                self.prefixes.setdefault(title, []).append((rank, title))
+            else:
+                self.words.setdefault(first_word.group(), []) \
+                                                   .append((rank, title))
+        self.prefix_lengths = sorted(set(len(prefix)
+                                         for prefix in self.prefixes))
+
+    def get_candidates(self, line):
+        """Return the titles that may appear in line, in search order."""
+        candidates = set(self.always)
+        for word in re_title_word.findall(line):
+            titles = self.words.get(word)
+            if titles:
+                candidates.update(titles)
+            for length in self.prefix_lengths:
+                if length > len(word):
+                    break
+                titles = self.prefixes.get(word[:length])
+                if titles:
+                    candidates.update(titles)
+        return [title for dummy, title in sorted(candidates)]
 
 
 def _cmp_bystrlen_reverse(a, b):
@@ -797,7 +871,7 @@ def build_journals_kb(knowledgebase):
     write_message('Processed journals kb', verbose=3)
 
     # return the raw knowledge base:
-    return kb, standardised_titles, seek_phrases
+    return kb, standardised_titles, seek_phrases, TitlesIndex(seek_phrases)
 
 
 def build_collaborations_kb(knowledgebase):
@@ -26,6 +26,8 @@ They are intended to make sure there is no regression in references parsing.
 
 from invenio.testutils import InvenioTestCase
 import re
+import sys
+import time
 from mock import patch
 
 from invenio import bibupload
@@ -34,6 +36,9 @@ from invenio.testutils import make_test_suite, run_test_suite, InvenioXmlTestCas
 from invenio.refextract_engine import parse_references
 from invenio.docextract_utils import setup_loggers
 from invenio.refextract_text import wash_and_repair_reference_line
+from invenio.refextract_tag import identify_journals, identify_report_numbers
+from invenio.refextract_re import re_punctuation
+from invenio.docextract_text import remove_and_record_multiple_spaces_in_line
 from invenio.config import CFG_ETCDIR
 from invenio import refextract_kbs
 from invenio import refextract_record
@@ -3009,6 +3014,58 @@ and C. Tomei et al., Astropart. Phys. 33 (2010) 169 [arXiv:0912.0452 [physics.in
 </record>""")
 
 
+class _AllTitles(object):
+    """Titles index returning every title of the knowledge base"""
+    def __init__(self, titles):
+        self.titles = titles
+
+    def get_candidates(self, dummy_line):
+        return self.titles
+
+
+class KbsMatchingSpeedTest(InvenioTestCase):
+    """Benchmark of the journal titles and report numbers matching
+
+    The indexed knowledge bases must give the same results as trying
+    every pattern.  The time taken both ways is reported.
+    """
+
+    def setUp(self):
+        setup_loggers(verbosity=0)
+        self.old_override = refextract_kbs.CFG_REFEXTRACT_KBS_OVERRIDE
+        refextract_kbs.CFG_REFEXTRACT_KBS_OVERRIDE = {}
+        kbs = refextract_kbs.get_kbs()
+        self.kb_journals = kbs['journals']
+        self.kb_reports = kbs['report-numbers']
+        self.lines = []
+        for line in open("%s/docextract/example.txt" % CFG_ETCDIR):
+            line = re_punctuation.sub(u' ', line.decode('utf-8').upper())
+            self.lines.append(remove_and_record_multiple_spaces_in_line(line)[1])
+
+    def tearDown(self):
+        refextract_kbs.CFG_REFEXTRACT_KBS_OVERRIDE = self.old_override
+
+    def _identify(self, kb_journals, kb_reports):
+        start = time.time()
+        results = []
+        for line in self.lines:
+            repnums = identify_report_numbers(line, kb_reports)
+            results.append((repnums, identify_journals(repnums[2], kb_journals)))
+        return results, time.time() - start
+
+    def test_speed_identify(self):
+        """refextract - speed test on journals and report numbers matching"""
+        kb_journals = self.kb_journals[:3] + (_AllTitles(self.kb_journals[2]), )
+        kb_reports = self.kb_reports[:2] + \
+                 ([(categ, None) for categ, dummy in self.kb_reports[2]], )
+        expected, time_all_patterns = self._identify(kb_journals, kb_reports)
+        results, time_indexed = self._identify(self.kb_journals, self.kb_reports)
+        self.assertEqual(results, expected)
+        # wall-clock times vary too much between machines to be asserted
+        sys.stderr.write("\n  all patterns: %.3fs, indexed: %.3fs ... "
+                         % (time_all_patterns, time_indexed))
+
+
 class TaskTest(InvenioTestCase):
     def setUp(self):
         setup_loggers(verbosity=0)
@@ -3080,6 +3137,6 @@ class TaskRecordWithRefsTest(InvenioTestCase):
                 self.assertEqual(len(results), 1)
                 self.assertTrue(results[0]['999C5'])
 
-TEST_SUITE = make_test_suite(RefextractTest)
+TEST_SUITE = make_test_suite(RefextractTest, KbsMatchingSpeedTest)
 if __name__ == '__main__':
     run_test_suite(TEST_SUITE, warn_user=True)
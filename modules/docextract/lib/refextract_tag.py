@@ -1132,7 +1132,8 @@ def identify_journals(line, kb_journals):
                                          found in the line.
     """
     periodical_title_search_kb = kb_journals[0]
-    periodical_title_search_keys = kb_journals[2]
+    # Only search for the titles which can be found in the line
+    periodical_title_search_keys = kb_journals[3].get_candidates(line)
 
     title_matches = {}            # the text matched at the given line
                                   # location (i.e. the title itself)
@@ -1197,31 +1198,22 @@ def identify_report_numbers(line, kb_reports):
             (matched-reportnum-lengths, matched-reportnum-replacements,
              working-line)
     """
-    def _by_len(a, b):
-        """Comparison function used to sort a list by the length of the
-           strings in each element of the list.
-        """
-        if len(a[1]) < len(b[1]):
-            return 1
-        elif len(a[1]) == len(b[1]):
-            return 0
-        else:
-            return -1
-
     repnum_matches_matchlen = {}  # info about lengths of report numbers
                                   # matched at given locations in line
     repnum_matches_repl_str = {}  # standardised report numbers matched
                                   # at given locations in line
 
-    repnum_search_kb, repnum_standardised_categs = kb_reports
-    repnum_categs = repnum_standardised_categs.keys()
-    repnum_categs.sort(_by_len)
+    # the categories are already ordered by length (long - short)
+    repnum_search_kb, repnum_standardised_categs, repnum_categs = kb_reports
 
     # Handle CERN/LHCC/98-013
     line = line.replace('/', ' ')
 
     # try to match preprint report numbers in the line:
-    for categ in repnum_categs:
+    for categ, literal in repnum_categs:
+        if literal is not None and literal not in line:
+            # this category can not be found in the line
+            continue
         # search for all instances of the current report
         # numbering style in the line:
         repnum_matches_iter = repnum_search_kb[categ].finditer(line)
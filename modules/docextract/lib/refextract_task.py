@@ -41,8 +41,10 @@ from invenio.search_engine import perform_request_search
 from invenio.refextract_cli import HELP_MESSAGE, DESCRIPTION
 from invenio.refextract_api import extract_references_from_record, \
                                    FullTextNotAvailable, \
+                                   look_for_fulltext, \
                                    record_can_extract_refs, \
                                    record_can_overwrite_refs
+from invenio.refextract_batch import RefextractPool
 from invenio.refextract_config import CFG_REFEXTRACT_FILENAME
 from invenio.bibtask import task_low_level_submission
 from invenio.docextract_task import task_run_core_wrapper, \
@@ -219,6 +221,50 @@ def extract_one(recid, records, overwrite=False, bibcatalog_system=None,
         raise NotSafeForExtraction()
 
 
+def task_run_core_batch(recids, records, bibcatalog_system=None):
+    """Extract the references of many records with a RefextractPool.
+
+    Yields every recid once its references have been extracted.
+    """
+    setup_loggers(None, use_bibtask=True)
+    overwrite = task_get_option('overwrite')
+    create_a_ticket = task_get_option('new') or task_get_option('create-ticket')
+
+    # The database is only accessed from this process: the workers
+    # are only given the files to process.
+    files = []
+    for recid in recids:
+        msg = "Extracting references for %s" % recid
+        if overwrite:
+            write_message("%s (overwrite)" % msg)
+            safe_to_extract = record_can_overwrite_refs(recid)
+        else:
+            write_message(msg)
+            safe_to_extract = record_can_extract_refs(recid)
+        path = None
+        if not safe_to_extract:
+            write_message('Record not safe for re-extraction, skipping')
+        else:
+            path = look_for_fulltext(recid)
+            if not path:
+                write_message("No full text available for %s" % recid)
+        files.append((recid, path, recid))
+
+    pool = RefextractPool()
+    try:
+        for recid, record, error in pool.imap(files):
+            if error:
+                write_message(error)
+            elif record is not None:
+                records.append(record)
+                # Create a RT ticket if necessary
+                if create_a_ticket:
+                    create_ticket(recid, bibcatalog_system)
+            yield recid
+    finally:
+        pool.close()
+    write_message(pool.get_report())
+
 
 def cb_submit_bibupload(bibcatalog_system=None, records=None):
     if records:
@@ -281,4 +327,5 @@ def main():
         task_run_fnc=task_run_core_wrapper('refextract',
                                            task_run_core,
                                            extra_vars=extra_vars,
-                                           post_process=cb_submit_bibupload))
+                                           post_process=cb_submit_bibupload,
+                                           batch_func=task_run_core_batch))
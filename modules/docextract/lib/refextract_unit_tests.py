@@ -34,7 +34,8 @@ from invenio.refextract_tag import identify_ibids, \
                                    find_numeration, \
                                    find_numeration_more
 
-from invenio.refextract_tag import identify_ibids, tag_arxiv
+from invenio.refextract_tag import identify_ibids, tag_arxiv, \
+                                   identify_journals
 from invenio import refextract_re
 from invenio.refextract_find import get_reference_section_beginning
 from invenio.refextract_api import search_from_reference, extract_journal_reference
@@ -259,6 +260,28 @@ class SearchTest(InvenioTestCase):
         self.assertEqual(pattern, '')
 
 
+class IdentifyJournalsTest(InvenioTestCase):
+    def setUp(self):
+        setup_loggers(verbosity=1)
+        from invenio.refextract_kbs import build_journals_kb
+        self.kb = build_journals_kb([('PHYS REV LETT', 'Phys.Rev.Lett.'),
+                                     ('PHYS REV', 'Phys.Rev.'),
+                                     ('NUCL PHYS', 'Nucl.Phys.')])
+
+    def test_candidates(self):
+        line = u"PHYS REV LETT 19 1264 AND PHYS REV D 12 1 "
+        self.assertEqual(self.kb[3].get_candidates(line),
+                         [u'PHYS REV LETT', u'PHYS REV'])
+
+    def test_identify_journals(self):
+        line = u"PHYS REV LETT 19 1264 AND PHYS REV D 12 1 "
+        matches, line, count = identify_journals(line, self.kb)
+        self.assertEqual(matches, {0: u'PHYS REV LETT', 26: u'PHYS REV'})
+        self.assertEqual(count, {u'PHYS REV LETT': 1, u'PHYS REV': 1})
+        self.assertEqual(line,
+                         u"_____________ 19 1264 AND ________ D 12 1 ")
+
+
 class RebuildReferencesTest(InvenioTestCase):
     def setUp(self):
         setup_loggers(verbosity=1)
@@ -417,6 +440,7 @@ TEST_SUITE = make_test_suite(ReTest,
                              FindNumerationTest,
                              FindSectionTest,
                              SearchTest,
+                             IdentifyJournalsTest,
                              RebuildReferencesTest)
 
 if __name__ == '__main__':
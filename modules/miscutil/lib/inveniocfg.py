@@ -173,8 +173,11 @@ Please, update your invenio-local.conf file accordingly.""" % (option_name, new_
                        'CFG_BIBSCHED_NODE_TASKS',
                        'CFG_BIBEDIT_EXTEND_RECORD_WITH_COLLECTION_TEMPLATE',
                        'CFG_OAI_METADATA_FORMATS',
+                       'CFG_OAI_POSTPROCESS_WORKERS',
                        'CFG_BIBDOCFILE_DESIRED_CONVERSIONS',
                        'CFG_BIBDOCFILE_BEST_FORMATS_TO_EXTRACT_TEXT_FROM',
+                       'CFG_WEBSUBMIT_FILE_CONVERTER_CONCURRENCY',
+                       'CFG_WEBSUBMIT_FILE_CONVERTER_TIMEOUTS',
                        'CFG_WEB_API_KEY_ALLOWED_URL',
                        'CFG_BIBDOCFILE_DOCUMENT_FILE_MANAGER_MISC',
                        'CFG_BIBDOCFILE_DOCUMENT_FILE_MANAGER_DOCTYPES',
@@ -22,12 +22,16 @@ import os
 import getopt
 import re
 import time
+import threading
+from cStringIO import StringIO
+from multiprocessing.pool import ThreadPool
 
 from invenio.shellutils import run_shell_command, Timeout, run_process_with_timeout
 from invenio.invenio_connector import InvenioConnector
 from invenio.textutils import wrap_text_in_a_box, \
                               wait_for_user
 from invenio.config import CFG_TMPSHAREDDIR, CFG_TMPDIR, CFG_SITE_URL, \
+                           CFG_PLOTEXTRACTOR_CONVERSION_WORKERS, \
                            CFG_PLOTEXTRACTOR_DISALLOWED_TEX, \
                            CFG_PLOTEXTRACTOR_CONTEXT_WORD_LIMIT, \
                            CFG_PLOTEXTRACTOR_CONTEXT_SENTENCE_LIMIT, \
@@ -62,6 +66,9 @@ PLOTS_DIR = 'plots'
 MAIN_CAPTION_OR_IMAGE = 0
 SUB_CAPTION_OR_IMAGE = 1
 
+# serializes the writes to MARCXML files shared by several tarballs
+_MARC_FILE_LOCK = threading.Lock()
+
 def main():
     """
     The main program loop.
@@ -207,14 +214,15 @@ def main():
         os.write(squash_fd, '<?xml version="1.0" encoding="UTF-8"?>\n<collection>\n')
         os.close(squash_fd)
 
-    for tarball in tars_and_gzips:
-        recid = None
-        if isinstance(tarball, tuple):
-            tarball, recid = tarball
-        process_single(tarball, sdir=sdir, xtract_text=xtract_text, \
-                       upload_plots=upload_plots, force=force, squash=squash_path, \
-                       yes_i_know=yes_i_know, refno_url=refno_url, \
-                       clean=clean, recid=recid, upload_mode=upload_mode)
+    if upload_plots and not squash and not yes_i_know:
+        # every upload has to be confirmed: one tarball at a time
+        workers = 1
+    else:
+        workers = CFG_PLOTEXTRACTOR_CONVERSION_WORKERS
+    process_batch(tars_and_gzips, workers=workers, sdir=sdir, \
+                  xtract_text=xtract_text, upload_plots=upload_plots, \
+                  force=force, squash=squash_path, yes_i_know=yes_i_know, \
+                  refno_url=refno_url, clean=clean, upload_mode=upload_mode)
     if squash:
         squash_fd = open(squash_path, "a")
         squash_fd.write("</collection>\n")
@@ -223,10 +231,76 @@ def main():
         if upload_plots:
             upload_to_site(squash_path, yes_i_know, upload_mode)
 
+def process_batch(tarballs, workers=CFG_PLOTEXTRACTOR_CONVERSION_WORKERS, \
+                  **kwargs):
+    """
+    Processes many tarballs, up to workers of them in parallel, and
+    reports the throughput.
+
+    @param: tarballs (list): the tarballs to process, as paths or as
+        (path, recid) tuples
+    @param: workers (int): number of tarballs processed in parallel
+    @param: kwargs: the other arguments of process_single
+    @return: marc_names (list): the results of process_single for every
+        tarball, in the same order
+    """
+    start_time = time.time()
+
+    def process(tarball):
+        recid = None
+        if isinstance(tarball, tuple):
+            tarball, recid = tarball
+        return process_single(tarball, recid=recid, **kwargs)
+
+    if workers <= 1 or len(tarballs) <= 1:
+        marc_names = [process(tarball) for tarball in tarballs]
+    else:
+        # the images of each tarball are then converted one at a time,
+        # so as not to run workers * workers conversions at once
+        kwargs['conversion_workers'] = 1
+        pool = ThreadPool(min(workers, len(tarballs)))
+        try:
+            marc_names = pool.map(process, tarballs, 1)
+        finally:
+            pool.close()
+            pool.join()
+    write_message(get_throughput_message(len(tarballs), start_time))
+    return marc_names
+
+def get_throughput_message(nb_records, start_time):
+    """
+    Gives a summary of the processing speed.
+
+    @param: nb_records (int): number of records (tarballs) processed
+    @param: start_time (float): when the processing started
+    @return: message (string)
+    """
+    duration = max(time.time() - start_time, 0.001)
+    return '%d records processed in %.1fs (%.1f records/minute)' % \
+           (nb_records, duration, nb_records * 60 / duration)
+
+def read_tex_file(tex_file, tex_cache=None):
+    """
+    Reads a TeX file, only once if a cache is given.
+
+    @param: tex_file (string): path to the TeX file
+    @param: tex_cache (dict): contents of the TeX files already read
+    @return: content (string): the content of the file
+    """
+    if tex_cache is not None and tex_file in tex_cache:
+        return tex_cache[tex_file]
+    fd = open(tex_file)
+    content = fd.read()
+    fd.close()
+    if tex_cache is not None:
+        tex_cache[tex_file] = content
+    return content
+
 def process_single(tarball, sdir=CFG_TMPDIR, xtract_text=False, \
                    upload_plots=False, force=False, squash="", \
                    yes_i_know=False, refno_url="", \
-                   clean=False, recid=None, upload_mode='append'):
+                   clean=False, recid=None, upload_mode='append', \
+                   conversion_workers=CFG_PLOTEXTRACTOR_CONVERSION_WORKERS):
     """
     Processes one tarball end-to-end.
 
@@ -251,6 +325,7 @@ def process_single(tarball, sdir=CFG_TMPDIR, xtract_text=False, \
     @param recid: the record ID linked to this tarball. Overrides C{refno_url}
     @param upload_mode: the mode in which to call bibupload (when C{upload_plots}
                         is set to True.
+    @param conversion_workers: number of images converted in parallel
     @return: marc_name(string): path to generated marcxml file
     """
     sub_dir, refno = get_defaults(tarball, sdir, refno_url, recid)
@@ -274,22 +349,26 @@ def process_single(tarball, sdir=CFG_TMPDIR, xtract_text=False, \
         run_shell_command('rm -r %s', (sub_dir,))
         return
 
-    converted_image_list = convert_images(image_list)
+    converted_image_list = convert_images(image_list, workers=conversion_workers)
     write_message('converted %d of %d images found for %s' % (len(converted_image_list), \
                                                               len(image_list), \
                                                               os.path.basename(tarball)))
     extracted_image_data = []
+    # every TeX file (including the \input ones) is only read once
+    tex_cache = {}
 
     for tex_file in tex_files:
         # Extract images, captions and labels
         partly_extracted_image_data = extract_captions(tex_file, sub_dir, \
-                                                converted_image_list)
+                                                converted_image_list, \
+                                                tex_cache=tex_cache)
         if partly_extracted_image_data != []:
             # Add proper filepaths and do various cleaning
             cleaned_image_data = prepare_image_data(partly_extracted_image_data, \
                                                   tex_file, converted_image_list)
             # Using prev. extracted info, get contexts for each image found
-            extracted_image_data.extend((extract_context(tex_file, cleaned_image_data)))
+            extracted_image_data.extend((extract_context(tex_file, cleaned_image_data, \
+                                                         tex_cache=tex_cache)))
     extracted_image_data = remove_dups(extracted_image_data)
     if extracted_image_data == []:
         write_message('No plots detected in %s' % (refno,))
@@ -301,9 +380,13 @@ def process_single(tarball, sdir=CFG_TMPDIR, xtract_text=False, \
         if not squash:
             marc_xml += "\n</collection>"
         if marc_name != None:
-            marc_fd = open(marc_name, 'a')
-            marc_fd.write('%s\n' % (marc_xml,))
-            marc_fd.close()
+            _MARC_FILE_LOCK.acquire()
+            try:
+                marc_fd = open(marc_name, 'a')
+                marc_fd.write('%s\n' % (marc_xml,))
+                marc_fd.close()
+            finally:
+                _MARC_FILE_LOCK.release()
             if not squash:
                 write_message('generated %s' % (marc_name,))
                 if upload_plots:
@@ -503,7 +586,7 @@ def get_context(lines, backwards=False):
     else:
         return " ".join(sentence_list)
 
-def extract_context(tex_file, extracted_image_data):
+def extract_context(tex_file, extracted_image_data, tex_cache=None):
     """
     Given a .tex file and a label name, this function will extract the text before
     and after for all the references made to this label in the text. The number
@@ -514,15 +597,15 @@ def extract_context(tex_file, extracted_image_data):
         a list of tuples of images matched to labels and captions from
         this document.
 
+    @param tex_cache (dict): contents of the TeX files already read
+
     @return extracted_image_data ([(string, string, list, list),
         (string, string, list, list),...)]: the same list, but now containing
         extracted contexts
     """
     if os.path.isdir(tex_file) or not os.path.exists(tex_file):
         return []
-    fd = open(tex_file)
-    lines = fd.read()
-    fd.close()
+    lines = read_tex_file(tex_file, tex_cache)
 
     # Generate context for each image and its assoc. labels
     new_image_data = []
@@ -550,7 +633,7 @@ def extract_context(tex_file, extracted_image_data):
         new_image_data.append((image, caption, label, context_list))
     return new_image_data
 
-def extract_captions(tex_file, sdir, image_list, level=0):
+def extract_captions(tex_file, sdir, image_list, level=0, tex_cache=None):
     """
     Take the TeX file and the list of images in the tarball (which all,
     presumably, are used in the TeX file) and figure out which captions
@@ -562,6 +645,8 @@ def extract_captions(tex_file, sdir, image_list, level=0):
     @param: sdir (string): path to current sub-directory
     @param: image_list (list): list of images in tarball
     @param: level (int): nesting level of includes, recursion of extract_caption
+    @param: tex_cache (dict): contents of the TeX files already read, and
+        whether the directories already scanned contain commas in filenames
 
     @return: images_and_captions_and_labels ([(string, string, list),
         (string, string, list), ...]):
@@ -570,9 +655,7 @@ def extract_captions(tex_file, sdir, image_list, level=0):
     """
     if os.path.isdir(tex_file) or not os.path.exists(tex_file):
         return []
-    fd = open(tex_file)
-    lines = fd.readlines()
-    fd.close()
+    lines = StringIO(read_tex_file(tex_file, tex_cache)).readlines()
 
     # possible figure lead-ins
     figure_head = '\\begin{figure'  # also matches figure*
@@ -615,13 +698,18 @@ def extract_captions(tex_file, sdir, image_list, level=0):
                 break
 
     # are we using commas in filenames here?
-    commas_okay = False
-    for dummy1, dummy2, filenames in \
-            os.walk(os.path.split(os.path.split(tex_file)[0])[0]):
-        for filename in filenames:
-            if filename.find(',') > -1:
-                commas_okay = True
-                break
+    walk_dir = os.path.split(os.path.split(tex_file)[0])[0]
+    if tex_cache is not None and ('commas', walk_dir) in tex_cache:
+        commas_okay = tex_cache[('commas', walk_dir)]
+    else:
+        commas_okay = False
+        for dummy1, dummy2, filenames in os.walk(walk_dir):
+            for filename in filenames:
+                if filename.find(',') > -1:
+                    commas_okay = True
+                    break
+        if tex_cache is not None:
+            tex_cache[('commas', walk_dir)] = commas_okay
 
     # a comment is a % not preceded by a \
     comment = re.compile("(?<!\\\\)%")
@@ -762,7 +850,8 @@ def extract_captions(tex_file, sdir, image_list, level=0):
                         extracted_image_data.extend(extract_captions(\
                                                       new_tex_file, sdir, \
                                                       image_list,
-                                                      level=level+1))
+                                                      level=level+1,
+                                                      tex_cache=tex_cache))
 
         """PICTURE"""
 
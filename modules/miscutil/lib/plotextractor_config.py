@@ -21,9 +21,16 @@
 
 __revision__ = "$Id$"
 
+import os
+
+from invenio.config import CFG_CACHEDIR
+
 ## CFG_PLOTEXTRACTOR_DESY_BASE --
 CFG_PLOTEXTRACTOR_DESY_BASE = 'http://www-library.desy.de/preparch/desy/'
 
 ## CFG_PLOTEXTRACTOR_DESY_PIECE --
 CFG_PLOTEXTRACTOR_DESY_PIECE = '/desy'
 
+## CFG_PLOTEXTRACTOR_CONVERSION_CACHEDIR -- where the converted images are
+## cached when CFG_PLOTEXTRACTOR_CONVERSION_CACHE is set
+CFG_PLOTEXTRACTOR_CONVERSION_CACHEDIR = os.path.join(CFG_CACHEDIR, 'plotextractor')
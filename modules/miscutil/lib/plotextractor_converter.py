@@ -18,13 +18,24 @@
 ## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
 
 import os
+import shutil
 import tarfile
+import tempfile
+from multiprocessing.pool import ThreadPool
 
 from time import time
+from invenio.config import CFG_PLOTEXTRACTOR_CONVERSION_WORKERS, \
+                           CFG_PLOTEXTRACTOR_CONVERSION_CACHE
+from invenio.plotextractor_config import CFG_PLOTEXTRACTOR_CONVERSION_CACHEDIR
 from invenio.shellutils import run_shell_command, run_process_with_timeout, Timeout
 from invenio.plotextractor_output_utils import (get_converted_image_name,
                                                 write_message)
 
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
 
 def untar(original_tarball, sdir):
     """
@@ -146,49 +157,119 @@ def check_for_gzip(tfile):
 
     return tfile
 
-def convert_images(image_list):
+def convert_images(image_list, workers=CFG_PLOTEXTRACTOR_CONVERSION_WORKERS):
     """
     Here we figure out the types of the images that were extracted from
     the tarball and determine how to convert them into PNG.
 
     @param: image_list ([string, string, ...]): the list of image files
         extracted from the tarball in step 1
+    @param: workers (int): number of images converted in parallel
 
     @return: image_list ([str, str, ...]): The list of image files when all
         have been converted to PNG format.
     """
+    image_list = [image_file for image_file in image_list
+                  if not os.path.isdir(image_file)]
+    if workers <= 1 or len(image_list) <= 1:
+        converted_images = [convert_image(image_file)
+                            for image_file in image_list]
+    else:
+        pool = ThreadPool(min(workers, len(image_list)))
+        try:
+            converted_images = pool.map(convert_image, image_list, 1)
+        finally:
+            pool.close()
+            pool.join()
+    return [image_file for image_file in converted_images if image_file]
+
+def convert_image(image_file):
+    """
+    Convert an image to PNG, unless it already is one.
+
+    If CFG_PLOTEXTRACTOR_CONVERSION_CACHE is set, the converted image is
+    taken from (or stored into) the cache of converted images.
+
+    @param: image_file (string): path to the image
+
+    @return: (string) the path to the PNG image, or None if the
+        conversion failed
+    """
+    # FIXME: here and everywhere else in the plot extractor
+    # library the run shell command statements should be (1)
+    # called with timeout in order to prevent runaway imagemagick
+    # conversions; (2) the arguments should be passed properly so
+    # that they are escaped.
+
     png_output_contains = 'PNG image'
-    ret_list = []
-    for image_file in image_list:
-        if os.path.isdir(image_file):
-            continue
-
-        # FIXME: here and everywhere else in the plot extractor
-        # library the run shell command statements should be (1)
-        # called with timeout in order to prevent runaway imagemagick
-        # conversions; (2) the arguments should be passed properly so
-        # that they are escaped.
-
-        dummy1, cmd_out, dummy2 = run_shell_command('file %s', (image_file,))
-        if cmd_out.find(png_output_contains) > -1:
-            ret_list.append(image_file)
-        else:
-            # we're just going to assume that ImageMagick can convert all
-            # the image types that we may be faced with
-            # for sure it can do EPS->PNG and JPG->PNG and PS->PNG
-            # and PSTEX->PNG
-            converted_image_file = get_converted_image_name(image_file)
-            cmd_list = ['convert', image_file, converted_image_file]
-            try:
-                dummy1, cmd_out, cmd_err = run_process_with_timeout(cmd_list)
-                if cmd_err == '':
-                    ret_list.append(converted_image_file)
-                else:
-                    write_message('convert failed on ' + image_file)
-            except Timeout:
-                write_message('convert timed out on ' + image_file)
-
-    return ret_list
+    dummy1, cmd_out, dummy2 = run_shell_command('file %s', (image_file,))
+    if cmd_out.find(png_output_contains) > -1:
+        return image_file
+
+    # we're just going to assume that ImageMagick can convert all
+    # the image types that we may be faced with
+    # for sure it can do EPS->PNG and JPG->PNG and PS->PNG
+    # and PSTEX->PNG
+    converted_image_file = get_converted_image_name(image_file)
+    cached_image_file = None
+    if CFG_PLOTEXTRACTOR_CONVERSION_CACHE:
+        cached_image_file = get_cached_image_name(image_file)
+        if os.path.exists(cached_image_file):
+            shutil.copyfile(cached_image_file, converted_image_file)
+            return converted_image_file
+
+    cmd_list = ['convert', image_file, converted_image_file]
+    try:
+        dummy1, cmd_out, cmd_err = run_process_with_timeout(cmd_list)
+    except Timeout:
+        write_message('convert timed out on ' + image_file)
+        return None
+    if cmd_err != '':
+        write_message('convert failed on ' + image_file)
+        return None
+    if cached_image_file and os.path.exists(converted_image_file):
+        cache_image(converted_image_file, cached_image_file)
+    return converted_image_file
+
+def get_cached_image_name(image_file):
+    """
+    Gives the path of the converted image in the cache, which depends on
+    the content of the original image.
+
+    @param: image_file (string): path to the image before conversion
+
+    @return: (string) the path to the cached PNG image
+    """
+    checksum = md5()
+    image_fd = open(image_file, 'rb')
+    try:
+        for chunk in iter(lambda: image_fd.read(65536), ''):
+            checksum.update(chunk)
+    finally:
+        image_fd.close()
+    checksum = checksum.hexdigest()
+    return os.path.join(CFG_PLOTEXTRACTOR_CONVERSION_CACHEDIR, checksum[:2],
+                        checksum + '.png')
+
+def cache_image(converted_image_file, cached_image_file):
+    """
+    Stores a converted image in the cache.  The image is written to a
+    temporary file first, so that other processes never see a partial
+    image.
+
+    @param: converted_image_file (string): path to the converted image
+    @param: cached_image_file (string): its path in the cache
+    """
+    cache_dir = os.path.dirname(cached_image_file)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        tmp_fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        os.close(tmp_fd)
+        shutil.copyfile(converted_image_file, tmp_path)
+        os.rename(tmp_path, cached_image_file)
+    except (IOError, OSError), err:
+        write_message('could not cache %s: %s' % (converted_image_file, err))
 
 def extract_text(tarball):
     """
@@ -19,13 +19,21 @@
 
 """Unit tests for the plotextract script."""
 
+import os
+import shutil
+import tempfile
+
 from invenio.testutils import InvenioTestCase
 from invenio.plotextractor import put_it_together, \
                                   find_open_and_close_braces, \
                                   intelligently_find_filenames, \
-                                  assemble_caption
+                                  assemble_caption, \
+                                  extract_captions, \
+                                  extract_context
 from invenio.plotextractor_output_utils import remove_dups, \
                                                get_converted_image_name
+from invenio import plotextractor
+from invenio import plotextractor_converter
 from invenio.testutils import make_test_suite, run_test_suite
 
 
@@ -341,10 +349,157 @@ class TestGetConvertedImageName(InvenioTestCase):
                         "didn't change extension")
 
 
+class TestTeXCache(InvenioTestCase):
+    """Test the extraction of captions and contexts with a TeX cache."""
+
+    def setUp(self):
+        self.sdir = tempfile.mkdtemp()
+        self.tex_dir = os.path.join(self.sdir, 'paper_plots')
+        os.mkdir(self.tex_dir)
+        self.tex_file = os.path.join(self.tex_dir, 'paper.tex')
+        tex_fd = open(self.tex_file, 'w')
+        tex_fd.write('\\begin{document}\n'
+                     'As shown in \\ref{fig:plot}, it works.\n'
+                     '\\begin{figure}\n'
+                     '\\includegraphics{plot.eps}\n'
+                     '\\caption{A plot}\n'
+                     '\\label{fig:plot}\n'
+                     '\\end{figure}\n'
+                     '\\end{document}\n')
+        tex_fd.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.sdir)
+
+    def test_same_results(self):
+        """plotextractor - captions and contexts with a TeX cache"""
+        expected = extract_captions(self.tex_file, self.tex_dir, [])
+        tex_cache = {}
+        captions = extract_captions(self.tex_file, self.tex_dir, [],
+                                    tex_cache=tex_cache)
+        self.assertEqual(captions, expected)
+        self.assertEqual(captions[0], ('plot.eps', 'A plot', 'fig:plot'))
+        self.assertTrue(self.tex_file in tex_cache)
+        # the cached content is used instead of reading the file again
+        open(self.tex_file, 'w').close()
+        self.assertEqual(extract_context(self.tex_file, captions[:1],
+                                         tex_cache=tex_cache),
+                         [('plot.eps', 'A plot', 'fig:plot',
+                           [' \\ref{fig:plot} , it works.'])])
+
+
+
+class TestConvertImages(InvenioTestCase):
+    """Test the conversion of images, with the cache of converted images."""
+
+    def setUp(self):
+        self.sdir = tempfile.mkdtemp()
+        self.conversions = []
+        self.orig = (plotextractor_converter.run_shell_command,
+                     plotextractor_converter.run_process_with_timeout,
+                     plotextractor_converter.CFG_PLOTEXTRACTOR_CONVERSION_CACHE,
+                     plotextractor_converter.CFG_PLOTEXTRACTOR_CONVERSION_CACHEDIR)
+
+        def fake_file(cmd, args):
+            """Only the .png files are PNG images."""
+            if args[0].endswith('.png'):
+                return 0, args[0] + ': PNG image data', ''
+            return 0, args[0] + ': PostScript document text', ''
+
+        def fake_convert(cmd_list):
+            """Converts by copying, fails on the images named bad."""
+            self.conversions.append(cmd_list[1])
+            if 'bad' in cmd_list[1]:
+                return 1, '', 'convert: no decode delegate'
+            shutil.copyfile(cmd_list[1], cmd_list[2])
+            return 0, '', ''
+
+        plotextractor_converter.run_shell_command = fake_file
+        plotextractor_converter.run_process_with_timeout = fake_convert
+        plotextractor_converter.CFG_PLOTEXTRACTOR_CONVERSION_CACHE = 1
+        plotextractor_converter.CFG_PLOTEXTRACTOR_CONVERSION_CACHEDIR = \
+            os.path.join(self.sdir, 'cache')
+
+    def tearDown(self):
+        (plotextractor_converter.run_shell_command,
+         plotextractor_converter.run_process_with_timeout,
+         plotextractor_converter.CFG_PLOTEXTRACTOR_CONVERSION_CACHE,
+         plotextractor_converter.CFG_PLOTEXTRACTOR_CONVERSION_CACHEDIR) = \
+            self.orig
+        shutil.rmtree(self.sdir)
+
+    def _write_image(self, name, content):
+        path = os.path.join(self.sdir, name)
+        image_fd = open(path, 'w')
+        image_fd.write(content)
+        image_fd.close()
+        return path
+
+    def test_cache(self):
+        """plotextractor - converted images are taken from the cache"""
+        image = self._write_image('plot.eps', 'plot')
+        cached_image = plotextractor_converter.get_cached_image_name(image)
+        self.assertFalse(os.path.exists(cached_image))
+        self.assertEqual(plotextractor_converter.convert_image(image),
+                         os.path.join(self.sdir, 'plot.png'))
+        self.assertEqual(self.conversions, [image])
+        self.assertEqual(open(cached_image).read(), 'plot')
+        # the same image in another paper is not converted again
+        same_image = self._write_image('same.eps', 'plot')
+        self.assertEqual(
+            plotextractor_converter.get_cached_image_name(same_image),
+            cached_image)
+        self.assertEqual(plotextractor_converter.convert_image(same_image),
+                         os.path.join(self.sdir, 'same.png'))
+        self.assertEqual(self.conversions, [image])
+        self.assertEqual(open(os.path.join(self.sdir, 'same.png')).read(),
+                         'plot')
+        # an image with another content is converted
+        other_image = self._write_image('other.eps', 'other plot')
+        plotextractor_converter.convert_image(other_image)
+        self.assertEqual(self.conversions, [image, other_image])
+
+    def test_pool(self):
+        """plotextractor - images converted in parallel"""
+        images = [self._write_image('plot%d.eps' % i, 'plot %d' % i)
+                  for i in range(5)]
+        images.insert(2, self._write_image('bad.eps', 'bad'))
+        images.insert(4, self._write_image('ready.png', 'png'))
+        images.append(self.sdir)
+        self.assertEqual(plotextractor_converter.convert_images(images,
+                                                                workers=3),
+                         [os.path.join(self.sdir, 'plot%d.png' % i)
+                          for i in range(3)] +
+                         [os.path.join(self.sdir, 'ready.png')] +
+                         [os.path.join(self.sdir, 'plot%d.png' % i)
+                          for i in range(3, 5)])
+        self.assertEqual(sorted(self.conversions),
+                         sorted(images[:4] + images[5:-1]))
+
+    def test_batch_workers(self):
+        """plotextractor - images converted one at a time by parallel tarballs"""
+        calls = []
+        orig_process_single = plotextractor.process_single
+        plotextractor.process_single = \
+            lambda tarball, **kwargs: calls.append((tarball, kwargs))
+        try:
+            plotextractor.process_batch(['a.tar.gz'], workers=2)
+            plotextractor.process_batch(['b.tar.gz', 'c.tar.gz'], workers=2)
+        finally:
+            plotextractor.process_single = orig_process_single
+        self.assertEqual(sorted(calls),
+                         [('a.tar.gz', {'recid': None}),
+                          ('b.tar.gz', {'recid': None,
+                                        'conversion_workers': 1}),
+                          ('c.tar.gz', {'recid': None,
+                                        'conversion_workers': 1})])
+
+
 TEST_SUITE = make_test_suite(PutItTogetherTest, TestFindOpenAndCloseBraces,
                              TestIntelligentlyFindFilenames,
                              TestAssembleCaption, TestRemoveDups,
-                             TestGetConvertedImageName)
+                             TestGetConvertedImageName, TestTeXCache,
+                             TestConvertImages)
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE)
@@ -0,0 +1,45 @@
+## -*- mode: python; coding: utf-8; -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Add the schCHANGE table used by the event driven BibSched."""
+
+from invenio.dbquery import run_sql
+
+depends_on = ['invenio_2014_11_04_format_recjson']
+
+
+def info():
+    """Upgrade recipe information."""
+    return "New table schCHANGE recording BibSched task changes."
+
+
+def do_upgrade():
+    """Upgrade recipe procedure."""
+    run_sql("""CREATE TABLE IF NOT EXISTS schCHANGE (
+  id int(15) unsigned NOT NULL auto_increment,
+  id_schTASK int(15) unsigned NULL default NULL,
+  change_date datetime NOT NULL default '0000-00-00 00:00:00',
+  PRIMARY KEY  (id),
+  KEY change_date (change_date)
+) ENGINE=MyISAM""")
+
+
+def estimate():
+    """Upgrade recipe time estimate."""
+    return 1
@@ -0,0 +1,53 @@
+## -*- mode: python; coding: utf-8; -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Add the aidTORTOISEQUEUE table used by the distributed disambiguation."""
+
+from invenio.dbquery import run_sql
+
+depends_on = ['invenio_2014_11_20_bibsched_schCHANGE']
+
+
+def info():
+    """Upgrade recipe information."""
+    return "New table aidTORTOISEQUEUE holding the last name clusters of the distributed disambiguation."
+
+
+def do_upgrade():
+    """Upgrade recipe procedure."""
+    run_sql("""CREATE TABLE IF NOT EXISTS `aidTORTOISEQUEUE` (
+  `id` INT( 15 ) UNSIGNED NOT NULL AUTO_INCREMENT,
+  `last_name` VARCHAR( 255 ) NOT NULL ,
+  `cost` BIGINT( 20 ) UNSIGNED NOT NULL ,
+  `payload` LONGBLOB NOT NULL ,
+  `status` VARCHAR( 10 ) NOT NULL DEFAULT 'WAITING' ,
+  `worker` VARCHAR( 255 ) NULL DEFAULT NULL ,
+  `attempts` SMALLINT( 6 ) UNSIGNED NOT NULL DEFAULT 0 ,
+  `lease_expires` DATETIME NULL DEFAULT NULL ,
+  `started` DATETIME NULL DEFAULT NULL ,
+  `finished` DATETIME NULL DEFAULT NULL ,
+  `message` TEXT NULL ,
+  PRIMARY KEY  (`id`),
+  INDEX `status-cost-b` (`status`, `cost`)
+) ENGINE=MyISAM""")
+
+
+def estimate():
+    """Upgrade recipe time estimate."""
+    return 1
@@ -0,0 +1,52 @@
+## -*- mode: python; coding: utf-8; -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Add the bibdocfscheck table used by bibdocfile --check-md5."""
+
+from invenio.dbquery import run_sql
+
+depends_on = ['invenio_2014_11_24_aidTORTOISEQUEUE']
+
+
+def info():
+    """Upgrade recipe information."""
+    return "New table bibdocfscheck holding the progress of the checks of the MD5 checksums of the files."
+
+
+def do_upgrade():
+    """Upgrade recipe procedure."""
+    run_sql("""CREATE TABLE IF NOT EXISTS bibdocfscheck (
+  id int(15) unsigned NOT NULL auto_increment,
+  action varchar(20) NOT NULL,
+  arguments text NOT NULL,
+  start_time datetime NOT NULL,
+  last_update datetime NOT NULL,
+  last_docid mediumint(9) unsigned NOT NULL default 0,
+  files int(15) unsigned NOT NULL default 0,
+  bytes bigint(20) unsigned NOT NULL default 0,
+  failures int(15) unsigned NOT NULL default 0,
+  status varchar(10) NOT NULL default 'RUNNING',
+  PRIMARY KEY (id),
+  KEY (action, status)
+) ENGINE=MyISAM""")
+
+
+def estimate():
+    """Upgrade recipe time estimate."""
+    return 1
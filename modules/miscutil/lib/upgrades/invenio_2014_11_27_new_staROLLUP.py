@@ -0,0 +1,51 @@
+## -*- mode: python; coding: utf-8; -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Add the staROLLUP and staROLLUPSTATUS tables used by WebStat."""
+
+from invenio.dbquery import run_sql
+
+depends_on = ['invenio_2014_11_26_new_bibdocfscheck']
+
+
+def info():
+    """Upgrade recipe information."""
+    return "New tables staROLLUP and staROLLUPSTATUS holding the hourly and daily counts of the WebStat events."
+
+
+def do_upgrade():
+    """Upgrade recipe procedure."""
+    run_sql("""CREATE TABLE IF NOT EXISTS staROLLUP (
+  source varchar(50) NOT NULL,
+  granularity varchar(5) NOT NULL,
+  period datetime NOT NULL,
+  count int(15) unsigned NOT NULL default 0,
+  PRIMARY KEY (source, granularity, period)
+) ENGINE=MyISAM""")
+    run_sql("""CREATE TABLE IF NOT EXISTS staROLLUPSTATUS (
+  source varchar(50) NOT NULL,
+  aggregated_until datetime NOT NULL,
+  PRIMARY KEY (source)
+) ENGINE=MyISAM""")
+
+
+def estimate():
+    """Upgrade recipe time estimate."""
+    return 1
+
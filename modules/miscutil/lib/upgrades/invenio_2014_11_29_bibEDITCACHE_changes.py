@@ -0,0 +1,51 @@
+## -*- mode: python; coding: utf-8; -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Store the updates of the BibEdit caches as changes."""
+
+from invenio.dbquery import run_sql
+
+depends_on = ['invenio_2014_11_28_new_bibEDITQUEUE']
+
+
+def info():
+    """Upgrade recipe information."""
+    return "New table bibEDITCACHECHANGES holding the changes of the BibEdit caches since their last full version."
+
+
+def do_upgrade():
+    """Upgrade recipe procedure."""
+    columns = [row[0] for row in run_sql("SHOW COLUMNS FROM bibEDITCACHE")]
+    if 'base_id' not in columns:
+        run_sql("""ALTER TABLE bibEDITCACHE
+  ADD COLUMN base_id int(15) unsigned NOT NULL DEFAULT 0 AFTER is_active,
+  ADD COLUMN nb_changes smallint(5) unsigned NOT NULL DEFAULT 0 AFTER base_id""")
+    run_sql("""CREATE TABLE IF NOT EXISTS bibEDITCACHECHANGES (
+  id_bibrec mediumint(8) unsigned NOT NULL,
+  uid int(15) unsigned NOT NULL,
+  base_id int(15) unsigned NOT NULL,
+  seq smallint(5) unsigned NOT NULL,
+  data LONGBLOB,
+  PRIMARY KEY (id_bibrec, uid, base_id, seq)
+) ENGINE=MyISAM""")
+
+
+def estimate():
+    """Upgrade recipe time estimate."""
+    return 1
@@ -3678,6 +3678,21 @@ CREATE TABLE IF NOT EXISTS bibdocfsinfo (
   KEY (mime)
 ) ENGINE=MyISAM;
 
+CREATE TABLE IF NOT EXISTS bibdocfscheck (
+  id int(15) unsigned NOT NULL auto_increment,
+  action varchar(20) NOT NULL,
+  arguments text NOT NULL,
+  start_time datetime NOT NULL,
+  last_update datetime NOT NULL,
+  last_docid mediumint(9) unsigned NOT NULL default 0,
+  files int(15) unsigned NOT NULL default 0,
+  bytes bigint(20) unsigned NOT NULL default 0,
+  failures int(15) unsigned NOT NULL default 0,
+  status varchar(10) NOT NULL default 'RUNNING',
+  PRIMARY KEY (id),
+  KEY (action, status)
+) ENGINE=MyISAM;
+
 -- tables for publication requests:
 
 CREATE TABLE IF NOT EXISTS publreq (
@@ -4307,6 +4322,14 @@ CREATE TABLE IF NOT EXISTS schTASK (
   KEY sequenceid (sequenceid)
 ) ENGINE=MyISAM;
 
+CREATE TABLE IF NOT EXISTS schCHANGE (
+  id int(15) unsigned NOT NULL auto_increment,
+  id_schTASK int(15) unsigned NULL default NULL,
+  change_date datetime NOT NULL default '0000-00-00 00:00:00',
+  PRIMARY KEY  (id),
+  KEY change_date (change_date)
+) ENGINE=MyISAM;
+
 -- FIXME, To be moved to redis when available
 CREATE TABLE IF NOT EXISTS schSTATUS (
   name varchar(50),
@@ -4375,6 +4398,20 @@ CREATE TABLE IF NOT EXISTS staEVENT (
   UNIQUE KEY number (number)
 ) ENGINE=MyISAM;
 
+CREATE TABLE IF NOT EXISTS staROLLUP (
+  source varchar(50) NOT NULL,
+  granularity varchar(5) NOT NULL,
+  period datetime NOT NULL,
+  count int(15) unsigned NOT NULL default 0,
+  PRIMARY KEY (source, granularity, period)
+) ENGINE=MyISAM;
+
+CREATE TABLE IF NOT EXISTS staROLLUPSTATUS (
+  source varchar(50) NOT NULL,
+  aggregated_until datetime NOT NULL,
+  PRIMARY KEY (source)
+) ENGINE=MyISAM;
+
 -- BibClassify tables:
 
 CREATE TABLE IF NOT EXISTS clsMETHOD (
@@ -4805,6 +4842,22 @@ CREATE TABLE IF NOT EXISTS `aidTOKEN` (
   `was_changed` SMALLINT( 6 ) NOT NULL
 ) ENGINE=MyISAM;
 
+CREATE TABLE IF NOT EXISTS `aidTORTOISEQUEUE` (
+  `id` INT( 15 ) UNSIGNED NOT NULL AUTO_INCREMENT,
+  `last_name` VARCHAR( 255 ) NOT NULL ,
+  `cost` BIGINT( 20 ) UNSIGNED NOT NULL ,
+  `payload` LONGBLOB NOT NULL ,
+  `status` VARCHAR( 10 ) NOT NULL DEFAULT 'WAITING' ,
+  `worker` VARCHAR( 255 ) NULL DEFAULT NULL ,
+  `attempts` SMALLINT( 6 ) UNSIGNED NOT NULL DEFAULT 0 ,
+  `lease_expires` DATETIME NULL DEFAULT NULL ,
+  `started` DATETIME NULL DEFAULT NULL ,
+  `finished` DATETIME NULL DEFAULT NULL ,
+  `message` TEXT NULL ,
+  PRIMARY KEY  (`id`),
+  INDEX `status-cost-b` (`status`, `cost`)
+) ENGINE=MyISAM;
+
 -- tables for search engine
 
 CREATE TABLE IF NOT EXISTS `aidDENSEINDEX` (
@@ -4989,10 +5042,33 @@ CREATE TABLE IF NOT EXISTS `bibEDITCACHE` (
   `data` LONGBLOB,
   `post_date` datetime NOT NULL,
   `is_active` tinyint(1) NOT NULL DEFAULT 1,
+  `base_id` int(15) unsigned NOT NULL DEFAULT 0,
+  `nb_changes` smallint(5) unsigned NOT NULL DEFAULT 0,
   PRIMARY KEY (`id_bibrec`, `uid`),
   INDEX `post_date` (`post_date`)
 ) ENGINE=MyISAM;
 
+-- changes of the BibEdit caches since their last full version:
+CREATE TABLE IF NOT EXISTS `bibEDITCACHECHANGES` (
+  `id_bibrec` mediumint(8) unsigned NOT NULL,
+  `uid` int(15) unsigned NOT NULL,
+  `base_id` int(15) unsigned NOT NULL,
+  `seq` smallint(5) unsigned NOT NULL,
+  `data` LONGBLOB,
+  PRIMARY KEY (`id_bibrec`, `uid`, `base_id`, `seq`)
+) ENGINE=MyISAM;
+
+-- identifiers of the records uploaded by the queued bibupload tasks,
+-- used by BibEdit to lock the records (an empty id_type marks an
+-- indexed task):
+CREATE TABLE IF NOT EXISTS `bibEDITQUEUE` (
+  `id_schTASK` int(15) unsigned NOT NULL,
+  `id_type` varchar(10) NOT NULL default '',
+  `id_value` varchar(255) NOT NULL default '',
+  INDEX `id_schTASK` (`id_schTASK`),
+  INDEX `id` (`id_type`, `id_value`(100))
+) ENGINE=MyISAM;
+
 -- tables for goto:
 CREATE TABLE IF NOT EXISTS goto (
   label varchar(150) NOT NULL,
@@ -5163,4 +5239,10 @@ INSERT INTO upgrade (upgrade, applied) VALUES ('invenio_2014_04_15_bibrec_earlie
 INSERT INTO upgrade (upgrade, applied) VALUES ('invenio_2014_10_28_remove_author_duplicates',NOW());
 INSERT INTO upgrade (upgrade, applied) VALUES ('invenio_2014_10_14_new_aidTOKEN', NOW());
 INSERT INTO upgrade (upgrade, applied) VALUES ('invenio_2014_11_04_format_recjson',NOW());
+INSERT INTO upgrade (upgrade, applied) VALUES ('invenio_2014_11_20_bibsched_schCHANGE',NOW());
+INSERT INTO upgrade (upgrade, applied) VALUES ('invenio_2014_11_24_aidTORTOISEQUEUE',NOW());
+INSERT INTO upgrade (upgrade, applied) VALUES ('invenio_2014_11_26_new_bibdocfscheck',NOW());
+INSERT INTO upgrade (upgrade, applied) VALUES ('invenio_2014_11_27_new_staROLLUP',NOW());
+INSERT INTO upgrade (upgrade, applied) VALUES ('invenio_2014_11_28_new_bibEDITQUEUE',NOW());
+INSERT INTO upgrade (upgrade, applied) VALUES ('invenio_2014_11_29_bibEDITCACHE_changes',NOW());
 -- end of file
@@ -496,6 +496,7 @@ DROP TABLE IF EXISTS bibdoc_bibdoc;
 DROP TABLE IF EXISTS bibdocmoreinfo;
 DROP TABLE IF EXISTS bibrec_bibdoc;
 DROP TABLE IF EXISTS bibdocfsinfo;
+DROP TABLE IF EXISTS bibdocfscheck;
 DROP TABLE IF EXISTS usergroup;
 DROP TABLE IF EXISTS user_usergroup;
 DROP TABLE IF EXISTS user_basket;
@@ -514,6 +515,8 @@ DROP TABLE IF EXISTS collection_externalcollection;
 DROP TABLE IF EXISTS externalcollection;
 DROP TABLE IF EXISTS collectiondetailedrecordpagetabs;
 DROP TABLE IF EXISTS staEVENT;
+DROP TABLE IF EXISTS staROLLUP;
+DROP TABLE IF EXISTS staROLLUPSTATUS;
 DROP TABLE IF EXISTS clsMETHOD;
 DROP TABLE IF EXISTS collection_clsMETHOD;
 DROP TABLE IF EXISTS jrnJOURNAL;
@@ -549,6 +552,7 @@ DROP TABLE IF EXISTS aidPERSONIDPAPERS;
 DROP TABLE IF EXISTS aidRESULTS;
 DROP TABLE IF EXISTS aidAFFILIATIONS;
 DROP TABLE IF EXISTS aidTOKEN;
+DROP TABLE IF EXISTS aidTORTOISEQUEUE;
 DROP TABLE IF EXISTS xtrJOB;
 DROP TABLE IF EXISTS bsrMETHOD;
 DROP TABLE IF EXISTS bsrMETHODNAME;
@@ -568,8 +572,11 @@ DROP TABLE IF EXISTS upgrade;
 DROP TABLE IF EXISTS goto;
 DROP TABLE IF EXISTS rnkSELFCITEDICT;
 DROP TABLE IF EXISTS schSTATUS;
+DROP TABLE IF EXISTS schCHANGE;
 DROP TABLE IF EXISTS oauth1_storage;
 DROP TABLE IF EXISTS bibEDITCACHE;
+DROP TABLE IF EXISTS bibEDITCACHECHANGES;
+DROP TABLE IF EXISTS bibEDITQUEUE;
 DROP TABLE IF EXISTS aulPAPERS;
 DROP TABLE IF EXISTS aulREFERENCES;
 DROP TABLE IF EXISTS aulAUTHORS;
@@ -38,6 +38,9 @@ import tempfile
 import urlparse
 import random
 import traceback
+import threading
+import Queue
+import cPickle
 
 from invenio.search_engine import get_record
 from invenio.config import \
@@ -49,7 +52,10 @@ from invenio.config import \
      CFG_OAI_FAILED_HARVESTING_EMAILS_ADMIN, \
      CFG_SITE_SUPPORT_EMAIL, \
      CFG_TMPDIR, \
-     CFG_BIBUPLOAD_EXTERNAL_OAIID_TAG
+     CFG_BIBUPLOAD_EXTERNAL_OAIID_TAG, \
+     CFG_OAI_POSTPROCESS_WORKERS, \
+     CFG_OAI_POSTPROCESS_QUEUE_SIZE, \
+     CFG_OAI_HARVEST_CONCURRENT_REPOSITORIES
 from invenio.oai_harvest_config import InvenioOAIHarvestWarning
 from invenio.dbquery import deserialize_via_marshal
 from invenio.bibtask import \
@@ -72,7 +78,9 @@ from invenio import oai_harvest_getter
 from invenio.errorlib import register_exception
 from invenio.plotextractor_getter import harvest_single, make_single_directory
 from invenio.plotextractor_converter import untar
-from invenio.plotextractor import process_single, get_defaults
+from invenio.plotextractor import process_single, get_defaults, \
+                                  get_throughput_message
+from invenio.refextract_batch import RefextractPool
 from invenio.shellutils import run_shell_command, Timeout
 from invenio.bibedit_utils import record_find_matching_fields
 from invenio.bibcatalog import BIBCATALOG_SYSTEM
@@ -89,7 +97,8 @@ from invenio.oai_harvest_utils import get_nb_records_in_file, \
                                       compare_timestamps_with_tolerance, \
                                       generate_harvest_report, \
                                       record_collect_oai_identifiers, \
-                                      record_collect_recid
+                                      record_collect_recid, \
+                                      map_records
 from invenio.webuser import email_valid_p
 from invenio.mailutils import send_email
 
@@ -99,12 +108,29 @@ oaiharvest_templates = invenio.template.load('oai_harvest')
 ## precompile some often-used regexp for speed reasons:
 REGEXP_OAI_ID = re.compile("<identifier.*?>(.*?)<\/identifier>", re.DOTALL)
 REGEXP_RECORD = re.compile("<record.*?>(.*?)</record>", re.DOTALL)
-REGEXP_REFS = re.compile("<record.*?>.*?<controlfield .*?>.*?</controlfield>(.*?)</record>", re.DOTALL)
+REGEXP_REFS = re.compile("<record>(.*?)</record>", re.DOTALL)
 REGEXP_AUTHLIST = re.compile("<collaborationauthorlist.*?</collaborationauthorlist>", re.DOTALL)
 
 
 ALLOWED_AUTHOREXTRACT_CATEGORIES = ['hep-ex', 'nucl-ex', 'astro-ph', 'physics.ins-det']
 
+## Pool of processes extracting the references during the whole
+## harvest run (see call_refextract)
+_REFEXTRACT_POOL = None
+
+
+def _stop_refextract_pool(terminate=False):
+    """Stop the pool of processes extracting the references, if any."""
+    global _REFEXTRACT_POOL
+    if _REFEXTRACT_POOL is not None:
+        if terminate:
+            _REFEXTRACT_POOL.terminate()
+        else:
+            _REFEXTRACT_POOL.close()
+        write_message(_REFEXTRACT_POOL.get_report(), verbose=3)
+        _REFEXTRACT_POOL = None
+
+
 def task_run_core():
     """Run the harvesting task.  The row argument is the oaiharvest task
     queue row, containing if, arguments, etc.
@@ -143,119 +169,52 @@ def task_run_core():
     # 0: no error
     # 1: "recoverable" error (don't stop queue)
     # 2: error (admin intervention needed)
-    error_happened_p = 0
+    error_codes = [0]
 
-    j = 0
-    for repository in reposlist:
-        j += 1
+    def run_harvest(j, repository):
         current_progress = "(%i/%i)" % (j, len(reposlist))
-        task_sleep_now_if_required()
-        if repository['arguments']:
-            repository['arguments'] = deserialize_via_marshal(repository['arguments'])
-
-        write_message("running with post-processes: %s" % (repository["postprocess"],))
-
-        downloaded_material_dict = {}
-
-        # Harvest phase
-        harvested_files_list = []
         harvestpath = "%s_%d_%s_" % (filepath_prefix, j, time.strftime("%Y%m%d%H%M%S"))
-        harvest_start_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-        harvested_files_list, error_code = harvest_step(repository, harvestpath, identifiers, datelist, current_progress)
-        if harvested_files_list == None or len(harvested_files_list) < 1:
-            if error_code:
-                error_happened_p = error_code
-                write_message("Error while harvesting %s. Skipping." % (repository["name"],))
-            else:
-                write_message("No records harvested for %s" % (repository["name"],))
-            continue
-
-        # Retrieve all OAI IDs and set active list
-        harvested_identifier_list = collect_identifiers(harvested_files_list)
-        active_files_list = harvested_files_list
-        if len(active_files_list) != len(harvested_identifier_list):
-            # Harvested files and its identifiers are 'out of sync', abort harvest
-            write_message("Harvested files miss identifiers for %s" % (repository["name"],))
-            continue
-
-        # Harvesting done, now convert/extract/filter/upload as requested
-        write_message("post-harvest processes started")
-
-        post_process_functions = []
-
-        # Convert?
-        if 'c' in repository["postprocess"]:
-            post_process_functions.append(convert_step)
-
-        # Authorlist?
-        if 'a' in repository["postprocess"]:
-            post_process_functions.append(authorlist_step)
-
-        # Filter?
-        if 'f' in repository["postprocess"]:
-            post_process_functions.append(filter_step)
-
-        # Fulltext?
-        if 't' in repository["postprocess"]:
-            post_process_functions.append(fulltext_step)
-
-        # Plotextract?
-        if 'p' in repository["postprocess"]:
-            post_process_functions.append(plotextract_step)
-
-        # Refextract?
-        if 'r' in repository["postprocess"]:
-            post_process_functions.append(refextract_step)
-
-        # Upload?
-        if 'u' in repository["postprocess"]:
-            post_process_functions.append(upload_step)
-
-        uploaded_task_ids = []
-
-        # Run the post-process functions
-        for fun in post_process_functions:
-            active_files_list, error_code = fun(repository=repository, \
-                                                active_files_list=active_files_list, \
-                                                downloaded_material_dict=downloaded_material_dict, \
-                                                uploaded_task_ids=uploaded_task_ids)
-            if error_code:
-                error_happened_p = error_code
-                continue
-            # print stats:
-            for active_files in active_files_list:
-                write_message("File %s contains %i records." % \
-                              (active_files,
-                               get_nb_records_in_file(active_files)))
-        write_message("post-harvest processes ended")
-
-        # We got this far. Now we can actually update the last_run
-        if not datelist and not identifiers and repository["frequency"] != 0:
-            update_lastrun(repository["id"],
-                           runtime=harvest_start_time)
-
-        # Generate reports
-        ticket_queue = task_get_option("create-ticket-in")
-        notification_email = task_get_option("notify-email-to")
-        if ticket_queue or notification_email:
-            subject, text = generate_harvest_report(repository, harvested_identifier_list, \
-                                                    uploaded_task_ids, active_files_list, \
-                                                    task_specific_name=task_get_task_param("task_specific_name") or "", \
-                                                    current_task_id=task_get_task_param("task_id"), \
-                                                    manual_harvest=bool(identifiers), \
-                                                    error_happened=bool(error_happened_p))
-            # Create ticket for finished harvest?
-            if ticket_queue:
-                ticketid = create_ticket(ticket_queue, subject=subject, text=text)
-                if ticketid:
-                    write_message("Ticket %s submitted." % (str(ticketid),))
-
-            # Send e-mail for finished harvest?
-            if notification_email:
-                send_email(fromaddr=CFG_SITE_SUPPORT_EMAIL, \
-                           toaddr=notification_email, \
-                           subject=subject, \
-                           content=text)
+        try:
+            error_codes.append(harvest_repository(repository, harvestpath, identifiers, \
+                                                  datelist, current_progress))
+        except Exception:
+            register_exception(alert_admin=True)
+            write_message("Error while harvesting %s." % (repository["name"],))
+            error_codes.append(1)
+
+    # The processes extracting the references are forked once for the
+    # whole run, before any harvest or post-process thread is started:
+    # forking a multi-threaded process may deadlock the children.
+    global _REFEXTRACT_POOL
+    if [repository for repository in reposlist if 'r' in repository["postprocess"]]:
+        _REFEXTRACT_POOL = RefextractPool(workers=CFG_OAI_POSTPROCESS_WORKERS.get('r', 1))
+
+    # Harvest up to CFG_OAI_HARVEST_CONCURRENT_REPOSITORIES
+    # repositories at the same time
+    pending_repositories = list(enumerate(reposlist))
+    running_threads = []
+    try:
+        while pending_repositories or running_threads:
+            task_sleep_now_if_required()
+            running_threads = [thread for thread in running_threads if thread.isAlive()]
+            while pending_repositories and \
+                  len(running_threads) < CFG_OAI_HARVEST_CONCURRENT_REPOSITORIES:
+                j, repository = pending_repositories.pop(0)
+                if CFG_OAI_HARVEST_CONCURRENT_REPOSITORIES <= 1:
+                    run_harvest(j + 1, repository)
+                    break
+                thread = threading.Thread(target=run_harvest, args=(j + 1, repository))
+                thread.setDaemon(True)
+                thread.start()
+                running_threads.append(thread)
+            if running_threads:
+                running_threads[0].join(1)
+    except:
+        # The task is stopped: do not wait for the pending extractions
+        _stop_refextract_pool(terminate=True)
+        raise
+    _stop_refextract_pool()
+    error_happened_p = max(error_codes)
 
     # All records from all repositories harvested. Check for any errors.
     if error_happened_p:
@@ -281,14 +240,196 @@ def task_run_core():
         return True
 
 
-def harvest_by_identifiers(repository, identifiers, harvestpath):
+def harvest_repository(repository, harvestpath, identifiers, datelist, current_progress=""):
+    """
+    Harvest a repository and run its post-processes on the harvested
+    files as soon as they are downloaded.
+
+    Returns the error code:
+        0: no error
+        1: "recoverable" error (don't stop queue)
+        2: error (admin intervention needed)
+    """
+    error_happened_p = 0
+    if repository['arguments']:
+        repository['arguments'] = deserialize_via_marshal(repository['arguments'])
+
+    write_message("running with post-processes: %s" % (repository["postprocess"],))
+
+    uploaded_task_ids = []
+    downloaded_material_dict = HarvestedMaterial(get_material_selection(repository["postprocess"]))
+    pipeline = PostProcessPipeline(repository, \
+                                   get_post_process_steps(repository, uploaded_task_ids), \
+                                   downloaded_material_dict)
+    checkpoint = HarvestCheckpoint(repository)
+    harvested_identifier_list = []
+
+    def harvested_page(harvested_file, dummy_resume=None):
+        # Retrieve all OAI IDs and post-process the file
+        identifier_list = collect_identifiers([harvested_file])
+        if not identifier_list:
+            # Harvested file and its identifiers are 'out of sync', skip it
+            write_message("Harvested file %s misses identifiers for %s" % \
+                          (harvested_file, repository["name"]))
+            return
+        harvested_identifier_list.append(identifier_list[0])
+        pipeline.put(harvested_file)
+
+    # Harvest phase, the post-process steps start with the first harvested file
+    write_message("post-harvest processes started")
+    pipeline.start()
+    dummy, error_code = harvest_step(repository, harvestpath, identifiers, \
+                                     datelist, current_progress, \
+                                     page_callback=harvested_page, \
+                                     checkpoint=checkpoint)
+    pipeline.close()
+    active_files_list, post_process_error_code = pipeline.wait()
+    # print stats:
+    for active_files in active_files_list:
+        write_message("File %s contains %i records." % \
+                      (active_files,
+                       get_nb_records_in_file(active_files)))
+    write_message("post-harvest processes ended")
+
+    if error_code:
+        # The files harvested so far have been processed: the next run
+        # will go on with the rest of the harvest.
+        checkpoint.forget_harvested_files()
+        write_message("Error while harvesting %s. Skipping." % (repository["name"],))
+        return error_code
+    checkpoint.remove()
+    if not harvested_identifier_list:
+        write_message("No records harvested for %s" % (repository["name"],))
+        return 0
+    if post_process_error_code:
+        error_happened_p = post_process_error_code
+
+    # We got this far. Now we can actually update the last_run
+    if not datelist and not identifiers and repository["frequency"] != 0:
+        update_lastrun(repository["id"],
+                       runtime=checkpoint.harvest_start_time)
+
+    # Generate reports
+    ticket_queue = task_get_option("create-ticket-in")
+    notification_email = task_get_option("notify-email-to")
+    if ticket_queue or notification_email:
+        subject, text = generate_harvest_report(repository, harvested_identifier_list, \
+                                                uploaded_task_ids, active_files_list, \
+                                                task_specific_name=task_get_task_param("task_specific_name") or "", \
+                                                current_task_id=task_get_task_param("task_id"), \
+                                                manual_harvest=bool(identifiers), \
+                                                error_happened=bool(error_happened_p))
+        # Create ticket for finished harvest?
+        if ticket_queue:
+            ticketid = create_ticket(ticket_queue, subject=subject, text=text)
+            if ticketid:
+                write_message("Ticket %s submitted." % (str(ticketid),))
+
+        # Send e-mail for finished harvest?
+        if notification_email:
+            send_email(fromaddr=CFG_SITE_SUPPORT_EMAIL, \
+                       toaddr=notification_email, \
+                       subject=subject, \
+                       content=text)
+    return error_happened_p
+
+
+class HarvestCheckpoint(object):
+    """
+    Progress of the harvest of a repository, saved after every
+    harvested file so that the next run can resume an interrupted
+    harvest: the files harvested so far are post-processed again and
+    the harvest goes on from the last resumption token.
+    """
+
+    def __init__(self, repository):
+        self.path = os.path.join(CFG_TMPDIR, "oaiharvest_checkpoint_%s" % (repository["id"],))
+        self.request = None
+        self.harvest_start_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+        self.harvested_files = []
+        ## (set, resumption token, request number) to go on with, see
+        ## oai_harvest_getter.harvest
+        self.resume = None
+        self.complete = False
+
+    def start(self, request):
+        """
+        Start the harvest of the given request (any picklable description
+        of it), taking over the saved state of an interrupted harvest of
+        the same request.
+
+        @return: True if an interrupted harvest is resumed
+        """
+        self.request = request
+        try:
+            checkpoint_fd = open(self.path, 'rb')
+            try:
+                state = cPickle.load(checkpoint_fd)
+            finally:
+                checkpoint_fd.close()
+        except (IOError, EOFError, ValueError, cPickle.UnpicklingError):
+            return False
+        if state.get('request') != request or \
+           not (state['resume'] or state['complete'] or state['harvested_files']):
+            return False
+        self.harvest_start_time = state['harvest_start_time']
+        self.harvested_files = [harvested_file for harvested_file in state['harvested_files']
+                                if os.path.exists(harvested_file)]
+        self.resume = state['resume']
+        self.complete = state['complete']
+        return True
+
+    def restart(self):
+        """Forget the resumed state and start the harvest from scratch."""
+        self.resume = None
+        self.complete = False
+        self.save()
+
+    def harvested(self, harvested_file, resume):
+        """
+        Record a harvested file along with the position to resume
+        the harvest from (None when the harvest is complete).
+        """
+        self.harvested_files.append(harvested_file)
+        self.resume = resume
+        self.complete = resume is None
+        self.save()
+
+    def forget_harvested_files(self):
+        """Record that the harvested files have been processed."""
+        self.harvested_files = []
+        self.save()
+
+    def save(self):
+        """Atomically store the checkpoint."""
+        state = {'request': self.request,
+                 'harvest_start_time': self.harvest_start_time,
+                 'harvested_files': self.harvested_files,
+                 'resume': self.resume,
+                 'complete': self.complete}
+        tmp_path = self.path + '.tmp'
+        checkpoint_fd = open(tmp_path, 'wb')
+        try:
+            cPickle.dump(state, checkpoint_fd, -1)
+        finally:
+            checkpoint_fd.close()
+        os.rename(tmp_path, self.path)
+
+    def remove(self):
+        """Remove the checkpoint, once the harvest is over."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def harvest_by_identifiers(repository, identifiers, harvestpath, page_callback=None):
     """
     Harvest an OAI repository by identifiers.
 
     Given a repository "object" (dict from DB) and a list of OAI identifiers
     of records in the repository perform a OAI harvest using GetRecord for each.
 
-    The records will be harvested into the specified filepath.
+    The records will be harvested into the specified filepath, and
+    page_callback, if given, called with each harvested file.
     """
     harvested_files_list = []
     count = 0
@@ -304,7 +445,8 @@ def harvest_by_identifiers(repository, identifiers, harvestpath):
                                                         baseurl=repository["baseurl"],
                                                         harvestpath=harvestpath,
                                                         verb="GetRecord",
-                                                        identifier=oai_identifier))
+                                                        identifier=oai_identifier,
+                                                        page_callback=page_callback))
         except StandardError:
             # exception already dealt with, just noting the error.
             error_happened = 1
@@ -315,7 +457,8 @@ def harvest_by_identifiers(repository, identifiers, harvestpath):
     return harvested_files_list, error_happened
 
 
-def harvest_by_dates(repository, harvestpath, fromdate=None, todate=None, progress=""):
+def harvest_by_dates(repository, harvestpath, fromdate=None, todate=None, progress="",
+                     page_callback=None, checkpoint=None):
     """
     Harvest an OAI repository by dates.
 
@@ -327,7 +470,12 @@ def harvest_by_dates(repository, harvestpath, fromdate=None, todate=None, progre
     If you set fromdate == last-run and todate == None, then the repository
     will be harvested since last time (most common type).
 
-    The records will be harvested into the specified filepath.
+    The records will be harvested into the specified filepath, and
+    page_callback, if given, called with each harvested file.
+
+    If a L{HarvestCheckpoint} is given, the harvest of the same dates
+    interrupted during a previous run is resumed: page_callback is first
+    called with the files harvested at that time.
     """
     if fromdate and todate:
         dates = "from %s to %s" % (fromdate, todate)
@@ -340,23 +488,65 @@ def harvest_by_dates(repository, harvestpath, fromdate=None, todate=None, progre
                          (repository["name"], \
                           dates,
                           progress))
+
+    file_list = []
+    resume = None
+    harvested_page = page_callback
+    if checkpoint is not None:
+        if checkpoint.start((repository["baseurl"], repository["metadataprefix"],
+                             repository["setspecs"], fromdate, todate)):
+            write_message("resuming the interrupted harvest of %s %s" % \
+                          (repository["name"], dates))
+            file_list.extend(checkpoint.harvested_files)
+            if page_callback is not None:
+                for harvested_file in checkpoint.harvested_files:
+                    page_callback(harvested_file)
+            if checkpoint.complete:
+                return file_list, 0
+            resume = checkpoint.resume
+
+        def harvested_page(harvested_file, resume=None):
+            checkpoint.harvested(harvested_file, resume)
+            if page_callback is not None:
+                page_callback(harvested_file)
+
     try:
-        file_list = oai_harvest_get(prefix=repository["metadataprefix"],
-                                    baseurl=repository["baseurl"],
-                                    harvestpath=harvestpath,
-                                    fro=fromdate,
-                                    until=todate,
-                                    setspecs=repository["setspecs"])
-    except StandardError:
+        try:
+            file_list.extend(oai_harvest_get(prefix=repository["metadataprefix"],
+                                             baseurl=repository["baseurl"],
+                                             harvestpath=harvestpath,
+                                             fro=fromdate,
+                                             until=todate,
+                                             setspecs=repository["setspecs"],
+                                             page_callback=harvested_page,
+                                             resume=resume,
+                                             previous_files=file_list))
+        except oai_harvest_getter.InvenioOAIBadResumptionTokenError:
+            # The repository does not accept the saved resumption token
+            # any longer: harvest everything again
+            write_message("cannot resume the harvest of %s, starting again" % \
+                          (repository["name"],))
+            checkpoint.restart()
+            file_list.extend(oai_harvest_get(prefix=repository["metadataprefix"],
+                                             baseurl=repository["baseurl"],
+                                             harvestpath=harvestpath,
+                                             fro=fromdate,
+                                             until=todate,
+                                             setspecs=repository["setspecs"],
+                                             page_callback=harvested_page,
+                                             previous_files=file_list))
+    except (StandardError, oai_harvest_getter.InvenioOAIRequestError):
         # exception already dealt with, just noting the error.
         return [], 1
 
     return file_list, 0
 
 
-def harvest_step(repository, harvestpath, identifiers, dates, current_progress):
+def harvest_step(repository, harvestpath, identifiers, dates, current_progress,
+                 page_callback=None, checkpoint=None):
     """
-    Performs the entire harvesting step.
+    Performs the entire harvesting step.  See harvest_by_dates for
+    page_callback and checkpoint.
 
     Returns a tuple of (file_list, error_code)
     """
@@ -365,7 +555,8 @@ def harvest_step(repository, harvestpath, identifiers, dates, current_progress):
         # Harvesting is done per identifier instead of server-updates
         write_message("about to harvest %d identifiers: %s" % \
                      (len(identifiers), ",".join(identifiers[:20],)))
-        harvested_files_list, error_code = harvest_by_identifiers(repository, identifiers, harvestpath)
+        harvested_files_list, error_code = harvest_by_identifiers(repository, identifiers, harvestpath, \
+                                                                  page_callback=page_callback)
         if error_code:
             return [], error_code
         write_message("all records harvested from %s" % \
@@ -379,7 +570,9 @@ def harvest_step(repository, harvestpath, identifiers, dates, current_progress):
                                                             harvestpath, \
                                                             str(dates[0]), \
                                                             str(dates[1]), \
-                                                            current_progress)
+                                                            current_progress, \
+                                                            page_callback=page_callback, \
+                                                            checkpoint=checkpoint)
         if error_code:
             return [], error_code
         write_message("source %s was successfully harvested" % \
@@ -389,7 +582,10 @@ def harvest_step(repository, harvestpath, identifiers, dates, current_progress):
         # First time we harvest from this repository
         write_message("source %s was never harvested before - harvesting whole repository" % \
                       (repository["name"],))
-        harvested_files_list, error_code = harvest_by_dates(repository, harvestpath, current_progress)
+        harvested_files_list, error_code = harvest_by_dates(repository, harvestpath, \
+                                                            progress=current_progress, \
+                                                            page_callback=page_callback, \
+                                                            checkpoint=checkpoint)
         if error_code:
             return [], error_code
         write_message("source %s was successfully harvested" % \
@@ -414,7 +610,9 @@ def harvest_step(repository, harvestpath, identifiers, dates, current_progress):
             fromdate = fromdate.split()[0]
             harvested_files_list, error_code = harvest_by_dates(repository, harvestpath, \
                                                                 fromdate=fromdate, \
-                                                                progress=current_progress)
+                                                                progress=current_progress, \
+                                                                page_callback=page_callback, \
+                                                                checkpoint=checkpoint)
             if error_code:
                 return [], error_code
             write_message("source %s was successfully harvested" % \
@@ -430,250 +628,410 @@ def harvest_step(repository, harvestpath, identifiers, dates, current_progress):
     return harvested_files_list, 0
 
 
-def convert_step(repository, active_files_list, *args, **kwargs):
+def get_material_selection(postprocess):
     """
-    Performs the conversion step.
+    Return the material (tarball and/or pdf) the given post-process
+    modes need to download for every harvested record.
     """
-    updated_files_list = []
-    i = 0
-    final_exit_code = 0
-    write_message("conversion step started")
-    for active_file in active_files_list:
-        i += 1
-        task_sleep_now_if_required()
-        task_update_progress("Converting material harvested from %s (%i/%i)" % \
-                             (repository["name"], \
-                              i, \
-                              len(active_files_list)))
-        updated_file = "%s.converted" % (os.path.splitext(active_file)[0],)
-        updated_files_list.append(updated_file)
-        (exitcode, err_msg) = call_bibconvert(config=repository["arguments"]['c_stylesheet'],
-                                              harvestpath=active_file,
-                                              convertpath=updated_file)
-        if exitcode == 0:
-            write_message("harvested file %s was successfully converted" % \
-                          (active_file,))
-        else:
-            write_message("an error occurred while converting %s:\n%s" % \
-                          (active_file, err_msg))
-            final_exit_code = 1
-            continue
+    selection = []
+    if 'p' in postprocess or 'a' in postprocess:
+        selection.append("tarball")
+    if 'r' in postprocess or 't' in postprocess:
+        selection.append("pdf")
+    return selection
 
-    write_message("conversion step ended")
-    return updated_files_list, final_exit_code
 
-
-def plotextract_step(repository, active_files_list, downloaded_material_dict, *args, **kwargs):
+class HarvestedMaterial(dict):
     """
-    Performs the plotextraction step.
+    Dictionary of OAI identifier -> dict mappings for the material
+    downloaded for each harvested record ("tarball", "pdf" and
+    "tarball-extracted"), shared by the post-process steps.
+
+    The first step needing any material of a record downloads all the
+    material of the given selection at once, so that the other steps
+    find it already there.  Downloads are done one at a time, as the
+    source expects (see CFG_PLOTEXTRACTOR_DOWNLOAD_TIMEOUT), while the
+    records of different steps are processed in parallel.
     """
-    write_message("plotextraction step started")
-    if not repository["arguments"]['p_extraction-source']:
-        # No plotextractor type chosen, exit with failure
-        write_message("Error: No plotextractor source type chosen!")
-        return [], 1
 
-    final_exit_code = 0
+    def __init__(self, selection=("tarball", "pdf")):
+        dict.__init__(self)
+        self.selection = list(selection)
+        self.failed = set()
+        self.lock = threading.Lock()
+        self.download_lock = threading.Lock()
+        self.identifier_locks = {}
+
+    def get_material(self, identifier, active_file, material):
+        """
+        Return the path to the given material ("tarball" or "pdf") of the
+        record, downloading it if needed.
+
+        @return: exitcode, error message and path, as:
+            (exitcode, err_msg, path)
+        """
+        self.lock.acquire()
+        try:
+            identifier_lock = self.identifier_locks.setdefault(identifier, threading.Lock())
+            record_material = self.setdefault(identifier, {})
+        finally:
+            self.lock.release()
 
-    # Download tarball for each harvested/converted record, then run plotextrator.
-    # Update converted xml files with generated xml or add it for upload
-    updated_files_list = []
-    i = 0
-    for active_file in active_files_list:
-        i += 1
-        task_sleep_now_if_required()
-        task_update_progress("Extracting plots from harvested material from %s (%i/%i)" %
-                             (repository["name"], i, len(active_files_list)))
-        if 'f' in repository["postprocess"] and ".append." in active_file:
-            # Only process insert or correct records
-            updated_files_list.append(active_file)
-            continue
-        write_message("Insert/Correct detected (%s): extracting plots." % (active_file,))
-        updated_file = "%s.plotextracted" % (os.path.splitext(active_file)[0],)
-        updated_files_list.append(updated_file)
-        (exitcode, err_msg) = call_plotextractor(active_file,
-                                                 updated_file,
-                                                 downloaded_material_dict,
-                                                 repository["arguments"]['p_extraction-source'],
-                                                 repository["id"])
-        if exitcode == 0:
-            if err_msg != "":
-                write_message("plots from %s was extracted, but with some errors:\n%s" % \
-                          (active_file, err_msg))
-            else:
-                write_message("plots from %s was successfully extracted" % \
-                              (active_file,))
-        else:
-            write_message("an error occurred while extracting plots from %s:\n%s" % \
-                          (active_file, err_msg))
-            final_exit_code = 1
-            continue
+        identifier_lock.acquire()
+        try:
+            if material not in record_material and (identifier, material) not in self.failed:
+                selection = [name for name in self.selection
+                             if name not in record_material and
+                             (identifier, name) not in self.failed]
+                if material not in selection:
+                    selection.append(material)
+                self.download_lock.acquire()
+                try:
+                    dummy, dummy, tarball, pdf = \
+                        plotextractor_harvest(identifier, active_file, selection=selection)
+                finally:
+                    self.download_lock.release()
+                for name, path in (("tarball", tarball), ("pdf", pdf)):
+                    if name in selection:
+                        if path is None:
+                            self.failed.add((identifier, name))
+                        else:
+                            record_material[name] = path
+        finally:
+            identifier_lock.release()
 
-    return updated_files_list, final_exit_code
+        if material in record_material:
+            return 0, "", record_material[material]
+        if material == "pdf":
+            material = "full-text"
+        return 1, "Error harvesting %s from id: %s" % (material, identifier), None
 
 
-def refextract_step(repository, active_files_list, downloaded_material_dict, *args, **kwargs):
+def get_post_process_steps(repository, uploaded_task_ids):
     """
-    Performs the reference extraction step.
+    Return the list of (name, function) post-process steps requested
+    for the repository, in the order they have to run.
+
+    @param uploaded_task_ids: list filled with the IDs of the
+        BibUpload tasks submitted by the upload step.
     """
-    updated_files_list = []
-    final_exit_code = 0
-    i = 0
-    write_message("refextraction step started")
-    for active_file in active_files_list:
-        i += 1
-        task_sleep_now_if_required()
-        task_update_progress("Extracting references from material harvested from %s (%i/%i)" % \
-                             (repository["name"], i, len(active_files_list)))
-        if 'f' in repository["postprocess"] and not ".insert." in active_file:
-            # Only process new records
-            updated_files_list.append(active_file)
-            continue
-        write_message("Insert detected (%s): extracting references." % (active_file,))
-        updated_file = "%s.refextracted" % (os.path.splitext(active_file)[0],)
-        updated_files_list.append(updated_file)
-        (exitcode, err_msg) = call_refextract(active_file,
-                                              updated_file,
-                                              downloaded_material_dict,
-                                              repository["arguments"],
-                                              repository["id"])
-        if exitcode == 0:
-            if err_msg != "":
-                write_message("references from %s was extracted, but with some errors:\n%s" % \
-                              (active_file, err_msg))
-            else:
-                write_message("references from %s was successfully extracted" % \
-                              (active_file,))
-        else:
-            write_message("an error occurred while extracting references from %s:\n%s" % \
-                          (active_file, err_msg))
-            final_exit_code = 1
-            continue
+    post_process_functions = []
+
+    # Convert?
+    if 'c' in repository["postprocess"]:
+        post_process_functions.append(("convert", convert_step))
+
+    # Authorlist?
+    if 'a' in repository["postprocess"]:
+        post_process_functions.append(("authorlist", authorlist_step))
+
+    # Filter?
+    if 'f' in repository["postprocess"]:
+        post_process_functions.append(("filter", filter_step))
+
+    # Fulltext?
+    if 't' in repository["postprocess"]:
+        post_process_functions.append(("fulltext", fulltext_step))
+
+    # Plotextract?
+    if 'p' in repository["postprocess"]:
+        post_process_functions.append(("plotextract", plotextract_step))
+
+    # Refextract?
+    if 'r' in repository["postprocess"]:
+        post_process_functions.append(("refextract", refextract_step))
 
-    return updated_files_list, final_exit_code
+    # Upload?
+    if 'u' in repository["postprocess"]:
+        # Get a random sequence ID that will allow for the tasks to be
+        # run in order, regardless if parallel task execution is activated
+        sequence_id = random.randrange(1, 2147483648)
 
+        def upload_files_step(repository, active_file, *args, **kwargs):
+            return upload_step(repository, active_file, uploaded_task_ids, sequence_id)
+        post_process_functions.append(("upload", upload_files_step))
 
-def authorlist_step(repository, active_files_list, downloaded_material_dict, *args, **kwargs):
+    return post_process_functions
+
+
+def sleep_now_if_required():
     """
-    Performs the special authorlist extraction step (Mostly INSPIRE/CERN related).
+    Same as task_sleep_now_if_required(), but only in the main thread
+    (bibtask signal handlers cannot be set in the others).
     """
-    write_message("authorlist extraction step started")
-    updated_files_list = []
-    final_exit_code = 0
-    i = 0
-    for active_file in active_files_list:
-        i += 1
+    if threading.currentThread().getName() == 'MainThread':
         task_sleep_now_if_required()
-        task_update_progress("Extracting any authorlists from material harvested from %s (%i/%i)" %
-                             (repository["name"], i, len(active_files_list)))
-
-        write_message("Extracting authors...")
-        updated_file = "%s.authextracted" % (os.path.splitext(active_file)[0],)
-        updated_files_list.append(updated_file)
-        (exitcode, err_msg) = call_authorlist_extract(active_file,
-                                                      updated_file,
-                                                      downloaded_material_dict,
-                                                      repository["arguments"].get('a_rt-queue', ""),
-                                                      repository["arguments"].get('a_stylesheet', "authorlist2marcxml.xsl"),
-                                                      repository["id"])
-        if exitcode == 0:
-            if err_msg != "":
-                write_message("authorlists from %s was extracted, but with some errors:\n%s" % \
-                              (active_file, err_msg))
-            else:
-                write_message("any authorlists from %s was successfully extracted" % \
-                              (active_file,))
-        else:
-            write_message("an error occurred while extracting authorlists from %s:\n%s" % \
-                          (active_file, err_msg))
-            final_exit_code = 1
-            continue
 
-    return updated_files_list, final_exit_code
 
-
-def fulltext_step(repository, active_files_list, downloaded_material_dict, *args, **kwargs):
+class PostProcessPipeline(object):
     """
-    Performs the fulltext download step.
+    Run the post-process steps over the harvested files as a pipeline.
+    Every step runs in its own thread and takes the files to process from
+    a bounded queue filled by the previous step (see
+    CFG_OAI_POSTPROCESS_QUEUE_SIZE), so that a file enters a step as soon
+    as the previous one is done with it.  Files keep their order.
+
+    Harvested files are given with put() while the harvest goes on;
+    close() is called once it is over, then wait() returns the results.
     """
-    write_message("full-text attachment step started")
-    updated_files_list = []
-    final_exit_code = 0
-    i = 0
-    for active_file in active_files_list:
-        i += 1
-        task_sleep_now_if_required()
-        task_update_progress("Attaching fulltext to records harvested from %s (%i/%i)" %
-                             (repository["name"], i, len(active_files_list)))
-        if 'f' in repository["postprocess"] and not ".insert." in active_file:
-            # Only process new records
-            updated_files_list.append(active_file)
-            write_message("Skipping updates (%s)" % (active_file,))
-            continue
-        write_message("Insert detected (%s): downloading fulltexts." % (active_file,))
-        updated_file = "%s.fulltext" % (os.path.splitext(active_file)[0],)
-        updated_files_list.append(updated_file)
-        (exitcode, err_msg) = call_fulltext(active_file,
-                                            updated_file,
-                                            downloaded_material_dict,
-                                            repository["arguments"].get('t_doctype', ""),
-                                            repository["id"])
-        if exitcode == 0:
-            write_message("fulltext from %s was successfully attached" % \
-                          (active_file,))
-        else:
-            write_message("an error occurred while attaching fulltext to %s:\n%s" % \
-                          (active_file, err_msg))
-            final_exit_code = 1
-            continue
 
-    return updated_files_list, final_exit_code
+    def __init__(self, repository, steps, downloaded_material_dict):
+        """
+        @param steps: list of (name, function) for the post-process steps
+        @param downloaded_material_dict: L{HarvestedMaterial} of the harvest
+        """
+        self.repository = repository
+        self.steps = steps
+        self.downloaded_material_dict = downloaded_material_dict
+        # The harvest must not wait for the post-processing: only the
+        # queues between the steps are bounded
+        self.queues = [Queue.Queue()]
+        self.queues.extend([Queue.Queue(CFG_OAI_POSTPROCESS_QUEUE_SIZE) for dummy in steps[1:]])
+        if steps:
+            self.queues.append(Queue.Queue())
+        self.processed_files = [0] * len(steps)
+        self.error_codes = []
+        self.threads = [threading.Thread(target=self._run_step, args=(index,))
+                        for index in range(len(steps))]
+
+    def start(self):
+        """Start the post-process steps."""
+        if self.steps:
+            write_message("running post-process steps: %s" % \
+                          (", ".join([name for name, dummy in self.steps]),))
+        for thread in self.threads:
+            thread.setDaemon(True)
+            thread.start()
+
+    def put(self, active_file):
+        """Post-process a harvested file."""
+        self.queues[0].put(active_file)
+
+    def close(self):
+        """Signal that all the harvested files have been given."""
+        self.queues[0].put(None)
+
+    def wait(self):
+        """
+        Wait for the end of the post-processing.
+
+        Returns a tuple of (file_list, error_code)
+        """
+        updated_files_list = []
+        while True:
+            sleep_now_if_required()
+            if self.steps:
+                task_update_progress("Post-processing material harvested from %s (%s)" % \
+                                     (self.repository["name"],
+                                      ", ".join(["%s: %i files" % (name, self.processed_files[index])
+                                                 for index, (name, dummy) in enumerate(self.steps)])))
+            try:
+                updated_file = self.queues[-1].get(timeout=1)
+            except Queue.Empty:
+                continue
+            if updated_file is None:
+                break
+            updated_files_list.append(updated_file)
+
+        for thread in self.threads:
+            thread.join()
+        return updated_files_list, max(self.error_codes or [0])
+
+    def _run_step(self, index):
+        name, function = self.steps[index]
+        while True:
+            active_file = self.queues[index].get()
+            if active_file is None:
+                self.queues[index + 1].put(None)
+                return
+            try:
+                updated_files_list, error_code = function(repository=self.repository, \
+                                                          active_file=active_file, \
+                                                          downloaded_material_dict=self.downloaded_material_dict)
+            except Exception:
+                register_exception(alert_admin=True)
+                write_message("an exception occurred while running the %s step on %s" % \
+                              (name, active_file))
+                updated_files_list, error_code = [], 1
+            if error_code:
+                self.error_codes.append(error_code)
+            self.processed_files[index] += 1
+            for updated_file in updated_files_list:
+                self.queues[index + 1].put(updated_file)
 
 
-def filter_step(repository, active_files_list, *args, **kwargs):
+def convert_step(repository, active_file, *args, **kwargs):
     """
-    Perform filtering step
+    Performs the conversion step on a harvested file.
     """
-    write_message("filtering step started")
-    updated_files_list = []
-    final_exit_code = 0
-    i = 0
-    for active_file in active_files_list:
-        i += 1
-        task_sleep_now_if_required()
-        task_update_progress("Filtering material harvested from %s (%i/%i)" % \
-                             (repository["name"], \
-                              i, \
-                              len(active_files_list)))
-        (exitcode, err_msg) = call_bibfilter(repository["arguments"]['f_filter-file'], active_file)
+    updated_file = "%s.converted" % (os.path.splitext(active_file)[0],)
+    (exitcode, err_msg) = call_bibconvert(config=repository["arguments"]['c_stylesheet'],
+                                          harvestpath=active_file,
+                                          convertpath=updated_file)
+    if exitcode == 0:
+        write_message("harvested file %s was successfully converted" % \
+                      (active_file,))
+    else:
+        write_message("an error occurred while converting %s:\n%s" % \
+                      (active_file, err_msg))
+        return [updated_file], 1
+    return [updated_file], 0
+
 
-        if exitcode == 0:
-            write_message("%s was successfully bibfiltered" % \
+def plotextract_step(repository, active_file, downloaded_material_dict, *args, **kwargs):
+    """
+    Performs the plotextraction step on a harvested file.
+    """
+    if not repository["arguments"]['p_extraction-source']:
+        # No plotextractor type chosen, exit with failure
+        write_message("Error: No plotextractor source type chosen!")
+        return [], 1
+
+    # Download tarball for each harvested/converted record, then run plotextrator.
+    # Update converted xml files with generated xml or add it for upload
+    if 'f' in repository["postprocess"] and ".append." in active_file:
+        # Only process insert or correct records
+        return [active_file], 0
+    write_message("Insert/Correct detected (%s): extracting plots." % (active_file,))
+    updated_file = "%s.plotextracted" % (os.path.splitext(active_file)[0],)
+    (exitcode, err_msg) = call_plotextractor(active_file,
+                                             updated_file,
+                                             downloaded_material_dict,
+                                             repository["arguments"]['p_extraction-source'],
+                                             repository["id"],
+                                             CFG_OAI_POSTPROCESS_WORKERS.get('p', 1))
+    if exitcode == 0:
+        if err_msg != "":
+            write_message("plots from %s was extracted, but with some errors:\n%s" % \
+                      (active_file, err_msg))
+        else:
+            write_message("plots from %s was successfully extracted" % \
                           (active_file,))
+    else:
+        write_message("an error occurred while extracting plots from %s:\n%s" % \
+                      (active_file, err_msg))
+        return [updated_file], 1
+    return [updated_file], 0
+
+
+def refextract_step(repository, active_file, downloaded_material_dict, *args, **kwargs):
+    """
+    Performs the reference extraction step on a harvested file.
+    """
+    if 'f' in repository["postprocess"] and not ".insert." in active_file:
+        # Only process new records
+        return [active_file], 0
+    write_message("Insert detected (%s): extracting references." % (active_file,))
+    updated_file = "%s.refextracted" % (os.path.splitext(active_file)[0],)
+    (exitcode, err_msg) = call_refextract(active_file,
+                                          updated_file,
+                                          downloaded_material_dict,
+                                          repository["arguments"],
+                                          repository["id"],
+                                          CFG_OAI_POSTPROCESS_WORKERS.get('r', 1))
+    if exitcode == 0:
+        if err_msg != "":
+            write_message("references from %s was extracted, but with some errors:\n%s" % \
+                          (active_file, err_msg))
         else:
-            write_message("an error occurred while bibfiltering %s:\n%s" % \
+            write_message("references from %s was successfully extracted" % \
+                          (active_file,))
+    else:
+        write_message("an error occurred while extracting references from %s:\n%s" % \
+                      (active_file, err_msg))
+        return [updated_file], 1
+    return [updated_file], 0
+
+
+def authorlist_step(repository, active_file, downloaded_material_dict, *args, **kwargs):
+    """
+    Performs the special authorlist extraction step (Mostly INSPIRE/CERN
+    related) on a harvested file.
+    """
+    write_message("Extracting authors from %s..." % (active_file,))
+    updated_file = "%s.authextracted" % (os.path.splitext(active_file)[0],)
+    (exitcode, err_msg) = call_authorlist_extract(active_file,
+                                                  updated_file,
+                                                  downloaded_material_dict,
+                                                  repository["arguments"].get('a_rt-queue', ""),
+                                                  repository["arguments"].get('a_stylesheet', "authorlist2marcxml.xsl"),
+                                                  repository["id"],
+                                                  CFG_OAI_POSTPROCESS_WORKERS.get('a', 1))
+    if exitcode == 0:
+        if err_msg != "":
+            write_message("authorlists from %s was extracted, but with some errors:\n%s" % \
                           (active_file, err_msg))
-            final_exit_code = 1
-            continue
+        else:
+            write_message("any authorlists from %s was successfully extracted" % \
+                          (active_file,))
+    else:
+        write_message("an error occurred while extracting authorlists from %s:\n%s" % \
+                      (active_file, err_msg))
+        return [updated_file], 1
+    return [updated_file], 0
+
+
+def fulltext_step(repository, active_file, downloaded_material_dict, *args, **kwargs):
+    """
+    Performs the fulltext download step on a harvested file.
+    """
+    if 'f' in repository["postprocess"] and not ".insert." in active_file:
+        # Only process new records
+        write_message("Skipping updates (%s)" % (active_file,))
+        return [active_file], 0
+    write_message("Insert detected (%s): downloading fulltexts." % (active_file,))
+    updated_file = "%s.fulltext" % (os.path.splitext(active_file)[0],)
+    (exitcode, err_msg) = call_fulltext(active_file,
+                                        updated_file,
+                                        downloaded_material_dict,
+                                        repository["arguments"].get('t_doctype', ""),
+                                        repository["id"],
+                                        CFG_OAI_POSTPROCESS_WORKERS.get('t', 1))
+    if exitcode == 0:
+        write_message("fulltext from %s was successfully attached" % \
+                      (active_file,))
+    else:
+        write_message("an error occurred while attaching fulltext to %s:\n%s" % \
+                      (active_file, err_msg))
+        return [updated_file], 1
+    return [updated_file], 0
 
-        if os.path.exists("%s.insert.xml" % (active_file,)):
-            updated_files_list.append("%s.insert.xml" % (active_file,))
-        if os.path.exists("%s.correct.xml" % (active_file,)):
-            updated_files_list.append("%s.correct.xml" % (active_file,))
-        if os.path.exists("%s.append.xml" % (active_file,)):
-            updated_files_list.append("%s.append.xml" % (active_file,))
-        if os.path.exists("%s.holdingpen.xml" % (active_file,)):
-            updated_files_list.append("%s.holdingpen.xml" % (active_file,))
 
-    write_message("filtering step ended")
-    return updated_files_list, final_exit_code
+def filter_step(repository, active_file, *args, **kwargs):
+    """
+    Perform filtering step on a harvested file.
+    """
+    (exitcode, err_msg) = call_bibfilter(repository["arguments"]['f_filter-file'], active_file)
 
+    if exitcode == 0:
+        write_message("%s was successfully bibfiltered" % \
+                      (active_file,))
+    else:
+        write_message("an error occurred while bibfiltering %s:\n%s" % \
+                      (active_file, err_msg))
+        return [], 1
 
-def upload_step(repository, active_files_list, uploaded_task_ids=None, *args, **kwargs):
+    updated_files_list = []
+    if os.path.exists("%s.insert.xml" % (active_file,)):
+        updated_files_list.append("%s.insert.xml" % (active_file,))
+    if os.path.exists("%s.correct.xml" % (active_file,)):
+        updated_files_list.append("%s.correct.xml" % (active_file,))
+    if os.path.exists("%s.append.xml" % (active_file,)):
+        updated_files_list.append("%s.append.xml" % (active_file,))
+    if os.path.exists("%s.holdingpen.xml" % (active_file,)):
+        updated_files_list.append("%s.holdingpen.xml" % (active_file,))
+    return updated_files_list, 0
+
+
+def upload_step(repository, active_file, uploaded_task_ids, sequence_id, *args, **kwargs):
     """
-    Perform the upload step.
+    Perform the upload step on a file.
+
+    @param uploaded_task_ids: list to which the IDs of the submitted
+        BibUpload tasks are added.
+    @param sequence_id: the sequence ID of the BibUpload tasks of
+        the harvest, so that they run in order.
     """
-    write_message("upload step started")
     if 'f' in repository["postprocess"]:
         upload_modes = {'insert': '-i',
                         'correct': '-c',
@@ -682,51 +1040,45 @@ def upload_step(repository, active_files_list, uploaded_task_ids=None, *args, **
     else:
         upload_modes = {'': '-ir'}
 
-    i = 0
-    last_upload_task_id = -1
     final_exit_code = 0
-    # Get a random sequence ID that will allow for the tasks to be
-    # run in order, regardless if parallel task execution is activated
-    sequence_id = random.randrange(1, 2147483648)
-    for active_file in active_files_list:
-        task_sleep_now_if_required()
-        i += 1
-        task_update_progress("Uploading records harvested from %s (%i/%i)" % \
-                            (repository["name"], \
-                             i, \
-                             len(active_files_list)))
-        # Now we launch BibUpload tasks for the final MARCXML files
-        for suffix, mode in upload_modes.items():
-            # We check for each upload-mode in question.
-            if not suffix or suffix in active_file:
-                last_upload_task_id = call_bibupload(active_file, \
-                                                     [mode], \
-                                                     repository["id"], \
-                                                     sequence_id, \
-                                                     repository["arguments"].get('u_name', ""), \
-                                                     repository["arguments"].get('u_priority', 5))
-                if not last_upload_task_id:
-                    final_exit_code = 2
-                    write_message("an error occurred while uploading %s from %s" % \
-                                  (active_file, repository["name"]))
-                    break
-                uploaded_task_ids.append(last_upload_task_id)
-        else:
-            write_message("material harvested from source %s was successfully uploaded" % \
-                          (repository["name"],))
-    if len(active_files_list) == 0:
-        write_message("nothing to upload")
-    write_message("upload step ended")
-    return active_files_list, final_exit_code
+    # Now we launch BibUpload tasks for the final MARCXML files
+    for suffix, mode in upload_modes.items():
+        # We check for each upload-mode in question.
+        if not suffix or suffix in active_file:
+            last_upload_task_id = call_bibupload(active_file, \
+                                                 [mode], \
+                                                 repository["id"], \
+                                                 sequence_id, \
+                                                 repository["arguments"].get('u_name', ""), \
+                                                 repository["arguments"].get('u_priority', 5))
+            if not last_upload_task_id:
+                final_exit_code = 2
+                write_message("an error occurred while uploading %s from %s" % \
+                              (active_file, repository["name"]))
+                break
+            uploaded_task_ids.append(last_upload_task_id)
+    else:
+        write_message("material harvested from source %s was successfully uploaded" % \
+                      (repository["name"],))
+    return [active_file], final_exit_code
 
 
 def oai_harvest_get(prefix, baseurl, harvestpath,
                     fro=None, until=None, setspecs=None,
                     user=None, password=None, cert_file=None,
                     key_file=None, method="POST", verb="ListRecords",
-                    identifier=""):
+                    identifier="", page_callback=None, resume=None,
+                    previous_files=None):
     """
     Retrieve OAI records from given repository, with given arguments
+
+    @param page_callback: function called with every harvested file
+        (from which duplicate records have been removed) and the
+        position to resume the harvest after it, as soon as it is
+        downloaded.  See oai_harvest_getter.harvest.
+    @param resume: position to resume an interrupted harvest from.
+    @param previous_files: files harvested before the interruption,
+        whose records are not harvested again.
     """
     try:
         (addressing_scheme, network_location, path, dummy1, \
@@ -745,11 +1097,22 @@ def oai_harvest_get(prefix, baseurl, harvestpath,
         if setspecs:
             sets = [oai_set.strip() for oai_set in setspecs.split(' ')]
 
+        harvested_identifiers = set()
+        if verb == "ListRecords" and previous_files:
+            remove_duplicates(previous_files, harvested_identifiers)
+
+        def harvested_page(harvested_file, resume=None):
+            if verb == "ListRecords":
+                remove_duplicates([harvested_file], harvested_identifiers)
+            if page_callback is not None:
+                page_callback(harvested_file, resume)
+
         harvested_files = oai_harvest_getter.harvest(network_location, path, http_param_dict, method, harvestpath,
-                                   sets, secure, user, password, cert_file, key_file)
-        if verb == "ListRecords":
-            remove_duplicates(harvested_files)
+                                   sets, secure, user, password, cert_file, key_file,
+                                   harvested_page, resume)
         return harvested_files
+    except oai_harvest_getter.InvenioOAIBadResumptionTokenError:
+        raise
     except (StandardError, oai_harvest_getter.InvenioOAIRequestError), e:
         write_message("An error occurred while harvesting from %s: %s\n%s\n"
                       % (baseurl, str(e), traceback.print_exc()))
@@ -770,38 +1133,33 @@ def call_bibconvert(config, harvestpath, convertpath):
     return (exitcode, cmd_stderr)
 
 def call_plotextractor(active_file, extracted_file,
-                       downloaded_files, plotextractor_types, source_id):
+                       downloaded_files, plotextractor_types, source_id,
+                       workers=1):
     """
     Function that generates proper MARCXML containing harvested plots for
     each record.
 
     @param active_file: path to the currently processed file
     @param extracted_file: path to the file where the final results will be saved
-    @param downloaded_files: dict of identifier -> dict mappings for downloaded material.
+    @param downloaded_files: L{HarvestedMaterial} of identifier -> dict mappings
+        for downloaded material.
     @param plotextractor_types: list of names of which plotextractor(s) to use (latex or pdf)
         (pdf is currently ignored).
     @param source_id: the repository identifier
+    @param workers: number of records to process in parallel
 
     @return: exitcode and any error messages as: (exitcode, err_msg)
     """
-    all_err_msg = []
-    exitcode = 0
-    # Read in active file
-    recs_fd = open(active_file, 'r')
-    records = recs_fd.read()
-    recs_fd.close()
-
     correct_mode = '.correct.' in active_file
+    start_time = time.time()
+    processed_tarballs = []
 
-    # Find all record
-    record_xmls = REGEXP_RECORD.findall(records)
-    updated_xml = ['<?xml version="1.0" encoding="UTF-8"?>']
-    updated_xml.append('<collection>')
-    for record_xml in record_xmls:
+    def process_record(record_xml):
+        """Return the updated record, error messages and exitcode."""
+        all_err_msg = []
         current_exitcode = 0
 
-        updated_xml.append("<record>")
-        updated_xml.append(record_xml)
+        updated_xml = [record_xml]
         identifier = None
         id_list = None
 
@@ -823,29 +1181,22 @@ def call_plotextractor(active_file, extracted_file,
                     identifier = oai_id
                     break
         if identifier is None:
-            updated_xml.append("</record>")
-            continue
+            return updated_xml, all_err_msg, 0
 
         write_message("OAI identifier found in record: %s" % (identifier,), verbose=6)
 
-        if identifier not in downloaded_files:
-            downloaded_files[identifier] = {}
-
         if not oaiharvest_templates.tmpl_should_process_record_with_mode(record_xml, 'p', source_id):
             # We skip this record
-            updated_xml.append("</record>")
-            continue
+            return updated_xml, all_err_msg, 0
         if 'latex' in plotextractor_types:
             # Run LaTeX plotextractor
-            if "tarball" not in downloaded_files[identifier]:
-                current_exitcode, err_msg, tarball, dummy = \
-                            plotextractor_harvest(identifier, active_file, selection=["tarball"])
-                if current_exitcode != 0:
-                    all_err_msg.append(err_msg)
-                else:
-                    downloaded_files[identifier]["tarball"] = tarball
-            if current_exitcode == 0:
-                plotextracted_xml_path = process_single(downloaded_files[identifier]["tarball"])
+            current_exitcode, err_msg, tarball = \
+                        downloaded_files.get_material(identifier, active_file, "tarball")
+            if current_exitcode != 0:
+                all_err_msg.append(err_msg)
+            else:
+                plotextracted_xml_path = process_single(tarball)
+                processed_tarballs.append(tarball)
                 if plotextracted_xml_path != None:
                     # We store the path to the directory the tarball contents live
                     downloaded_files[identifier]["tarball-extracted"] = os.path.split(plotextracted_xml_path)[0]
@@ -857,18 +1208,15 @@ def call_plotextractor(active_file, extracted_file,
                     if re_list != []:
                         # Add final FFT info from LaTeX plotextractor to record.
                         updated_xml.append(re_list[0])
-        updated_xml.append("</record>")
-    updated_xml.append('</collection>')
-    # Write to file
-    file_fd = open(extracted_file, 'w')
-    file_fd.write("\n".join(updated_xml))
-    file_fd.close()
-    if len(all_err_msg) > 0:
-        return exitcode, "\n".join(all_err_msg)
-    return exitcode, ""
+        return updated_xml, all_err_msg, 0
+
+    result = process_records_in_file(process_record, active_file, extracted_file, workers)
+    write_message(get_throughput_message(len(processed_tarballs), start_time))
+    return result
+
 
 def call_refextract(active_file, extracted_file,
-                    downloaded_files, arguments, source_id):
+                    downloaded_files, arguments, source_id, workers=1):
     """
     Function that calls refextractor to extract references and attach them to
     harvested records. It will download the fulltext-pdf for each identifier
@@ -876,37 +1224,34 @@ def call_refextract(active_file, extracted_file,
 
     @param active_file: path to the currently processed file
     @param extracted_file: path to the file where the final results will be saved
-    @param downloaded_files: dict of identifier -> dict mappings for downloaded material.
+    @param downloaded_files: L{HarvestedMaterial} of identifier -> dict mappings
+        for downloaded material.
     @param arguments: dict of post-process arguments.
-                      r_format, r_kb-journal-file, r_kb-rep-no-file
+                      r_kb-journal-file, r_kb-rep-no-file
     @param source_id: the repository identifier
+    @param workers: number of records to process in parallel
     @return: exitcode and any error messages as: (exitcode, all_err_msg)
     """
-    all_err_msg = []
-    exitcode = 0
-
-    flags = []
-    if arguments.get('r_format'):
-        flags.append("--%s" % (arguments['r_format'],))
-    elif CFG_INSPIRE_SITE:
-        flags.append("--inspire")
-    if arguments.get('r_kb-journal-file'):
-        flags.append("--kb-journal '%s'" % (arguments['r_kb-journal-file'],))
-    if arguments.get('r_kb-rep-no-file'):
-        flags.append("--kb-report-number '%s'" % (arguments['r_kb-rep-no-file'],))
-
-    flag = " ".join(flags)
-    # Read in active file
-    recs_fd = open(active_file, 'r')
-    records = recs_fd.read()
-    recs_fd.close()
-
-    # Find all record
-    record_xmls = REGEXP_RECORD.findall(records)
-    updated_xml = ['<?xml version="1.0" encoding="UTF-8"?>']
-    updated_xml.append('<collection>')
-    for record_xml in record_xmls:
-        current_exitcode = 0
+    # Only the overridden knowledge bases are given, so that the default
+    # ones, preloaded by the pool, are found in the cache of get_kbs
+    kbs_files = {}
+    for kb_name, argument in (('journals', 'r_kb-journal-file'),
+                              ('report-numbers', 'r_kb-rep-no-file')):
+        if arguments.get(argument):
+            kbs_files[kb_name] = arguments[argument]
+    kbs_files = kbs_files or None
+    # The references are extracted by worker processes which keep the
+    # knowledge bases loaded, instead of loading them for every record:
+    # those of the harvest run, or a pool of our own.
+    pool = _REFEXTRACT_POOL
+    own_pool = pool is None
+    if own_pool:
+        pool = RefextractPool(workers=workers, kbs_files=kbs_files)
+
+    def process_record(record_xml):
+        """Return the updated record, error messages and exitcode."""
+        all_err_msg = []
+        exitcode = 0
 
         id_list = record_collect_oai_identifiers("<record>" + record_xml + "</record>")
         # We bet on the first one.
@@ -917,44 +1262,37 @@ def call_refextract(active_file, extracted_file,
                 break
         write_message("OAI identifier found in record: %s" % (identifier,), verbose=6)
 
-        if identifier not in downloaded_files:
-            downloaded_files[identifier] = {}
-        updated_xml.append("<record>")
-        updated_xml.append(record_xml)
+        updated_xml = [record_xml]
         if not oaiharvest_templates.tmpl_should_process_record_with_mode(record_xml, 'p', source_id):
             # We skip this record
-            updated_xml.append("</record>")
-            continue
-        if "pdf" not in downloaded_files[identifier]:
-            current_exitcode, err_msg, dummy, pdf = \
-                        plotextractor_harvest(identifier, active_file, selection=["pdf"])
-            if current_exitcode != 0:
-                all_err_msg.append(err_msg)
-            else:
-                downloaded_files[identifier]["pdf"] = pdf
-        if current_exitcode == 0:
-            current_exitcode, cmd_stdout, err_msg = run_shell_command(cmd="%s/refextract %s -f '%s'" % \
-                                                (CFG_BINDIR, flag, downloaded_files[identifier]["pdf"]))
-            if err_msg != "" or current_exitcode != 0:
-                exitcode = current_exitcode
+            return updated_xml, all_err_msg, exitcode
+        current_exitcode, err_msg, pdf = \
+                    downloaded_files.get_material(identifier, active_file, "pdf")
+        if current_exitcode != 0:
+            all_err_msg.append(err_msg)
+        else:
+            references, err_msg = pool.extract_references_from_file(pdf, kbs_files=kbs_files)
+            if err_msg:
+                exitcode = 1
                 all_err_msg.append("Error extracting references from id: %s\nError:%s" % \
                          (identifier, err_msg))
             else:
-                references_xml = REGEXP_REFS.search(cmd_stdout)
+                references_xml = REGEXP_REFS.search(references.to_xml())
                 if references_xml:
                     updated_xml.append(references_xml.group(1))
-        updated_xml.append("</record>")
-    updated_xml.append('</collection>')
-    # Write to file
-    file_fd = open(extracted_file, 'w')
-    file_fd.write("\n".join(updated_xml))
-    file_fd.close()
-    if len(all_err_msg) > 0:
-        return exitcode, "\n".join(all_err_msg)
-    return exitcode, ""
+        return updated_xml, all_err_msg, exitcode
+
+    try:
+        return process_records_in_file(process_record, active_file, extracted_file, workers)
+    finally:
+        if own_pool:
+            pool.close()
+            write_message(pool.get_report(), verbose=3)
+
 
 def call_authorlist_extract(active_file, extracted_file,
-                            downloaded_files, queue, stylesheet, source_id):
+                            downloaded_files, queue, stylesheet, source_id,
+                            workers=1):
     """
     Function that will look in harvested tarball for any authorlists. If found
     it will extract and convert the authors using a XSLT stylesheet.
@@ -965,8 +1303,8 @@ def call_authorlist_extract(active_file, extracted_file,
     @param extracted_file: path to the file where the final results will be saved
     @type extracted_file: string
 
-    @param downloaded_files: dict of identifier -> dict mappings for downloaded material.
-    @type downloaded_files: dict
+    @param downloaded_files: identifier -> dict mappings for downloaded material.
+    @type downloaded_files: L{HarvestedMaterial}
 
     @param queue: name of the RT queue
     @type queue: string
@@ -974,23 +1312,16 @@ def call_authorlist_extract(active_file, extracted_file,
     @param source_id: the repository identifier
     @type source_id: integer
 
+    @param workers: number of records to process in parallel
+    @type workers: integer
+
     @return: exitcode and any error messages as: (exitcode, all_err_msg)
     @rtype: tuple
     """
-    all_err_msg = []
-    exitcode = 0
-
-    # Read in active file
-    recs_fd = open(active_file, 'r')
-    records = recs_fd.read()
-    recs_fd.close()
-
-    # Find all records
-    record_xmls = REGEXP_RECORD.findall(records)
-    updated_xml = ['<?xml version="1.0" encoding="UTF-8"?>']
-    updated_xml.append('<collection>')
-    for record_xml in record_xmls:
-        current_exitcode = 0
+    def process_record(record_xml):
+        """Return the updated record, error messages and exitcode."""
+        all_err_msg = []
+        exitcode = 0
 
         id_list, subjects = record_collect_oai_identifiers(
             "<record>" + record_xml + "</record>",
@@ -1011,10 +1342,7 @@ def call_authorlist_extract(active_file, extracted_file,
 
         if not identifier or not allowed_subjects or not oaiharvest_templates.tmpl_should_process_record_with_mode(record_xml, 'p', source_id):
             # We skip this record
-            updated_xml.append("<record>")
-            updated_xml.append(record_xml)
-            updated_xml.append("</record>")
-            continue
+            return [record_xml], all_err_msg, exitcode
 
 
         # Grab BibRec instance of current record for later amending
@@ -1022,19 +1350,13 @@ def call_authorlist_extract(active_file, extracted_file,
         if status_code == 0:
             all_err_msg.append("Error parsing record, skipping authorlist extraction of: %s\n" % \
                                (identifier,))
-            updated_xml.append("<record>%s</record>" % (record_xml,))
-            continue
-        if identifier not in downloaded_files:
-            downloaded_files[identifier] = {}
-        if "tarball" not in downloaded_files[identifier]:
-            current_exitcode, err_msg, tarball, dummy = \
-                        plotextractor_harvest(identifier, active_file, selection=["tarball"])
-            if current_exitcode != 0:
-                all_err_msg.append(err_msg)
-            else:
-                downloaded_files[identifier]["tarball"] = tarball
-        if current_exitcode == 0:
-            current_exitcode, err_msg, authorlist_xml_path = authorlist_extract(downloaded_files[identifier]["tarball"], \
+            return [record_xml], all_err_msg, exitcode
+        current_exitcode, err_msg, tarball = \
+                    downloaded_files.get_material(identifier, active_file, "tarball")
+        if current_exitcode != 0:
+            all_err_msg.append(err_msg)
+        else:
+            current_exitcode, err_msg, authorlist_xml_path = authorlist_extract(tarball, \
                                                                                 identifier, downloaded_files, stylesheet)
             if current_exitcode != 0:
                 exitcode = current_exitcode
@@ -1051,7 +1373,7 @@ def call_authorlist_extract(active_file, extracted_file,
                     if authorlist_record[0][0] == None:
                         all_err_msg.append("Error parsing authorlist record for id: %s" % \
                              (identifier,))
-                        continue
+                        return [], all_err_msg, exitcode
                     authorlist_record = authorlist_record[0][0]
                     # Convert any LaTeX symbols in authornames
                     translate_fieldvalues_from_latex(authorlist_record, '100', code='a')
@@ -1082,44 +1404,30 @@ def call_authorlist_extract(active_file, extracted_file,
                         additional_authors = record_get_field_instances(authorlist_record, '700')
                         record_add_fields(existing_record, '700', additional_authors)
 
-        updated_xml.append(record_xml_output(existing_record))
-    updated_xml.append('</collection>')
-    # Write to file
-    file_fd = open(extracted_file, 'w')
-    file_fd.write("\n".join(updated_xml))
-    file_fd.close()
+        return REGEXP_RECORD.findall(record_xml_output(existing_record)), all_err_msg, exitcode
+
+    return process_records_in_file(process_record, active_file, extracted_file, workers)
 
-    if len(all_err_msg) > 0:
-        return exitcode, "\n".join(all_err_msg)
-    return exitcode, ""
 
 def call_fulltext(active_file, extracted_file,
-                  downloaded_files, doctype, source_id):
+                  downloaded_files, doctype, source_id, workers=1):
     """
     Function that calls attach FFT tag for a downloaded file to harvested records.
     It will download the fulltext-pdf for each identifier if necessary.
 
     @param active_file: path to the currently processed file
     @param extracted_file: path to the file where the final results will be saved
-    @param downloaded_files: dict of identifier -> dict mappings for downloaded material.
+    @param downloaded_files: L{HarvestedMaterial} of identifier -> dict mappings
+        for downloaded material.
     @param doctype: doctype of downloaded file in BibDocFile
     @param source_id: the repository identifier
+    @param workers: number of records to process in parallel
 
     @return: exitcode and any error messages as: (exitcode, err_msg)
     """
-    all_err_msg = []
-    exitcode = 0
-    # Read in active file
-    recs_fd = open(active_file, 'r')
-    records = recs_fd.read()
-    recs_fd.close()
-
-    # Find all records
-    record_xmls = REGEXP_RECORD.findall(records)
-    updated_xml = ['<?xml version="1.0" encoding="UTF-8"?>']
-    updated_xml.append('<collection>')
-    for record_xml in record_xmls:
-        current_exitcode = 0
+    def process_record(record_xml):
+        """Return the updated record, error messages and exitcode."""
+        all_err_msg = []
 
         id_list = record_collect_oai_identifiers("<record>" + record_xml + "</record>")
         # We bet on the first one.
@@ -1130,29 +1438,60 @@ def call_fulltext(active_file, extracted_file,
                 break
         write_message("OAI identifier found in record: %s" % (identifier,), verbose=6)
 
-        if identifier not in downloaded_files:
-            downloaded_files[identifier] = {}
-        updated_xml.append("<record>")
-        updated_xml.append(record_xml)
+        updated_xml = [record_xml]
         if not oaiharvest_templates.tmpl_should_process_record_with_mode(record_xml, 'p', source_id):
             # We skip this record
-            updated_xml.append("</record>")
-            continue
-        if "pdf" not in downloaded_files[identifier]:
-            current_exitcode, err_msg, dummy, pdf = \
-                        plotextractor_harvest(identifier, active_file, selection=["pdf"])
-            if current_exitcode != 0:
-                all_err_msg.append(err_msg)
-            else:
-                downloaded_files[identifier]["pdf"] = pdf
-        if current_exitcode == 0:
+            return updated_xml, all_err_msg, 0
+        current_exitcode, err_msg, pdf = \
+                    downloaded_files.get_material(identifier, active_file, "pdf")
+        if current_exitcode != 0:
+            all_err_msg.append(err_msg)
+        else:
             fulltext_xml = """  <datafield tag="FFT" ind1=" " ind2=" ">
     <subfield code="a">%(url)s</subfield>
     <subfield code="t">%(doctype)s</subfield>
-  </datafield>""" % {'url': downloaded_files[identifier]["pdf"],
+  </datafield>""" % {'url': pdf,
                      'doctype': doctype}
             updated_xml.append(fulltext_xml)
-        updated_xml.append("</record>")
+        return updated_xml, all_err_msg, 0
+
+    return process_records_in_file(process_record, active_file, extracted_file, workers)
+
+
+def process_records_in_file(process_record, active_file, extracted_file, workers=1):
+    """
+    Apply process_record to every record of active_file, processing up
+    to workers records in parallel, and write the updated records to
+    extracted_file in their original order.
+
+    @param process_record: function taking the content of a record and
+        returning the list of parts of the updated record content, a list
+        of error messages and an exitcode
+    @param active_file: path to the currently processed file
+    @param extracted_file: path to the file where the final results will be saved
+    @param workers: number of records to process in parallel
+
+    @return: exitcode and any error messages as: (exitcode, err_msg)
+    """
+    all_err_msg = []
+    exitcode = 0
+    # Read in active file
+    recs_fd = open(active_file, 'r')
+    records = recs_fd.read()
+    recs_fd.close()
+
+    # Find all records
+    record_xmls = REGEXP_RECORD.findall(records)
+    updated_xml = ['<?xml version="1.0" encoding="UTF-8"?>']
+    updated_xml.append('<collection>')
+    for record_parts, err_msgs, current_exitcode in map_records(process_record, record_xmls, workers):
+        if record_parts:
+            updated_xml.append("<record>")
+            updated_xml.extend(record_parts)
+            updated_xml.append("</record>")
+        all_err_msg.extend(err_msgs)
+        if current_exitcode != 0:
+            exitcode = current_exitcode
     updated_xml.append('</collection>')
     # Write to file
     file_fd = open(extracted_file, 'w')
@@ -35,6 +35,7 @@ try:
     import base64
     import tempfile
     import os
+    import threading
 except ImportError, e:
     print "Error: %s" % e
     sys.exit(1)
@@ -48,6 +49,9 @@ except ImportError, e:
 class InvenioOAIRequestError(Exception):
     pass
 
+class InvenioOAIBadResumptionTokenError(InvenioOAIRequestError):
+    pass
+
 http_response_status_code = {
 
     "000" : "Unknown",
@@ -76,9 +80,34 @@ def http_request_parameters(http_param_dict, method="POST"):
 
     return urllib.urlencode(http_param_dict)
 
+class OAI_PageFetcher(threading.Thread):
+    """Download one OAI answer in the background (see OAI_Session)."""
+
+    def __init__(self, *request_args):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.request_args = request_args
+        self.data = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.data = OAI_Request(*self.request_args)
+        except (Exception, SystemExit), e:
+            # OAI_Request exits when the credentials cannot be read: the
+            # session has to stop as if the request was not threaded
+            self.error = e
+
+    def get_data(self):
+        """Wait for the answer and return it, or raise the download error."""
+        self.join()
+        if self.error is not None:
+            raise self.error
+        return self.data
+
 def OAI_Session(server, script, http_param_dict , method="POST", output="",
                 resume_request_nbr=0, secure=False, user=None, password=None,
-                cert_file=None, key_file=None):
+                cert_file=None, key_file=None, page_callback=None):
     """Handle one OAI session (1 request, which might lead
     to multiple answers because of resumption tokens)
 
@@ -86,6 +115,15 @@ def OAI_Session(server, script, http_param_dict , method="POST", output="",
     in corresponding filepath, with a unique number appended at the end.
     This number starts at 'resume_request_nbr'.
 
+    The next answer is downloaded while the current one is saved and
+    handed to 'page_callback', if given, as
+    page_callback(filepath, resumption_token, request_nbr), where
+    resumption_token is the one of the next answer (None after the last
+    answer) and request_nbr the number of the current one.
+
+    To resume an interrupted session, give the resumption token in
+    'http_param_dict' (see http_param_resume).
+
     Returns a tuple containing an int corresponding to the last created 'resume_request_nbr' and
     a list of harvested files.
     """
@@ -97,10 +135,26 @@ def OAI_Session(server, script, http_param_dict , method="POST", output="",
     output_path, output_name = os.path.split(output)
     harvested_files = []
     i = resume_request_nbr
+    harvested_data = OAI_Request(server, script,
+                                 http_request_parameters(http_param_dict, method), method,
+                                 secure, user, password, cert_file, key_file)
     while True:
-        harvested_data = OAI_Request(server, script,
-                                     http_request_parameters(http_param_dict, method), method,
-                                     secure, user, password, cert_file, key_file)
+        if 'resumptionToken' in http_param_dict and \
+               re.search('<error[^>]+code="badResumptionToken"', harvested_data):
+            raise InvenioOAIBadResumptionTokenError("Bad resumption token %s" % \
+                                                    http_param_dict['resumptionToken'])
+        rt_obj = re.search('<resumptionToken.*>(.+)</resumptionToken>',
+            harvested_data, re.DOTALL)
+        next_page = None
+        resumption_token = None
+        if rt_obj is not None and rt_obj != "":
+            resumption_token = rt_obj.group(1)
+            http_param_dict = http_param_resume(http_param_dict, resumption_token)
+            next_page = OAI_PageFetcher(server, script,
+                                        http_request_parameters(http_param_dict, method), method,
+                                        secure, user, password, cert_file, key_file)
+            next_page.start()
+
         if output:
             # Write results to a file specified by 'output'
             if harvested_data.lower().find('<'+http_param_dict['verb'].lower()) > -1:
@@ -109,6 +163,8 @@ def OAI_Session(server, script, http_param_dict , method="POST", output="",
                 os.write(output_fd, harvested_data)
                 os.close(output_fd)
                 harvested_files.append(output_filename)
+                if page_callback is not None:
+                    page_callback(output_filename, resumption_token, i)
             else:
                 # No records in output? Do not create a file. Warn the user.
                 sys.stderr.write("\n<!--\n*** WARNING: NO RECORDS IN THE HARVESTED DATA: "
@@ -116,19 +172,16 @@ def OAI_Session(server, script, http_param_dict , method="POST", output="",
         else:
             sys.stdout.write(harvested_data)
 
-        rt_obj = re.search('<resumptionToken.*>(.+)</resumptionToken>',
-            harvested_data, re.DOTALL)
-        if rt_obj is not None and rt_obj != "":
-            http_param_dict = http_param_resume(http_param_dict, rt_obj.group(1))
-            i = i + 1
-        else:
+        if next_page is None:
             break
+        harvested_data = next_page.get_data()
+        i = i + 1
 
     return i, harvested_files
 
 def harvest(server, script, http_param_dict , method="POST", output="",
             sets=None, secure=False, user=None, password=None,
-            cert_file=None, key_file=None):
+            cert_file=None, key_file=None, page_callback=None, resume=None):
     """
     Handle multiple OAI sessions (multiple requests, which might lead to
     multiple answers).
@@ -186,24 +239,57 @@ http_param_dict - *dict* the URL parameters to send to the OAI script
                   key in case the server to harvest requires
                   certificate-based authentication
                   (If provided, 'key_file' must also be provided)
+
+  page_callback - *function* called with each harvested file as soon
+                  as it is saved, while the next answer is downloaded:
+                  page_callback(filepath, resume), where 'resume'
+                  allows to resume the harvest right after this answer
+                  (see below), or is None after the last answer.
+
+         resume - *tuple* (set, resumption_token, resume_request_nbr)
+                  as given to 'page_callback', to resume an
+                  interrupted harvest.  The sets before 'set' are
+                  skipped, and 'set' is harvested from the beginning
+                  if 'resumption_token' is None.
+                  Raises InvenioOAIBadResumptionTokenError if the
+                  server does not accept the token any longer.
     """
-    if sets:
-        resume_request_nbr = 0
-        all_harvested_files = []
-        for set in sets:
-            http_param_dict['set'] = set
-            resume_request_nbr, harvested_files = OAI_Session(server, script, http_param_dict, method,
-                            output, resume_request_nbr, secure, user, password,
-                            cert_file, key_file)
-            resume_request_nbr += 1
-            all_harvested_files.extend(harvested_files)
-        return all_harvested_files
-    else:
-        dummy, harvested_files = OAI_Session(server, script, http_param_dict, method,
-                    output, secure=secure, user=user,
-                    password=password, cert_file=cert_file,
-                    key_file=key_file)
-        return harvested_files
+    if not sets:
+        sets = [None]
+    resume_request_nbr = 0
+    resume_set = resume_token = None
+    if resume:
+        resume_set, resume_token, resume_request_nbr = resume
+        if resume_set in sets:
+            sets = sets[sets.index(resume_set):]
+    all_harvested_files = []
+    for set_nbr, set in enumerate(sets):
+        session_param_dict = dict(http_param_dict)
+        if set is not None:
+            session_param_dict['set'] = set
+        if resume_token and set == resume_set:
+            session_param_dict = http_param_resume(session_param_dict, resume_token)
+        resume_token = None
+        session_callback = None
+        if page_callback is not None:
+            if set_nbr + 1 < len(sets):
+                next_set = sets[set_nbr + 1]
+            else:
+                next_set = None
+            def session_callback(filepath, resumption_token, request_nbr,
+                                 set=set, next_set=next_set):
+                if resumption_token:
+                    page_callback(filepath, (set, resumption_token, request_nbr + 1))
+                elif next_set is not None:
+                    page_callback(filepath, (next_set, None, request_nbr + 1))
+                else:
+                    page_callback(filepath, None)
+        resume_request_nbr, harvested_files = OAI_Session(server, script, session_param_dict, method,
+                        output, resume_request_nbr, secure, user, password,
+                        cert_file, key_file, session_callback)
+        resume_request_nbr += 1
+        all_harvested_files.extend(harvested_files)
+    return all_harvested_files
 
 def OAI_Request(server, script, params, method="POST", secure=False,
                 user=None, password=None,
@@ -50,8 +50,85 @@ class TestOAIUtils(InvenioTestCase):
         self.assertEqual(get_identifier_names("oai:arXiv.org:1234.12452"),
                          ["oai:arXiv.org:1234.12452"])
 
+    def test_map_records_keeps_order(self):
+        """oaiharvest - testing parallel processing of records."""
+        from invenio.oai_harvest_utils import map_records
+        records = [str(i) for i in range(20)]
+        self.assertEqual(map_records(lambda record: record * 2, records, workers=4),
+                         [record * 2 for record in records])
+        self.assertEqual(map_records(lambda record: record, [], workers=4), [])
 
-TEST_SUITE = make_test_suite(TestOAIUtils)
+    def test_material_selection(self):
+        """oaiharvest - testing material shared by post-process modes."""
+        from invenio.oai_harvest_daemon import get_material_selection
+        self.assertEqual(get_material_selection("c-p-a-u"), ["tarball"])
+        self.assertEqual(get_material_selection("c-r-t-u"), ["pdf"])
+        self.assertEqual(get_material_selection("p-r"), ["tarball", "pdf"])
+        self.assertEqual(get_material_selection("c-u"), [])
+
+
+class TestOAIHarvestResume(InvenioTestCase):
+
+    """Test for the resumption of interrupted harvests."""
+
+    def setUp(self):
+        import tempfile
+        from invenio import oai_harvest_getter
+        self.harvestdir = tempfile.mkdtemp()
+        self.requests = []
+        self.original_request = oai_harvest_getter.OAI_Request
+
+        def fake_request(server, script, params, *args):
+            """Two answers per set, the first one with a token."""
+            self.requests.append(params)
+            if 'resumptionToken' in params:
+                return '<OAI-PMH><ListRecords><record/></ListRecords></OAI-PMH>'
+            return '<OAI-PMH><ListRecords><record/>' \
+                   '<resumptionToken>token</resumptionToken></ListRecords></OAI-PMH>'
+        oai_harvest_getter.OAI_Request = fake_request
+
+    def tearDown(self):
+        import shutil
+        from invenio import oai_harvest_getter
+        oai_harvest_getter.OAI_Request = self.original_request
+        shutil.rmtree(self.harvestdir)
+
+    def _harvest(self, resume=None):
+        import os
+        from invenio.oai_harvest_getter import harvest
+        pages = []
+        harvest("example.org", "/oai2d", {'verb': 'ListRecords', 'metadataPrefix': 'marcxml'},
+                output=os.path.join(self.harvestdir, "harvest"), sets=["a", "b"],
+                page_callback=lambda filepath, resume: pages.append(resume),
+                resume=resume)
+        return pages
+
+    def test_page_callback_resume(self):
+        """oaiharvest - testing the resumption points of harvested pages."""
+        self.assertEqual(self._harvest(),
+                         [("a", "token", 1), ("b", None, 2), ("b", "token", 3), None])
+        self.assertEqual(len(self.requests), 4)
+
+    def test_resume_harvest(self):
+        """oaiharvest - testing the resumption of a harvest."""
+        self.assertEqual(self._harvest(resume=("b", "token", 3)), [None])
+        self.assertEqual(self.requests, ["verb=ListRecords&resumptionToken=token"])
+
+    def test_next_page_exit(self):
+        """oaiharvest - testing an exit while downloading the next page."""
+        from invenio import oai_harvest_getter
+
+        def exiting_request(server, script, params, *args):
+            """Exits on the second answer, as on unreadable credentials."""
+            if 'resumptionToken' in params:
+                raise SystemExit(1)
+            return '<OAI-PMH><ListRecords><record/>' \
+                   '<resumptionToken>token</resumptionToken></ListRecords></OAI-PMH>'
+        oai_harvest_getter.OAI_Request = exiting_request
+        self.assertRaises(SystemExit, self._harvest)
+
+
+TEST_SUITE = make_test_suite(TestOAIUtils, TestOAIHarvestResume)
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE)
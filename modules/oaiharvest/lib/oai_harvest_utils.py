@@ -28,6 +28,7 @@ import re
 import time
 import calendar
 import traceback
+from multiprocessing.dummy import Pool as ThreadPool
 
 from lxml import etree as ET
 
@@ -64,6 +65,23 @@ def get_nb_records_in_file(filename):
     return nb
 
 
+def map_records(function, record_xmls, workers=1):
+    """
+    Return the results of function applied to every record, in the
+    order of record_xmls, running up to workers calls in parallel
+    threads.  Meant for functions spending their time downloading
+    material or waiting for external programs.
+    """
+    if workers <= 1 or len(record_xmls) <= 1:
+        return [function(record_xml) for record_xml in record_xmls]
+    pool = ThreadPool(min(workers, len(record_xmls)))
+    try:
+        return pool.map(function, record_xmls, 1)
+    finally:
+        pool.close()
+        pool.join()
+
+
 def collect_identifiers(harvested_file_list):
     """Collects all OAI PMH identifiers from each file in the list
     and adds them to a list of identifiers per file.
@@ -130,14 +148,19 @@ def record_collect_oai_identifiers(record_xml, subjects=False):
     return result
 
 
-def remove_duplicates(harvested_file_list):
+def remove_duplicates(harvested_file_list, harvested_identifiers=None):
     """
     Go through a list of harvested files and remove any duplicate records.
     Usually happens when records are cross-listed across OAI sets.
 
     Saves a backup of original harvested file in: filename~
+
+    @param harvested_identifiers: set of the OAI identifiers of the
+        records harvested so far, updated with the ones of the given
+        files, to remove duplicates from files harvested one by one.
     """
-    harvested_identifiers = set()
+    if harvested_identifiers is None:
+        harvested_identifiers = set()
     for harvested_file in harvested_file_list:
         try:
             tree = ET.parse(harvested_file)
@@ -26,3 +26,7 @@ CFG_OAI_REPOSITORY_MARCXML_SIZE = 1000
 ## Makefile.am and tabcreate.sql defaults for setSpec column in
 ## oaiREPOSITORY MySQL table.
 CFG_OAI_REPOSITORY_GLOBAL_SET_SPEC = "GLOBAL_SET"
+
+## Minimum number of seconds between two garbage collections of the
+## resumptionTokens stored in files (see CFG_OAI_RESUMPTION_TOKEN_STORAGE)
+CFG_OAI_REPOSITORY_RESUMPTION_TOKEN_GC_INTERVAL = 600
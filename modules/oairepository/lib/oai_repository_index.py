@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+OAI Repository precomputed index.
+
+The index keeps, for every OAI setSpec value, the records carrying it
+(both in CFG_OAI_SET_FIELD and in CFG_OAI_PREVIOUS_SET_FIELD), the
+records marked as deleted and the datestamp of every record, stored as
+two aligned arrays sorted by record ID.  It is (re)built incrementally
+by oairepositoryupdater and used by the OAI server to answer
+ListRecords/ListIdentifiers requests without querying the bibxxx tables.
+
+Records modified after the index was built (the "tail") are not in the
+index: the OAI server has to look them up in the database.
+"""
+
+import os
+import time
+import calendar
+import cPickle
+from array import array
+from bisect import bisect_left, bisect_right
+
+from invenio.config import \
+     CFG_CACHEDIR, \
+     CFG_CERN_SITE, \
+     CFG_OAI_SET_FIELD, \
+     CFG_OAI_PREVIOUS_SET_FIELD
+from invenio.dbquery import run_sql, wash_table_column_name
+from invenio.intbitset import intbitset
+from invenio.search_engine import get_all_field_values, search_unit_in_bibxxx
+
+CFG_OAI_INDEX_FILE = os.path.join(CFG_CACHEDIR, 'oairepository', 'index')
+
+## Version of the index file layout, to be increased whenever the
+## structure of OAIIndex changes.
+CFG_OAI_INDEX_VERSION = 1
+
+_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def datestamp_to_int(datestamp):
+    """
+    Convert a local date string (YYYY-MM-DD HH:MM:SS) to the integer
+    stored in the index.  The integer is the number of wall-clock
+    seconds since the epoch, i.e. no timezone conversion is applied,
+    which is all we need to compare datestamps.  Invalid dates (such
+    as MySQL zero dates) are mapped to 0.
+    """
+    try:
+        return calendar.timegm(time.strptime(datestamp, _DATE_FORMAT))
+    except (ValueError, TypeError):
+        return 0
+
+
+def int_to_datestamp(value):
+    """Convert back an integer produced by datestamp_to_int()."""
+    return time.strftime(_DATE_FORMAT, time.gmtime(value))
+
+
+def get_field_values_for_recids(recids, field):
+    """
+    Return the values of 'field' for many records at once.
+
+    @param recids: the record IDs
+    @param field: the MARC field (e.g. 909COp), possibly with '%'
+        wildcards (e.g. 980__%)
+    @return: dictionary recid -> list of values
+    """
+    ret = {}
+    if not recids:
+        return ret
+    digit = field[0:2]
+    bibbx = "bib%sx" % digit
+    bibx = "bibrec_bib%sx" % digit
+    if '%' in field:
+        tag_condition = "bx.tag LIKE %s"
+    else:
+        tag_condition = "bx.tag=%s"
+    query = "SELECT bibx.id_bibrec, bx.value FROM %s AS bx, %s AS bibx " \
+            "WHERE bibx.id_bibrec IN (%s) AND bx.id=bibx.id_bibxxx " \
+            "AND %s" % (wash_table_column_name(bibbx),
+                        wash_table_column_name(bibx),
+                        ','.join(str(int(recid)) for recid in recids),
+                        tag_condition)
+    for recid, value in run_sql(query, (field, )):
+        ret.setdefault(recid, []).append(value)
+    return ret
+
+
+def get_deleted_recids():
+    """Return the records marked as deleted."""
+    ret = search_unit_in_bibxxx(p='DELETED', f='980__%', type='e')
+    if CFG_CERN_SITE:
+        ret |= search_unit_in_bibxxx(p='DUMMY', f='980__%', type='e')
+    return ret
+
+
+def _get_set_membership(field):
+    """Return a dictionary setSpec -> intbitset for the given field."""
+    ret = {}
+    for set_spec in get_all_field_values(field):
+        ret[set_spec] = search_unit_in_bibxxx(p=set_spec, f=field, type='e')
+    return ret
+
+
+class OAIIndex(object):
+    """Precomputed set membership and datestamps of OAI records."""
+
+    def __init__(self):
+        self.version = CFG_OAI_INDEX_VERSION
+        ## local time of the beginning of the last update
+        self.last_updated = None
+        self.sets = {}
+        self.previous_sets = {}
+        self.deleted = intbitset()
+        self.recids = array('l')
+        self.datestamps = array('l')
+        ## record IDs sorted by datestamp, used to select date ranges
+        self.date_sorted_recids = array('l')
+        self.date_sorted_datestamps = array('l')
+
+    def update(self):
+        """
+        Bring the index up to date.  Set membership is recomputed, while
+        datestamps are only fetched for records modified since the last
+        update.
+        """
+        last_updated = run_sql("SELECT DATE_FORMAT(NOW(), '%Y-%m-%d %H:%i:%s')")[0][0]
+        self.sets = _get_set_membership(CFG_OAI_SET_FIELD)
+        self.previous_sets = _get_set_membership(CFG_OAI_PREVIOUS_SET_FIELD)
+        self.deleted = get_deleted_recids()
+
+        if self.last_updated is None:
+            res = run_sql("SELECT id, DATE_FORMAT(modification_date, '%Y-%m-%d %H:%i:%s') FROM bibrec ORDER BY id")
+        else:
+            res = run_sql("SELECT id, DATE_FORMAT(modification_date, '%%Y-%%m-%%d %%H:%%i:%%s') FROM bibrec WHERE modification_date >= %s ORDER BY id", (self.last_updated, ))
+        self._merge_datestamps([(recid, datestamp_to_int(date)) for recid, date in res])
+        self.last_updated = last_updated
+
+    def _merge_datestamps(self, changes):
+        """
+        Merge (recid, datestamp) pairs, sorted by recid, in the
+        datestamp arrays.
+        """
+        new_pairs = []
+        for recid, datestamp in changes:
+            pos = bisect_left(self.recids, recid)
+            if pos < len(self.recids) and self.recids[pos] == recid:
+                self.datestamps[pos] = datestamp
+            else:
+                new_pairs.append((recid, datestamp))
+        if new_pairs:
+            if not self.recids or new_pairs[0][0] > self.recids[-1]:
+                ## Usual case: new records have bigger IDs
+                self.recids.extend([recid for recid, dummy in new_pairs])
+                self.datestamps.extend([datestamp for dummy, datestamp in new_pairs])
+            else:
+                pairs = sorted(zip(self.recids, self.datestamps) + new_pairs)
+                self.recids = array('l', [recid for recid, dummy in pairs])
+                self.datestamps = array('l', [datestamp for dummy, datestamp in pairs])
+        pairs = sorted(zip(self.datestamps, self.recids))
+        self.date_sorted_datestamps = array('l', [datestamp for datestamp, dummy in pairs])
+        self.date_sorted_recids = array('l', [recid for dummy, recid in pairs])
+
+    def get_set_recids(self, set_spec="", include_previous=True):
+        """
+        Return the records belonging to set_spec or to any of its
+        subsets (all the exported records if set_spec is empty).
+
+        @param include_previous: if True, add the records which used
+            to belong to the set (needed to report deleted records).
+        """
+        ret = intbitset()
+        sources = [self.sets]
+        if include_previous:
+            sources.append(self.previous_sets)
+        for source in sources:
+            for a_set, recids in source.iteritems():
+                if not set_spec or a_set == set_spec or \
+                       a_set.startswith("%s:" % set_spec):
+                    ret |= recids
+        return ret
+
+    def get_recids_in_date_range(self, fromdate="", untildate=""):
+        """
+        Return the records whose datestamp is within the given range.
+
+        @param fromdate: local date (YYYY-MM-DD HH:MM:SS), or empty
+        @param untildate: local date (YYYY-MM-DD HH:MM:SS), or empty
+        """
+        start = 0
+        end = len(self.date_sorted_datestamps)
+        if fromdate:
+            start = bisect_left(self.date_sorted_datestamps, datestamp_to_int(fromdate))
+        if untildate:
+            end = bisect_right(self.date_sorted_datestamps, datestamp_to_int(untildate))
+        return intbitset(self.date_sorted_recids[start:end].tolist())
+
+    def get_datestamp(self, recid):
+        """Return the local modification date of recid, or None."""
+        pos = bisect_left(self.recids, recid)
+        if pos < len(self.recids) and self.recids[pos] == recid:
+            return int_to_datestamp(self.datestamps[pos])
+        return None
+
+    def get_sets(self, recid):
+        """Return the setSpecs of recid (from CFG_OAI_SET_FIELD)."""
+        return [a_set for a_set, recids in self.sets.iteritems()
+                if recid in recids]
+
+    def record_exists(self, recid):
+        """Same as search_engine.record_exists(), for indexed records."""
+        pos = bisect_left(self.recids, recid)
+        if pos < len(self.recids) and self.recids[pos] == recid:
+            if recid in self.deleted:
+                return -1
+            return 1
+        return 0
+
+
+def store_oai_index(index):
+    """Atomically store the index in CFG_OAI_INDEX_FILE."""
+    dirname = os.path.dirname(CFG_OAI_INDEX_FILE)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    tmp_file = CFG_OAI_INDEX_FILE + '.tmp'
+    index_file = open(tmp_file, 'wb')
+    try:
+        cPickle.dump(index, index_file, -1)
+    finally:
+        index_file.close()
+    os.rename(tmp_file, CFG_OAI_INDEX_FILE)
+
+
+_OAI_INDEX_CACHE = {'mtime': None, 'index': None}
+
+
+def load_oai_index():
+    """
+    Return the OAI index, or None if it has never been built.  The index
+    is kept in memory and reloaded only when the file changes.
+    """
+    try:
+        mtime = os.path.getmtime(CFG_OAI_INDEX_FILE)
+    except OSError:
+        return None
+    if _OAI_INDEX_CACHE['mtime'] != mtime:
+        try:
+            index = cPickle.load(open(CFG_OAI_INDEX_FILE, 'rb'))
+        except (IOError, EOFError, cPickle.UnpicklingError):
+            return None
+        if getattr(index, 'version', None) != CFG_OAI_INDEX_VERSION:
+            return None
+        _OAI_INDEX_CACHE['index'] = index
+        _OAI_INDEX_CACHE['mtime'] = mtime
+    return _OAI_INDEX_CACHE['index']
+
+
+def update_oai_index():
+    """
+    Update (or build, the first time) the OAI index.
+
+    @return: the updated index
+    """
+    index = load_oai_index()
+    if index is None:
+        index = OAIIndex()
+    index.update()
+    store_oai_index(index)
+    return index
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the oai repository index."""
+
+from invenio.testutils import InvenioTestCase
+from invenio.testutils import make_test_suite, run_test_suite
+from invenio.intbitset import intbitset
+from invenio.oai_repository_index import OAIIndex, datestamp_to_int, \
+     int_to_datestamp
+
+
+class TestOAIIndex(InvenioTestCase):
+    """Test the precomputed OAI index."""
+
+    def setUp(self):
+        self.index = OAIIndex()
+        self.index.sets = {'cern': intbitset([1, 2]),
+                           'cern:theses': intbitset([3]),
+                           'cernity': intbitset([4])}
+        self.index.previous_sets = {'cern': intbitset([5])}
+        self.index.deleted = intbitset([5])
+        self.index._merge_datestamps([
+            (1, datestamp_to_int('2010-01-01 10:00:00')),
+            (2, datestamp_to_int('2011-01-01 10:00:00')),
+            (3, datestamp_to_int('2012-01-01 10:00:00')),
+            (5, datestamp_to_int('2009-01-01 10:00:00'))])
+
+    def test_datestamp_conversion(self):
+        """oairepository - index datestamp conversion"""
+        self.assertEqual('2012-02-29 23:59:59',
+                         int_to_datestamp(datestamp_to_int('2012-02-29 23:59:59')))
+        self.assertEqual(0, datestamp_to_int('0000-00-00 00:00:00'))
+
+    def test_set_recids(self):
+        """oairepository - index set membership with subsets"""
+        self.assertEqual(intbitset([1, 2, 3, 5]),
+                         self.index.get_set_recids('cern'))
+        self.assertEqual(intbitset([1, 2, 3]),
+                         self.index.get_set_recids('cern', include_previous=False))
+        self.assertEqual(intbitset([1, 2, 3, 4, 5]),
+                         self.index.get_set_recids(''))
+
+    def test_date_range(self):
+        """oairepository - index date range"""
+        self.assertEqual(intbitset([2, 3]), self.index.get_recids_in_date_range(
+            '2010-06-01 00:00:00', ''))
+        self.assertEqual(intbitset([1, 5]), self.index.get_recids_in_date_range(
+            '', '2010-01-01 10:00:00'))
+        self.assertEqual(intbitset([2]), self.index.get_recids_in_date_range(
+            '2011-01-01 10:00:00', '2011-01-01 10:00:00'))
+
+    def test_merge_datestamps(self):
+        """oairepository - index datestamp merging"""
+        self.index._merge_datestamps([
+            (2, datestamp_to_int('2013-01-01 10:00:00')),
+            (4, datestamp_to_int('2013-01-02 10:00:00')),
+            (7, datestamp_to_int('2013-01-03 10:00:00'))])
+        self.assertEqual([1, 2, 3, 4, 5, 7], self.index.recids.tolist())
+        self.assertEqual('2013-01-01 10:00:00', self.index.get_datestamp(2))
+        self.assertEqual(None, self.index.get_datestamp(6))
+        self.assertEqual(intbitset([2, 4, 7]), self.index.get_recids_in_date_range(
+            '2013-01-01 00:00:00', ''))
+
+    def test_record_exists_and_sets(self):
+        """oairepository - index record existence and sets"""
+        self.assertEqual(1, self.index.record_exists(1))
+        self.assertEqual(-1, self.index.record_exists(5))
+        self.assertEqual(0, self.index.record_exists(42))
+        self.assertEqual(['cern:theses'], self.index.get_sets(3))
+
+
+TEST_SUITE = make_test_suite(TestOAIIndex, )
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
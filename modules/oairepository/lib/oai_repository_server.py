@@ -20,6 +20,7 @@
 __revision__ = "$Id$"
 
 import cPickle
+import base64
 import os
 import re
 import time
@@ -34,6 +35,7 @@ else:
 from invenio.config import \
      CFG_OAI_DELETED_POLICY, \
      CFG_OAI_EXPIRE, \
+     CFG_OAI_RESUMPTION_TOKEN_STORAGE, \
      CFG_OAI_IDENTIFY_DESCRIPTION, \
      CFG_OAI_ID_FIELD, \
      CFG_OAI_LOAD, \
@@ -64,7 +66,12 @@ from invenio.search_engine import record_exists, get_all_restricted_recids, get_
 from invenio.bibformat import format_record
 from invenio.bibrecord import record_get_field_instances
 from invenio.errorlib import register_exception
-from invenio.oai_repository_config import CFG_OAI_REPOSITORY_GLOBAL_SET_SPEC
+from invenio.oai_repository_config import CFG_OAI_REPOSITORY_GLOBAL_SET_SPEC, \
+     CFG_OAI_REPOSITORY_RESUMPTION_TOKEN_GC_INTERVAL
+from invenio.redisutils import get_redis
+from invenio.jsonutils import json
+from invenio.oai_repository_index import load_oai_index, \
+     get_field_values_for_recids
 from invenio.dateutils import localtime_to_utc, utc_to_localtime
 
 CFG_VERBS = {
@@ -289,7 +296,51 @@ def get_record_rights(dummy):
             #elif code == CFG_OAI_LICENSE_URI_SUBFIELD:
                 #license_uri = value
 
-def print_record(recid, prefix='marcxml', verb='ListRecords', set_spec=None, set_last_updated=None):
+def get_oai_headers(recids):
+    """
+    Fetch at once the information needed to print the OAI header of
+    many records.
+
+    The precomputed OAI index is used when available, with the database
+    being queried only for the OAI identifiers and for the records
+    modified since the index was last updated.
+
+    @param recids: list of record IDs
+    @return: dictionary recid -> (record_exists, OAI identifiers,
+        setSpecs, modification date in UTC)
+    """
+    ret = {}
+    if not recids:
+        return ret
+    idents = get_field_values_for_recids(recids, CFG_OAI_ID_FIELD)
+    to_fetch = []
+    index = load_oai_index()
+    if index is not None:
+        tail = intbitset(run_sql("SELECT id FROM bibrec WHERE id IN (%s) AND modification_date >= %%s" % ','.join(str(recid) for recid in recids), (index.last_updated, )))
+        for recid in recids:
+            datestamp = index.get_datestamp(recid)
+            if recid in tail or datestamp is None:
+                to_fetch.append(recid)
+            else:
+                ret[recid] = (index.record_exists(recid), idents.get(recid, []),
+                              index.get_sets(recid), localtime_to_utc(datestamp))
+    else:
+        to_fetch = recids
+    if to_fetch:
+        sets = get_field_values_for_recids(to_fetch, CFG_OAI_SET_FIELD)
+        collections = get_field_values_for_recids(to_fetch, '980__%')
+        res = run_sql("SELECT id, DATE_FORMAT(modification_date,'%%Y-%%m-%%d %%H:%%i:%%s') FROM bibrec WHERE id IN (%s)" % ','.join(str(recid) for recid in to_fetch))
+        for recid, datestamp in res:
+            dbcollids = collections.get(recid, [])
+            if "DELETED" in dbcollids or (CFG_CERN_SITE and "DUMMY" in dbcollids):
+                exists = -1
+            else:
+                exists = 1
+            ret[recid] = (exists, idents.get(recid, []), sets.get(recid, []),
+                          datestamp and localtime_to_utc(datestamp) or "")
+    return ret
+
+def print_record(recid, prefix='marcxml', verb='ListRecords', set_spec=None, set_last_updated=None, header_info=None):
     """Prints record 'recid' formatted according to 'prefix'.
 
     - if record does not exist, return nothing.
@@ -301,11 +352,17 @@ def print_record(recid, prefix='marcxml', verb='ListRecords', set_spec=None, set
     - if record has been deleted and CFG_OAI_DELETED_POLICY is 'no',
       then return nothing.
 
+    @param header_info: the header information of the record as
+        returned by get_oai_headers(); if not specified it is fetched
+        from the database.
     """
 
-    record_exists_result = record_exists(recid) == 1
+    if header_info is None:
+        header_info = get_oai_headers([recid]).get(recid, (0, [], [], ""))
+    record_exists_code, idents, sets, modification_date = header_info
+
+    record_exists_result = record_exists_code == 1
     if record_exists_result:
-        sets = get_field(recid, CFG_OAI_SET_FIELD)
         if set_spec is not None and not set_spec in sets and not [set_ for set_ in sets if set_.startswith("%s:" % set_spec)]:
             ## the record is not in the requested set, and is not
             ## in any subset
@@ -319,7 +376,6 @@ def print_record(recid, prefix='marcxml', verb='ListRecords', set_spec=None, set
     if not record_exists_result and CFG_OAI_DELETED_POLICY not in ('persistent', 'transient'):
         return ""
 
-    idents = get_field(recid, CFG_OAI_ID_FIELD)
     if not idents:
         return ""
     ## FIXME: Move these checks in a bibtask
@@ -337,10 +393,10 @@ def print_record(recid, prefix='marcxml', verb='ListRecords', set_spec=None, set
     header_body = EscapedXMLString('')
     header_body += X.identifier()(ident)
     if set_last_updated:
-        header_body += X.datestamp()(max(get_modification_date(recid), set_last_updated))
+        header_body += X.datestamp()(max(modification_date, set_last_updated))
     else:
-        header_body += X.datestamp()(get_modification_date(recid))
-    for set_spec in get_field(recid, CFG_OAI_SET_FIELD):
+        header_body += X.datestamp()(modification_date)
+    for set_spec in sets:
         if set_spec and set_spec != CFG_OAI_REPOSITORY_GLOBAL_SET_SPEC:
             # Print only if field not empty
             header_body += X.setSpec()(set_spec)
@@ -397,17 +453,24 @@ def oai_list_records_or_identifiers(req, argd):
     # check if the resumption_token did not expire
     if argd.get('resumptionToken'):
         resumption_token_was_specified = True
+        resumption_token = argd['resumptionToken']
         try:
-            cache = oai_cache_load(argd['resumptionToken'])
+            cache = oai_cache_load(resumption_token)
             last_recid = cache['last_recid']
             argd = cache['argd']
             complete_list = cache['complete_list']
-            complete_list = filter_out_based_on_date_range(complete_list, argd.get('from', ''), argd.get('until', ''))
+            if complete_list is None:
+                ## The token does not carry the list of records: let's
+                ## compute it again.
+                complete_list = oai_get_recid_list(argd.get('set', ""), argd.get('from', ""), argd.get('until', ""))
+            else:
+                complete_list = filter_out_based_on_date_range(complete_list, argd.get('from', ''), argd.get('until', ''))
         except Exception, e:
-            # Ignore cache not found errors
-            if not isinstance(e, IOError) or e.errno != 2:
+            # Ignore cache not found errors and invalid/expired tokens
+            if not isinstance(e, ValueError) and \
+                   (not isinstance(e, IOError) or e.errno != 2):
                 register_exception(alert_admin=True)
-            req.write(oai_error(argd, [("badResumptionToken", "ResumptionToken expired or invalid: %s" % argd['resumptionToken'])]))
+            req.write(oai_error({'verb': verb, 'resumptionToken': resumption_token}, [("badResumptionToken", "ResumptionToken expired or invalid: %s" % resumption_token)]))
             return
     else:
         last_recid = 0
@@ -417,27 +480,27 @@ def oai_list_records_or_identifiers(req, argd):
             req.write(oai_error(argd, [("noRecordsMatch", "no records correspond to the request")]))
             return
 
-    cursor = 0
-    for cursor, recid in enumerate(complete_list):
-        ## Let's fast-forward the cursor to point after the last recid that was
-        ## disseminated successfully
-        if recid > last_recid:
-            break
+    ## Let's fast-forward the cursor to point after the last recid that was
+    ## disseminated successfully, with set operations only: converting the
+    ## whole list of records for every page would cost O(n) per page.
+    remaining = complete_list & intbitset([last_recid + 1], trailing_bits=True)
+    cursor = len(complete_list) - len(remaining)
+    page = remaining[:CFG_OAI_LOAD].tolist()
 
     set_last_updated = get_set_last_update(argd.get('set', ""))
+    headers = get_oai_headers(page)
 
     req.write(oai_header(argd, verb))
-    for recid in list(complete_list)[cursor:cursor+CFG_OAI_LOAD]:
-        req.write(print_record(recid, argd['metadataPrefix'], verb=verb, set_spec=argd.get('set'), set_last_updated=set_last_updated))
+    for recid in page:
+        req.write(print_record(recid, argd['metadataPrefix'], verb=verb, set_spec=argd.get('set'), set_last_updated=set_last_updated, header_info=headers.get(recid, (0, [], [], ""))))
 
-    if list(complete_list)[cursor+CFG_OAI_LOAD:]:
-        resumption_token = oai_generate_resumption_token(argd.get('set', ''))
+    if len(remaining) > CFG_OAI_LOAD:
         cache = {
             'argd': argd,
-            'last_recid': recid,
-            'complete_list': complete_list.fastdump(),
+            'last_recid': page[-1],
+            'complete_list': complete_list,
         }
-        oai_cache_dump(resumption_token, cache)
+        resumption_token = oai_cache_dump(cache)
         expdate = oai_get_response_date(CFG_OAI_EXPIRE)
         req.write(X.resumptionToken(expirationDate=expdate, cursor=cursor, completeListSize=len(complete_list))(resumption_token))
     elif resumption_token_was_specified:
@@ -589,8 +652,18 @@ def get_set_last_update(set_spec=""):
         return None
 
 
+def get_records_modified_since(datestamp):
+    """
+    Return a dictionary recid -> local modification date of the records
+    modified since 'datestamp' (local time).
+    """
+    return dict(run_sql("SELECT id, DATE_FORMAT(modification_date,'%%Y-%%m-%%d %%H:%%i:%%s') FROM bibrec WHERE modification_date >= %s", (datestamp, )))
+
 def filter_out_based_on_date_range(recids, fromdate="", untildate="", set_spec=None):
     """ Filter out recids based on date range."""
+    index = load_oai_index()
+    if index is not None:
+        return filter_out_based_on_date_range_from_index(index, recids, fromdate, untildate, set_spec)
     if fromdate:
         fromdate = normalize_date(fromdate, "T00:00:00Z")
     else:
@@ -620,10 +693,64 @@ def filter_out_based_on_date_range(recids, fromdate="", untildate="", set_spec=N
         recids &= intbitset(run_sql("SELECT id FROM bibrec WHERE modification_date <= %s", (untildate, )))
     return recids - get_all_restricted_recids()
 
+def filter_out_based_on_date_range_from_index(index, recids, fromdate="", untildate="", set_spec=None):
+    """
+    Same as filter_out_based_on_date_range() but using the datestamps of
+    the precomputed OAI index, plus those of the records modified after
+    its last update.
+    """
+    if fromdate:
+        fromdate = utc_to_localtime(normalize_date(fromdate, "T00:00:00Z"))
+    if untildate:
+        untildate = utc_to_localtime(normalize_date(untildate, "T23:59:59Z"))
+
+    if fromdate and set_spec is not None:
+        last_updated = get_set_last_update(set_spec)
+        if last_updated is not None and utc_to_localtime(last_updated) > fromdate:
+            fromdate = ""
+
+    tail = get_records_modified_since(index.last_updated)
+    in_range = index.get_recids_in_date_range(fromdate, untildate)
+    in_range -= intbitset(tail.keys())
+    in_range += [recid for recid, datestamp in tail.iteritems()
+                 if (not fromdate or datestamp >= fromdate) and \
+                    (not untildate or datestamp <= untildate)]
+    return (intbitset(recids) & in_range) - get_all_restricted_recids()
+
+def oai_get_recid_list_from_index(index, set_spec="", fromdate="", untildate=""):
+    """
+    Same as oai_get_recid_list() but using the precomputed OAI index,
+    with the database being queried only for the records modified after
+    its last update.
+    """
+    include_previous = CFG_OAI_DELETED_POLICY != 'no'
+    ret = index.get_set_recids(set_spec, include_previous)
+    if not include_previous:
+        ret -= index.deleted
+
+    tail = intbitset(get_records_modified_since(index.last_updated).keys())
+    if tail:
+        ret -= tail
+        fields = [CFG_OAI_SET_FIELD]
+        if include_previous:
+            fields.append(CFG_OAI_PREVIOUS_SET_FIELD)
+        for field in fields:
+            for recid, values in get_field_values_for_recids(tail, field).iteritems():
+                if not set_spec or [value for value in values if value == set_spec or value.startswith("%s:" % set_spec)]:
+                    ret.add(recid)
+        if not include_previous:
+            for recid, values in get_field_values_for_recids(tail, '980__%').iteritems():
+                if "DELETED" in values or (CFG_CERN_SITE and "DUMMY" in values):
+                    ret.discard(recid)
+    return filter_out_based_on_date_range_from_index(index, ret, fromdate, untildate, set_spec)
+
 def oai_get_recid_list(set_spec="", fromdate="", untildate=""):
     """
     Returns list of recids for the OAI set 'set', modified from 'fromdate' until 'untildate'.
     """
+    index = load_oai_index()
+    if index is not None:
+        return oai_get_recid_list_from_index(index, set_spec, fromdate, untildate)
     ret = intbitset()
     if not set_spec:
         ret |= search_unit_in_bibxxx(p='*', f=CFG_OAI_SET_FIELD, type='e')
@@ -641,53 +768,195 @@ def oai_get_recid_list(set_spec="", fromdate="", untildate=""):
             ret -= search_unit_in_bibxxx(p='DUMMY', f='980__%', type='e')
     return filter_out_based_on_date_range(ret, fromdate, untildate, set_spec)
 
-def oai_generate_resumption_token(set_spec):
-    """Generates unique ID for resumption token management."""
-    fd, name = tempfile.mkstemp(dir=os.path.join(CFG_CACHEDIR, 'RTdata'), prefix='%s___' % set_spec)
-    os.close(fd)
-    return os.path.basename(name)
+class OAIResumptionTokenStorage(object):
+    """
+    Base class of the resumptionToken storages.
+
+    The state of a ListRecords/ListIdentifiers request is a dictionary
+    with keys:
+      - 'argd': the arguments of the original request;
+      - 'last_recid': the last record disseminated;
+      - 'complete_list': the intbitset of the records of the request, or
+        None if the storage does not keep it (in that case the list has
+        to be computed again).
+    """
+
+    def dump(self, cache):
+        """Store the state and return the resumptionToken."""
+        raise NotImplementedError
+
+    def load(self, resumption_token):
+        """
+        Restore the state of the given resumptionToken.  Raise an
+        exception if the token is invalid or has expired.
+        """
+        raise NotImplementedError
+
+    def delete_for_set(self, set_spec):
+        """Invalidate the resumptionTokens of the given set."""
+        pass
+
+    def gc(self):
+        """Garbage collect expired resumptionTokens."""
+        pass
+
+
+class OAIResumptionTokenCompactStorage(OAIResumptionTokenStorage):
+    """
+    Stateless storage: the arguments of the request, the last record
+    disseminated and the expiration time are encoded in the token
+    itself, so nothing needs to be stored, nor garbage collected.
+    """
+
+    version = 1
+
+    def dump(self, cache):
+        argd = cache['argd']
+        state = [self.version, argd['verb'], argd['metadataPrefix'],
+                 argd.get('set', ''), argd.get('from', ''),
+                 argd.get('until', ''), cache['last_recid'],
+                 int(time.time()) + CFG_OAI_EXPIRE]
+        return base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':'))).rstrip('=')
+
+    def load(self, resumption_token):
+        resumption_token = str(resumption_token)
+        padding = '=' * (-len(resumption_token) % 4)
+        try:
+            state = json.loads(base64.urlsafe_b64decode(resumption_token + padding))
+        except (TypeError, ValueError):
+            raise ValueError("Invalid resumptionToken")
+        if not isinstance(state, list) or len(state) != 8 or \
+               state[0] != self.version:
+            raise ValueError("Invalid resumptionToken")
+        dummy, verb, prefix, set_spec, fromdate, untildate, last_recid, expire = state
+        if expire < time.time():
+            raise ValueError("Expired resumptionToken")
+        if verb not in ('ListRecords', 'ListIdentifiers') or \
+               prefix not in CFG_OAI_METADATA_FORMATS or \
+               (fromdate and not check_date(fromdate)) or \
+               (untildate and not check_date(untildate)):
+            raise ValueError("Invalid resumptionToken")
+        argd = {'verb': str(verb), 'metadataPrefix': str(prefix)}
+        if set_spec:
+            argd['set'] = set_spec.encode('utf-8')
+        if fromdate:
+            argd['from'] = str(fromdate)
+        if untildate:
+            argd['until'] = str(untildate)
+        return {'argd': argd,
+                'last_recid': int(last_recid),
+                'complete_list': None}
+
+
+class OAIResumptionTokenFileStorage(OAIResumptionTokenStorage):
+    """
+    Storage pickling the state of every token in a file under
+    CFG_CACHEDIR/RTdata.
+    """
+
+    def __init__(self):
+        self.last_gc = 0
+
+    def _generate_resumption_token(self, set_spec):
+        """Generates unique ID for resumption token management."""
+        fd, name = tempfile.mkstemp(dir=os.path.join(CFG_CACHEDIR, 'RTdata'), prefix='%s___' % set_spec)
+        os.close(fd)
+        return os.path.basename(name)
+
+    def dump(self, cache):
+        resumption_token = self._generate_resumption_token(cache['argd'].get('set', ''))
+        cPickle.dump(cache, open(os.path.join(CFG_CACHEDIR, 'RTdata', resumption_token), 'w'), -1)
+        return resumption_token
+
+    def load(self, resumption_token):
+        fullpath = os.path.join(CFG_CACHEDIR, 'RTdata', resumption_token)
+        if os.path.dirname(os.path.abspath(fullpath)) != os.path.abspath(os.path.join(CFG_CACHEDIR, 'RTdata')):
+            raise ValueError("Invalid path")
+        return cPickle.load(open(fullpath))
+
+    def delete_for_set(self, set_spec):
+        aset = set_spec
+        while aset:
+            for name in iglob(os.path.join(CFG_CACHEDIR, 'RTdata', '%s___*' % set_spec)):
+                os.remove(name)
+            aset = aset.rsplit(":", 1)[0]
+        for name in iglob(os.path.join(CFG_CACHEDIR, 'RTdata', '___*')):
+            os.remove(name)
+
+    def gc(self):
+        ## Scanning the whole directory is expensive, so let's not do it
+        ## at every request.
+        if time.time() - self.last_gc < CFG_OAI_REPOSITORY_RESUMPTION_TOKEN_GC_INTERVAL:
+            return
+        self.last_gc = time.time()
+        for file_ in os.listdir(os.path.join(CFG_CACHEDIR, 'RTdata')):
+            filename = os.path.join(os.path.join(CFG_CACHEDIR, 'RTdata', file_))
+            # cache entry expires when not modified during a specified period of time
+            try:
+                if ((time.time() - os.path.getmtime(filename)) > CFG_OAI_EXPIRE):
+                    os.remove(filename)
+            except OSError:
+                # Most probably the cache was already deleted
+                pass
+
+
+class OAIResumptionTokenRedisStorage(OAIResumptionTokenStorage):
+    """
+    Storage keeping the state of every token in Redis, where it expires
+    by itself after CFG_OAI_EXPIRE seconds.
+
+    Note: tokens are not invalidated when a set is modified, they just
+    expire.
+    """
+
+    def generate_key(self, resumption_token):
+        return 'oai_resumption_token_%s' % resumption_token
+
+    def dump(self, cache):
+        resumption_token = base64.urlsafe_b64encode(os.urandom(18))
+        get_redis().setex(self.generate_key(resumption_token),
+                          cPickle.dumps(cache, -1),
+                          CFG_OAI_EXPIRE)
+        return resumption_token
+
+    def load(self, resumption_token):
+        value = get_redis().get(self.generate_key(resumption_token))
+        if value is None:
+            raise ValueError("Expired resumptionToken")
+        return cPickle.loads(value)
+
+
+if CFG_OAI_RESUMPTION_TOKEN_STORAGE == 'compact':
+    _RESUMPTION_TOKEN_STORAGE = OAIResumptionTokenCompactStorage()
+elif CFG_OAI_RESUMPTION_TOKEN_STORAGE == 'redis':
+    _RESUMPTION_TOKEN_STORAGE = OAIResumptionTokenRedisStorage()
+else:
+    _RESUMPTION_TOKEN_STORAGE = OAIResumptionTokenFileStorage()
 
 def oai_delete_resumption_tokens_for_set(set_spec):
     """
     In case a set is modified by the admin interface, this will delete
     any resumption token that is now invalid.
     """
-    aset = set_spec
-    while aset:
-        for name in iglob(os.path.join(CFG_CACHEDIR, 'RTdata', '%s___*' % set_spec)):
-            os.remove(name)
-        aset = aset.rsplit(":", 1)[0]
-    for name in iglob(os.path.join(CFG_CACHEDIR, 'RTdata', '___*')):
-        os.remove(name)
+    _RESUMPTION_TOKEN_STORAGE.delete_for_set(set_spec)
 
-def oai_cache_dump(resumption_token, cache):
+def oai_cache_dump(cache):
     """
-    Given a resumption_token and the cache, stores the cache.
+    Stores the cache and returns the corresponding resumption_token.
     """
-    cPickle.dump(cache, open(os.path.join(CFG_CACHEDIR, 'RTdata', resumption_token), 'w'), -1)
+    return _RESUMPTION_TOKEN_STORAGE.dump(cache)
 
 def oai_cache_load(resumption_token):
     """
     Restores the cache from the resumption_token.
     """
-    fullpath = os.path.join(CFG_CACHEDIR, 'RTdata', resumption_token)
-    if os.path.dirname(os.path.abspath(fullpath)) != os.path.abspath(os.path.join(CFG_CACHEDIR, 'RTdata')):
-        raise ValueError("Invalid path")
-    return cPickle.load(open(fullpath))
+    return _RESUMPTION_TOKEN_STORAGE.load(resumption_token)
 
 def oai_cache_gc():
     """
     OAI Cache Garbage Collector.
     """
-    for file_ in os.listdir(os.path.join(CFG_CACHEDIR, 'RTdata')):
-        filename = os.path.join(os.path.join(CFG_CACHEDIR, 'RTdata', file_))
-        # cache entry expires when not modified during a specified period of time
-        if ((time.time() - os.path.getmtime(filename)) > CFG_OAI_EXPIRE):
-            try:
-                os.remove(filename)
-            except OSError, e:
-                # Most probably the cache was already deleted
-                pass
+    _RESUMPTION_TOKEN_STORAGE.gc()
 
 def get_all_sets():
     """
@@ -80,8 +80,36 @@ class TestErrorCodes(InvenioTestCase):
 
         self.assertNotEqual([], [code for (code, dummy_text) in oai_repository_server.check_argd({'verb': 'ListRecords', 'resumptionToken': ''}) if code == 'badResumptionToken'])
 
+class TestCompactResumptionToken(InvenioTestCase):
+    """Test the resumptionTokens encoding their own state."""
+
+    def setUp(self):
+        self.storage = oai_repository_server.OAIResumptionTokenCompactStorage()
+
+    def test_roundtrip(self):
+        """oairepository - compact resumptionToken roundtrip"""
+        argd = {'verb': 'ListRecords', 'metadataPrefix': 'marcxml',
+                'set': 'cern:theses', 'from': '2001-01-01'}
+        token = self.storage.dump({'argd': argd, 'last_recid': 1234,
+                                   'complete_list': None})
+        self.assertEqual(None, re.search(r'[^A-Za-z0-9_-]', token))
+        cache = self.storage.load(token)
+        self.assertEqual(argd, cache['argd'])
+        self.assertEqual(1234, cache['last_recid'])
+        self.assertEqual(None, cache['complete_list'])
+
+    def test_invalid(self):
+        """oairepository - invalid compact resumptionToken"""
+        self.assertRaises(ValueError, self.storage.load, 'foo')
+        self.assertRaises(ValueError, self.storage.load, '!!!')
+        token = self.storage.dump({'argd': {'verb': 'ListRecords', 'metadataPrefix': 'not_a_format'},
+                                   'last_recid': 1, 'complete_list': None})
+        self.assertRaises(ValueError, self.storage.load, token)
+
+
 TEST_SUITE = make_test_suite(TestVerbs,
-                             TestErrorCodes)
+                             TestErrorCodes,
+                             TestCompactResumptionToken)
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE)
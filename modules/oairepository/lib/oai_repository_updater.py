@@ -46,6 +46,7 @@ from invenio.oai_repository_config import CFG_OAI_REPOSITORY_MARCXML_SIZE, \
      CFG_OAI_REPOSITORY_GLOBAL_SET_SPEC
 from invenio.search_engine import perform_request_search, get_record, search_unit_in_bibxxx
 from invenio.intbitset import intbitset
+from invenio.oai_repository_index import update_oai_index
 from invenio.dbquery import run_sql
 from invenio.bibtask import \
      task_get_option, \
@@ -339,6 +340,11 @@ def oairepositoryupdater_task():
     all_affected_recids |= missing_oaiid | no_more_exported_recids
     write_message("%s recids should updated" % (len(all_affected_recids)), verbose=2)
 
+    if not task_get_option("no_index"):
+        task_update_progress("Updating the OAI index")
+        index = update_oai_index()
+        write_message("OAI index updated: %s sets, %s records" % (len(index.sets), len(index.recids)))
+
     if not all_affected_recids:
         write_message("Nothing to do!")
         return True
@@ -498,12 +504,14 @@ field. Please revise your configuration for the variables
                 " -d --detailed-report\t\tOAI repository detailed status\n"
                 " -n --no-process\tDo no upload the modifications\n"
                 " --notimechange\tDo not update record modification_date\n"
+                " --no-index\tDo not update the OAI index used by the OAI server\n"
                 "NOTE: --notimechange should be used with care, basically only the first time a new set is added.",
             specific_params=("rdn", [
                 "report",
                 "detailed-report",
                 "no-process",
-                "notimechange"]),
+                "notimechange",
+                "no-index"]),
             task_submit_elaborate_specific_parameter_fnc=
                 task_submit_elaborate_specific_parameter,
             task_run_fnc=oairepositoryupdater_task)
@@ -518,6 +526,8 @@ def task_submit_elaborate_specific_parameter(key, _value, _opts, _args):
         task_set_option("no_upload", 1)
     elif key in ("--notimechange",):
         task_set_option("notimechange", 1)
+    elif key in ("--no-index",):
+        task_set_option("no_index", 1)
     else:
         return False
     return True
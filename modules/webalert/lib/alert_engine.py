@@ -25,7 +25,7 @@ __revision__ = "$Id$"
 
 from cgi import parse_qs
 from re import search, sub
-from time import strftime
+from time import strftime, time
 import datetime
 
 from invenio.config import \
@@ -58,6 +58,11 @@ import invenio.template
 websearch_templates = invenio.template.load('websearch')
 webalert_templates = invenio.template.load('webalert')
 
+# URL arguments of the alert queries used by get_record_ids
+_SEARCH_ARGUMENTS = ('p', 'c', 'cc', 'aas', 'f', 'so', 'sp', 'ot',
+                     'p1', 'f1', 'm1', 'op1', 'p2', 'f2', 'm2', 'op3',
+                     'p3', 'f3', 'm3', 'sc')
+
 def update_date_lastrun(alert):
     """Update the last time this alert was ran in the database."""
 
@@ -158,8 +163,12 @@ def get_query(alert_id):
     r = run_sql('select urlargs from query where id=%s', (alert_id,))
     return r[0][0]
 
-def email_notify(alert, records, argstr):
-    """Send the notification e-mail for a specific alert."""
+def email_notify(alert, records, argstr, rendered_records=None):
+    """Send the notification e-mail for a specific alert.
+
+    rendered_records is a dictionary where the records listed in the
+    e-mails are kept once formatted, to be reused by the other alerts
+    sending the same records."""
     if CFG_WEBALERT_DEBUG_LEVEL > 2:
         print "+" * 80 + '\n'
     uid = alert[0]
@@ -215,6 +224,13 @@ def email_notify(alert, records, argstr):
     sc = query.get('sc', ['1'])
     collections = calculate_desired_collection_list(collection_list, current_collection, int(sc[0]))
 
+    if rendered_records is None:
+        rendered_records = {}
+    key = (repr(filtered_records), repr(collections), alert_use_basket_p(alert))
+    if key not in rendered_records:
+        rendered_records[key] = webalert_templates.tmpl_alert_email_records(
+            filtered_records, collections, alert_use_basket_p(alert))
+
     msg += webalert_templates.tmpl_alert_email_body(alert_name,
                                                     alert_description,
                                                     url,
@@ -222,7 +238,8 @@ def email_notify(alert, records, argstr):
                                                     pattern,
                                                     collections,
                                                     frequency,
-                                                    alert_use_basket_p(alert))
+                                                    alert_use_basket_p(alert),
+                                                    rendered_records[key])
 
     email = alert_recipient_email or get_email(uid)
 
@@ -315,11 +332,18 @@ def get_record_ids(argstr, date_from, date_until):
 
     return (recids, external_records)
 
-def run_query(query, frequency, date_until):
-    """Return a dictionary containing the information of the performed query.
+def get_query_key(argstr):
+    """Return a key identifying the search done by get_record_ids for
+    the given query.  Queries differing only by the order of their
+    arguments or by arguments not used in the search (rg, of, ln...)
+    have the same key."""
 
-    The information contains the id of the query, the arguments as a
-    string, and the list of found records."""
+    argd = wash_urlargd(parse_qs(argstr), websearch_templates.search_results_default_urlargd)
+    return repr([(name, argd.get(name)) for name in _SEARCH_ARGUMENTS])
+
+def get_date_from(frequency, date_until):
+    """Return the beginning of the period covered by an alert of the given
+    frequency run on date_until."""
 
     if frequency == 'day':
         date_from = date_until - datetime.timedelta(days=1)
@@ -340,7 +364,25 @@ def run_query(query, frequency, date_until):
 
         date_from = datetime.date(year=y, month=m, day=d)
 
-    recs = get_record_ids(query[1], date_from, date_until)
+    return date_from
+
+def run_query(query, frequency, date_until, hitsets=None):
+    """Return a dictionary containing the information of the performed query.
+
+    The information contains the id of the query, the arguments as a
+    string, and the list of found records.  If hitsets is given, it is a
+    dictionary where the records found are kept, and taken from when the
+    same search is run again for another query."""
+
+    date_from = get_date_from(frequency, date_until)
+
+    if hitsets is None:
+        recs = get_record_ids(query[1], date_from, date_until)
+    else:
+        key = (get_query_key(query[1]), date_from, date_until)
+        if key not in hitsets:
+            hitsets[key] = get_record_ids(query[1], date_from, date_until)
+        recs = hitsets[key]
 
     n = len(recs[0])
     if n:
@@ -362,14 +404,25 @@ def process_alert_queries(frequency, date):
     """Run the alerts according to the frequency.
 
     Retrieves the queries for which an alert exists, performs it, and
-    processes the corresponding alerts."""
+    processes the corresponding alerts.
+
+    Each distinct search is run only once, whichever the number of queries
+    doing it, and the records listed in the e-mails are formatted only once
+    for all the alerts sending the same records.
+
+    Return the number of queries processed and the number of searches
+    actually run."""
 
     alert_queries = get_alert_queries(frequency)
+    hitsets = {}
+    rendered_records = {}
 
     for aq in alert_queries:
-        q = run_query(aq, frequency, date)
+        q = run_query(aq, frequency, date, hitsets)
         alerts = get_alerts(q, frequency)
-        process_alerts(alerts)
+        process_alerts(alerts, rendered_records)
+
+    return len(alert_queries), len(hitsets)
 
 def process_alert_queries_for_user(uid, date):
     """Process the alerts for the given user id.
@@ -424,12 +477,12 @@ def log(msg):
     except Exception:
         register_exception()
 
-def process_alerts(alerts):
+def process_alerts(alerts, rendered_records=None):
     """Process the given alerts and store the records found to the user defined baskets
-    and/or notify them by e-mail"""
+    and/or notify them by e-mail (see email_notify for rendered_records)"""
 
-    # TBD: do not generate the email each time, forge it once and then
-    # send it to all appropriate people
+    if rendered_records is None:
+        rendered_records = {}
 
     for a in alerts['alerts']:
         if alert_use_basket_p(a):
@@ -437,7 +490,7 @@ def process_alerts(alerts):
         if alert_use_notification_p(a):
             argstr = update_arguments(alerts['argstr'], alerts['date_from'], alerts['date_until'])
             try:
-                email_notify(a, alerts['records'], argstr)
+                email_notify(a, alerts['records'], argstr, rendered_records)
             except Exception:
                 # There were troubles sending this alert, so register
                 # this exception and continue with other alerts:
@@ -466,15 +519,31 @@ def run_alerts(date):
     """Run the alerts.
 
     First decide which alerts to run according to the current local
-    time, and runs them."""
+    time, and runs them.
+
+    Return a message reporting the number of queries processed, the
+    number of distinct searches run and the time taken."""
+
+    start = time()
+    stats = []
 
     if date.day == 1:
-        process_alert_queries('month', date)
+        stats.append(process_alert_queries('month', date))
 
     if date.isoweekday() == 1: # first day of the week
-        process_alert_queries('week', date)
+        stats.append(process_alert_queries('week', date))
+
+    stats.append(process_alert_queries('day', date))
+
+    nb_queries = sum([n for n, dummy in stats])
+    nb_searches = sum([n for dummy, n in stats])
 
-    process_alert_queries('day', date)
+    report = '%d queries processed by running %d distinct searches ' \
+             '(%.1f%%) in %.2f seconds' % (nb_queries, nb_searches,
+                                            nb_searches * 100.0 / max(nb_queries, 1),
+                                            time() - start)
+    log(report)
+    return report
 
 # External records related functions
 def calculate_external_records(req_args, pattern_list, field, hosted_colls, timeout=CFG_EXTERNAL_COLLECTION_TIMEOUT, limit=CFG_EXTERNAL_COLLECTION_MAXRESULTS_ALERTS):
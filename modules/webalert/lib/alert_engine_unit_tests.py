@@ -26,6 +26,7 @@ from invenio.testutils import InvenioTestCase
 from invenio.config import CFG_SITE_URL
 from invenio.testutils import make_test_suite, run_test_suite
 from invenio.htmlparser import RecordHTMLParser
+from invenio.alert_engine import get_query_key
 
 class TestWashHTMLtoText(InvenioTestCase):
     """Test HTML to text conversion."""
@@ -55,7 +56,21 @@ class TestWashHTMLtoText(InvenioTestCase):
         htparser.feed('&#80;ython is co&#111;l')
         self.assertEqual('Python is cool', htparser.result)
 
-TEST_SUITE = make_test_suite(TestWashHTMLtoText)
+class TestAlertQueryKey(InvenioTestCase):
+    """Test the identification of the alert queries doing the same search."""
+
+    def test_same_search(self):
+        """webalert - same key for the same search written differently"""
+        self.assertEqual(get_query_key('p=ellis&c=Theses&c=Poetry'),
+                         get_query_key('c=Theses&c=Poetry&rg=25&p=ellis&ln=fr'))
+
+    def test_different_search(self):
+        """webalert - different keys for different searches"""
+        self.assertNotEqual(get_query_key('p=ellis&c=Theses'),
+                            get_query_key('p=ellis&c=Poetry'))
+
+TEST_SUITE = make_test_suite(TestWashHTMLtoText,
+                             TestAlertQueryKey)
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE)
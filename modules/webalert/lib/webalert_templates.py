@@ -499,9 +499,12 @@ class Template:
     def tmpl_alert_email_from(self):
         return '%s Alert Engine <%s>' % (CFG_SITE_NAME, CFG_WEBALERT_ALERT_ENGINE_EMAIL)
 
-    def tmpl_alert_email_body(self, name, description, url, records, pattern,
-                              collection_list, frequency, add_to_basket_p):
-
+    def tmpl_alert_email_records(self, records, collection_list,
+                                 add_to_basket_p):
+        """
+        Return the part of the alert email depending on the records
+        found: (collections line, total line, list of the records).
+        """
         recids_by_collection = {}
         for recid in records[0]:
             primary_collection = guess_primary_collection_of_a_record(recid)
@@ -547,39 +550,8 @@ class Template:
         else:
             total = '%d records' % l
 
-        if pattern:
-            pattern = 'pattern: %s\n' % pattern
-
-        frequency = {'day': 'daily',
-                     'week': 'weekly',
-                     'month': 'monthly'}[frequency]
-
-        body = """\
-Hello:
-
-Below are the results of the email notification alert that
-was set up with the %(sitename)s.
-%(description)s
-This is an automatic message, please don't reply to it.
-For any question, please use <%(sitesupportemail)s> instead.
-
-alert name: %(name)s
-%(pattern)s%(collections)sfrequency: %(frequency)s
-run time: %(runtime)s
-found: %(total)s
-url: <%(url)s>
-""" % {'sitesupportemail': CFG_SITE_SUPPORT_EMAIL,
-       'name': name,
-       'sitename': CFG_SITE_NAME,
-       'description': description and '\n' + description + '\n' or '',
-       'pattern': pattern,
-       'collections': collections,
-       'frequency': frequency,
-       'runtime': time.strftime("%a %Y-%m-%d %H:%M:%S"),
-       'total': total,
-       'url': url}
-
         index = 0
+        body = ''
 
         for collection_recids in recids_by_collection.items():
             if collection_recids[0] != 'None of the above':
@@ -635,6 +607,55 @@ Only the first %s records were added to your basket. To manually add more
 records please consult the search URL as described before.
 ''' % (CFG_WEBALERT_MAX_NUM_OF_RECORDS_IN_ALERT_EMAIL,)
 
+        return collections, total, body
+
+    def tmpl_alert_email_body(self, name, description, url, records, pattern,
+                              collection_list, frequency, add_to_basket_p,
+                              rendered_records=None):
+        """
+        Return the alert email.  rendered_records is the result of
+        tmpl_alert_email_records, if it was already computed for the
+        same records by another alert.
+        """
+        if rendered_records is None:
+            rendered_records = self.tmpl_alert_email_records(records,
+                                                             collection_list,
+                                                             add_to_basket_p)
+        collections, total, records_body = rendered_records
+
+        if pattern:
+            pattern = 'pattern: %s\n' % pattern
+
+        frequency = {'day': 'daily',
+                     'week': 'weekly',
+                     'month': 'monthly'}[frequency]
+
+        body = """\
+Hello:
+
+Below are the results of the email notification alert that
+was set up with the %(sitename)s.
+%(description)s
+This is an automatic message, please don't reply to it.
+For any question, please use <%(sitesupportemail)s> instead.
+
+alert name: %(name)s
+%(pattern)s%(collections)sfrequency: %(frequency)s
+run time: %(runtime)s
+found: %(total)s
+url: <%(url)s>
+""" % {'sitesupportemail': CFG_SITE_SUPPORT_EMAIL,
+       'name': name,
+       'sitename': CFG_SITE_NAME,
+       'description': description and '\n' + description + '\n' or '',
+       'pattern': pattern,
+       'collections': collections,
+       'frequency': frequency,
+       'runtime': time.strftime("%a %Y-%m-%d %H:%M:%S"),
+       'total': total,
+       'url': url}
+
+        body += records_body
 
         body += '''
 --
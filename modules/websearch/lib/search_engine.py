@@ -2036,7 +2036,7 @@ def browse_in_bibwords(req, p, f, ln=CFG_SITE_LANG):
     ))
     return
 
-def search_pattern(req=None, p=None, f=None, m=None, ap=0, of="id", verbose=0, ln=CFG_SITE_LANG, display_nearest_terms_box=True, wl=0):
+def search_pattern(req=None, p=None, f=None, m=None, ap=0, of="id", verbose=0, ln=CFG_SITE_LANG, display_nearest_terms_box=True, wl=0, hitset_restriction=None):
     """Search for complex pattern 'p' within field 'f' according to
        matching type 'm'.  Return hitset of recIDs.
 
@@ -2062,6 +2062,11 @@ def search_pattern(req=None, p=None, f=None, m=None, ap=0, of="id", verbose=0, l
        The 'verbose' argument controls the level of debugging information
        to be printed (0=least, 9=most).
 
+       The 'hitset_restriction' argument, if given, is the set of
+       records the search is restricted to.  It can speed up searches
+       performed on a few records (e.g. by webcoll, to know in which
+       collections the last modified records belong).
+
        All the parameters are assumed to have been previously washed.
 
        This function is suitable as a mid-level API.
@@ -2072,6 +2077,8 @@ def search_pattern(req=None, p=None, f=None, m=None, ap=0, of="id", verbose=0, l
     hitset_empty = intbitset()
     # sanity check:
     if not p:
+        if hitset_restriction is not None:
+            return intbitset(hitset_restriction)
         hitset_full = intbitset(trailing_bits=1)
         hitset_full.discard(0)
         # no pattern, so return all universe
@@ -2113,7 +2120,7 @@ def search_pattern(req=None, p=None, f=None, m=None, ap=0, of="id", verbose=0, l
             if of.startswith("h") and verbose:
                 write_warning(_('Instead searching %s.' % str([bsu_o, bsu_p, bsu_f, bsu_m])), req=req)
         try:
-            basic_search_unit_hitset = search_unit(bsu_p, bsu_f, bsu_m, wl)
+            basic_search_unit_hitset = search_unit(bsu_p, bsu_f, bsu_m, wl, hitset_restriction=hitset_restriction)
         except InvenioWebSearchWildcardLimitError, excp:
             basic_search_unit_hitset = excp.res
             if of.startswith("h"):
@@ -2127,6 +2134,9 @@ def search_pattern(req=None, p=None, f=None, m=None, ap=0, of="id", verbose=0, l
             if of.startswith("h"):
                 write_warning(_("Search term after citedby operator too generic, displaying only partial results..."), req=req)
 
+        if hitset_restriction is not None:
+            basic_search_unit_hitset = basic_search_unit_hitset & hitset_restriction
+
         # FIXME: print warning if we use native full-text indexing
         if bsu_f == 'fulltext' and bsu_m != 'w' and of.startswith('h') and not CFG_SOLR_URL:
             write_warning(_("No phrase index available for fulltext yet, looking for word combination..."), req=req)
@@ -2168,7 +2178,7 @@ def search_pattern(req=None, p=None, f=None, m=None, ap=0, of="id", verbose=0, l
                     bsu_pn = re.sub(r'[^a-zA-Z0-9\s\:]+', " ", bsu_p)
                 if verbose and of.startswith('h') and req:
                     write_warning("Trying (%s,%s,%s)" % (cgi.escape(bsu_pn), cgi.escape(bsu_f), cgi.escape(bsu_m)), req=req)
-                basic_search_unit_hitset = search_pattern(req=None, p=bsu_pn, f=bsu_f, m=bsu_m, of="id", ln=ln, wl=wl)
+                basic_search_unit_hitset = search_pattern(req=None, p=bsu_pn, f=bsu_f, m=bsu_m, of="id", ln=ln, wl=wl, hitset_restriction=hitset_restriction)
                 if len(basic_search_unit_hitset) > 0:
                     # we retain the new unit instead
                     if of.startswith('h'):
@@ -2207,8 +2217,11 @@ def search_pattern(req=None, p=None, f=None, m=None, ap=0, of="id", verbose=0, l
     if verbose and of.startswith("h"):
         t1 = os.times()[4]
     # let the initial set be the complete universe:
-    hitset_in_any_collection = intbitset(trailing_bits=1)
-    hitset_in_any_collection.discard(0)
+    if hitset_restriction is not None:
+        hitset_in_any_collection = intbitset(hitset_restriction)
+    else:
+        hitset_in_any_collection = intbitset(trailing_bits=1)
+        hitset_in_any_collection.discard(0)
     for idx_unit in xrange(len(basic_search_units)):
         this_unit_operation = basic_search_units[idx_unit][0]
         this_unit_hitset = basic_search_units_hitsets[idx_unit]
@@ -2249,7 +2262,7 @@ def search_pattern(req=None, p=None, f=None, m=None, ap=0, of="id", verbose=0, l
         write_warning("Search stage 3: execution took %.2f seconds." % (t2 - t1), req=req)
     return hitset_in_any_collection
 
-def search_pattern_parenthesised(req=None, p=None, f=None, m=None, ap=0, of="id", verbose=0, ln=CFG_SITE_LANG, display_nearest_terms_box=True, wl=0):
+def search_pattern_parenthesised(req=None, p=None, f=None, m=None, ap=0, of="id", verbose=0, ln=CFG_SITE_LANG, display_nearest_terms_box=True, wl=0, hitset_restriction=None):
     """Search for complex pattern 'p' containing parenthesis within field 'f' according to
        matching type 'm'.  Return hitset of recIDs.
 
@@ -2267,14 +2280,17 @@ def search_pattern_parenthesised(req=None, p=None, f=None, m=None, ap=0, of="id"
     # sanity check: do not call parenthesised parser for search terms
     # like U(1) but still call it for searches like ('U(1)' | 'U(2)'):
     if not re_pattern_parens.search(re_pattern_parens_quotes.sub('_', p)):
-        return search_pattern(req, p, f, m, ap, of, verbose, ln, display_nearest_terms_box=display_nearest_terms_box, wl=wl)
+        return search_pattern(req, p, f, m, ap, of, verbose, ln, display_nearest_terms_box=display_nearest_terms_box, wl=wl, hitset_restriction=hitset_restriction)
 
     # Try searching with parentheses
     try:
         parser = SearchQueryParenthesisedParser()
 
         # get a hitset with all recids
-        result_hitset = intbitset(trailing_bits=1)
+        if hitset_restriction is not None:
+            result_hitset = intbitset(hitset_restriction)
+        else:
+            result_hitset = intbitset(trailing_bits=1)
 
         # parse the query. The result is list of [op1, expr1, op2, expr2, ..., opN, exprN]
         parsing_result = parser.parse_query(p)
@@ -2297,7 +2313,7 @@ def search_pattern_parenthesised(req=None, p=None, f=None, m=None, ap=0, of="id"
                 ap = 0
                 display_nearest_terms_box = False
              # obtain a hitset for the current pattern
-            current_hitset = search_pattern(req, current_pattern, f, m, ap, of, verbose, ln, display_nearest_terms_box=display_nearest_terms_box, wl=wl)
+            current_hitset = search_pattern(req, current_pattern, f, m, ap, of, verbose, ln, display_nearest_terms_box=display_nearest_terms_box, wl=wl, hitset_restriction=hitset_restriction)
             # combine the current hitset with resulting hitset using the current operator
             if current_operator == '+':
                 result_hitset = result_hitset & current_hitset
@@ -2320,10 +2336,10 @@ def search_pattern_parenthesised(req=None, p=None, f=None, m=None, ap=0, of="id"
         p = p.replace('(', ' ')
         p = p.replace(')', ' ')
 
-        return search_pattern(req, p, f, m, ap, of, verbose, ln, display_nearest_terms_box=display_nearest_terms_box, wl=wl)
+        return search_pattern(req, p, f, m, ap, of, verbose, ln, display_nearest_terms_box=display_nearest_terms_box, wl=wl, hitset_restriction=hitset_restriction)
 
 
-def search_unit(p, f=None, m=None, wl=0, ignore_synonyms=None):
+def search_unit(p, f=None, m=None, wl=0, ignore_synonyms=None, hitset_restriction=None):
     """Search for basic search unit defined by pattern 'p' and field
        'f' and matching type 'm'.  Return hitset of recIDs.
 
@@ -2345,6 +2361,11 @@ def search_unit(p, f=None, m=None, wl=0, ignore_synonyms=None):
        Parameter 'ignore_synonyms' is a list of terms for which we
        should not try to further find a synonym.
 
+       Parameter 'hitset_restriction' is an optional set of records
+       used to speed up the search when it has to be performed in the
+       bibxxx tables.  The returned hitset may still contain records
+       outside of it.
+
        This function is suitable as a low-level API.
     """
 
@@ -2437,7 +2458,7 @@ def search_unit(p, f=None, m=None, wl=0, ignore_synonyms=None):
             else:
                 hitset = search_unit_in_idxphrases(p, f, m, wl)
         else:
-            hitset = search_unit_in_bibxxx(p, f, m, wl)
+            hitset = search_unit_in_bibxxx(p, f, m, wl, hitset_restriction=hitset_restriction)
             # if not hitset and m == 'a' and (p[0] != '%' and p[-1] != '%'):
             #     #if we have no results by doing exact matching, do partial matching
             #     #for removing the distinction between simple and double quotes
@@ -2766,9 +2787,10 @@ def search_unit_in_idxphrases(p, f, search_type, wl=0):
     # okay, return result set:
     return hitset
 
-def search_unit_in_bibxxx(p, f, type, wl=0):
+def search_unit_in_bibxxx(p, f, type, wl=0, hitset_restriction=None):
     """Searches for pattern 'p' inside bibxxx tables for field 'f' and returns hitset of recIDs found.
-    The search type is defined by 'type' (e.g. equals to 'r' for a regexp search)."""
+    The search type is defined by 'type' (e.g. equals to 'r' for a regexp search).
+    If 'hitset_restriction' is given, only these records are looked up."""
 
     # call word search method in some cases:
     if f == 'journal' or f.endswith('count'):
@@ -2809,6 +2831,10 @@ def search_unit_in_bibxxx(p, f, type, wl=0):
         if not tl:
             # f index does not exist, nevermind
             pass
+    if hitset_restriction is not None:
+        if not hitset_restriction:
+            return intbitset()
+        recids_addon = ','.join(str(recid) for recid in hitset_restriction)
     # okay, start search:
     l = [] # will hold list of recID that matched
     for t in tl:
@@ -2824,19 +2850,22 @@ def search_unit_in_bibxxx(p, f, type, wl=0):
                     query_params = tuple(int(param) for param in query_params)
                 except ValueError:
                     return intbitset()
+            query = "SELECT id FROM bibrec WHERE id %s" % query_addons
+            if hitset_restriction is not None:
+                query += " AND id IN (%s)" % recids_addon
             if use_query_limit:
                 try:
-                    res = run_sql_with_limit("SELECT id FROM bibrec WHERE id %s" % query_addons,
-                              query_params, wildcard_limit=wl)
+                    res = run_sql_with_limit(query, query_params, wildcard_limit=wl)
                 except InvenioDbQueryWildcardLimitError, excp:
                     res = excp.res
                     limit_reached = 1 # set the limit reached flag to true
             else:
-                res = run_sql("SELECT id FROM bibrec WHERE id %s" % query_addons,
-                              query_params)
+                res = run_sql(query, query_params)
         else:
             query = "SELECT bibx.id_bibrec FROM %s AS bx LEFT JOIN %s AS bibx ON bx.id=bibx.id_bibxxx WHERE bx.value %s" % \
                     (bx, bibx, query_addons)
+            if hitset_restriction is not None:
+                query += " AND bibx.id_bibrec IN (%s)" % recids_addon
             if len(t) != 6 or t[-1:]=='%':
                 # wildcard query, or only the beginning of field 't'
                 # is defined, so add wildcard character:
@@ -4621,34 +4650,42 @@ def print_records(req, recIDs, jrec=1, rg=CFG_WEBSEARCH_DEF_RECORDS_IN_GROUPS, f
                 if em != "" and EM_REPOSITORY["basket"] not in em:
                     display_add_to_basket = False
                 req.write(websearch_templates.tmpl_record_format_htmlbrief_header(ln=ln))
-                for irec, recid in enumerate(recIDs):
-                    row_number = jrec+irec
-                    if relevances and relevances[irec]:
-                        relevance = relevances[irec]
-                    else:
-                        relevance = ''
-                    record = print_record(recid,
-                                          format,
-                                          ot=ot,
-                                          ln=ln,
-                                          search_pattern=search_pattern,
-                                          user_info=user_info,
-                                          verbose=verbose,
-                                          sf=sf,
-                                          so=so,
-                                          sp=sp,
-                                          rm=rm)
-
-                    req.write(websearch_templates.tmpl_record_format_htmlbrief_body(
-                        ln=ln,
-                        recid=recid,
-                        row_number=row_number,
-                        relevance=relevance,
-                        record=record,
-                        relevances_prologue=relevances_prologue,
-                        relevances_epilogue=relevances_epilogue,
-                        display_add_to_basket=display_add_to_basket
-                        ))
+                ## The documents of the records are needed by several
+                ## format elements: load them all at once.
+                from invenio.bibdocfile import preload_bibrecdocs, \
+                     forget_preloaded_bibrecdocs
+                preload_bibrecdocs(recIDs)
+                try:
+                    for irec, recid in enumerate(recIDs):
+                        row_number = jrec+irec
+                        if relevances and relevances[irec]:
+                            relevance = relevances[irec]
+                        else:
+                            relevance = ''
+                        record = print_record(recid,
+                                              format,
+                                              ot=ot,
+                                              ln=ln,
+                                              search_pattern=search_pattern,
+                                              user_info=user_info,
+                                              verbose=verbose,
+                                              sf=sf,
+                                              so=so,
+                                              sp=sp,
+                                              rm=rm)
+
+                        req.write(websearch_templates.tmpl_record_format_htmlbrief_body(
+                            ln=ln,
+                            recid=recid,
+                            row_number=row_number,
+                            relevance=relevance,
+                            record=record,
+                            relevances_prologue=relevances_prologue,
+                            relevances_epilogue=relevances_epilogue,
+                            display_add_to_basket=display_add_to_basket
+                            ))
+                finally:
+                    forget_preloaded_bibrecdocs()
 
                 req.write(websearch_templates.tmpl_record_format_htmlbrief_footer(
                     ln=ln,
@@ -60,7 +60,7 @@ from invenio.webinterface_handler_wsgi import SimulatedModPythonRequest
 from invenio.search_engine import perform_request_search, \
     guess_primary_collection_of_a_record, guess_collection_of_a_record, \
     collection_restricted_p, get_permitted_restricted_collections, \
-    search_pattern, search_unit, search_unit_in_bibrec, \
+    search_pattern, search_pattern_parenthesised, search_unit, search_unit_in_bibrec, \
     wash_colls, record_public_p
 from invenio import search_engine_summarizer
 from invenio.search_engine_utils import get_fieldvalues
@@ -4142,6 +4142,15 @@ class WebSearchMARCQueryTest(InvenioTestCase):
                          test_web_page_content(CFG_SITE_URL + '/search?of=id&p=245%3A%2Fand%2F&rg=100&so=a',
                                                expected_text="[1, 8, 9, 14, 15, 20, 22, 24, 28, 33, 47, 48, 49, 51, 53, 64, 69, 71, 79, 82, 83, 85, 91, 96, 108]"))
 
+    def test_marc_tag_query_with_hitset_restriction(self):
+        """websearch - MARC tag query restricted to some records"""
+        self.assertEqual(intbitset([9, 18]),
+                         search_pattern_parenthesised(p='100__a:"Ellis, J"', ap=-9,
+                                                      hitset_restriction=intbitset([1, 9, 18])))
+        self.assertEqual(intbitset([1]),
+                         search_pattern_parenthesised(p='245:\'and\' -100__a:"Ellis, J"', ap=-9,
+                                                      hitset_restriction=intbitset([1, 9, 18])))
+
 class WebSearchExtSysnoQueryTest(InvenioTestCase):
     """Test of queries using external system numbers."""
 
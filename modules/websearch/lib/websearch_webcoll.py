@@ -28,6 +28,10 @@ import os
 import string
 import time
 import cPickle
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
 
 from invenio.config import \
      CFG_CERN_SITE, \
@@ -41,6 +45,7 @@ from invenio.config import \
      CFG_WEBSEARCH_ENABLED_SEARCH_INTERFACES, \
      CFG_WEBSEARCH_DEFAULT_SEARCH_INTERFACE, \
      CFG_WEBSEARCH_DEF_RECORDS_IN_GROUPS, \
+     CFG_WEBCOLL_INCREMENTAL_MAX_RECORDS, \
      CFG_SCOAP3_SITE
 from invenio.messages import gettext_set_language, language_list_long
 from invenio.search_engine import search_pattern_parenthesised, get_creation_date, get_field_i18nname, collection_restricted_p, sort_records, EM_REPOSITORY
@@ -83,6 +88,12 @@ CFG_CACHE_LAST_UPDATED_TIMESTAMP_FILE = "%s/collections/last_updated" % CFG_CACH
 # timestamp file usef when running webcoll in the fast-mode.
 CFG_CACHE_LAST_FAST_UPDATED_TIMESTAMP_FILE = "%s/collections/last_fast_updated" % CFG_CACHEDIR
 
+# CFG_CACHE_INCREMENTAL_STATE_FILE -- location of the file where
+# webcoll stores the date since when modified records have to be
+# examined by the next incremental run, together with a checksum of
+# the collection definitions:
+CFG_CACHE_INCREMENTAL_STATE_FILE = "%s/collections/incremental_state" % CFG_CACHEDIR
+
 
 def get_collection(colname):
     """Return collection object from the collection house for given colname.
@@ -146,6 +157,7 @@ class Collection:
             self.reclist = intbitset()
             self.old_reclist = intbitset()
             self.reclist_updated_since_start = 1
+            self.old_nbrecs = self.nbrecs
         else:
             self.name = name
             try:
@@ -168,6 +180,7 @@ class Collection:
                     self.reclist = intbitset()
                     self.reclist_updated_since_start = 1
                 self.old_reclist = intbitset(self.reclist)
+                self.old_nbrecs = self.nbrecs
             except Error, e:
                 print "Error %d: %s" % (e.args[0], e.args[1])
                 sys.exit(1)
@@ -770,12 +783,16 @@ class Collection:
           formatoptions = self.create_formatoptions(ln)
         )
 
-    def calculate_reclist(self):
+    def calculate_reclist(self, modified_recids=None):
         """
         Calculate, set and return the (reclist,
                                        reclist_with_nonpublic_subcolls,
                                        nbrecs_from_hosted_collections)
-        tuple for the given collection."""
+        tuple for the given collection.
+
+        If modified_recids is given, the dbquery of the collection is
+        only evaluated on these records, and the reclist stored in the
+        database is patched accordingly."""
 
         if str(self.dbquery).startswith("hostedcollection:"):
             # we don't normally use this function to calculate the reclist
@@ -805,7 +822,7 @@ class Collection:
             for coll in self.get_sons():
                 coll_reclist,\
                 coll_reclist_with_nonpublic_subcolls,\
-                coll_nbrecs_from_hosted_collection = coll.calculate_reclist()
+                coll_nbrecs_from_hosted_collection = coll.calculate_reclist(modified_recids)
 
                 if ((coll.restricted_p() is None) or
                     (coll.restricted_p() == self.restricted_p())):
@@ -820,10 +837,17 @@ class Collection:
             # B - collection does have dbquery, so compute it:
             #     (note: explicitly remove DELETED records)
             if CFG_CERN_SITE:
-                reclist = search_pattern_parenthesised(None, self.dbquery + \
-                                         ' -980__:"DELETED" -980__:"DUMMY"', ap=-9) #ap=-9 for allow queries containing hidden tags
+                dbquery = self.dbquery + ' -980__:"DELETED" -980__:"DUMMY"'
+            else:
+                dbquery = self.dbquery + ' -980__:"DELETED"'
+            if modified_recids is not None and not self.reclist_updated_since_start:
+                # B1 - incremental update: only the modified records can
+                #      have entered or left the collection
+                write_message("... patching reclist of %s with %s modified records" % (self.name, len(modified_recids)), verbose=6)
+                reclist = self.reclist - modified_recids
+                reclist |= search_pattern_parenthesised(None, dbquery, ap=-9, hitset_restriction=modified_recids) #ap=-9 allow queries containing hidden tags
             else:
-                reclist = search_pattern_parenthesised(None, self.dbquery + ' -980__:"DELETED"', ap=-9) #ap=-9 allow queries containing hidden tags
+                reclist = search_pattern_parenthesised(None, dbquery, ap=-9) #ap=-9 allow queries containing hidden tags
             reclist_with_nonpublic_subcolls = copy.deepcopy(reclist)
 
         # store the results:
@@ -892,6 +916,11 @@ class Collection:
         if self.update_reclist_run_already:
             # do we have to reupdate?
             return 0
+        if task_get_option("incremental") and self.old_reclist == self.reclist \
+               and self.old_nbrecs == self.nbrecs:
+            write_message("... no changes in reclist of %s detected" % self.name, verbose=6)
+            self.update_reclist_run_already = 1
+            return 0
         write_message("... updating reclist of %s (%s recs)" % (self.name, self.nbrecs), verbose=6)
         sys.stdout.flush()
         try:
@@ -1044,6 +1073,81 @@ def set_cache_last_updated_timestamp(timestamp):
     f.close()
     return timestamp
 
+def get_collection_definitions_checksum():
+    """
+    Return a checksum of the collection definitions (dbqueries, tree,
+    restrictions): when they change, all the reclists have to be
+    recomputed.
+    """
+    collections = run_sql("SELECT id, name, dbquery FROM collection ORDER BY id")
+    tree = run_sql("""SELECT id_dad, id_son, type FROM collection_collection
+                      ORDER BY id_dad, id_son""")
+    restricted = [name for dummy, name, dummy in collections
+                  if collection_restricted_p(name)]
+    return md5(repr((collections, tree, restricted))).hexdigest()
+
+def get_incremental_state():
+    """
+    Return the (since, checksum) pair stored by the last run, or
+    (None, None).
+    """
+    try:
+        f = open(CFG_CACHE_INCREMENTAL_STATE_FILE, "r")
+    except IOError:
+        return None, None
+    try:
+        try:
+            since, checksum = f.read().split()[:2]
+        except ValueError:
+            return None, None
+    finally:
+        f.close()
+    return since.replace('T', ' '), checksum
+
+def set_incremental_state(since, checksum):
+    """Store the state needed by the next incremental run."""
+    f = open(CFG_CACHE_INCREMENTAL_STATE_FILE, "w")
+    try:
+        f.write("%s %s\n" % (since.replace(' ', 'T'), checksum))
+    finally:
+        f.close()
+
+def get_incremental_since(task_run_start_timestamp):
+    """
+    Return the date since when records have to be examined by the next
+    incremental run: records modified later than the start of this run,
+    as well as records not indexed yet at the start of this run (their
+    collection membership may change once they are indexed).
+    """
+    last_indexed = run_sql("""SELECT DATE_FORMAT(MIN(last_updated), '%Y-%m-%d %H:%i:%s')
+                              FROM idxINDEX
+                              WHERE last_updated > '0000-00-00 00:00:00'""")
+    if last_indexed and last_indexed[0][0]:
+        return min(last_indexed[0][0], task_run_start_timestamp)
+    return task_run_start_timestamp
+
+def get_recids_to_update_incrementally(checksum):
+    """
+    Return the records whose collection membership may have changed
+    since the last run, or None if all the reclists have to be
+    recomputed (first run, changed collection definitions, too many
+    modified records).
+    """
+    since, previous_checksum = get_incremental_state()
+    if since is None:
+        write_message("No previous incremental state found, running a full update.")
+        return None
+    if checksum != previous_checksum:
+        write_message("Collection definitions have changed, running a full update.")
+        return None
+    recids = intbitset(run_sql("SELECT id FROM bibrec WHERE modification_date >= %s",
+                               (since, )))
+    if len(recids) > CFG_WEBCOLL_INCREMENTAL_MAX_RECORDS:
+        write_message("%s records modified since %s, running a full update." % (len(recids), since))
+        return None
+    write_message("%s records modified since %s." % (len(recids), since), verbose=3)
+    return recids
+
 def main():
     """Main that construct all the bibtask."""
     task_init(authorization_action="runwebcoll",
@@ -1061,16 +1165,20 @@ def main():
                     "  -q, --quick\t\t Skip webpage cache update for those collections whose\n"
                     "\t\t\t reclist was not changed. Note: if you use this option, it is advised\n"
                     "\t\t\t to schedule, e.g. a nightly 'webcoll --force'. [no]\n"
+                    "  -i, --incremental\t Only re-examine the records modified since the last\n"
+                    "\t\t\t run, and skip the webpage cache update of unchanged\n"
+                    "\t\t\t collections. [no]\n"
                     "  -f, --force\t\t Force update even if cache is up to date. [no]\n"
                     "  -p, --part\t\t Update only certain cache parts (1=reclist,"
                     " 2=webpage). [both]\n"
                     "  -l, --language\t Update pages in only certain language"
                     " (e.g. fr,it,...). [all]\n",
             version=__revision__,
-            specific_params=("c:rqfp:l:", [
+            specific_params=("c:rqifp:l:", [
                     "collection=",
                     "recursive",
                     "quick",
+                    "incremental",
                     "force",
                     "part=",
                     "language="
@@ -1098,6 +1206,8 @@ def task_submit_elaborate_specific_parameter(key, value, opts, args):
         task_set_option("force", 1)
     elif key in ("-q", "--quick"):
         task_set_option("quick", 1)
+    elif key in ("-i", "--incremental"):
+        task_set_option("incremental", 1)
     elif key in ("-p", "--part"):
         task_set_option("part", int(value))
     elif key in ("-l", "--language"):
@@ -1173,6 +1283,11 @@ def task_run_core():
                 colls.append(get_collection(row[0]))
         # secondly, update collection reclist cache:
         if task_get_option('part', 1) == 1:
+            checksum = get_collection_definitions_checksum()
+            incremental_since = get_incremental_since(task_run_start_timestamp)
+            modified_recids = None
+            if task_get_option("incremental") and not task_get_option("force"):
+                modified_recids = get_recids_to_update_incrementally(checksum)
             all_recids_added = intbitset()
             i = 0
             for coll in colls:
@@ -1181,18 +1296,20 @@ def task_run_core():
                 if str(coll.dbquery).startswith("hostedcollection:"):
                     coll.set_nbrecs_for_external_collection()
                 else:
-                    coll.calculate_reclist()
+                    coll.calculate_reclist(modified_recids)
                 coll.update_reclist()
                 task_update_progress("Part 1/2: done %d/%d" % (i, len(colls)))
                 all_recids_added.update(coll.get_added_records())
                 task_sleep_now_if_required(can_stop_too=True)
             params.update({'recids': list(all_recids_added)})
+            if not task_has_option("collection"):
+                set_incremental_state(incremental_since, checksum)
         # thirdly, update collection webpage cache:
         if task_get_option("part", 2) == 2:
             i = 0
             for coll in colls:
                 i += 1
-                if coll.reclist_updated_since_start or task_has_option("collection") or task_get_option("force") or not task_get_option("quick"):
+                if coll.reclist_updated_since_start or task_has_option("collection") or task_get_option("force") or not (task_get_option("quick") or task_get_option("incremental")):
                     write_message("%s / webpage cache update" % coll.name)
                     for lang in CFG_SITE_LANGS:
                         coll.update_webpage_cache(lang)
@@ -359,10 +359,21 @@ def clean_sessions():
         write_message("Deleted %d sessions" % (deleted_sessions,))
 
 def clean_bibedit_cache():
-    """Deletes experied bibedit cache entries"""
+    """Deletes experied bibedit cache entries and the bibupload queue
+    index entries of tasks that are no longer queued"""
     datecut = datetime.datetime.now() - datetime.timedelta(days=CFG_MAX_ATIME_BIBEDIT_TMP)
     datecut_str = datecut.strftime("%Y-%m-%d %H:%M:%S")
     run_sql("DELETE FROM bibEDITCACHE WHERE post_date < %s", [datecut_str])
+    run_sql("""DELETE c FROM bibEDITCACHECHANGES AS c LEFT JOIN bibEDITCACHE AS b
+               ON c.id_bibrec = b.id_bibrec AND c.uid = b.uid AND c.base_id = b.base_id
+               WHERE b.id_bibrec IS NULL""")
+    # Identifiers of the records of bibupload tasks that are no longer
+    # queued (e.g. failed, deleted or indexed by BibEdit while finishing)
+    run_sql("""DELETE q FROM bibEDITQUEUE AS q LEFT JOIN schTASK AS t
+               ON q.id_schTASK = t.id AND t.status IN ('WAITING', 'SCHEDULED',
+                  'RUNNING', 'CONTINUING', 'ABOUT TO STOP', 'ABOUT TO SLEEP',
+                  'SLEEPING')
+               WHERE t.id IS NULL""")
 
 def guest_user_garbage_collector():
     """Session Garbage Collector
@@ -588,7 +599,8 @@ def main():
                 "  -k, --check-tables\tCheck DB tables to discover potential problems.\n"
                 "  -o, --optimise-tables\tOptimise DB tables to increase performance.\n"
                 "  -S, --sessions\tClean expired sessions from the DB.\n"
-                "  --bibedit-cache Clean expired bibedit cache entries from the DB.\n" % CFG_DELETED_BIBDOC_MAXLIFE,
+                "  --bibedit-cache Clean expired bibedit cache entries and the index of\n"
+                "\t\t\tthe BibUpload queue used by BibEdit from the DB.\n" % CFG_DELETED_BIBDOC_MAXLIFE,
             version=__revision__,
             specific_params=(short_options, long_options),
             task_submit_elaborate_specific_parameter_fnc=task_submit_elaborate_specific_parameter,
@@ -21,6 +21,8 @@ __lastupdated__ = "$Date$"
 import os
 import time
 import re
+import atexit
+import threading
 import datetime
 import cPickle
 import calendar
@@ -33,13 +35,17 @@ from invenio.config import \
      CFG_TMPDIR, \
      CFG_SITE_URL, \
      CFG_SITE_LANG, \
-     CFG_WEBSTAT_BIBCIRCULATION_START_YEAR
+     CFG_WEBSTAT_BIBCIRCULATION_START_YEAR, \
+     CFG_WEBSTAT_CUSTOMEVENT_BUFFER_SIZE, \
+     CFG_WEBSTAT_CUSTOMEVENT_BUFFER_TIMEOUT
 from invenio.webstat_config import CFG_WEBSTAT_CONFIG_PATH
 from invenio.bibindex_engine_utils import get_all_indexes
 from invenio.bibindex_tokenizers.BibIndexJournalTokenizer import CFG_JOURNAL_TAG
 from invenio.search_engine import get_coll_i18nname, \
     wash_index_term
-from invenio.dbquery import run_sql, wash_table_column_name, ProgrammingError
+from invenio.dbquery import run_sql, wash_table_column_name, ProgrammingError, \
+    close_connection
+from invenio.errorlib import register_exception
 from invenio.bibsched import is_task_scheduled, \
     get_task_ids_by_descending_date, \
     get_task_options
@@ -96,6 +102,10 @@ from invenio.webstat_engine import get_customevent_table, \
     get_customevent_trend, \
     get_customevent_dump
 
+# Imports handling the rollups of the events
+from invenio.webstat_engine import update_rollups, \
+    delete_rollup
+
 # Imports handling custom report
 from invenio.webstat_engine import get_custom_summary_data, \
     _get_tag_name, \
@@ -116,6 +126,7 @@ TEMPLATES = template.load('webstat')
 
 # Constants
 WEBSTAT_CACHE_INTERVAL = 600 # Seconds, cache_* functions not affected by this.
+WEBSTAT_CUSTOMEVENT_DEFINITIONS_INTERVAL = 60 # Seconds
                              # Also not taking into account if BibSched has
                              # webstatadmin process.
 WEBSTAT_RAWDATA_DIRECTORY = CFG_TMPDIR + "/"
@@ -573,6 +584,7 @@ def create_customevent(event_id=None, name=None, cols=[]):
     sql_query.append("PRIMARY KEY (id))")
     sql_str = ' '.join(sql_query)
     run_sql(sql_str)
+    _reset_customevent_definitions()
 
     # We're done! Print notice containing the name of the event.
     return ("Event table [%s] successfully created.\n" +
@@ -614,6 +626,7 @@ def modify_customevent(event_id=None, name=None, cols=[]):
                       "FROM staEVENT WHERE id = %s", (event_id, ))
     if not res:
         return "Invalid event id: %s! Aborted" % event_id
+    _reset_customevent_definitions()
     if not run_sql("SHOW TABLES LIKE %s", res[0][0]):
         run_sql("DELETE FROM staEVENT WHERE id=%s", (event_id, ))
         create_customevent(event_id, event_id, cols)
@@ -702,8 +715,10 @@ def destroy_customevent(event_id=None):
         return "Custom event ID '%s' doesn't exist! Aborted." % event_id
     else:
         tbl_name = get_customevent_table(event_id)
+        _reset_customevent_definitions()
         run_sql("DROP TABLE %s" % wash_table_column_name(tbl_name)) # kwalitee: disable=sql
         run_sql("DELETE FROM staEVENT WHERE id = %s", (event_id, ))
+        delete_rollup(tbl_name)
         return ("Custom event ID '%s' table '%s' was successfully destroyed.\n") \
                 % (event_id, tbl_name)
 
@@ -724,6 +739,50 @@ def destroy_customevents():
         msg += destroy_customevent(event[0])
     return msg
 
+_CUSTOMEVENT_DEFINITIONS = {}
+_CUSTOMEVENT_DEFINITIONS_TIME = 0
+_CUSTOMEVENT_QUEUE = []
+_CUSTOMEVENT_QUEUE_LOCK = threading.Lock()
+_CUSTOMEVENT_FLUSH_TIMER = None
+
+def _get_customevent_definition(event_id):
+    """
+    Returns the table name and the column titles of a custom event, or
+    None if it does not exist.  The definitions of all the custom events
+    are kept in memory and reloaded every
+    WEBSTAT_CUSTOMEVENT_DEFINITIONS_INTERVAL seconds.
+
+    @param event_id: Human-readable id of the event
+    @type event_id: str
+
+    @return: (table name, column titles)
+    @type: (str, [str])
+    """
+    global _CUSTOMEVENT_DEFINITIONS, _CUSTOMEVENT_DEFINITIONS_TIME
+    if time.time() - _CUSTOMEVENT_DEFINITIONS_TIME > \
+           WEBSTAT_CUSTOMEVENT_DEFINITIONS_INTERVAL:
+        definitions = {}
+        for an_event_id, tbl_name, cols in run_sql(
+                "SELECT id, CONCAT('staEVENT', number), cols FROM staEVENT"):
+            if cols:
+                definitions[an_event_id] = (tbl_name, cPickle.loads(cols))
+            else:
+                definitions[an_event_id] = (tbl_name, [])
+        _CUSTOMEVENT_DEFINITIONS = definitions
+        _CUSTOMEVENT_DEFINITIONS_TIME = time.time()
+    return _CUSTOMEVENT_DEFINITIONS.get(event_id)
+
+
+def _reset_customevent_definitions():
+    """
+    Writes the queued events and forgets the definitions of the custom
+    events, before they are changed.
+    """
+    global _CUSTOMEVENT_DEFINITIONS_TIME
+    flush_customevents()
+    _CUSTOMEVENT_DEFINITIONS_TIME = 0
+
+
 def register_customevent(event_id, *arguments):
     """
     Registers a custom event. Will add to the database's event tables
@@ -733,43 +792,95 @@ def register_customevent(event_id, *arguments):
     called throughout Invenio where one wants to register a
     custom event! Refer to the help section on the admin web page.
 
+    The events are queued in memory and written by flush_customevents()
+    when CFG_WEBSTAT_CUSTOMEVENT_BUFFER_SIZE events are queued, at most
+    CFG_WEBSTAT_CUSTOMEVENT_BUFFER_TIMEOUT seconds after the first one was
+    queued, and when the process exits.
+
     @param event_id: Human-readable id of the event to be registered
     @type event_id: str
 
     @param *arguments: The rest of the parameters of the function call
     @type *arguments: [params]
     """
-    res = run_sql("SELECT CONCAT('staEVENT', number),cols " + \
-                      "FROM staEVENT WHERE id = %s", (event_id, ))
-    if not res:
+    global _CUSTOMEVENT_FLUSH_TIMER
+    definition = _get_customevent_definition(event_id)
+    if definition is None:
         return # the id does not exist
-    tbl_name = res[0][0]
-    if res[0][1]:
-        col_titles = cPickle.loads(res[0][1])
-    else:
-        col_titles = []
+    tbl_name, col_titles = definition
     if len(col_titles) != len(arguments[0]):
         return # there is different number of arguments than cols
 
-    # Make sql query
-    if len(arguments[0]) != 0:
+    _CUSTOMEVENT_QUEUE_LOCK.acquire()
+    try:
+        _CUSTOMEVENT_QUEUE.append((tbl_name, col_titles,
+                                   datetime.datetime.now(), arguments[0]))
+        flush = len(_CUSTOMEVENT_QUEUE) >= CFG_WEBSTAT_CUSTOMEVENT_BUFFER_SIZE
+        if not flush and _CUSTOMEVENT_FLUSH_TIMER is None:
+            _CUSTOMEVENT_FLUSH_TIMER = threading.Timer(
+                CFG_WEBSTAT_CUSTOMEVENT_BUFFER_TIMEOUT, _flush_customevents_timer)
+            _CUSTOMEVENT_FLUSH_TIMER.setDaemon(True)
+            _CUSTOMEVENT_FLUSH_TIMER.start()
+    finally:
+        _CUSTOMEVENT_QUEUE_LOCK.release()
+    if flush:
+        flush_customevents()
+
+
+def flush_customevents():
+    """
+    Writes the queued custom events to their tables, with one multi-row
+    INSERT per table.
+    """
+    global _CUSTOMEVENT_QUEUE, _CUSTOMEVENT_FLUSH_TIMER
+    _CUSTOMEVENT_QUEUE_LOCK.acquire()
+    try:
+        queue = _CUSTOMEVENT_QUEUE
+        _CUSTOMEVENT_QUEUE = []
+        if _CUSTOMEVENT_FLUSH_TIMER is not None:
+            _CUSTOMEVENT_FLUSH_TIMER.cancel()
+            _CUSTOMEVENT_FLUSH_TIMER = None
+    finally:
+        _CUSTOMEVENT_QUEUE_LOCK.release()
+
+    # Group the events per table, keeping their order
+    tables = []
+    events = {}
+    for tbl_name, col_titles, creation_time, arguments in queue:
+        key = (tbl_name, tuple(col_titles))
+        if key not in events:
+            tables.append(key)
+            events[key] = []
+        events[key].append([creation_time] + list(arguments))
+
+    for tbl_name, col_titles in tables:
+        rows = events[(tbl_name, col_titles)]
+        sql_cols = ', '.join(["creation_time"] + ["`%s`" % wash_table_column_name(title)
+                                                  for title in col_titles])
+        sql_row = "(%s)" % ', '.join(["%s"] * (len(col_titles) + 1))
         sql_param = []
-        sql_query = ["INSERT INTO %s (" % wash_table_column_name(tbl_name)]
-        for title in col_titles:
-            sql_query.append("`%s`" % title)
-            sql_query.append(",")
-        sql_query.pop() # del the last ','
-        sql_query.append(") VALUES (")
-        for argument in arguments[0]:
-            sql_query.append("%s")
-            sql_query.append(",")
-            sql_param.append(argument)
-        sql_query.pop() # del the last ','
-        sql_query.append(")")
-        sql_str = ''.join(sql_query)
-        run_sql(sql_str, tuple(sql_param))
-    else:
-        run_sql("INSERT INTO %s () VALUES ()" % wash_table_column_name(tbl_name)) # kwalitee: disable=sql
+        for row in rows:
+            sql_param.extend(row)
+        try:
+            run_sql("INSERT INTO %s (%s) VALUES %s" % (wash_table_column_name(tbl_name), # kwalitee: disable=sql
+                                                      sql_cols, ', '.join([sql_row] * len(rows))),
+                    tuple(sql_param))
+        except Exception:
+            register_exception(prefix="Could not register %d events in %s" \
+                                      % (len(rows), tbl_name))
+
+
+def _flush_customevents_timer():
+    """
+    Writes the queued custom events from the timer thread, closing its
+    database connection afterwards.
+    """
+    try:
+        flush_customevents()
+    finally:
+        close_connection()
+
+atexit.register(flush_customevents)
 
 
 def cache_keyevent_trend(ids=[]):
@@ -34,7 +34,8 @@ from invenio.config import CFG_TMPDIR, \
     CFG_BIBCIRCULATION_ITEM_STATUS_ON_SHELF, \
     CFG_BIBCIRCULATION_ITEM_STATUS_OPTIONAL, \
     CFG_BIBCIRCULATION_REQUEST_STATUS_DONE, \
-    CFG_BIBCIRCULATION_ILL_STATUS_CANCELLED
+    CFG_BIBCIRCULATION_ILL_STATUS_CANCELLED, \
+    CFG_WEBSTAT_CUSTOMEVENT_BUFFER_TIMEOUT
 from invenio.bibindex_tokenizers.BibIndexJournalTokenizer import CFG_JOURNAL_TAG
 from invenio.urlutils import redirect_to_url
 from invenio.search_engine import perform_request_search, \
@@ -177,7 +178,7 @@ def get_keyevent_trend_search_frequency(args, return_sql=False):
     @type args['t_format']: str
     """
 
-    return _get_keyevent_trend(args, _get_sql_query("date", args["granularity"],
+    return _get_rollup_trend(args, 'searches', _get_sql_query("date", args["granularity"],
                 "query INNER JOIN user_query ON id=id_query"),
                             return_sql=return_sql)
 
@@ -203,8 +204,8 @@ def get_keyevent_trend_comments_frequency(args, return_sql=False):
     @type args['t_format']: str
     """
     if args.get('collection', 'All') == 'All':
-        sql = _get_sql_query("date_creation", args["granularity"],
-            "cmtRECORDCOMMENT")
+        return _get_rollup_trend(args, 'comments', _get_sql_query("date_creation",
+            args["granularity"], "cmtRECORDCOMMENT"), return_sql=return_sql)
     else:
         sql = _get_sql_query("date_creation", args["granularity"],
             "cmtRECORDCOMMENT", conditions=
@@ -275,7 +276,7 @@ def get_keyevent_trend_download_frequency(args, return_sql=False):
     """
     # Collect list of timestamps of insertion in the specific collection
     if args.get('collection', 'All') == 'All':
-        return _get_keyevent_trend(args, _get_sql_query("download_time",
+        return _get_rollup_trend(args, 'downloads', _get_sql_query("download_time",
                 args["granularity"], "rnkDOWNLOADS"), return_sql=return_sql)
     else:
         lower = _to_datetime(args['t_start'], args['t_format']).isoformat()
@@ -316,7 +317,7 @@ def get_keyevent_trend_number_of_loans(args, return_sql=False):
     @param args['t_format']: Date and time formatting string
     @type args['t_format']: str
     """
-    return _get_keyevent_trend(args, _get_sql_query("loaned_on",
+    return _get_rollup_trend(args, 'loans', _get_sql_query("loaned_on",
             args["granularity"], "crcLOAN"), return_sql=return_sql)
 
 
@@ -1714,6 +1715,10 @@ def get_customevent_trend(args):
 
     sql = _get_sql_query("creation_time", args['granularity'], tbl_name, " ".join(where))
 
+    if not where:
+        # No filter on the arguments: the rollups can be used
+        return _get_rollup_trend(args, tbl_name, sql)
+
     return _get_trend_from_actions(run_sql(sql, tuple(sql_param)), 0,
                                    args['t_start'], args['t_end'],
                                    args['granularity'], args['t_format'])
@@ -1941,6 +1946,269 @@ def create_custom_summary_graph(data, path, title):
     plt.savefig(path)
     plt.close(gfile)
 
+# ROLLUP SECTION
+
+# Event sources aggregated in staROLLUP: name -> (time column, tables).
+# The custom events are aggregated too, under the name of their table.
+WEBSTAT_ROLLUP_SOURCES = {
+    'searches': ('date', 'query INNER JOIN user_query ON id=id_query'),
+    'downloads': ('download_time', 'rnkDOWNLOADS'),
+    'comments': ('date_creation', 'cmtRECORDCOMMENT'),
+    'loans': ('loaned_on', 'crcLOAN'),
+    }
+# Largest span of raw events aggregated at once when updating the rollups
+WEBSTAT_ROLLUP_CHUNK = datetime.timedelta(days=7)
+# Events younger than this are not aggregated, as they may still be in the
+# buffers of register_customevent (see CFG_WEBSTAT_CUSTOMEVENT_BUFFER_TIMEOUT)
+WEBSTAT_ROLLUP_DELAY = datetime.timedelta(
+    seconds=max(300, 2 * CFG_WEBSTAT_CUSTOMEVENT_BUFFER_TIMEOUT))
+
+def _get_rollup_source(source):
+    """
+    Returns the (time column, tables) of the events of a rollup source.
+    """
+    if source in WEBSTAT_ROLLUP_SOURCES:
+        return WEBSTAT_ROLLUP_SOURCES[source]
+    return ('creation_time', wash_table_column_name(source))
+
+
+def _get_rollup_sources():
+    """
+    Returns the names of all the rollup sources.
+    """
+    return WEBSTAT_ROLLUP_SOURCES.keys() + \
+        [row[0] for row in run_sql("SELECT CONCAT('staEVENT', number) FROM staEVENT")]
+
+
+def _get_rollup_mark(source):
+    """
+    Returns the time up to which the events of the given source have been
+    aggregated in staROLLUP, or None if they have never been.
+    """
+    res = run_sql("SELECT aggregated_until FROM staROLLUPSTATUS WHERE source=%s",
+                  (source, ))
+    if res:
+        return res[0][0]
+    return None
+
+
+def _get_raw_hourly_counts(source, start, end, strict_start=False):
+    """
+    Returns the number of events of the given source per hour, in the raw
+    event table, between start (included unless strict_start) and end
+    (excluded).
+
+    @return: [(hour, count)]
+    @type: [(datetime, int)]
+    """
+    time_column, tables = _get_rollup_source(source)
+    sql = "SELECT DATE(%(col)s), HOUR(%(col)s), COUNT(*) FROM %(tables)s \
+WHERE %(col)s %(op)s %%s AND %(col)s < %%s GROUP BY DATE(%(col)s), HOUR(%(col)s)" \
+        % {'col': time_column, 'tables': tables, 'op': strict_start and '>' or '>='}
+    return [(datetime.datetime.combine(day, datetime.time(hour)), count)
+            for day, hour, count in run_sql(sql, (start, end))]
+
+
+def _get_rollup_counts(source, granularity, start, end):
+    """
+    Returns the counts of staROLLUP of the given granularity ('hour' or
+    'day') for the periods starting between start (included) and end
+    (excluded).
+
+    @return: [(period, count)]
+    @type: [(datetime, int)]
+    """
+    if start >= end:
+        return []
+    return list(run_sql("SELECT period, count FROM staROLLUP WHERE source=%s \
+AND granularity=%s AND period>=%s AND period<%s", (source, granularity, start, end)))
+
+
+def _floor_datetime(dttime, granularity):
+    """
+    Returns the start of the period of the given granularity (year, month,
+    day or hour) containing dttime.
+    """
+    if granularity == 'year':
+        return datetime.datetime(dttime.year, 1, 1)
+    elif granularity == 'month':
+        return datetime.datetime(dttime.year, dttime.month, 1)
+    elif granularity == 'day':
+        return datetime.datetime(dttime.year, dttime.month, dttime.day)
+    return datetime.datetime(dttime.year, dttime.month, dttime.day, dttime.hour)
+
+
+def _ceil_datetime(dttime, granularity):
+    """
+    Returns the start of the first period of the given granularity (day or
+    hour) starting at or after dttime.
+    """
+    floor = _floor_datetime(dttime, granularity)
+    if floor == dttime:
+        return floor
+    return floor + datetime.timedelta(**{granularity + 's': 1})
+
+
+def get_rollup_actions(source, lower, upper, granularity):
+    """
+    Returns the number of events of the given source per period of the
+    given granularity between lower and upper (both excluded), in the
+    format expected by _get_trend_from_actions.
+
+    The events aggregated in staROLLUP are read from the daily and hourly
+    rollups, and only the events not aggregated yet (the ones since the
+    last update of the rollups, and the ones before the first whole hour
+    of the range) are read from the raw event table, so that the cost does
+    not depend on the number of events.
+
+    @param source: A rollup source (see WEBSTAT_ROLLUP_SOURCES)
+    @type source: str
+
+    @param lower: Start of the range
+    @type lower: datetime
+
+    @param upper: End of the range
+    @type upper: datetime
+
+    @param granularity: One of year, month, day or hour.
+    @type granularity: str
+
+    @return: A list of (year, month, day or hour, count) sorted by
+             descending period, or None if the rollups of this source have
+             never been updated.
+    @type: [(int, int)]
+    """
+    mark = _get_rollup_mark(source)
+    if mark is None:
+        return None
+    counts = []
+    first_hour = _ceil_datetime(lower, 'hour')
+    rollup_end = min(mark, _floor_datetime(upper, 'hour'))
+    if rollup_end <= first_hour:
+        counts.extend(_get_raw_hourly_counts(source, lower, upper, strict_start=True))
+    else:
+        # Partial hour at the start of the range
+        if lower < first_hour:
+            counts.extend(_get_raw_hourly_counts(source, lower, first_hour,
+                                                 strict_start=True))
+        else:
+            # The events at lower itself are not part of the range
+            counts.extend([(period, -count) for period, count in
+                           _get_raw_hourly_counts(source, lower,
+                                                  lower + datetime.timedelta(seconds=1))])
+        # Whole days from the daily rollups, the rest from the hourly ones
+        first_day = _ceil_datetime(first_hour, 'day')
+        last_day = _floor_datetime(rollup_end, 'day')
+        if granularity != 'hour' and first_day < last_day:
+            counts.extend(_get_rollup_counts(source, 'hour', first_hour, first_day))
+            counts.extend(_get_rollup_counts(source, 'day', first_day, last_day))
+            counts.extend(_get_rollup_counts(source, 'hour', last_day, rollup_end))
+        else:
+            counts.extend(_get_rollup_counts(source, 'hour', first_hour, rollup_end))
+        # Events not aggregated yet
+        counts.extend(_get_raw_hourly_counts(source, rollup_end, upper))
+
+    periods = {}
+    for period, count in counts:
+        period = _floor_datetime(period, granularity)
+        periods[period] = periods.get(period, 0) + count
+    return [(getattr(start, granularity), periods[start])
+            for start in sorted(periods, reverse=True)]
+
+
+def _get_rollup_trend(args, source, sql, return_sql=False):
+    """
+    Returns the trend of the events of a rollup source, read from
+    staROLLUP when possible, from the raw events with the given sql
+    (see _get_sql_query) otherwise.
+    """
+    if not return_sql and args['granularity'] in ('year', 'month', 'day', 'hour'):
+        actions = get_rollup_actions(source,
+                                     _to_datetime(args['t_start'], args['t_format']),
+                                     _to_datetime(args['t_end'], args['t_format']),
+                                     args['granularity'])
+        if actions is not None:
+            return _get_trend_from_actions(actions, 0, args['t_start'],
+                                           args['t_end'], args['granularity'],
+                                           args['t_format'])
+    return _get_keyevent_trend(args, sql, return_sql=return_sql)
+
+
+def update_rollup(source, now=None):
+    """
+    Aggregates in staROLLUP the events of the given source that occurred
+    since the last update, up to the last whole hour (that ended at least
+    WEBSTAT_ROLLUP_DELAY ago).
+
+    @param source: A rollup source (see WEBSTAT_ROLLUP_SOURCES)
+    @type source: str
+
+    @param now: The current time (for testing purposes)
+    @type now: datetime
+
+    @return: The number of events aggregated
+    @type: int
+    """
+    if now is None:
+        now = datetime.datetime.now()
+    until = _floor_datetime(now - WEBSTAT_ROLLUP_DELAY, 'hour')
+    mark = _get_rollup_mark(source)
+    new_source = mark is None
+    if new_source:
+        time_column, tables = _get_rollup_source(source)
+        res = run_sql("SELECT MIN(%s) FROM %s WHERE %s>%%s" % (time_column, tables, time_column),
+                      (datetime.datetime(1900, 1, 1), ))
+        if res and res[0][0]:
+            mark = _floor_datetime(res[0][0], 'hour')
+        else:
+            mark = until
+    nb_events = 0
+    while mark < until:
+        chunk_end = min(mark + WEBSTAT_ROLLUP_CHUNK, until)
+        counts = _get_raw_hourly_counts(source, mark, chunk_end)
+        if counts:
+            # Idempotent, in case a previous update was interrupted before
+            # moving the mark
+            run_sql("INSERT INTO staROLLUP (source, granularity, period, count) VALUES %s \
+ON DUPLICATE KEY UPDATE count=VALUES(count)" % ', '.join(["(%s, 'hour', %s, %s)"] * len(counts)),
+                    tuple(sum([[source, period, count] for period, count in counts], [])))
+            nb_events += sum([count for dummy, count in counts])
+            # Recompute the days touched from their hours
+            run_sql("REPLACE INTO staROLLUP (source, granularity, period, count) \
+SELECT source, 'day', DATE(period), SUM(count) FROM staROLLUP \
+WHERE source=%s AND granularity='hour' AND period>=%s AND period<%s \
+GROUP BY DATE(period)", (source, _floor_datetime(mark, 'day'),
+                         _ceil_datetime(chunk_end, 'day')))
+        run_sql("REPLACE INTO staROLLUPSTATUS (source, aggregated_until) VALUES (%s, %s)",
+                (source, chunk_end))
+        mark = chunk_end
+        new_source = False
+    if new_source:
+        run_sql("INSERT INTO staROLLUPSTATUS (source, aggregated_until) VALUES (%s, %s)",
+                (source, mark))
+    return nb_events
+
+
+def update_rollups(sources=None):
+    """
+    Updates the rollups of the given sources, or of all the key and
+    custom events if not specified.
+
+    @return: {source: number of events aggregated}
+    @type: {str: int}
+    """
+    if sources is None:
+        sources = _get_rollup_sources()
+    return dict([(source, update_rollup(source)) for source in sources])
+
+
+def delete_rollup(source):
+    """
+    Deletes the rollups of the given source.
+    """
+    run_sql("DELETE FROM staROLLUP WHERE source=%s", (source, ))
+    run_sql("DELETE FROM staROLLUPSTATUS WHERE source=%s", (source, ))
+
 # GRAPHER
 
 def create_graph_trend(trend, path, settings):
@@ -21,12 +21,15 @@
 
 __revision__ = "$Id$"
 
+import datetime
+
 from invenio.testutils import InvenioTestCase
 
 from invenio.config import CFG_SITE_URL, \
      CFG_WEBSESSION_DIFFERENTIATE_BETWEEN_GUESTS
 from invenio.testutils import make_test_suite, run_test_suite, \
      test_web_page_content, merge_error_messages
+from invenio.dbquery import run_sql
 
 
 class WebStatWebPagesAvailabilityTest(InvenioTestCase):
@@ -51,7 +54,74 @@ class WebStatWebPagesAvailabilityTest(InvenioTestCase):
         return
 
 
-TEST_SUITE = make_test_suite(WebStatWebPagesAvailabilityTest, )
+class WebStatRollupTest(InvenioTestCase):
+    """Check that the trends read from the rollups match the raw events."""
+
+    def setUp(self):
+        from invenio.webstat import create_customevent
+        from invenio.webstat_engine import get_customevent_table
+        create_customevent('rollup_test', 'Rollup test')
+        self.table = get_customevent_table('rollup_test')
+        self.start = datetime.datetime(2014, 1, 1)
+        for i in range(200):
+            run_sql("INSERT INTO %s (creation_time) VALUES (%%s)" % self.table, # kwalitee: disable=sql
+                    (self.start + datetime.timedelta(minutes=i * 97), ))
+
+    def tearDown(self):
+        from invenio.webstat import destroy_customevent
+        destroy_customevent('rollup_test')
+
+    def test_rollup_trend(self):
+        """webstat - trends computed from the rollups and from the raw events"""
+        from invenio.webstat_engine import get_customevent_trend, \
+             update_rollup, _get_sql_query, _get_keyevent_trend
+        self.assertEqual(update_rollup(self.table,
+                                       self.start + datetime.timedelta(days=10)),
+                         148)
+        t_format = '%Y-%m-%d %H:%M:%S'
+        for granularity, t_start, t_end in (
+                ('day', '2013-12-30 00:00:00', '2014-01-20 00:00:00'),
+                ('day', '2014-01-02 05:30:00', '2014-01-13 11:00:00'),
+                ('hour', '2014-01-09 12:00:00', '2014-01-11 12:00:00'),
+                ('month', '2014-01-01 00:00:00', '2014-06-01 00:00:00')):
+            args = {'event_id': 'rollup_test', 'cols': [],
+                    't_start': t_start, 't_end': t_end,
+                    'granularity': granularity, 't_format': t_format}
+            raw = _get_keyevent_trend(args, _get_sql_query("creation_time",
+                                                           granularity, self.table))
+            self.assertEqual(get_customevent_trend(args), raw)
+
+
+class WebStatCustomEventRegistrationTest(InvenioTestCase):
+    """Check the buffered registration of the custom events."""
+
+    def setUp(self):
+        from invenio.webstat import create_customevent
+        from invenio.webstat_engine import get_customevent_table
+        create_customevent('registration_test', 'Registration test',
+                           ['action', 'user'])
+        self.table = get_customevent_table('registration_test')
+
+    def tearDown(self):
+        from invenio.webstat import destroy_customevent
+        destroy_customevent('registration_test')
+
+    def test_register_customevent(self):
+        """webstat - registration of custom events"""
+        from invenio.webstat import register_customevent, flush_customevents
+        for i in range(3):
+            register_customevent('registration_test', ['display', str(i)])
+        # Wrong number of arguments or unknown event: ignored
+        register_customevent('registration_test', ['display'])
+        register_customevent('no_such_event', [])
+        flush_customevents()
+        self.assertEqual(run_sql("SELECT action, user FROM %s ORDER BY id" % self.table), # kwalitee: disable=sql
+                         (('display', '0'), ('display', '1'), ('display', '2')))
+
+
+TEST_SUITE = make_test_suite(WebStatWebPagesAvailabilityTest,
+                             WebStatRollupTest,
+                             WebStatCustomEventRegistrationTest)
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE, warn_user=True)
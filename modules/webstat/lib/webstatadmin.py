@@ -44,6 +44,8 @@ def main():
                                   "                                  -c KEYEVENTS\n"
                                   "                                  -c CUSTOMEVENTS\n"
                                   "                                  -c 'event id1',id2,'testevent'\n"
+                                  "  -u, --update-rollups          aggregate the new events in the hourly and daily\n"
+                                  "                                rollups read by the trends (also done by -c)\n"
                                   "  -d,--dump-config              dump default config file\n"
                                   "  -e,--load-config              create the custom events described in config_file\n"
                                   "\nWhen creating events (-n) the following parameters are also applicable:\n"
@@ -51,9 +53,9 @@ def main():
                                   "  -a, --args=[NAME]       set column headers for additional custom event arguments\n"
                                   "                          (e.g. -a country,person,car)\n",
               version=__revision__,
-              specific_params=("n:r:Sl:a:c:de", ["new-event=", "remove-event=", "show-events",
-                                                  "event-label=", "args=", "cache-events=", "dump-config",
-                                                  "load-config"]),
+              specific_params=("n:r:Sl:a:c:ude", ["new-event=", "remove-event=", "show-events",
+                                                  "event-label=", "args=", "cache-events=", "update-rollups",
+                                                  "dump-config", "load-config"]),
               task_submit_elaborate_specific_parameter_fnc=task_submit_elaborate_specific_parameter,
               task_submit_check_options_fnc=task_submit_check_options,
               task_run_fnc=task_run_core)
@@ -83,6 +85,9 @@ def task_submit_elaborate_specific_parameter(key, value, opts, args):
     elif key in ("-c", "--cache-events"):
         task_set_option("cache_events", value.split(','))
 
+    elif key in ("-u", "--update-rollups"):
+        task_set_option("update_rollups", True)
+
     elif key in ("-d", "--dump-config"):
         task_set_option("dump_config", True)
 
@@ -150,6 +155,9 @@ def task_submit_check_options():
 
         return True
 
+    elif task_has_option("update_rollups"):
+        return True
+
     elif task_has_option("dump_config"):
         print """\
 [general]
@@ -224,6 +232,15 @@ def task_run_core():
     When this function is called, the tool has entered BibSched mode, which means
     that we're going to cache events according to the parameters.
     """
+    # Aggregate the new events, so that the trends are computed from the
+    # rollups
+    write_message("Updating the rollups")
+    task_update_progress("Updating the rollups")
+    for source, nb_events in sorted(webstat.update_rollups().items()):
+        write_message("%s: %d new events aggregated" % (source, nb_events))
+    if not task_has_option("cache_events"):
+        return True
+
     write_message("Initiating rawdata caching")
     task_update_progress("Initating rawdata caching")
 
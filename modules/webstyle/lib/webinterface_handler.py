@@ -39,6 +39,7 @@ import sys
 import re
 import os
 import gc
+import types
 
 from invenio import webinterface_handler_config as apache
 from invenio.config import CFG_SITE_URL, CFG_SITE_SECURE_URL, CFG_TMPDIR, \
@@ -94,6 +95,20 @@ def _debug(req, msg):
         req.log_error(msg)
 
 
+def _guess_content_type(req, result):
+    """
+    Set the content type of the request from the beginning of the
+    output, unless it was manually set.
+    """
+    if not req.content_type_set_p:
+        # make an attempt to guess content-type
+        if result[:100].strip()[:6].lower() == '<html>' \
+           or result.find('</') > 0:
+            req.content_type = 'text/html'
+        else:
+            req.content_type = 'text/plain'
+
+
 def _check_result(req, result):
     """
     Check that a page handler actually wrote something, and
@@ -101,7 +116,8 @@ def _check_result(req, result):
 
     @param req: the request.
     @param result: the produced output.
-    @type result: string
+    @type result: string, or generator of strings to stream the output
+        as it is produced
     @return: an apache error code
     @rtype: int
     @raise apache.SERVER_RETURN: in case of a HEAD request.
@@ -109,6 +125,31 @@ def _check_result(req, result):
         to the client.
     """
 
+    if isinstance(result, types.GeneratorType):
+        ## Each chunk is written as soon as it is produced, the request
+        ## sending it to the client whenever enough output is buffered.
+        written = False
+        try:
+            for chunk in result:
+                if not isinstance(chunk, unicode):
+                    chunk = str(chunk)
+                if not chunk:
+                    continue
+                if not written:
+                    _guess_content_type(req, chunk)
+                    written = True
+                    if req.header_only:
+                        break
+                req.write(chunk)
+        finally:
+            result.close()
+        if not written:
+            result = None
+        elif req.header_only and req.status in (apache.HTTP_NOT_FOUND, ):
+            raise apache.SERVER_RETURN, req.status
+        else:
+            return apache.OK
+
     if result or req.bytes_sent > 0:
 
         if result is None:
@@ -116,15 +157,7 @@ def _check_result(req, result):
         else:
             result = str(result)
 
-        # unless content_type was manually set, we will attempt
-        # to guess it
-        if not req.content_type_set_p:
-            # make an attempt to guess content-type
-            if result[:100].strip()[:6].lower() == '<html>' \
-               or result.find('</') > 0:
-                req.content_type = 'text/html'
-            else:
-                req.content_type = 'text/plain'
+        _guess_content_type(req, result)
 
         if req.header_only:
             if req.status in (apache.HTTP_NOT_FOUND, ):
@@ -24,6 +24,7 @@ __revision__ = "$Id$"
 from invenio.testutils import InvenioTestCase
 import httplib
 import os
+import sys
 import urlparse
 import mechanize
 from urllib2 import urlopen, HTTPError
@@ -32,6 +33,7 @@ from invenio.config import CFG_SITE_URL, CFG_SITE_SECURE_URL, CFG_PREFIX, CFG_DE
 from invenio.bibdocfile import calculate_md5
 from invenio.testutils import make_test_suite, run_test_suite, nottest
 from invenio.goto_engine import CFG_GOTO_PLUGINS, register_redirection, drop_redirection, update_redirection
+from invenio.webinterface_handler_wsgi import SimulatedModPythonRequest
 
 def get_final_url(url):
     """Perform a GET request to the given URL, discarding the result and return
@@ -70,6 +72,83 @@ class WebStyleWSGIUtilsTests(InvenioTestCase):
             self.assertEqual(body, body2, "Body sent differs from body received")
 
 
+class WebStyleWSGIResponseTests(InvenioTestCase):
+    """Test the output of the WSGI request object."""
+
+    def setUp(self):
+        self.output = []
+        self.environ = {'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+                        'REQUEST_METHOD': 'GET', 'PATH_INFO': '/',
+                        'QUERY_STRING': ''}
+        self.req = SimulatedModPythonRequest(self.environ, self.start_response)
+        self.path = os.path.join(CFG_PREFIX, 'lib', 'webtest', 'invenio', 'test.gif')
+        self.body = open(self.path).read()
+
+    def start_response(self, status, headers, exc_info=None):
+        return self.output.append
+
+    def test_buffered_writes(self):
+        """webstyle - output is buffered until flushed"""
+        self.req.write('foo', 0)
+        self.req.write(u'bar', 0)
+        self.assertEqual(self.req.get_buffer(), 'foobar')
+        self.assertEqual(self.req.bytes_sent, 6)
+        self.req.flush()
+        self.assertEqual(''.join(self.output), 'foobar')
+        self.assertEqual(self.req.get_buffer(), '')
+
+    def test_sendfile_uses_file_wrapper(self):
+        """webstyle - whole files are handed over to wsgi.file_wrapper"""
+        self.environ['wsgi.file_wrapper'] = lambda afile, size: ('wrapped', afile)
+        self.req.write('header', 0)
+        self.req.sendfile(self.path)
+        self.req.flush()
+        self.assertEqual(''.join(self.output), 'header')
+        self.assertEqual(self.req.bytes_sent, len('header') + len(self.body))
+        tag, afile = self.req.get_file_wrapper()
+        self.assertEqual(tag, 'wrapped')
+        self.assertEqual(afile.read(), self.body)
+
+    def test_sendfile_ranges(self):
+        """webstyle - file ranges are sent in order with the other output"""
+        self.req.write('--a\r\n', 0)
+        self.req.sendfile(self.path, 10, 20)
+        self.req.write('\r\n--b\r\n', 0)
+        self.req.sendfile(self.path, 5)
+        self.req.write('\r\n--end', 0)
+        self.req.flush()
+        self.assertEqual(''.join(self.output),
+                         '--a\r\n' + self.body[10:30] + '\r\n--b\r\n' +
+                         self.body[5:] + '\r\n--end')
+        self.assertEqual(self.req.get_file_wrapper(), None)
+
+    def test_tracked_writings_before_flush(self):
+        """webstyle - what_was_written includes the output not flushed yet"""
+        self.req.write('<a>', 0)
+        self.req.track_writings = True
+        self.req.write('<b/>')
+        self.req.write(u'<c/>', 0)
+        self.req.track_writings = False
+        self.req.write('</a>', 0)
+        self.assertEqual(self.req.what_was_written, '<b/><c/>')
+        self.assertEqual(self.output, [])
+        self.req.flush()
+        self.assertEqual(''.join(self.output), '<a><b/><c/></a>')
+
+    def test_finish_after_error(self):
+        """webstyle - buffered output and files are not lost on errors"""
+        self.req.write('started')
+        self.req.sendfile(self.path)
+        self.req.finish_after_error()
+        self.assertEqual(''.join(self.output), 'started')
+        self.assertEqual(self.req.get_file_wrapper(), None)
+        req = SimulatedModPythonRequest(self.environ, self.start_response)
+        req.write('not started', 0)
+        req.finish_after_error()
+        self.assertEqual(req.get_buffer(), '')
+        self.assertEqual(''.join(self.output), 'started')
+
+
 class WebStyleGotoTests(InvenioTestCase):
     """Test the goto framework"""
     def tearDown(self):
@@ -129,7 +208,9 @@ class WebStyleGotoTests(InvenioTestCase):
         self.assertEqual(get_final_url(CFG_SITE_URL + '/goto/first_record'), CFG_SITE_URL + '/record/2')
 
 
-TEST_SUITE = make_test_suite(WebStyleWSGIUtilsTests, WebStyleGotoTests)
+TEST_SUITE = make_test_suite(WebStyleWSGIUtilsTests,
+                             WebStyleWSGIResponseTests,
+                             WebStyleGotoTests)
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE, warn_user=True)
@@ -29,8 +29,8 @@ from invenio.config import \
      CFG_SITE_LANG, \
      CFG_BIBDOCFILE_FILEDIR
 from invenio.bibdocfile import decompose_file, decompose_file_with_version
-from invenio.errorlib import register_exception
-from invenio.websubmit_file_converter import convert_file, InvenioWebSubmitFileConverterError, get_missing_formats, get_file_converter_logger
+from invenio.websubmit_file_converter import get_missing_formats, get_file_converter_logger
+from invenio.websubmit_file_converter_pool import get_file_converter_pool
 from invenio.websubmit_config import InvenioWebSubmitFunctionError
 from invenio.dbquery import run_sql
 from invenio.bibsched import server_pid
@@ -80,27 +80,28 @@ def createRelatedFormats(fullpath, overwrite=True, debug=False, consider_version
             missing_formats = get_missing_formats(filelist)
         if debug:
             print >> sys.stderr, "missing_formats: %s" % missing_formats
+        conversions = []
         for path, formats in missing_formats.iteritems():
             if debug:
                 print >> sys.stderr, "... path: %s, formats: %s" % (path, formats)
             for aformat in formats:
                 if debug:
                     print >> sys.stderr, "...... aformat: %s" % aformat
-                newpath = os.path.join(basedir, filename + aformat)
-                if debug:
-                    print >> sys.stderr, "...... newpath: %s" % newpath
-                try:
-                    if CFG_BIBDOCFILE_FILEDIR in basedir:
-                        # We should create the new files in a temporary location, not
-                        # directly inside the BibDoc directory.
-                        newpath = convert_file(path, output_format=aformat)
-                    else:
-                        convert_file(path, newpath)
-                    createdpaths.append(newpath)
-                except InvenioWebSubmitFileConverterError, msg:
+                if CFG_BIBDOCFILE_FILEDIR in basedir:
+                    # We should create the new files in a temporary location, not
+                    # directly inside the BibDoc directory.
+                    conversions.append((path, None, aformat, {}))
+                else:
+                    newpath = os.path.join(basedir, filename + aformat)
                     if debug:
-                        print >> sys.stderr, "...... Exception: %s" % msg
-                    register_exception(alert_admin=True)
+                        print >> sys.stderr, "...... newpath: %s" % newpath
+                    conversions.append((path, newpath, None, {}))
+        ## The formats are created in parallel by the pool of converters
+        for newpath, msg in get_file_converter_pool().imap(conversions, register_errors=True):
+            if newpath:
+                createdpaths.append(newpath)
+            elif debug:
+                print >> sys.stderr, "...... Exception: %s" % msg
     finally:
         if debug:
             file_converter_logger.setLevel(old_logging_level)
@@ -19,8 +19,11 @@
 
 __revision__ = "$Id$"
 
+import os
 import re
 
+from invenio.config import CFG_CACHEDIR
+
 ## test:
 test = "FALSE"
 
@@ -54,6 +57,10 @@ CFG_RESERVED_SUBMISSION_FILENAMES = ['SuE',
 ## Prefix for video uploads, Garbage Collector
 CFG_WEBSUBMIT_TMP_VIDEO_PREFIX = "video_upload_"
 
+## Where websubmit_file_converter_pool caches the converted files
+## (see CFG_WEBSUBMIT_FILE_CONVERTER_CACHE)
+CFG_WEBSUBMIT_FILE_CONVERTER_CACHEDIR = os.path.join(CFG_CACHEDIR, 'conversions')
+
 class InvenioWebSubmitFunctionError(Exception):
     """This exception should only ever be raised by WebSubmit functions.
        It will be caught and handled by the WebSubmit core itself.
@@ -75,7 +75,11 @@ from invenio.config import CFG_TMPDIR, CFG_ETCDIR, CFG_PYLIBDIR, \
     CFG_LOGDIR, \
     CFG_BIBSCHED_PROCESS_USER, \
     CFG_BIBDOCFILE_BEST_FORMATS_TO_EXTRACT_TEXT_FROM, \
-    CFG_BIBDOCFILE_DESIRED_CONVERSIONS
+    CFG_BIBDOCFILE_DESIRED_CONVERSIONS, \
+    CFG_MISCUTIL_DEFAULT_PROCESS_TIMEOUT, \
+    CFG_WEBSUBMIT_FILE_CONVERTER_CONCURRENCY, \
+    CFG_WEBSUBMIT_FILE_CONVERTER_TIMEOUTS, \
+    CFG_WEBSUBMIT_FILE_CONVERTER_KEEP_OPENOFFICE_RUNNING
 
 from invenio.errorlib import register_exception
 
@@ -465,6 +469,47 @@ def guess_is_OCR_needed(input_file, ln='en'):
     return True
 
 
+## Semaphores limiting the number of conversions run at the same time by
+## each converter (see CFG_WEBSUBMIT_FILE_CONVERTER_CONCURRENCY)
+_CONVERTER_SEMAPHORES = {}
+_CONVERTER_SEMAPHORES_LOCK = threading.Lock()
+
+## Timeout of the commands run by the converter running in each thread
+## (see CFG_WEBSUBMIT_FILE_CONVERTER_TIMEOUTS)
+_CONVERTER_TIMEOUT = threading.local()
+
+def _get_converter_semaphore(converter_name):
+    """
+    Return the semaphore limiting the concurrent conversions of the given
+    converter, or None if it is not limited.
+    """
+    limit = CFG_WEBSUBMIT_FILE_CONVERTER_CONCURRENCY.get(converter_name)
+    if not limit:
+        return None
+    _CONVERTER_SEMAPHORES_LOCK.acquire()
+    try:
+        if converter_name not in _CONVERTER_SEMAPHORES:
+            _CONVERTER_SEMAPHORES[converter_name] = threading.BoundedSemaphore(limit)
+        return _CONVERTER_SEMAPHORES[converter_name]
+    finally:
+        _CONVERTER_SEMAPHORES_LOCK.release()
+
+def _run_converter(converter, input_file, output_file, **params):
+    """
+    Run a converter within its concurrency limit and with its timeout.
+    """
+    semaphore = _get_converter_semaphore(converter.__name__)
+    if semaphore is not None:
+        semaphore.acquire()
+    previous_timeout = getattr(_CONVERTER_TIMEOUT, 'value', CFG_MISCUTIL_DEFAULT_PROCESS_TIMEOUT)
+    _CONVERTER_TIMEOUT.value = CFG_WEBSUBMIT_FILE_CONVERTER_TIMEOUTS.get(converter.__name__, CFG_MISCUTIL_DEFAULT_PROCESS_TIMEOUT)
+    try:
+        return converter(input_file, output_file, **params)
+    finally:
+        _CONVERTER_TIMEOUT.value = previous_timeout
+        if semaphore is not None:
+            semaphore.release()
+
 def convert_file(input_file, output_file=None, output_format=None, **params):
     """
     Convert files from one format to another.
@@ -497,7 +542,7 @@ def convert_file(input_file, output_file=None, output_format=None, **params):
             final_params.update(params)
             try:
                 get_file_converter_logger().debug("Converting from %s to %s using %s with params %s" % (current_input, current_output, converter, final_params))
-                current_output = converter(current_input, current_output, **final_params)
+                current_output = _run_converter(converter, current_input, current_output, **final_params)
                 get_file_converter_logger().debug("... current_output %s" % (current_output, ))
             except InvenioWebSubmitFileConverterError, err:
                 raise InvenioWebSubmitFileConverterError("Error when converting from %s to %s: %s" % (input_file, output_ext, err))
@@ -542,30 +587,32 @@ def _unregister_unoconv():
             output_log = open(CFG_UNOCONV_LOG_PATH, 'a')
             subprocess.call(['sudo', '-S', '-u', CFG_OPENOFFICE_USER, os.path.join(CFG_BINDIR, 'inveniounoconv'), '-k', '-vvv'], stdin=open('/dev/null', 'r'), stdout=output_log, stderr=output_log)
             time.sleep(1)
-            if _UNOCONV_DAEMON.poll():
+            if _UNOCONV_DAEMON.poll() is None:
                 try:
                     os.kill(_UNOCONV_DAEMON.pid, signal.SIGTERM)
                 except OSError:
                     pass
-                if _UNOCONV_DAEMON.poll():
+                time.sleep(1)
+                if _UNOCONV_DAEMON.poll() is None:
                     try:
                         os.kill(_UNOCONV_DAEMON.pid, signal.SIGKILL)
                     except OSError:
                         pass
+            _UNOCONV_DAEMON = None
     finally:
         _UNOCONV_DAEMON_LOCK.release()
 
-## NOTE: in case we switch back keeping LibreOffice running, uncomment
-## the following line.
-#atexit.register(_unregister_unoconv)
+## The OpenOffice listener is kept running between conversions only if
+## CFG_WEBSUBMIT_FILE_CONVERTER_KEEP_OPENOFFICE_RUNNING is set.
+if CFG_WEBSUBMIT_FILE_CONVERTER_KEEP_OPENOFFICE_RUNNING:
+    atexit.register(_unregister_unoconv)
 
 def unoconv(input_file, output_file=None, output_format='txt', pdfopt=True, **dummy):
     """Use unconv to convert among OpenOffice understood documents."""
     from invenio.bibdocfile import normalize_format
 
-    ## NOTE: in case we switch back keeping LibreOffice running, uncomment
-    ## the following line.
-    #_register_unoconv()
+    if CFG_WEBSUBMIT_FILE_CONVERTER_KEEP_OPENOFFICE_RUNNING:
+        _register_unoconv()
     input_file, output_file, dummy = prepare_io(input_file, output_file, output_format, need_working_dir=False)
     if output_format == 'txt':
         unoconv_format = 'text'
@@ -600,16 +647,19 @@ def unoconv(input_file, output_file=None, output_format='txt', pdfopt=True, **du
                     ## it still have created a nice file.
                     pass
             else:
-                execute_command(os.path.join(CFG_BINDIR, 'inveniounoconv'), '-vvv', '-k', sudo=CFG_OPENOFFICE_USER)
-                ## NOTE: in case we switch back keeping LibreOffice running, uncomment
-                ## the following lines.
-                #_unregister_unoconv()
-                #_register_unoconv()
-                time.sleep(5)
+                if CFG_WEBSUBMIT_FILE_CONVERTER_KEEP_OPENOFFICE_RUNNING:
+                    _unregister_unoconv()
+                    _register_unoconv()
+                else:
+                    execute_command(os.path.join(CFG_BINDIR, 'inveniounoconv'), '-vvv', '-k', sudo=CFG_OPENOFFICE_USER)
+                    time.sleep(5)
                 try:
                     execute_command(os.path.join(CFG_BINDIR, 'inveniounoconv'), '-vvv', '-s', CFG_OPENOFFICE_SERVER_HOST, '-p', str(CFG_OPENOFFICE_SERVER_PORT), '--output', tmpoutputfile, '-f', unoconv_format, tmpinputfile, sudo=CFG_OPENOFFICE_USER)
                 except InvenioWebSubmitFileConverterError:
-                    execute_command(os.path.join(CFG_BINDIR, 'inveniounoconv'), '-vvv', '-k', sudo=CFG_OPENOFFICE_USER)
+                    if CFG_WEBSUBMIT_FILE_CONVERTER_KEEP_OPENOFFICE_RUNNING:
+                        _unregister_unoconv()
+                    else:
+                        execute_command(os.path.join(CFG_BINDIR, 'inveniounoconv'), '-vvv', '-k', sudo=CFG_OPENOFFICE_USER)
                     if not os.path.exists(tmpoutputfile) or not os.path.getsize(tmpoutputfile):
                         raise InvenioWebSubmitFileConverterError('No output was generated by OpenOffice')
                     else:
@@ -1161,7 +1211,7 @@ def pdf2text(input_file, output_file=None, perform_ocr=True, ln='en', **dummy):
     input_file, output_file, dummy = prepare_io(input_file, output_file, '.txt', need_working_dir=False)
     execute_command(CFG_PATH_PDFTOTEXT, '-enc', 'UTF-8', '-eol', 'unix', '-nopgbrk', input_file, output_file)
     if perform_ocr and can_perform_ocr():
-        ocred_output = pdf2hocr2pdf(input_file, ln=ln, extract_only_text=True)
+        ocred_output = _run_converter(pdf2hocr2pdf, input_file, None, ln=ln, extract_only_text=True)
         try:
             output = open(output_file, 'a')
             for row in open(ocred_output):
@@ -1257,7 +1307,7 @@ def tiff2pdf(input_file, output_file=None, pdfopt=True, pdfa=True, perform_ocr=T
             partial_output = os.path.join(working_dir, 'output.pdf')
             execute_command(CFG_PATH_TIFF2PDF, '-o', partial_output, input_file)
             if perform_ocr:
-                pdf2hocr2pdf(partial_output, output_file, pdfopt=pdfopt, **args)
+                _run_converter(pdf2hocr2pdf, partial_output, output_file, pdfopt=pdfopt, **args)
             elif pdfa:
                 pdf2pdfa(partial_output, output_file, pdfopt=pdfopt, **args)
             else:
@@ -1372,6 +1422,7 @@ def execute_command(*args, **argd):
                                         cwd=argd.get('cwd'),
                                         filename_out=argd.get('filename_out'),
                                         filename_err=argd.get('filename_err'),
+                                        timeout=getattr(_CONVERTER_TIMEOUT, 'value', CFG_MISCUTIL_DEFAULT_PROCESS_TIMEOUT),
                                         sudo=sudo)
     get_file_converter_logger().debug('res: %s, stdout: %s, stderr: %s' % (res, stdout, stderr))
     if res != 0:
@@ -1384,7 +1435,7 @@ def execute_command(*args, **argd):
 def execute_command_with_stderr(*args, **argd):
     """Wrapper to run_process_with_timeout."""
     get_file_converter_logger().debug("Executing: %s" % (args, ))
-    res, stdout, stderr = run_process_with_timeout(args, cwd=argd.get('cwd'), filename_out=argd.get('filename_out'), sudo=argd.get('sudo'))
+    res, stdout, stderr = run_process_with_timeout(args, cwd=argd.get('cwd'), filename_out=argd.get('filename_out'), timeout=getattr(_CONVERTER_TIMEOUT, 'value', CFG_MISCUTIL_DEFAULT_PROCESS_TIMEOUT), sudo=argd.get('sudo'))
     if res != 0:
         message = "ERROR: Error in running %s\n stdout:\n%s\nstderr:\n%s\n" % (args, stdout, stderr)
         get_file_converter_logger().error(message)
@@ -1421,6 +1472,8 @@ def main_cli():
     parser.add_option("--is-ocr-needed", dest="check_ocr_is_needed", help="check if OCR is needed for the FILE specified", metavar="FILE")
     parser.add_option("-t", "--title", dest="title", help="specify the title (used when creating PDFs)", metavar="TITLE")
     parser.add_option("-l", "--language", dest="ln", help="specify the language (used when performing OCR, e.g. en, it, fr...)", metavar="LN", default='en')
+    parser.add_option("--benchmark", dest="benchmark", help="measure the conversions per minute of the pool of converters on the files of DIR (to the format given by --format)", metavar="DIR")
+    parser.add_option("-w", "--workers", dest="workers", type="int", help="number of conversions run at the same time by --benchmark", metavar="N")
     (options, dummy) = parser.parse_args()
     if options.debug:
         from logging import basicConfig
@@ -1447,6 +1500,17 @@ def main_cli():
                 if can_convert(input_format, output_format):
                     print '"%s"' % output_format[1:],
             print
+    elif options.benchmark:
+        from invenio.websubmit_file_converter_pool import file_converter_benchmark
+        if not options.output_format:
+            parser.error("--format should be specified")
+        input_files = [os.path.join(options.benchmark, filename) for filename in sorted(os.listdir(options.benchmark)) if os.path.isfile(os.path.join(options.benchmark, filename))]
+        if options.workers:
+            reports = file_converter_benchmark(input_files, options.output_format, options.workers)
+        else:
+            reports = file_converter_benchmark(input_files, options.output_format)
+        print "First run: %s" % reports[0]
+        print "Second run (cached): %s" % reports[1]
     elif options.check_ocr_is_needed:
         print "Checking if OCR is needed on %s..." % options.check_ocr_is_needed,
         sys.stdout.flush()
@@ -0,0 +1,247 @@
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+File conversions run by a pool of workers, with a cache of the results.
+
+The conversions are queued to a pool of threads, each of them running
+websubmit_file_converter.convert_file (the actual work is done by
+external processes), which enforces the concurrency limits and the
+timeouts configured for each converter.  The converted files are cached
+in CFG_WEBSUBMIT_FILE_CONVERTER_CACHEDIR under the MD5 checksum of the
+input file, the output format and the conversion parameters, so that
+converting again the same file is just a copy.
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+from multiprocessing.pool import ThreadPool
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+from invenio.config import CFG_TMPDIR, \
+     CFG_WEBSUBMIT_FILE_CONVERTER_WORKERS, \
+     CFG_WEBSUBMIT_FILE_CONVERTER_CACHE
+from invenio.websubmit_config import CFG_WEBSUBMIT_FILE_CONVERTER_CACHEDIR
+from invenio.websubmit_file_converter import convert_file as _convert_file, \
+     InvenioWebSubmitFileConverterError
+from invenio.bibdocfile_text_cache import calculate_checksum
+from invenio.errorlib import register_exception
+
+
+def get_cached_conversion_path(input_file, output_ext, params):
+    """
+    Return the path where the conversion of input_file to output_ext
+    with the given parameters is cached.
+    """
+    checksum = calculate_checksum(input_file)
+    params_hash = md5(repr(sorted(params.items()))).hexdigest()[:8]
+    return os.path.join(CFG_WEBSUBMIT_FILE_CONVERTER_CACHEDIR, checksum[:2],
+                        '%s-%s%s' % (checksum, params_hash, output_ext))
+
+
+def _cache_conversion(output_file, cached_path):
+    """Copy a converted file in the cache, atomically."""
+    cache_dir = os.path.dirname(cached_path)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+    except OSError:
+        # Probably created in the meantime by another process
+        pass
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix='.tmp')
+    os.close(fd)
+    try:
+        shutil.copyfile(output_file, tmp_path)
+        os.rename(tmp_path, cached_path)
+    except (IOError, OSError):
+        register_exception(alert_admin=True,
+                           prefix="Can't cache converted file in %s" % cached_path)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def convert_file(input_file, output_file=None, output_format=None, **params):
+    """
+    Same as websubmit_file_converter.convert_file, taking the result from
+    the cache when the same file was already converted with the same
+    parameters.
+
+    @return: (output file, True if it was taken from the cache)
+    """
+    from invenio.bibdocfile import decompose_file, normalize_format
+    if not CFG_WEBSUBMIT_FILE_CONVERTER_CACHE:
+        return _convert_file(input_file, output_file, output_format,
+                             **params), False
+    if output_format is None:
+        if output_file is None:
+            raise ValueError("At least output_file or format should be specified.")
+        output_ext = decompose_file(output_file, skip_version=True)[2]
+    else:
+        output_ext = normalize_format(output_format)
+    cached_path = get_cached_conversion_path(input_file, output_ext, params)
+    if os.path.exists(cached_path):
+        if output_file is None:
+            fd, output_file = tempfile.mkstemp(suffix=output_ext,
+                                               dir=CFG_TMPDIR)
+            os.close(fd)
+        shutil.copyfile(cached_path, output_file)
+        return output_file, True
+    output_file = _convert_file(input_file, output_file, output_format,
+                                **params)
+    _cache_conversion(output_file, cached_path)
+    return output_file, False
+
+
+class FileConverterPool(object):
+    """Pool of workers converting files."""
+
+    def __init__(self, workers=CFG_WEBSUBMIT_FILE_CONVERTER_WORKERS):
+        """
+        @param workers: number of conversions run at the same time (the
+            concurrency of each converter can be further limited by
+            CFG_WEBSUBMIT_FILE_CONVERTER_CONCURRENCY)
+        """
+        self.pool = ThreadPool(max(workers, 1))
+        self.start_time = time.time()
+        self.nb_conversions = 0
+        self.nb_cached = 0
+        self.nb_errors = 0
+        self.lock = threading.Lock()
+
+    def _convert(self, args, register_errors=False):
+        """Run a conversion in a worker.
+
+        Returns (output file, error message)
+        """
+        input_file, output_file, output_format, params = args
+        output, cached, error = None, False, None
+        try:
+            output, cached = convert_file(input_file, output_file,
+                                          output_format, **params)
+        except InvenioWebSubmitFileConverterError, err:
+            if register_errors:
+                register_exception(alert_admin=True)
+            error = str(err)
+        except Exception, err:
+            register_exception(alert_admin=True)
+            error = "Unexpected error when converting %s: %s" \
+                    % (input_file, err)
+        self.lock.acquire()
+        try:
+            self.nb_conversions += 1
+            if cached:
+                self.nb_cached += 1
+            if error:
+                self.nb_errors += 1
+        finally:
+            self.lock.release()
+        return output, error
+
+    def convert_file(self, input_file, output_file=None, output_format=None,
+                     **params):
+        """
+        Same as websubmit_file_converter.convert_file, run in one of the
+        workers.  Can be called from several threads.
+
+        @raise InvenioWebSubmitFileConverterError: in case of error.
+        """
+        output, error = self.pool.apply(self._convert,
+            ((input_file, output_file, output_format, params), ))
+        if error:
+            raise InvenioWebSubmitFileConverterError(error)
+        return output
+
+    def imap(self, conversions, register_errors=False):
+        """
+        Run many conversions.
+
+        @param conversions: list of (input file, output file, output
+            format, dictionary of parameters), see
+            websubmit_file_converter.convert_file.
+        @param register_errors: whether to register the conversion
+            errors with register_exception (unexpected errors are always
+            registered).
+        @return: iterator over (output file, error message) in the same
+            order as the conversions, output file being None in case of
+            error.
+        """
+        if register_errors:
+            return self.pool.imap(self._convert_registering_errors,
+                                  conversions)
+        return self.pool.imap(self._convert, conversions)
+
+    def _convert_registering_errors(self, args):
+        return self._convert(args, register_errors=True)
+
+    def get_report(self):
+        """Return a summary of the conversions done."""
+        duration = time.time() - self.start_time
+        return "%d conversions in %.1fs (%.1f conversions/minute; " \
+               "%d from the cache, %d errors)" \
+               % (self.nb_conversions, duration,
+                  self.nb_conversions * 60 / max(duration, 0.001),
+                  self.nb_cached, self.nb_errors)
+
+    def close(self):
+        """Stop the workers."""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+_FILE_CONVERTER_POOL = None
+_FILE_CONVERTER_POOL_LOCK = threading.Lock()
+
+def get_file_converter_pool():
+    """Return the pool of workers shared by the whole process."""
+    global _FILE_CONVERTER_POOL
+    _FILE_CONVERTER_POOL_LOCK.acquire()
+    try:
+        if _FILE_CONVERTER_POOL is None:
+            _FILE_CONVERTER_POOL = FileConverterPool()
+        return _FILE_CONVERTER_POOL
+    finally:
+        _FILE_CONVERTER_POOL_LOCK.release()
+
+
+def file_converter_benchmark(input_files, output_format,
+                             workers=CFG_WEBSUBMIT_FILE_CONVERTER_WORKERS):
+    """
+    Convert a sample corpus twice, the second time from the cache, and
+    return the reports of both runs.
+    """
+    reports = []
+    for dummy in range(2):
+        pool = FileConverterPool(workers)
+        try:
+            for output, dummy_error in pool.imap(
+                    [(input_file, None, output_format, {})
+                     for input_file in input_files]):
+                if output and os.path.exists(output):
+                    os.remove(output)
+            reports.append(pool.get_report())
+        finally:
+            pool.close()
+    return reports
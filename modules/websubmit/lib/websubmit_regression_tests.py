@@ -28,7 +28,8 @@ from cStringIO import StringIO
 
 from invenio.websubmit_file_converter import get_file_converter_logger
 from invenio.errorlib import register_exception
-from invenio.config import CFG_SITE_URL, CFG_PREFIX, CFG_TMPDIR, CFG_PATH_PDFTK
+from invenio.config import CFG_SITE_URL, CFG_PREFIX, CFG_TMPDIR, CFG_PATH_PDFTK, \
+     CFG_WEBSUBMIT_FILE_CONVERTER_CACHE
 from invenio.testutils import make_test_suite, run_test_suite, \
                               test_web_page_content, merge_error_messages
 from invenio import websubmit_file_stamper
@@ -192,6 +193,48 @@ class WebSubmitFileConverterTest(InvenioTestCase):
             register_exception(alert_admin=True)
             self.fail("ERROR: when converting from %s to %s: %s, the log contained: %s" % (self.from_format, self.to_format, err, self.log.getvalue()))
 
+class WebSubmitFileConverterPoolTest(InvenioTestCase):
+    """Test the pool of file converters"""
+
+    def setUp(self):
+        self.input_file = os.path.join(CFG_TMPDIR, 'file_converter_pool_test.html')
+        open(self.input_file, 'w').write('<html><body><p>%s</p></body></html>' % self.id())
+        self.outputs = []
+
+    def tearDown(self):
+        for path in [self.input_file] + self.outputs:
+            if path and os.path.exists(path):
+                os.remove(path)
+
+    def test_conversions(self):
+        """websubmit - conversions in the pool of file converters"""
+        from invenio.websubmit_file_converter_pool import FileConverterPool
+        pool = FileConverterPool(2)
+        try:
+            results = list(pool.imap([(self.input_file, None, '.txt', {}),
+                                      (self.input_file, None, '.foo', {})]))
+            self.outputs.extend([output for output, dummy in results])
+            self.assertEqual(open(results[0][0]).read().strip(), self.id())
+            self.assertEqual(results[0][1], None)
+            self.assertEqual(results[1][0], None)
+            self.failUnless(results[1][1])
+        finally:
+            pool.close()
+
+    if CFG_WEBSUBMIT_FILE_CONVERTER_CACHE:
+        def test_cached_conversion(self):
+            """websubmit - conversion taken from the cache"""
+            from invenio.websubmit_file_converter_pool import convert_file, \
+                get_cached_conversion_path
+            output, cached = convert_file(self.input_file, output_format='.txt')
+            self.outputs.append(output)
+            self.failIf(cached)
+            self.outputs.append(get_cached_conversion_path(self.input_file, '.txt', {}))
+            output, cached = convert_file(self.input_file, output_format='.txt')
+            self.outputs.append(output)
+            self.failUnless(cached)
+            self.assertEqual(open(output).read().strip(), self.id())
+
 if CFG_PATH_PDFTK:
     class WebSubmitStampingTest(InvenioTestCase):
         """Test WebSubmit file stamping tool"""
@@ -264,6 +307,7 @@ else:
 TEST_SUITE = make_test_suite(WebSubmitWebPagesAvailabilityTest,
                              WebSubmitLegacyURLsTest,
                              WebSubmitXSSVulnerabilityTest,
+                             WebSubmitFileConverterPoolTest,
                              WebSubmitStampingTest)
 
 for test in WebSubmitFileConverterTestGenerator():